@@ -9,7 +9,7 @@ class Cutflow(object):
   """Container class for cutflow."""
   
   def __init__(self, histname, ncuts, **kwargs):
-    self.hist    = TH1D('cutflow','cutflow',ncuts,0,ncuts)
+    self.hist    = TH1D(histname,'cutflow',ncuts,0,ncuts)
     self.hist.GetXaxis().SetLabelSize(0.041)
     self.nextidx = 0
     self.cuts    = { }
@@ -25,6 +25,15 @@ class Cutflow(object):
     self.hist.GetXaxis().SetBinLabel(bin,title)
     self.cuts[name] = index
     
+  def clone(self, histname):
+    """Create new, empty cutflow with the same cuts."""
+    ncuts   = self.hist.GetXaxis().GetNbins()
+    cutflow = Cutflow(histname,ncuts)
+    for cut, index in sorted(self.cuts.items(),key=lambda x: x[1]):
+      cutflow.addcut(cut,self.hist.GetXaxis().GetBinLabel(1+index),index)
+    cutflow.nextidx = self.nextidx
+    return cutflow
+    
   def getbincontent(self,bin):
     if isinstance(bin,str):
       bin = self.hist.GetXaxis().FindBin(bin)
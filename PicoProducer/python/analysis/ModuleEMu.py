@@ -5,6 +5,7 @@ import numpy as np
 from TauFW.PicoProducer.analysis.TreeProducerEMu import *
 from TauFW.PicoProducer.analysis.ModuleTauPair import *
 from TauFW.PicoProducer.analysis.utils import LeptonPair, idIso, matchtaujet
+from TauFW.PicoProducer.analysis.columnar import getbranches, deltaR, cartesian, bestpair
 from TauFW.PicoProducer.corrections.MuonSFs import *
 from TauFW.PicoProducer.corrections.ElectronSFs import *
 from TauPOG.TauIDSFs.TauIDSFTool import TauIDSFTool, TauESTool
@@ -36,6 +37,19 @@ class ModuleEMu(ModuleTauPair):
     self.tauCutPt     = 20
     self.tauCutEta    = 2.3
     
+    # PRESELECTION: minimum number of objects for getpreselection (with presel=True)
+    self.preselobjs = { 'Electron': 1, 'Muon': 1 }
+    
+    # COLUMNAR ENGINE
+    self.colcuts    = ['trig','electron','muon','pair']
+    self.colobjs    = ['Electron','Muon']
+    self.colscalars = getbranches(self.trigger)+getbranches(self.muonCutPt)+getbranches(self.muonCutEta)
+    self.colfields  = {
+      'Electron': ['pt','eta','phi','dz','dxy','convVeto','lostHits','mvaFall17V2Iso_WP90',
+                   'mvaFall17V2noIso_WP90','pfRelIso03_all'],
+      'Muon':     ['pt','eta','phi','dz','dxy','mediumId','pfRelIso04_all'],
+    }
+    
     # CORRECTIONS
     if self.ismc:
       self.muSFs   = MuonSFs(era=self.era)
@@ -63,26 +77,19 @@ class ModuleEMu(ModuleTauPair):
     pass
     
   
-  def analyze(self, event):
-    """Process and pre-select events; fill branches and return True if the events passes,
-    return False otherwise."""
-    sys.stdout.flush()
-    
-    
-    ##### NO CUT #####################################
-    if not self.fillhists(event):
-      return False
-    
+  def selectpair(self, event):
+    """Select trigger, electrons, muons and the best emu pair by looping over the objects.
+    Return the pair, or None if the event fails."""
     
     ##### TRIGGER ####################################
     if not self.trigger(event):
-      return False
+      return None
     self.out.cutflow.fill('trig')
     
     
     ##### ELECTRON ###################################
     electrons = [ ]
-    for electron in Collection(event,'Electron'):
+    for electron in self.collection(event,'Electron'):
       #if self.ismc and self.ees!=1:
       #  electron.pt   *= self.ees
       #  electron.mass *= self.ees
@@ -95,13 +102,13 @@ class ModuleEMu(ModuleTauPair):
       if not (electron.mvaFall17V2Iso_WP90 or electron.mvaFall17V2noIso_WP90): continue
       electrons.append(electron)
     if len(electrons)==0:
-      return False
+      return None
     self.out.cutflow.fill('electron')
     
     
     ##### MUON #######################################
     muons = [ ]
-    for muon in Collection(event,'Muon'):
+    for muon in self.collection(event,'Muon'):
       if muon.pt<self.muonCutPt(event): continue
       if abs(muon.eta)>self.muonCutEta(event): continue
       if abs(muon.dz)>0.2: continue
@@ -110,7 +117,7 @@ class ModuleEMu(ModuleTauPair):
       if muon.pfRelIso04_all>0.50: continue
       muons.append(muon)
     if len(muons)==0:
-      return False
+      return None
     self.out.cutflow.fill('muon')
     
     
@@ -122,16 +129,83 @@ class ModuleEMu(ModuleTauPair):
         ltau = LeptonPair(electron,electron.pfRelIso03_all,muon,muon.pfRelIso04_all)
         dileps.append(ltau)
     if len(dileps)==0:
+      return None
+    self.out.cutflow.fill('pair')
+    return max(dileps).pair
+    
+  
+  def selectcolumns(self, block):
+    """Vectorized version of selectpair for a block of entries (see analysis/columnar.py).
+    Return per-event arrays of the number of passed cuts, and indices of the selected electron and muon."""
+    nevts    = block.size
+    eles     = block.Electron
+    muons    = block.Muon
+    
+    # TRIGGER
+    trigger  = block.evaluate(self.trigger,dtype=bool)
+    
+    # ELECTRON
+    elemask  = trigger[eles.evtidx] & (eles.pt>=self.eleCutPt) & (np.abs(eles.eta)<=self.eleCutEta) &\
+               (np.abs(eles.dz)<=0.2) & (np.abs(eles.dxy)<=0.045) & (eles.convVeto!=0) & (eles.lostHits<=1) &\
+               ((eles.mvaFall17V2Iso_WP90!=0) | (eles.mvaFall17V2noIso_WP90!=0))
+    haselec  = eles.any(elemask)
+    
+    # MUON
+    muCutPt  = block.evaluate(self.muonCutPt)[muons.evtidx]
+    muCutEta = block.evaluate(self.muonCutEta)[muons.evtidx]
+    mumask   = haselec[muons.evtidx] & (muons.pt>=muCutPt) & (np.abs(muons.eta)<=muCutEta) &\
+               (np.abs(muons.dz)<=0.2) & (np.abs(muons.dxy)<=0.045) & (muons.mediumId!=0) &\
+               (muons.pfRelIso04_all<=0.50)
+    hasmuon  = muons.any(mumask)
+    
+    # EMU PAIR
+    iele, imu, ipair = cartesian(np.nonzero(elemask)[0],eles.evtidx[elemask],
+                                 np.nonzero(mumask)[0],muons.evtidx[mumask],nevts)
+    dR       = deltaR(muons.eta[imu],muons.phi[imu],eles.eta[iele],eles.phi[iele])
+    iele, imu, ipair = iele[dR>=0.5], imu[dR>=0.5], ipair[dR>=0.5]
+    best     = bestpair(ipair,nevts,eles.pt[iele].astype(np.float64),muons.pt[imu].astype(np.float64),
+                        -eles.pfRelIso03_all[iele],-muons.pfRelIso04_all[imu])
+    haspair  = best>=0
+    
+    # RESULT
+    stage    = trigger.astype(np.int8) + haselec + hasmuon + haspair
+    ibest    = best[haspair]
+    result   = {
+      'stage':  stage,
+      'index1': np.full(nevts,-1,dtype=np.int64),
+      'index2': np.full(nevts,-1,dtype=np.int64),
+    }
+    result['index1'][haspair] = eles.locidx[iele[ibest]]
+    result['index2'][haspair] = muons.locidx[imu[ibest]]
+    return result
+    
+  
+  def analyze(self, event):
+    """Process and pre-select events; fill branches and return True if the events passes,
+    return False otherwise."""
+    sys.stdout.flush()
+    
+    
+    ##### NO CUT #####################################
+    if not self.fillhists(event):
+      return False
+    
+    
+    ##### EMU PAIR ##################################
+    if self.columns: # vectorized selection per block of entries
+      pair = self.selectpair_columnar(event)
+    else:
+      pair = self.selectpair(event)
+    if not pair:
       return False
-    electron, muon = max(dileps).pair
+    electron, muon = pair
     electron.tlv   = electron.p4()
     muon.tlv       = muon.p4()
-    self.out.cutflow.fill('pair')
     
     
     # VETOS
-    extramuon_veto, extraelec_veto, dilepton_veto = getlepvetoes(event,[electron],[muon],[ ],self.channel)
-    self.out.extramuon_veto[0], self.out.extraelec_veto[0], self.out.dilepton_veto[0] = getlepvetoes(event,[electron],[muon],[ ],self.channel)
+    extramuon_veto, extraelec_veto, dilepton_veto = getlepvetoes(event,[electron],[muon],[ ],self.channel,era=self.era)
+    self.out.extramuon_veto[0], self.out.extraelec_veto[0], self.out.dilepton_veto[0] = getlepvetoes(event,[electron],[muon],[ ],self.channel,era=self.era)
     self.out.lepton_vetoes[0]       = self.out.extramuon_veto[0] or self.out.extraelec_veto[0] or self.out.dilepton_veto[0]
     self.out.lepton_vetoes_notau[0] = extramuon_veto or extraelec_veto or dilepton_veto
     
@@ -176,7 +250,7 @@ class ModuleEMu(ModuleTauPair):
     # TAU for jet -> tau fake rate measurement in emu+tau events
     maxtau = None
     ptmax  = 20
-    for tau in Collection(event,'Tau'):
+    for tau in self.collection(event,'Tau'):
       if tau.pt<ptmax: continue
       if electron.DeltaR(tau)<0.5: continue
       if muon.DeltaR(tau)<0.5: continue
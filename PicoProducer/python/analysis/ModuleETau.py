@@ -6,6 +6,7 @@ from TauFW.PicoProducer import datadir
 from TauFW.PicoProducer.analysis.TreeProducerETau import *
 from TauFW.PicoProducer.analysis.ModuleTauPair import *
 from TauFW.PicoProducer.analysis.utils import LeptonTauPair, loosestIso, idIso, matchgenvistau, matchtaujet
+from TauFW.PicoProducer.analysis.columnar import deltaR, cartesian, bestpair
 from TauFW.PicoProducer.corrections.ElectronSFs import *
 from TauFW.PicoProducer.corrections.TrigObjMatcher import TrigObjMatcher
 from TauPOG.TauIDSFs.TauIDSFTool import TauIDSFTool, TauESTool, TauFESTool
@@ -26,6 +27,22 @@ class ModuleETau(ModuleTauPair):
     self.eleCutEta = 2.3
     self.tauCutEta = 2.3
     
+    # PRESELECTION: minimum number of objects for getpreselection (with presel=True)
+    self.preselobjs = { 'Electron': 1, 'Tau': 1 }
+    
+    # COLUMNAR ENGINE
+    trigscalars, trigfields = self.trigger.getcolumns()
+    self.colcuts    = ['trig','electron','tau','pair']
+    self.colobjs    = ['Electron','Tau']
+    self.colscalars = trigscalars
+    self.colfields  = {
+      'Electron': ['pt','eta','phi','dz','dxy','convVeto','lostHits','mvaFall17V2Iso_WP90',
+                   'mvaFall17V2noIso_WP90','pfRelIso03_all'],
+      'Tau':      ['pt','eta','phi','mass','dz','charge','decayMode','rawDeepTau2017v2p1VSjet',
+                   'idDeepTau2017v2p1VSe','idDeepTau2017v2p1VSmu','idDeepTau2017v2p1VSjet']+(['genPartFlav'] if self.ismc else [ ]),
+      'TrigObj':  trigfields,
+    }
+    
     # CORRECTIONS
     if self.ismc:
       self.eleSFs  = ElectronSFs(era=self.era) # electron id/iso/trigger SFs
@@ -56,26 +73,10 @@ class ModuleETau(ModuleTauPair):
     pass
     
   
-  def analyze(self, event):
-    """Process and pre-select events; fill branches and return True if the events passes,
-    return False otherwise."""
-    sys.stdout.flush()
-    
-    
-    ##### NO CUT #####################################
-    if not self.fillhists(event):
-      return False
-    
-    
-    ##### TRIGGER ####################################
-    if not self.trigger.fired(event):
-      return False
-    self.out.cutflow.fill('trig')
-    
-    
-    ##### ELECTRON ###################################
+  def selectelectrons(self, event):
+    """Select electrons. Independent of the tau energy scale, so reused between variations."""
     electrons = [ ]
-    for electron in Collection(event,'Electron'):
+    for electron in self.collection(event,'Electron'):
       #if self.ismc and self.ees!=1:
       #  electron.pt   *= self.ees
       #  electron.mass *= self.ees
@@ -88,14 +89,29 @@ class ModuleETau(ModuleTauPair):
       if not (electron.mvaFall17V2Iso_WP90 or electron.mvaFall17V2noIso_WP90): continue
       if not self.trigger.match(event,electron): continue
       electrons.append(electron)
+    return electrons
+    
+  
+  def selectpair(self, event):
+    """Select trigger, electrons, taus and the best etau pair by looping over the objects.
+    Return the pair, or None if the event fails."""
+    
+    ##### TRIGGER ####################################
+    if not self.trigger.fired(event):
+      return None
+    self.out.cutflow.fill('trig')
+    
+    
+    ##### ELECTRON ###################################
+    electrons = self.getcached('electrons',self.selectelectrons,event)
     if len(electrons)==0:
-      return False
+      return None
     self.out.cutflow.fill('electron')
     
     
     ##### TAU ########################################
     taus = [ ]
-    for tau in Collection(event,'Tau'):
+    for tau in self.collection(event,'Tau'):
       if abs(tau.eta)>self.tauCutEta: continue
       if abs(tau.dz)>0.2: continue
       if tau.decayMode not in [0,1,10,11]: continue
@@ -131,7 +147,7 @@ class ModuleETau(ModuleTauPair):
       if tau.pt<self.tauCutPt: continue
       taus.append(tau)
     if len(taus)==0:
-      return False
+      return None
     self.out.cutflow.fill('tau')
     
     
@@ -142,18 +158,87 @@ class ModuleETau(ModuleTauPair):
         if tau.DeltaR(electron)<0.5: continue
         ltau = LeptonTauPair(electron,electron.pfRelIso03_all,tau,tau.rawDeepTau2017v2p1VSjet)
         ltaus.append(ltau)
-    
     if len(ltaus)==0:
+      return None
+    self.out.cutflow.fill('pair')
+    return max(ltaus).pair
+    
+  
+  def selectcolumns(self, block):
+    """Vectorized version of selectpair for a block of entries (see analysis/columnar.py).
+    Return per-event arrays of the number of passed cuts, and indices of the selected electron and tau."""
+    nevts    = block.size
+    eles     = block.Electron
+    taus     = block.Tau
+    
+    # TRIGGER
+    fired    = self.trigger.firedcolumns(block)
+    trigger  = fired.any(axis=0)
+    
+    # ELECTRON
+    elemask  = trigger[eles.evtidx] & (eles.pt>=self.eleCutPt) & (np.abs(eles.eta)<=self.eleCutEta) &\
+               (np.abs(eles.dz)<=0.2) & (np.abs(eles.dxy)<=0.045) & (eles.convVeto!=0) & (eles.lostHits<=1) &\
+               ((eles.mvaFall17V2Iso_WP90!=0) | (eles.mvaFall17V2noIso_WP90!=0))
+    elemask &= self.trigger.matchcolumns(block,eles,elemask,fired=fired)
+    haselec  = eles.any(elemask)
+    
+    # TAU
+    taumask, taupt, taumass, taues = self.selecttaus_columnar(block,fes=True)
+    taumask &= haselec[taus.evtidx]
+    hastau   = taus.any(taumask)
+    
+    # ETAU PAIR
+    iele, itau, ipair = cartesian(np.nonzero(elemask)[0],eles.evtidx[elemask],
+                                  np.nonzero(taumask)[0],taus.evtidx[taumask],nevts)
+    dR       = deltaR(taus.eta[itau],taus.phi[itau],eles.eta[iele],eles.phi[iele])
+    iele, itau, ipair = iele[dR>=0.5], itau[dR>=0.5], ipair[dR>=0.5]
+    best     = bestpair(ipair,nevts,eles.pt[iele].astype(np.float64),taupt[itau],
+                        -eles.pfRelIso03_all[iele],taus.rawDeepTau2017v2p1VSjet[itau])
+    haspair  = best>=0
+    
+    # RESULT
+    stage    = trigger.astype(np.int8) + haselec + hastau + haspair
+    ibest    = best[haspair]
+    result   = {
+      'stage':  stage,
+      'index1': np.full(nevts,-1,dtype=np.int64),
+      'index2': np.full(nevts,-1,dtype=np.int64),
+      'pt2':    np.zeros(nevts), 'mass2': np.zeros(nevts), 'es2': np.ones(nevts),
+    }
+    result['index1'][haspair] = eles.locidx[iele[ibest]]
+    result['index2'][haspair] = taus.locidx[itau[ibest]]
+    result['pt2'][haspair]    = taupt[itau[ibest]]
+    result['mass2'][haspair]  = taumass[itau[ibest]]
+    result['es2'][haspair]    = taues[itau[ibest]]
+    return result
+    
+  
+  def analyze(self, event):
+    """Process and pre-select events; fill branches and return True if the events passes,
+    return False otherwise."""
+    sys.stdout.flush()
+    
+    
+    ##### NO CUT #####################################
+    if not self.fillhists(event):
       return False
-    electron, tau = max(ltaus).pair
+    
+    
+    ##### ETAU PAIR ##################################
+    if self.columns: # vectorized selection per block of entries
+      pair = self.selectpair_columnar(event)
+    else:
+      pair = self.selectpair(event)
+    if not pair:
+      return False
+    electron, tau = pair
     electron.tlv  = electron.p4()
     tau.tlv       = tau.p4()
-    self.out.cutflow.fill('pair')
     
     
     # VETOS
-    extramuon_veto, extraelec_veto, dilepton_veto = getlepvetoes(event,[electron],[ ],[tau],self.channel)
-    self.out.extramuon_veto[0], self.out.extraelec_veto[0], self.out.dilepton_veto[0] = getlepvetoes(event,[electron],[ ],[ ],self.channel)
+    extramuon_veto, extraelec_veto, dilepton_veto = getlepvetoes(event,[electron],[ ],[tau],self.channel,era=self.era)
+    self.out.extramuon_veto[0], self.out.extraelec_veto[0], self.out.dilepton_veto[0] = getlepvetoes(event,[electron],[ ],[ ],self.channel,era=self.era)
     self.out.lepton_vetoes[0]       = self.out.extramuon_veto[0] or self.out.extraelec_veto[0] or self.out.dilepton_veto[0]
     self.out.lepton_vetoes_notau[0] = extramuon_veto or extraelec_veto or dilepton_veto
     
@@ -247,7 +332,7 @@ class ModuleETau(ModuleTauPair):
     # WEIGHTS
     if self.ismc:
       self.fillCommonCorrBranches(event,jets,met,njets_vars,met_vars)
-      if electron.pfRelIso03_all<0.50 and tau.idDeepTau2017v2p1VSjet>=2:
+      if not self.variation and electron.pfRelIso03_all<0.50 and tau.idDeepTau2017v2p1VSjet>=2: # fill once with nominal settings
         self.btagTool.fillEffMaps(jets,usejec=self.dojec)
       
       # MUON WEIGHTS
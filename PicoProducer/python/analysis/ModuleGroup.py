@@ -0,0 +1,41 @@
+# Description: Run several analysis modules side by side on the same events,
+#              e.g. for a group of channels in one job (see picojob.py -c mutau,etau,tautau,mumu)
+from PhysicsTools.NanoAODTools.postprocessing.framework.eventloop import Module
+
+
+class ModuleGroup(Module):
+  """Wrap several modules, each with their own output file, to process them in one event loop.
+  Unlike a plain list of modules in PostProcessor, an event that is rejected by one module
+  is still passed to the next ones."""
+
+  def __init__(self, modules, **kwargs):
+    self.modules   = list(modules)
+    self.verbosity = kwargs.get('verb', 0 )
+    self.branchsel = None
+
+  def __repr__(self):
+    return "<%s(%s) at %s>"%(self.__class__.__name__,', '.join(m.__class__.__name__ for m in self.modules),hex(id(self)))
+
+  def beginJob(self):
+    for module in self.modules:
+      module.beginJob()
+
+  def endJob(self):
+    for module in self.modules:
+      module.endJob()
+
+  def beginFile(self, inputFile, outputFile, inputTree, wrappedOutputTree):
+    for module in self.modules:
+      module.beginFile(inputFile,outputFile,inputTree,wrappedOutputTree)
+
+  def endFile(self, inputFile, outputFile, inputTree, wrappedOutputTree):
+    for module in self.modules:
+      module.endFile(inputFile,outputFile,inputTree,wrappedOutputTree)
+
+  def analyze(self, event):
+    """Process event with each module, and keep it if any module selects it."""
+    result = False
+    for module in self.modules:
+      result = module.analyze(event) or result
+    return result
+
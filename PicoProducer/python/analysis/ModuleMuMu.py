@@ -5,6 +5,7 @@ import numpy as np
 from TauFW.PicoProducer.analysis.TreeProducerMuMu import *
 from TauFW.PicoProducer.analysis.ModuleTauPair import *
 from TauFW.PicoProducer.analysis.utils import LeptonPair, idIso, matchtaujet
+from TauFW.PicoProducer.analysis.columnar import getbranches, deltaR, invmass, cartesian, bestpair
 from TauFW.PicoProducer.corrections.MuonSFs import *
 from TauFW.PicoProducer.corrections.TrigObjMatcher import loadTriggerDataFromJSON, TrigObjMatcher
 #from TauPOG.TauIDSFs.TauIDSFTool import TauIDSFTool, TauESTool
@@ -40,6 +41,9 @@ class ModuleMuMu(ModuleTauPair):
     self.tauCutPt     = 20
     self.tauCutEta    = 2.3
     
+    # PRESELECTION: minimum number of objects for getpreselection (with presel=True)
+    self.preselobjs = { 'Muon': 2 }
+    
     # CORRECTIONS
     if self.ismc:
       self.muSFs   = MuonSFs(era=self.era)
@@ -48,6 +52,14 @@ class ModuleMuMu(ModuleTauPair):
     jsonfile = os.path.join(datadir,"trigger/tau_triggers_%d.json"%(2018))
     self.trigger = TrigObjMatcher(jsonfile,trigger='SingleMuon',isdata=self.isdata)
     
+    # COLUMNAR ENGINE
+    self.colcuts    = ['trig','muon','pair']
+    self.colobjs    = ['Muon','Muon']
+    self.colscalars = self.trigger.getcolumns()[0]+getbranches(self.muon1CutPt)+getbranches(self.muonCutEta)
+    self.colfields  = {
+      'Muon': ['pt','eta','phi','mass','dz','dxy','mediumId','pfRelIso04_all'],
+    }
+    
     # CUTFLOW
     self.out.cutflow.addcut('none',         "no cut"                     )
     self.out.cutflow.addcut('trig',         "trigger"                    )
@@ -77,27 +89,20 @@ class ModuleMuMu(ModuleTauPair):
     pass
     
   
-  def analyze(self, event):
-    """Process and pre-select events; fill branches and return True if the events passes,
-    return False otherwise."""
-    sys.stdout.flush()
-    
-    
-    ##### NO CUT #####################################
-    if not self.fillhists(event):
-      return False
-    
+  def selectpair(self, event):
+    """Select trigger, muons and the best dimuon pair by looping over the objects.
+    Return the pair, or None if the event fails."""
     
     ##### TRIGGER ####################################
     #if not self.trigger(event):
     if not self.trigger.fired(event):
-      return False
+      return None
     self.out.cutflow.fill('trig')
     
     
     ##### MUON #######################################
     muons = [ ]
-    for muon in Collection(event,'Muon'):
+    for muon in self.collection(event,'Muon'):
       if muon.pt<self.muon2CutPt: continue # lower pt cut
       if abs(muon.eta)>self.muonCutEta(event): continue
       if abs(muon.dz)>0.2: continue
@@ -106,7 +111,7 @@ class ModuleMuMu(ModuleTauPair):
       if muon.pfRelIso04_all>0.50: continue
       muons.append(muon)
     if len(muons)==0:
-      return False
+      return None
     self.out.cutflow.fill('muon')
     
     
@@ -121,11 +126,77 @@ class ModuleMuMu(ModuleTauPair):
         ltau = LeptonPair(muon1,muon1.pfRelIso04_all,muon2,muon2.pfRelIso04_all)
         dileps.append(ltau)
     if len(dileps)==0:
+      return None
+    self.out.cutflow.fill('pair')
+    return max(dileps).pair
+    
+  
+  def selectcolumns(self, block):
+    """Vectorized version of selectpair for a block of entries (see analysis/columnar.py).
+    Return per-event arrays of the number of passed cuts, and indices of the two selected muons."""
+    nevts    = block.size
+    muons    = block.Muon
+    
+    # TRIGGER
+    trigger  = self.trigger.firedcolumns(block).any(axis=0)
+    
+    # MUON
+    muCutEta = block.evaluate(self.muonCutEta)[muons.evtidx]
+    mumask   = trigger[muons.evtidx] & (muons.pt>=self.muon2CutPt) & (np.abs(muons.eta)<=muCutEta) &\
+               (np.abs(muons.dz)<=0.2) & (np.abs(muons.dxy)<=0.045) & (muons.mediumId!=0) &\
+               (muons.pfRelIso04_all<=0.50)
+    hasmuon  = muons.any(mumask)
+    
+    # MUMU PAIR: each pair once, in the order of the collection
+    imuons   = np.nonzero(mumask)[0]
+    imu1, imu2, ipair = cartesian(imuons,muons.evtidx[imuons],imuons,muons.evtidx[imuons],nevts)
+    ptcut    = block.evaluate(self.muon1CutPt)[ipair] # trigger dependent
+    keep     = (muons.locidx[imu1]<muons.locidx[imu2]) &\
+               (deltaR(muons.eta[imu2],muons.phi[imu2],muons.eta[imu1],muons.phi[imu1])>=0.5) &\
+               ((muons.pt[imu1]>=ptcut) | (muons.pt[imu2]>=ptcut)) # larger pt cut
+    if self.zwindow: # Z mass
+      mass   = invmass(muons.pt[imu1],muons.eta[imu1],muons.phi[imu1],muons.mass[imu1],
+                       muons.pt[imu2],muons.eta[imu2],muons.phi[imu2],muons.mass[imu2])
+      keep  &= (70<mass) & (mass<110)
+    imu1, imu2, ipair = imu1[keep], imu2[keep], ipair[keep]
+    best     = bestpair(ipair,nevts,muons.pt[imu1].astype(np.float64),muons.pt[imu2].astype(np.float64),
+                        -muons.pfRelIso04_all[imu1],-muons.pfRelIso04_all[imu2])
+    haspair  = best>=0
+    
+    # RESULT
+    stage    = trigger.astype(np.int8) + hasmuon + haspair
+    ibest    = best[haspair]
+    result   = {
+      'stage':  stage,
+      'index1': np.full(nevts,-1,dtype=np.int64),
+      'index2': np.full(nevts,-1,dtype=np.int64),
+    }
+    result['index1'][haspair] = muons.locidx[imu1[ibest]]
+    result['index2'][haspair] = muons.locidx[imu2[ibest]]
+    return result
+    
+  
+  def analyze(self, event):
+    """Process and pre-select events; fill branches and return True if the events passes,
+    return False otherwise."""
+    sys.stdout.flush()
+    
+    
+    ##### NO CUT #####################################
+    if not self.fillhists(event):
+      return False
+    
+    
+    ##### MUMU PAIR #################################
+    if self.columns: # vectorized selection per block of entries
+      pair = self.selectpair_columnar(event)
+    else:
+      pair = self.selectpair(event)
+    if not pair:
       return False
-    muon1, muon2 = max(dileps).pair
+    muon1, muon2 = pair
     muon1.tlv    = muon1.p4()
     muon2.tlv    = muon2.p4()
-    self.out.cutflow.fill('pair')
 
     if "202" in self.year:
         if self.jetveto(event): return False 
@@ -183,7 +254,7 @@ class ModuleMuMu(ModuleTauPair):
     # TAU for jet -> tau fake rate measurement in mumu+tau events
     maxtau = None
     ptmax  = 20
-    for tau in Collection(event,'Tau'):
+    for tau in self.collection(event,'Tau'):
       if tau.pt<ptmax: continue
       if muon1.DeltaR(tau)<0.5: continue
       if muon2.DeltaR(tau)<0.5: continue
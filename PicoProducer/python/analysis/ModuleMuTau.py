@@ -5,6 +5,7 @@ import numpy as np
 from TauFW.PicoProducer.analysis.TreeProducerMuTau import *
 from TauFW.PicoProducer.analysis.ModuleTauPair import *
 from TauFW.PicoProducer.analysis.utils import LeptonTauPair, loosestIso, idIso, matchgenvistau, matchtaujet, filtermutau
+from TauFW.PicoProducer.analysis.columnar import getbranches, deltaR, cartesian, bestpair
 from TauFW.PicoProducer.corrections.MuonSFs import *
 #from TauFW.PicoProducer.corrections.TrigObjMatcher import loadTriggerDataFromJSON, TrigObjMatcher
 from TauPOG.TauIDSFs.TauIDSFTool import TauIDSFTool, TauESTool, campaigns
@@ -34,6 +35,23 @@ class ModuleMuTau(ModuleTauPair):
     self.tauCutPt     = 20
     self.tauCutEta    = 2.3
     
+    # PRESELECTION: minimum number of objects for getpreselection (with presel=True)
+    self.preselobjs   = { 'Muon': 1, 'Tau': 1 }
+    
+    # COLUMNAR ENGINE
+    self.colcuts      = ['trig','muon','tau','pair']
+    self.colobjs      = ['Muon','Tau']
+    self.colscalars   = getbranches(self.trigger)+getbranches(self.muonCutPt)+getbranches(self.muonCutEta)
+    self.colfields    = {
+      'Muon': ['pt','eta','phi','dz','dxy','mediumId','pfRelIso04_all'],
+      'Tau':  ['pt','eta','phi','mass','dz','charge','decayMode','rawDeepTau2017v2p1VSjet',
+               'idDeepTau2017v2p1VSe','idDeepTau2017v2p1VSmu','idDeepTau2017v2p1VSjet']+(['genPartFlav'] if self.ismc else [ ]),
+    }
+    
+    # OBJECT PROXIES
+    self.objfields['Muon'] = self.colfields['Muon']+['mass','charge']
+    self.objfields['Tau']  = self.colfields['Tau']
+    
     # CORRECTIONS
     if self.ismc:
       self.muSFs      = MuonSFs(era=self.era,verb=self.verbosity) # muon id/iso/trigger SFs
@@ -74,26 +92,10 @@ class ModuleMuTau(ModuleTauPair):
     pass
     
   
-  def analyze(self, event):
-    """Process and pre-select events; fill branches and return True if the events passes,
-    return False otherwise."""
-    sys.stdout.flush()
-    
-    
-    ##### NO CUT #####################################
-    if not self.fillhists(event):
-      return False
-
-    
-    ##### TRIGGER ####################################
-    if not self.trigger(event):
-      return False
-    self.out.cutflow.fill('trig')
-    
-    
-    ##### MUON #######################################
+  def selectmuons(self, event):
+    """Select muons. Independent of the tau energy scale, so reused between variations."""
     muons = [ ]
-    for muon in Collection(event,'Muon'):
+    for muon in self.collection(event,'Muon'):
       if muon.pt<self.muonCutPt(event): continue
       if abs(muon.eta)>self.muonCutEta(event): continue
       if abs(muon.dz)>0.2: continue
@@ -101,14 +103,29 @@ class ModuleMuTau(ModuleTauPair):
       if not muon.mediumId: continue
       if muon.pfRelIso04_all>0.50: continue
       muons.append(muon)
+    return muons
+    
+  
+  def selectpair(self, event):
+    """Select trigger, muons, taus and the best mutau pair by looping over the objects.
+    Return the pair, or None if the event fails."""
+    
+    ##### TRIGGER ####################################
+    if not self.trigger(event):
+      return None
+    self.out.cutflow.fill('trig')
+    
+    
+    ##### MUON #######################################
+    muons = self.getcached('muons',self.selectmuons,event)
     if len(muons)==0:
-      return False
+      return None
     self.out.cutflow.fill('muon')
     
     
     ##### TAU ########################################
     taus = [ ]
-    for tau in Collection(event,'Tau'):
+    for tau in self.collection(event,'Tau'):
       if abs(tau.eta)>self.tauCutEta: continue
       if abs(tau.dz)>0.2: continue
       if tau.decayMode not in [0,1,10,11]: continue
@@ -144,7 +161,7 @@ class ModuleMuTau(ModuleTauPair):
       if tau.pt<self.tauCutPt: continue
       taus.append(tau)
     if len(taus)==0:
-      return False
+      return None
     self.out.cutflow.fill('tau')
     
     
@@ -156,17 +173,87 @@ class ModuleMuTau(ModuleTauPair):
         ltau = LeptonTauPair(muon,muon.pfRelIso04_all,tau,tau.rawDeepTau2017v2p1VSjet)
         ltaus.append(ltau)
     if len(ltaus)==0:
+      return None
+    self.out.cutflow.fill('pair')
+    return max(ltaus).pair
+    
+  
+  def selectcolumns(self, block):
+    """Vectorized version of selectpair for a block of entries (see analysis/columnar.py).
+    Return per-event arrays of the number of passed cuts, and indices of the selected muon and tau."""
+    nevts    = block.size
+    muons    = block.Muon
+    taus     = block.Tau
+    
+    # TRIGGER
+    trigger  = block.evaluate(self.trigger,dtype=bool)
+    
+    # MUON
+    muCutPt  = block.evaluate(self.muonCutPt)[muons.evtidx]
+    muCutEta = block.evaluate(self.muonCutEta)[muons.evtidx]
+    mumask   = trigger[muons.evtidx] & (muons.pt>=muCutPt) & (np.abs(muons.eta)<=muCutEta) &\
+               (np.abs(muons.dz)<=0.2) & (np.abs(muons.dxy)<=0.045) & (muons.mediumId!=0) &\
+               (muons.pfRelIso04_all<=0.50)
+    hasmuon  = muons.any(mumask)
+    
+    # TAU
+    taumask, taupt, taumass, taues = self.selecttaus_columnar(block)
+    taumask &= hasmuon[taus.evtidx]
+    hastau   = taus.any(taumask)
+    
+    # MUTAU PAIR
+    imu, itau, ipair = cartesian(np.nonzero(mumask)[0],muons.evtidx[mumask],
+                                 np.nonzero(taumask)[0],taus.evtidx[taumask],nevts)
+    dR       = deltaR(taus.eta[itau],taus.phi[itau],muons.eta[imu],muons.phi[imu])
+    imu, itau, ipair = imu[dR>=0.5], itau[dR>=0.5], ipair[dR>=0.5]
+    best     = bestpair(ipair,nevts,muons.pt[imu].astype(np.float64),taupt[itau],
+                        -muons.pfRelIso04_all[imu],taus.rawDeepTau2017v2p1VSjet[itau])
+    haspair  = best>=0
+    
+    # RESULT
+    stage    = trigger.astype(np.int8) + hasmuon + hastau + haspair
+    ibest    = best[haspair]
+    result   = {
+      'stage':  stage,
+      'index1': np.full(nevts,-1,dtype=np.int64),
+      'index2': np.full(nevts,-1,dtype=np.int64),
+      'pt2':    np.zeros(nevts), 'mass2': np.zeros(nevts), 'es2': np.ones(nevts),
+    }
+    result['index1'][haspair] = muons.locidx[imu[ibest]]
+    result['index2'][haspair] = taus.locidx[itau[ibest]]
+    result['pt2'][haspair]    = taupt[itau[ibest]]
+    result['mass2'][haspair]  = taumass[itau[ibest]]
+    result['es2'][haspair]    = taues[itau[ibest]]
+    return result
+    
+  
+  def analyze(self, event):
+    """Process and pre-select events; fill branches and return True if the events passes,
+    return False otherwise."""
+    sys.stdout.flush()
+    
+    
+    ##### NO CUT #####################################
+    if not self.fillhists(event):
       return False
-    muon, tau = max(ltaus).pair
+
+    
+    ##### MUTAU PAIR #################################
+    if self.columns: # vectorized selection per block of entries
+      pair = self.selectpair_columnar(event)
+    else:
+      pair = self.selectpair(event)
+    if not pair:
+      return False
+    muon, tau = pair
     muon.tlv  = muon.p4()
     tau.tlv   = tau.p4()
     genmatch  = -1 if self.isdata else tau.genPartFlav
-    self.out.cutflow.fill('pair')
     
 
     # VETOES
-    extramuon_veto, extraelec_veto, dilepton_veto = getlepvetoes(event,[ ],[muon],[tau],self.channel)
-    self.out.extramuon_veto[0], self.out.extraelec_veto[0], self.out.dilepton_veto[0] = getlepvetoes(event,[ ],[muon],[ ],self.channel)
+    extramuon_veto, extraelec_veto, dilepton_veto = getlepvetoes(event,[ ],[muon],[tau],self.channel,era=self.era)
+    self.out.extramuon_veto[0], self.out.extraelec_veto[0], self.out.dilepton_veto[0] = getlepvetoes(event,[ ],[muon],[ ],self.channel,era=self.era)
     self.out.lepton_vetoes[0]       = self.out.extramuon_veto[0] or self.out.extraelec_veto[0] or self.out.dilepton_veto[0]
     self.out.lepton_vetoes_notau[0] = extramuon_veto or extraelec_veto or dilepton_veto
     
@@ -259,7 +346,7 @@ class ModuleMuTau(ModuleTauPair):
     # WEIGHTS
     if self.ismc:
       self.fillCommonCorrBranches(event,jets,met,njets_vars,met_vars)
-      if muon.pfRelIso04_all<0.50 and tau.idDeepTau2017v2p1VSjet>=2:
+      if not self.variation and muon.pfRelIso04_all<0.50 and tau.idDeepTau2017v2p1VSjet>=2: # fill once with nominal settings
         self.btagTool.fillEffMaps(jets,usejec=self.dojec)
       
       # MUON WEIGHTS
@@ -5,7 +5,7 @@ import sys, re
 from math import sqrt, exp, cos
 from ROOT import TLorentzVector, TVector3
 from PhysicsTools.NanoAODTools.postprocessing.framework.eventloop import Module
-from PhysicsTools.NanoAODTools.postprocessing.framework.datamodel import Collection, Event
+from PhysicsTools.NanoAODTools.postprocessing.framework.datamodel import Collection, Event, Object
 from TauFW.PicoProducer.corrections.PileupTool import *
 from TauFW.PicoProducer.corrections.JetVetoMapTool import *
 from TauFW.PicoProducer.corrections.RecoilCorrectionTool import *
@@ -13,10 +13,67 @@ from TauFW.PicoProducer.corrections.RecoilCorrectionTool import *
 from TauFW.PicoProducer.corrections.BTagTool import BTagWeightTool, BTagWPs
 from TauFW.common.tools.log import header
 from TauFW.PicoProducer.analysis.utils import ensurebranches, redirectbranch, deltaPhi, getmet, getmetfilters, correctmet, getlepvetoes, filtermutau
+from TauFW.PicoProducer.analysis.columnar import ColumnLoader, mutaufields, mutaucolumns, selectmutau,\
+                                                 evalmutaufilter, getbranches, getrejected
+from TauFW.PicoProducer.analysis.objects import getcollection
+from TauFW.PicoProducer.analysis.Profiler import Profiler
+import numpy as np
 __metaclass__ = type # to use super() with subclasses from CommonProducer
 tauSFVersion  = { 2016: '2016Legacy', 2017: '2017ReReco', 2018: '2018ReReco', 2022: '2022ReReco' }
 
 
+_tools = { } # correction tools shared by modules in the same process, e.g. a group of channels in picojob.py
+def sharedtool(tool, key, *args, **kwargs):
+  """Load a correction tool, or reuse the one loaded with the same key by another module
+  running in the same job, e.g. sharedtool(JetVetoMapTool,(era,),era=era)."""
+  key = (tool.__name__,)+tuple(key)
+  if key not in _tools:
+    _tools[key] = tool(*args,**kwargs)
+  return _tools[key]
+  
+
+def getvariations(tesvars=None, ltfvars=None, jtfvars=None):
+  """Parse energy scale variations to be produced in the same event loop.
+  Values can be given as a list, a comma-separated string, or an inclusive range 'start:stop:step', e.g.
+    tesvars='0.970,1.000,1.030'
+    tesvars='0.970:1.030:0.002'
+  Return a list of (name,settings) tuples, e.g. ('TES0p970',{'tes':0.970})."""
+  variations = [ ]
+  for key, values in [('tes',tesvars),('ltf',ltfvars),('jtf',jtfvars)]:
+    if values in [None,'']: continue
+    if isinstance(values,str):
+      if ':' in values: # range
+        start, stop, step = [float(x) for x in values.split(':')]
+        nsteps = int(round((stop-start)/step))
+        values = [round(start+i*step,6) for i in range(nsteps+1)]
+      else: # comma-separated list
+        values = [float(x) for x in values.split(',') if x]
+    elif not isinstance(values,(list,tuple)):
+      values = [values]
+    for value in values:
+      name = ("%s%.3f"%(key.upper(),value)).replace('.','p') # e.g. 'TES0p970'
+      variations.append((name,{ key: float(value) }))
+  return variations
+
+
+def getcommonbranches(fnames, branches, treename='Events'):
+  """Check which branches are available in the tree of each file.
+  Return the list of branches that are in all files, and the list of branches that are only in some files."""
+  if isinstance(fnames,str):
+    fnames = [fnames]
+  found = [ ] # set of available branches per file
+  for fname in fnames:
+    file = TFile.Open(fname,'READ')
+    tree = file.Get(treename)
+    found.append(set(b for b in branches if tree.GetBranch(b)))
+    file.Close()
+  if not found:
+    return list(branches), [ ]
+  common = set.intersection(*found)
+  anyfile = set.union(*found)
+  return [b for b in branches if b in common], [b for b in branches if b in anyfile and b not in common]
+
+
 
 class ModuleTauPair(Module):
   """Base class the channels of an analysis with two tau leptons: for mutau, etau, tautau, emu, mumu, ee."""
@@ -40,6 +97,8 @@ class ModuleTauPair(Module):
     self.fes        = kwargs.get('fes',      None           ) # electron-tau-fake energy scale: None, 'Up' or 'Down' (override with 'ltf=1')
     self.ltf        = kwargs.get('ltf',      None           ) # lepton-tau-fake energy scale
     self.jtf        = kwargs.get('jtf',      1.0            ) or 1.0 # jet-tau-fake energy scale
+    self.variations = getvariations(kwargs.get('tesvars',None),kwargs.get('ltfvars',None),kwargs.get('jtfvars',None)) # extra trees with shifts
+    self.variation  = None # name of current variation (None = nominal)
     ##addition Z resolution
     self.Zres       = kwargs.get('Zres',     None           ) # Z resolution 
     self.tauwp      = kwargs.get('tauwp',    1              ) # minimum DeepTau WP, e.g. 1 = VVVLoose, etc.
@@ -48,13 +107,19 @@ class ModuleTauPair(Module):
     self.domutau    = kwargs.get('domutau',  'DY' in fname or self.dozpt ) # mutau genfilter for stitching DY sample
     self.dopdf      = kwargs.get('dopdf',    False          ) and self.ismc # store PDF & scale weights
     self.dorecoil   = kwargs.get('recoil',   False          ) and self.ismc # recoil corrections #('DY' in name or re.search(r"W\d?Jets",name)) and self.year==2016) # and self.year==2016 
-    self.dosys      = self.tessys in [None,''] and self.ltf in [1,None] and self.jtf in [1,None] # include systematic variations of weight
+    self.dosys      = self.tessys in [None,''] and self.ltf in [1,None] and self.jtf in [1,None] and not self.variations # include systematic variations of weight
     self.dosys      = kwargs.get('sys',      self.dosys     ) # store fewer branches to save disk space
     self.dotight    = self.tes not in [1,None] or not self.dosys # tighten pre-selection to store fewer events
     self.dotight    = kwargs.get('tight',    self.dotight   ) # store fewer events to save disk space
     self.dojec      = kwargs.get('jec',      False          ) and self.ismc #and self.year==2016 #False
     self.dojecsys   = kwargs.get('jecsys',   self.dojec     ) and self.ismc and self.dosys #and self.dojec #and False
     self.useT1      = kwargs.get('useT1',    False          ) # MET T1 for backwards compatibility with old nanoAOD-tools JME corrector
+    self.engine     = kwargs.get('engine',   'python'       ) # 'python' (loop over objects) or 'columnar' (vectorized selection)
+    self.blocksize  = kwargs.get('blocksize', 10000         ) # number of entries read at once with columnar engine
+    self.profile    = kwargs.get('profile',  False          ) # time stages & correction tool calls (see analysis/Profiler.py)
+    self.buffer     = kwargs.get('buffer',   0              ) # number of events to buffer before filling output trees in bulk (see TreeProducer)
+    self.backend    = kwargs.get('backend',  'ttree'        ) # output format: 'ttree' or 'rntuple' (falls back to TTree if not supported)
+    self.presel     = kwargs.get('presel',   False          ) # skip events failing getpreselection before the event loop (see picojob.py)
     self.verbosity  = kwargs.get('verb',     0              ) # verbosity
     self.jetCutPt   = 30
     self.bjetCutEta = 2.4 if self.year==2016 else 2.5
@@ -62,6 +127,41 @@ class ModuleTauPair(Module):
     
     assert self.year in [2016,2017,2018,2022,2023], "Did not recognize year %s! Please choose from 2016, 2017 and 2018."%self.year
     assert self.dtype in ['mc','data','embed'], "Did not recognize data type '%s'! Please choose from 'mc', 'data' and 'embed'."%self.dtype
+    assert self.engine in ['python','columnar'], "Did not recognize engine '%s'! Please choose from 'python' and 'columnar'."%self.engine
+    assert self.engine!='columnar' or hasattr(self,'selectcolumns'),\
+      "Columnar engine not implemented for %s! Please use engine='python'."%(self.__class__.__name__)
+    if self.engine=='columnar' and self.variations:
+      print(">>> WARNING! Columnar engine not implemented for variations %s! Using engine='python'..."%(', '.join(n for n, s in self.variations)))
+      self.engine = 'python'
+    
+    # PROFILING
+    self.profiler   = Profiler() if self.profile else None
+    
+    # VARIATIONS: run analyze for each shift in the same event loop, reusing tau-independent objects
+    self.evtcache   = { } # cache of objects in the current event, shared between variations
+    self.nominal    = { 'tes': self.tes, 'ltf': self.ltf, 'jtf': self.jtf }
+    if self.variations:
+      self.analyze_ = self.analyze # channel-specific method
+      self.analyze  = self.analyzevars
+    
+    # COLUMNAR ENGINE
+    self.columns    = None # ColumnLoader for current file
+    self.mutaucols  = None # ColumnLoader of GenPart for the gen mutau filter in current file
+    self.colcuts    = [ ]  # cutflow names of selections done in selectcolumns, in order
+    self.colobjs    = [ ]  # collection names of the selected pair, e.g. ['Muon','Tau']
+    self.colscalars = [ ]  # scalar branches needed in selectcolumns, e.g. HLT paths
+    self.colfields  = { }  # collection name -> list of fields needed in selectcolumns
+    
+    # PRESELECTION: conservative cut passed to the PostProcessor, see getpreselection
+    self.preselobjs = { }  # collection name -> minimum number of objects, e.g. { 'Muon': 1, 'Tau': 1 }
+    self.preselcut  = None # preselection string set by picojob.py
+    self.preselrange = (0,None) # first entry and maximum number of entries per file
+    self.jsonfilter = None # JSON filter of certified data (run,lumi), applied together with the preselection
+    
+    # OBJECT PROXIES: collection name -> list of fields to pre-bind in the object proxies (see analysis/objects.py)
+    self.objfields  = {
+      'Jet': ['pt','eta','phi','jetId','btagDeepFlavB']+(['pt_nom'] if self.dojec else [ ]),
+    }
     
     # YEAR-DEPENDENT IDs
     self.met        = getmet(self.era,"nom" if self.dojec else "",useT1=self.useT1,verb=self.verbosity)
@@ -73,7 +173,8 @@ class ModuleTauPair(Module):
     self.jecUncLabels = [ ]
     self.metUncLabels = [ ]
     if self.ismc:
-      self.puTool      = PileupWeightTool(era=self.era,sample=self.filename,verb=self.verbosity)
+      self.puTool      = sharedtool(PileupWeightTool,(self.era,hasBuggyPU(self.filename),hasFlatPU(self.filename)),
+                                    era=self.era,sample=self.filename,verb=self.verbosity)
       self.btagTool    = BTagWeightTool('DeepJet','medium',era=self.era,channel=self.channel,maxeta=self.bjetCutEta) #,loadsys=not self.dotight
       if self.dozpt:
         self.zptTool  = ZptCorrectionTool(era=self.era)
@@ -91,7 +192,7 @@ class ModuleTauPair(Module):
       #  self.tes = 1.0 # placeholder
     self.jetvetoTool = None
     if '202' in self.era: # only mandatory for Run 3: 2022, 2023, ... (see https://cms-jerc.web.cern.ch/Recommendations/#jet-veto-maps)
-      self.jetvetoTool = JetVetoMapTool(era=self.era,verb=self.verbosity) 
+      self.jetvetoTool = sharedtool(JetVetoMapTool,(self.era,),era=self.era,verb=self.verbosity)
     self.deepjet_wp = BTagWPs('DeepJet',era=self.era)
     
   
@@ -125,12 +226,130 @@ class ModuleTauPair(Module):
     print(">>> %-12s = %s"%('useT1',     self.useT1))
     print(">>> %-12s = %s"%('jetCutPt',  self.jetCutPt))
     print(">>> %-12s = %s"%('bjetCutEta',self.bjetCutEta))
+    print(">>> %-12s = %r"%('engine',    self.engine))
+    print(">>> %-12s = %s"%('profile',   self.profile))
+    print(">>> %-12s = %s"%('buffer',    self.buffer))
+    print(">>> %-12s = %r"%('backend',   self.backend))
+    print(">>> %-12s = %r"%('presel',    self.preselcut if self.presel else self.presel))
+    if self.variations:
+      print(">>> %-12s = %s"%('variations',', '.join(n for n, s in self.variations)))
+      for name, settings in self.variations:
+        self.out.addVariation(name)
+    if self.profiler:
+      self.setprofiler()
+    
+  
+  def getpreselection(self, fnames=None, treename='Events'):
+    """Return a conservative preselection string (TTreeFormula) that all events passing selectpair
+    also pass: the OR of the trigger paths, and the minimum number of objects in self.preselobjs.
+    Trigger lambdas are assumed to be an OR of HLT paths. Paths that are not in the trees of any of the
+    given files are dropped, because ensurebranches sets them to False. Return None if there is nothing
+    to cut on, or if the files do not have the same paths, since the cut is applied to all files."""
+    paths = [ ] # list of (HLT path, expression)
+    trigger = getattr(self,'trigger',None)
+    if hasattr(trigger,'triggers'): # TrigObjMatcher
+      for trig in trigger.triggers:
+        expr = trig.patheval.replace("e.",'').replace(" and "," && ")
+        paths.append((trig.path,"(%s)"%(expr) if '&&' in expr else expr))
+    elif callable(trigger): # e.g. lambda e: e.HLT_IsoMu24 or e.HLT_IsoMu27
+      paths = [(b,b) for b in getbranches(trigger) if b.startswith('HLT_')]
+    if fnames and paths: # drop paths that are not available
+      common, partial = getcommonbranches(fnames,[p for p, e in paths],treename)
+      if partial:
+        print(">>> %s.getpreselection: Warning! Trigger paths %s are not available in all input files..."%(
+          self.__class__.__name__,', '.join(partial)))
+        return None
+      paths = [(p,e) for p, e in paths if p in common]
+    cuts = ["n%s>=%d"%(o,n) for o, n in self.preselobjs.items() if n>0]
+    if paths:
+      cuts.append("(%s)"%(' || '.join(e for p, e in paths)))
+    return ' && '.join(cuts) or None
+    
+  
+  def setpreselection(self, cut, firstevt=0, maxevts=None, json=None):
+    """Set the preselection that is passed as PostProcessor cut, and the entry range per file,
+    to account for the rejected events in the cutflow and histograms that are filled before any cuts."""
+    self.preselcut   = cut
+    self.preselrange = (firstevt,maxevts)
+    if json and self.isdata:
+      from PhysicsTools.NanoAODTools.postprocessing.framework.preskimming import JSONFilter
+      self.jsonfilter = JSONFilter(json)
+    
+  
+  def fillrejected(self, inputTree):
+    """Fill the cutflow and histograms that fillhists fills before any cuts, for the events that were
+    rejected by the preselection before the event loop, as if they had been processed."""
+    columns = ['run','luminosityBlock','PV_npvs'] if self.isdata else ['genWeight','Pileup_nTrueInt']
+    domutau = self.domutau and self.ismc
+    donjets = domutau and bool(inputTree.GetBranch('LHE_Njets'))
+    if domutau:
+      columns += mutaucolumns+(['LHE_Njets'] if donjets else [ ])
+    arrays  = getrejected(inputTree,columns,*self.preselrange)
+    if self.jsonfilter: # events rejected by the JSON are not processed at all
+      runlumis = set(zip(arrays['run'],arrays['luminosityBlock']))
+      certified = { rl: self.jsonfilter.filterRunLumi(*rl) for rl in runlumis }
+      mask    = np.array([certified[rl] for rl in zip(arrays['run'],arrays['luminosityBlock'])],dtype=bool)
+      arrays  = { c: a[mask] for c, a in arrays.items() }
+    nevts   = len(arrays[columns[0]])
+    if self.verbosity>=1:
+      print(">>> %s.fillrejected: %d events rejected by preselection %r"%(self.__class__.__name__,nevts,self.preselcut))
+    if nevts==0:
+      return 0
+    self.fillnocut('none',float(nevts))
+    if self.isdata:
+      self.fillnocut('weight',float(nevts))
+      self.fillnocut('weight_no0PU',float(np.count_nonzero(arrays['PV_npvs']>0)))
+    else:
+      genw    = arrays['genWeight'].astype(np.float64)
+      npu     = arrays['Pileup_nTrueInt'].astype(np.float64)
+      haspu   = npu>0
+      self.fillnocut('weight',genw.sum())
+      self.fillnocut('weight_no0PU',genw[haspu].sum())
+      for values in [npu,npu[haspu]]: # filled twice for events with PU>0, like in fillhists
+        if len(values)>0:
+          self.out.pileup.FillN(len(values),values,np.ones(len(values)))
+      if domutau: # only for events with PU>0, like in fillhists
+        wmutau = (genw*evalmutaufilter(arrays))[haspu]
+        self.fillnocut('weight_mutaufilter',wmutau.sum())
+        if donjets:
+          njets = arrays['LHE_Njets'][haspu]
+          for cut, mask in [('NUP0orp4',(njets==0)|(njets>4)),('NUP1',njets==1),('NUP2',njets==2),
+                            ('NUP3',njets==3),('NUP4',njets==4)]:
+            self.fillnocut('weight_mutaufilter_'+cut,wmutau[mask].sum())
+    return nevts
+    
+  
+  def setprofiler(self):
+    """Time the named stages of the event loop, tree filling, and all correction tool calls."""
+    stages = [ # methods to time, in order of the event loop
+      'analyze',                    # total per event
+      'fillhists',                  # no cut, incl. mutau filter
+      'trigger',
+      'selectpair',                 # object selection
+      'selectcolumns',              # vectorized object selection per block (engine=columnar)
+      'fillEventBranches',
+      'jetveto',
+      'selectjets',
+      'fillJetBranches',
+      'fillCommonCorrBranches',
+      'fillMETAndDiLeptonBranches',
+    ]
+    for attr in stages:
+      self.profiler.wrap(self,attr)
+    self.profiler.wrap(self,'selectpair_columnar','selectpair') # look-up of vectorized object selection
+    self.profiler.wrap(self.out,'fill','TreeProducer.fill')
+    for tool in list(vars(self).values()): # correction tools, e.g. self.btagTool
+      if type(tool).__module__.startswith('TauFW.PicoProducer.corrections'):
+        self.profiler.wraptool(tool)
     
   
   def endJob(self):
     """Wrap up after running on all events and files"""
     if self.ismc:
       self.btagTool.setDir(self.out.outfile,'btag')
+    if self.profiler:
+      self.profiler.display(title="Profile of %s:"%(self.__class__.__name__))
+      self.profiler.write(self.out.outfile)
     self.out.endJob()
     
   
@@ -192,9 +411,122 @@ class ModuleTauPair(Module):
     fullbranchlist = inputTree.GetListOfBranches()
     if 'Electron_mvaFall17Iso_WPL' not in fullbranchlist: #v10
        ensurebranches(inputTree,branchesV10)
+       redirects = dict(branchesV10)
     else: #v9
        ensurebranches(inputTree,branches) # make sure Event object has these branches
+       redirects = dict(branches)
+    
+    # PRESELECTION: account for events rejected before the event loop
+    if self.preselcut:
+      self.fillrejected(inputTree)
+    
+    # COLUMNAR ENGINE: read blocks of entries in arrays for vectorized selection
+    if self.engine=='columnar':
+      self.columns = ColumnLoader(inputFile.GetName(),inputTree.GetName(),self.selectcolumns,
+                                  scalars=self.colscalars,collections=self.colfields,redirects=redirects,
+                                  blocksize=self.blocksize,nentries=inputTree.GetEntries(),
+                                  elist=getattr(inputTree,'_entrylist',None),verb=self.verbosity)
+      if self.domutau and self.ismc:
+        self.mutaucols = ColumnLoader(inputFile.GetName(),inputTree.GetName(),selectmutau,
+                                      collections={ 'GenPart': mutaufields },blocksize=self.blocksize,
+                                      nentries=inputTree.GetEntries(),elist=getattr(inputTree,'_entrylist',None),
+                                      verb=self.verbosity)
+    if self.profiler:
+      for loader in [self.columns,self.mutaucols]:
+        if loader:
+          self.profiler.wrap(loader,'load','ColumnLoader.load')
 
+  def analyzevars(self, event):
+    """Run the channel's analyze method for the nominal settings and for each variation (e.g. TES shift)
+    in the same event loop, filling a separate tree per variation."""
+    self.evtcache = { }
+    passed = self.analyze_(event) # nominal
+    for name, settings in self.variations:
+      self.setvariation(name,settings)
+      passed = self.analyze_(event) or passed
+    self.setvariation(None)
+    return passed
+    
+  
+  def setvariation(self, name, settings={ }):
+    """Set energy scales of a variation, and fill its tree and cutflow. Restore nominal if name is None."""
+    self.variation = name
+    for key, value in self.nominal.items():
+      setattr(self,key,settings.get(key,value))
+    self.out.setVariation(name)
+    
+  
+  def getcached(self, key, func, *args, **kwargs):
+    """Compute result of a function once per event, and reuse it between variations,
+    e.g. for objects that do not depend on the tau energy scale."""
+    if not self.variations:
+      return func(*args,**kwargs)
+    if key not in self.evtcache:
+      self.evtcache[key] = func(*args,**kwargs)
+    return self.evtcache[key]
+    
+  
+  def selecttaus_columnar(self, block, fes=False):
+    """Vectorized version of the common tau selection of the channel modules for a block of entries,
+    including the TES/LTF/JTF shifts. Return the mask of selected taus in the flat arrays,
+    and the (shifted) pt, mass and energy scale of each tau."""
+    taus = block.Tau
+    mask = (np.abs(taus.eta)<=self.tauCutEta) & (np.abs(taus.dz)<=0.2) &\
+           np.isin(taus.decayMode,[0,1,10,11]) & (np.abs(taus.charge)==1) &\
+           (taus.idDeepTau2017v2p1VSe>=1) & (taus.idDeepTau2017v2p1VSmu>=1) &\
+           (taus.idDeepTau2017v2p1VSjet>=self.tauwp)
+    pt   = taus.pt.astype(np.float64)
+    mass = taus.mass.astype(np.float64)
+    es   = np.ones(len(taus),dtype=np.float64)
+    if self.ismc:
+      genmatch = taus.genPartFlav
+      real     = mask & (genmatch==5)
+      lfake    = mask & (genmatch>0) & (genmatch<5)
+      if self.tes!=None: # user-defined energy scale (for TES studies)
+        es[real] = self.tes
+      else: # recommended energy scale (apply by default)
+        for i in np.nonzero(real)[0]:
+          es[i] = self.tesTool.getTES(pt[i],int(taus.decayMode[i]),unc=self.tessys)
+      if self.ltf: # lepton -> tau fake
+        es[lfake] = self.ltf
+      elif fes: # electron -> tau fake (apply by default, override with 'ltf=1.0')
+        for i in np.nonzero(lfake & ((genmatch==1) | (genmatch==3)))[0]:
+          es[i] = self.fesTool.getFES(taus.eta[i],int(taus.decayMode[i]),unc=self.fes)
+      if self.jtf!=1.0: # jet -> tau fake
+        es[mask & (genmatch==0)] = self.jtf
+      pt   *= es
+      mass *= es
+    mask &= (pt>=self.tauCutPt)
+    return mask, pt, mass, es
+    
+  
+  def selectpair_columnar(self, event):
+    """Look up the result of the vectorized selection (selectcolumns) of the block of this event,
+    fill the cutflow, and return the selected pair of objects, or None if the event fails."""
+    index, result = self.columns.get(event)
+    stage = result['stage'][index] # number of passed cuts in self.colcuts
+    for cut in self.colcuts[:stage]:
+      self.out.cutflow.fill(cut)
+    if stage<len(self.colcuts):
+      return None
+    pair = [ ]
+    for leg, name in enumerate(self.colobjs,1):
+      obj = Object(event,name,int(result['index%d'%leg][index]))
+      if self.ismc and ('es%d'%leg) in result:
+        obj.es = float(result['es%d'%leg][index]) # store energy scale for propagating to MET
+        if obj.es!=1:
+          obj.pt   = float(result['pt%d'%leg][index])
+          obj.mass = float(result['mass%d'%leg][index])
+      pair.append(obj)
+    return pair
+    
+  
+  def collection(self, event, name):
+    """Get the objects of a collection as light-weight proxies, with the fields declared in self.objfields pre-bound.
+    The branches are read once per event and shared between helper functions (and modules of a channel group)."""
+    return getcollection(event,name,self.objfields.get(name,()))
+    
+  
   def jetveto(self, event):
     """Return number of vetoed jets. Jet veto maps are mandatory for Run 3 analyses.
     The safest procedure would be to veto events if ANY jet with a loose selection lies in the veto regions.
@@ -203,8 +535,8 @@ class ModuleTauPair(Module):
     if not self.jetvetoTool:
       return 0 # assume no jet veto required (e.g. for Run 2)
     vetojets = [ ]
-    muons = [m for m in Collection(event,'Muon') if m.isPFcand]
-    for jet in Collection(event,'Jet'):
+    muons = [m for m in self.collection(event,'Muon') if m.isPFcand]
+    for jet in self.collection(event,'Jet'):
       if abs(jet.pt) <= 15: continue
       if jet.jetId < 2: continue
       if (jet.chEmEF + jet.neEmEF) > 0.90: continue
@@ -213,17 +545,28 @@ class ModuleTauPair(Module):
       vetojets.append(jet)
     return len(vetojets)
 
+  def fillnocut(self, cut, *args):
+    """Fill a bin before any cuts (e.g. 'none', 'weight') into the cutflow of the nominal and of all variations,
+    so each cutflow_<VAR> can be normalized on its own."""
+    for tree, cutflow in self.out.variations.values():
+      if cutflow:
+        cutflow.fill(cut,*args)
+
+
   def fillhists(self,event):
     """Help function to fill common histograms (cutflow etc.) before any cuts."""
-    self.out.cutflow.fill('none')
+    if self.variation: # already filled with nominal settings
+      return self.evtcache['fillhists']
+    self.evtcache['fillhists'] = False
+    self.fillnocut('none')
     if self.isdata:
-      self.out.cutflow.fill('weight',1.)
+      self.fillnocut('weight',1.)
       if event.PV_npvs>0: # for pre-UL 2017 bug in 0 PU
-        self.out.cutflow.fill('weight_no0PU',1.)
+        self.fillnocut('weight_no0PU',1.)
       else:
         return False
     else: # ismc
-      self.out.cutflow.fill('weight',event.genWeight)
+      self.fillnocut('weight',event.genWeight)
       self.out.pileup.Fill(event.Pileup_nTrueInt)
       #if self.dosys and event.nLHEScaleWeight>0:
       #idxs = [(0,0),(1,5),(2,10),(3,15),(4,20),(5,24),(6,29),(7,34),(8,39)] if event.nLHEScaleWeight>40 else\
@@ -237,29 +580,34 @@ class ModuleTauPair(Module):
       #  self.out.h_muweight.Fill(ibin,event.LHEWeight_originalXWGTUP*event.LHEScaleWeight[idx])
       #  self.out.h_muweight_genw.Fill(ibin,event.LHEWeight_originalXWGTUP*event.LHEScaleWeight[idx]*event.genWeight)
       if event.Pileup_nTrueInt>0: # for pre-UL 2017 bug in 0 PU
-        self.out.cutflow.fill('weight_no0PU',event.genWeight)
+        self.fillnocut('weight_no0PU',event.genWeight)
       else: # bug in pre-UL 2017 caused small fraction of events with nPU<=0
         return False
       # Specific selections to compute mutau filter efficiencies for stitching of different DY samples (DYJetsToTauTauToMuTauh)
       if self.domutau:
-        self.ismutau = filtermutau(event) # event passes gen mutau filter
-        self.out.cutflow.fill('weight_mutaufilter',event.genWeight*self.ismutau)
+        if self.mutaucols: # vectorized per block of entries
+          index, result = self.mutaucols.get(event)
+          self.ismutau = bool(result['mutau'][index])
+        else:
+          self.ismutau = filtermutau(event) # event passes gen mutau filter
+        self.fillnocut('weight_mutaufilter',event.genWeight*self.ismutau)
         try:
           if event.LHE_Njets==0 or event.LHE_Njets>4:
-            self.out.cutflow.fill('weight_mutaufilter_NUP0orp4',event.genWeight*self.ismutau)
+            self.fillnocut('weight_mutaufilter_NUP0orp4',event.genWeight*self.ismutau)
           elif event.LHE_Njets==1:
-            self.out.cutflow.fill('weight_mutaufilter_NUP1',event.genWeight*self.ismutau)
+            self.fillnocut('weight_mutaufilter_NUP1',event.genWeight*self.ismutau)
           elif event.LHE_Njets==2:
-            self.out.cutflow.fill('weight_mutaufilter_NUP2',event.genWeight*self.ismutau)
+            self.fillnocut('weight_mutaufilter_NUP2',event.genWeight*self.ismutau)
           elif event.LHE_Njets==3:
-            self.out.cutflow.fill('weight_mutaufilter_NUP3',event.genWeight*self.ismutau)
+            self.fillnocut('weight_mutaufilter_NUP3',event.genWeight*self.ismutau)
           elif event.LHE_Njets==4:
-            self.out.cutflow.fill('weight_mutaufilter_NUP4',event.genWeight*self.ismutau)
+            self.fillnocut('weight_mutaufilter_NUP4',event.genWeight*self.ismutau)
         except RuntimeError:
           print(">>> WARNING: RuntimeError! Setting domutau=False !")
           self.domutau = False
       self.out.pileup.Fill(event.Pileup_nTrueInt)
     
+    self.evtcache['fillhists'] = True
     return True
     
   
@@ -290,26 +638,19 @@ class ModuleTauPair(Module):
     ###  self.out.isdata[0]        = False
     
   
-  def fillJetBranches(self,event,tau1,tau2):
-    """Help function to select jets and b tags, after removing overlap with tau decay candidates,
-    and fill the jet variable branches."""
-    
-    # NOMINAL AND VARIATIONS
-    metnom     = self.met(event)
-    met_vars   = { }
-    if self.dojecsys:
-      jets_vars = { u: [ ] for u in self.jecUncLabels }
-      met_vars  = { u: self.met_vars[u](event) for u in self.metUncLabels } # TLVs
+  def selectjets(self,event,tau1,tau2):
+    """Help function to select jets and b tags, after removing overlap with tau decay candidates.
+    The result does not depend on the tau energy scale, so it can be reused between variations."""
     
     # COUNTERS
-    njets_vars     = { }
+    jets_vars      = { u: [ ] for u in self.jecUncLabels }
     jets,   bjets  = [ ], [ ]
     nfjets, ncjets = 0, 0
     ncjets50       = 0
     nbtag          = 0
     
     # SELECT JET, remove overlap with selected objects
-    for jet in Collection(event,'Jet'):
+    for jet in self.collection(event,'Jet'):
       if abs(jet.eta)>4.7: continue
       if jet.DeltaR(tau1)<0.5: continue
       if jet.DeltaR(tau2)<0.5: continue
@@ -341,6 +682,25 @@ class ModuleTauPair(Module):
         nbtag += 1
         bjets.append(jet)
     
+    jets.sort( key=lambda j: self.ptnom(j),reverse=True)
+    bjets.sort(key=lambda j: self.ptnom(j),reverse=True)
+    return jets, bjets, jets_vars, nfjets, ncjets, ncjets50, nbtag
+    
+  
+  def fillJetBranches(self,event,tau1,tau2):
+    """Help function to select jets and b tags, after removing overlap with tau decay candidates,
+    and fill the jet variable branches."""
+    
+    # NOMINAL AND VARIATIONS
+    metnom     = self.met(event)
+    met_vars   = { }
+    if self.dojecsys:
+      met_vars  = { u: self.met_vars[u](event) for u in self.metUncLabels } # TLVs
+    
+    # SELECT JETS
+    njets_vars = { }
+    jets, bjets, jets_vars, nfjets, ncjets, ncjets50, nbtag = self.getcached(('jets',tau1._index,tau2._index),self.selectjets,event,tau1,tau2)
+    
     #### TOTAL MOMENTUM
     ###eventSum = TLorentzVector()
     ###for lep in muons :
@@ -351,8 +711,6 @@ class ModuleTauPair(Module):
     ###    eventSum += j.p4()
     
     # FILL JET BRANCHES
-    jets.sort( key=lambda j: self.ptnom(j),reverse=True)
-    bjets.sort(key=lambda j: self.ptnom(j),reverse=True)
     self.out.njets[0]         = len(jets)
     self.out.njets50[0]       = len([j for j in jets if self.ptnom(j)>50])
     self.out.nfjets[0]        = nfjets
@@ -431,20 +789,20 @@ class ModuleTauPair(Module):
     #    self.out.zptweight[0]      = self.zptTool.getzptweight(boson.Pt(),boson.M())
     #
     if self.dozpt:
-      zboson = getzboson(event)
+      zboson = self.getcached('zboson',getzboson,event)
       self.out.m_moth[0]      = zboson.M()
       self.out.pt_moth[0]     = zboson.Pt()
       self.out.zptweight[0]   = self.zptTool.getZptWeight(zboson.Pt(),zboson.M())
     
     elif self.dotoppt:
-      toppt1, toppt2          = gettoppt(event)
+      toppt1, toppt2          = self.getcached('toppt',gettoppt,event)
       self.out.pt_moth1[0]    = max(toppt1,toppt2)
       self.out.pt_moth2[0]    = min(toppt1,toppt2)
       self.out.ttptweight[0]  = getTopPtWeight(toppt1,toppt2)
     
     self.out.genweight[0]     = event.genWeight
-    self.out.puweight[0]      = self.puTool.getWeight(event.Pileup_nTrueInt)
-    self.out.btagweight[0]    = self.btagTool.getWeight(jets)
+    self.out.puweight[0]      = self.getcached('puweight',self.puTool.getWeight,event.Pileup_nTrueInt)
+    self.out.btagweight[0]    = self.getcached(('btagweight',)+tuple(j._index for j in jets),self.btagTool.getJetWeights,jets,uncs=['Nom'])['Nom']
     if self.dosys:
       if self.dopdf:
         self.out.npdfweight[0]  = min(event.nLHEPdfWeight,len(self.out.pdfweight))
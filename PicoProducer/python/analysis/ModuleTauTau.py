@@ -6,6 +6,7 @@ from TauFW.PicoProducer import datadir
 from TauFW.PicoProducer.analysis.TreeProducerTauTau import *
 from TauFW.PicoProducer.analysis.ModuleTauPair import *
 from TauFW.PicoProducer.analysis.utils import DiTauPair, loosestIso, idIso, matchgenvistau, matchtaujet
+from TauFW.PicoProducer.analysis.columnar import deltaR, cartesian, bestpair
 from TauFW.PicoProducer.corrections.TrigObjMatcher import TrigObjMatcher
 from TauFW.PicoProducer.corrections.TauTriggerSFs import TauTriggerSFs
 from TauPOG.TauIDSFs.TauIDSFTool import TauIDSFTool, TauESTool, TauFESTool
@@ -24,6 +25,18 @@ class ModuleTauTau(ModuleTauPair):
     self.tauCutPt  = 40
     self.tauCutEta = 2.1
     
+    # PRESELECTION: minimum number of objects for getpreselection (with presel=True)
+    self.preselobjs = { 'Tau': 2 }
+    
+    # COLUMNAR ENGINE
+    self.colcuts    = ['trig','tau','pair']
+    self.colobjs    = ['Tau','Tau']
+    self.colscalars = self.trigger.getcolumns()[0]
+    self.colfields  = {
+      'Tau': ['pt','eta','phi','mass','dz','charge','decayMode','rawDeepTau2017v2p1VSjet',
+              'idDeepTau2017v2p1VSe','idDeepTau2017v2p1VSmu','idDeepTau2017v2p1VSjet']+(['genPartFlav'] if self.ismc else [ ]),
+    }
+    
     # CORRECTIONS
     if self.ismc:
       self.trigTool       = TauTriggerSFs('tautau','Medium',year=self.year)
@@ -53,26 +66,19 @@ class ModuleTauTau(ModuleTauPair):
     print(">>> %-12s = '%s'"%('triggers',self.trigger.path.replace("||","\n>>> %s||"%(' '*16))))
     
   
-  def analyze(self, event):
-    """Process and pre-select events; fill branches and return True if the events passes,
-    return False otherwise."""
-    sys.stdout.flush()
-    
-    
-    ##### NO CUT #####################################
-    if not self.fillhists(event):
-      return False
-    
+  def selectpair(self, event):
+    """Select trigger, taus and the best ditau pair by looping over the objects.
+    Return the pair, or None if the event fails."""
     
     ##### TRIGGER ####################################
     if not self.trigger.fired(event):
-      return False
+      return None
     self.out.cutflow.fill('trig')
     
     
     ##### TAU ########################################
     taus = [ ]
-    for tau in Collection(event,'Tau'):
+    for tau in self.collection(event,'Tau'):
       if abs(tau.eta)>self.tauCutEta: continue
       if abs(tau.dz)>0.2: continue
       if tau.decayMode not in [0,1,10,11]: continue
@@ -108,7 +114,7 @@ class ModuleTauTau(ModuleTauPair):
       if tau.pt<self.tauCutPt: continue
       taus.append(tau)
     if len(taus)==0:
-      return False
+      return None
     self.out.cutflow.fill('tau')
     
     
@@ -120,16 +126,77 @@ class ModuleTauTau(ModuleTauPair):
         ditau = DiTauPair(tau1,tau1.rawDeepTau2017v2p1VSjet,tau2,tau2.rawDeepTau2017v2p1VSjet)
         ditaus.append(ditau)
     if len(ditaus)==0:
+      return None
+    self.out.cutflow.fill('pair')
+    return max(ditaus).pair
+    
+  
+  def selectcolumns(self, block):
+    """Vectorized version of selectpair for a block of entries (see analysis/columnar.py).
+    Return per-event arrays of the number of passed cuts, and indices of the two selected taus."""
+    nevts    = block.size
+    taus     = block.Tau
+    
+    # TRIGGER
+    trigger  = self.trigger.firedcolumns(block).any(axis=0)
+    
+    # TAU
+    taumask, taupt, taumass, taues = self.selecttaus_columnar(block,fes=True)
+    taumask &= trigger[taus.evtidx]
+    hastau   = taus.any(taumask)
+    
+    # DITAU PAIR: each pair once, in the order of the collection
+    itaus    = np.nonzero(taumask)[0]
+    itau1, itau2, ipair = cartesian(itaus,taus.evtidx[itaus],itaus,taus.evtidx[itaus],nevts)
+    keep     = (taus.locidx[itau1]<taus.locidx[itau2]) &\
+               (deltaR(taus.eta[itau1],taus.phi[itau1],taus.eta[itau2],taus.phi[itau2])>=0.5)
+    itau1, itau2, ipair = itau1[keep], itau2[keep], ipair[keep]
+    best     = bestpair(ipair,nevts,taupt[itau1],taupt[itau2],
+                        taus.rawDeepTau2017v2p1VSjet[itau1],taus.rawDeepTau2017v2p1VSjet[itau2])
+    haspair  = best>=0
+    
+    # RESULT
+    stage    = trigger.astype(np.int8) + hastau + haspair
+    ibest    = best[haspair]
+    result   = { 'stage': stage }
+    for leg, itau in [(1,itau1[ibest]),(2,itau2[ibest])]:
+      result['index%d'%leg] = np.full(nevts,-1,dtype=np.int64)
+      result['pt%d'%leg]    = np.zeros(nevts)
+      result['mass%d'%leg]  = np.zeros(nevts)
+      result['es%d'%leg]    = np.ones(nevts)
+      result['index%d'%leg][haspair] = taus.locidx[itau]
+      result['pt%d'%leg][haspair]    = taupt[itau]
+      result['mass%d'%leg][haspair]  = taumass[itau]
+      result['es%d'%leg][haspair]    = taues[itau]
+    return result
+    
+  
+  def analyze(self, event):
+    """Process and pre-select events; fill branches and return True if the events passes,
+    return False otherwise."""
+    sys.stdout.flush()
+    
+    
+    ##### NO CUT #####################################
+    if not self.fillhists(event):
+      return False
+    
+    
+    ##### DITAU PAIR #################################
+    if self.columns: # vectorized selection per block of entries
+      pair = self.selectpair_columnar(event)
+    else:
+      pair = self.selectpair(event)
+    if not pair:
       return False
-    tau1, tau2 = max(ditaus).pair
+    tau1, tau2 = pair
     tau1.tlv   = tau1.p4()
     tau2.tlv   = tau2.p4()
-    self.out.cutflow.fill('pair')
     
     
     # VETOS
-    extramuon_veto, extraelec_veto, dilepton_veto = getlepvetoes(event,[ ],[ ],[tau1,tau2],self.channel)
-    self.out.extramuon_veto[0], self.out.extraelec_veto[0], self.out.dilepton_veto[0] = getlepvetoes(event,[ ],[ ],[ ],self.channel)
+    extramuon_veto, extraelec_veto, dilepton_veto = getlepvetoes(event,[ ],[ ],[tau1,tau2],self.channel,era=self.era)
+    self.out.extramuon_veto[0], self.out.extraelec_veto[0], self.out.dilepton_veto[0] = getlepvetoes(event,[ ],[ ],[ ],self.channel,era=self.era)
     self.out.lepton_vetoes[0]       = self.out.extramuon_veto[0] or self.out.extraelec_veto[0] #or self.out.dilepton_veto[0]
     self.out.lepton_vetoes_notau[0] = extramuon_veto or extraelec_veto #or dilepton_veto
     
@@ -225,7 +292,7 @@ class ModuleTauTau(ModuleTauPair):
     # WEIGHTS
     if self.ismc:
       self.fillCommonCorrBranches(event,jets,met,njets_vars,met_vars)
-      if tau1.idDeepTau2017v2p1VSjet>=2 and tau2.idDeepTau2017v2p1VSjet>=2:
+      if not self.variation and tau1.idDeepTau2017v2p1VSjet>=2 and tau2.idDeepTau2017v2p1VSjet>=2: # fill once with nominal settings
         self.btagTool.fillEffMaps(jets,usejec=self.dojec)
       self.out.trigweight[0]             = self.trigTool.getSFPair(tau1,tau2)
       self.out.trigweight_tight[0]       = self.trigTool_tight.getSFPair(tau1,tau2)
@@ -0,0 +1,127 @@
+# Description: Opt-in profiling of the hot paths of analysis modules: count calls and time named stages
+#              (e.g. trigger, object selection, tree filling) and correction tool calls, and store
+#              a timing histogram and a text summary in the output file, next to the cutflow.
+#              Times are inclusive: nested stages (e.g. a tool called in fillCommonCorrBranches) are also
+#              counted in the outer stage.
+# Usage:
+#   pico.py run -c mutau -y 2018 -s DYJets -m 5000 -E profile=True
+#   pico.py status -c mutau -y 2018 -s DYJets --profile # aggregate over jobs
+import time
+from functools import wraps
+import ROOT; ROOT.PyConfig.IgnoreCommandLineOptions = True
+from ROOT import TH1D, TNamed
+
+
+class Profiler(object):
+  """Container class to count calls and accumulate the wall time of named stages."""
+
+  def __init__(self, name='profile'):
+    self.name   = name # name of the histograms in the output file
+    self.stages = { }  # stage -> [ncalls, time in seconds], in order of insertion
+
+  def add(self, stage, ncalls=1, dtime=0.):
+    """Add calls and time to a stage."""
+    if stage not in self.stages:
+      self.stages[stage] = [0,0.]
+    self.stages[stage][0] += ncalls
+    self.stages[stage][1] += dtime
+
+  def wrap(self, obj, attr, stage=None):
+    """Replace a method or callable attribute of an object by a timed version.
+    Callables that were already wrapped (e.g. of a tool shared between modules) are skipped."""
+    func = getattr(obj,attr,None)
+    if not callable(func) or hasattr(func,'_profiler'):
+      return func
+    stage   = stage or attr
+    entry   = self.stages.setdefault(stage,[0,0.])
+    timer   = time.perf_counter
+    @wraps(func)
+    def timed(*args,**kwargs):
+      start = timer()
+      try:
+        return func(*args,**kwargs)
+      finally:
+        entry[0] += 1
+        entry[1] += timer()-start
+    timed._profiler = self
+    setattr(obj,attr,timed)
+    return timed
+
+  def wraptool(self, tool, prefixes=('get','fill','eval','apply','correct')):
+    """Time all public methods of a correction tool starting with one of the given prefixes."""
+    name = tool.__class__.__name__
+    for attr in dir(tool.__class__):
+      if attr.startswith(prefixes) and callable(getattr(tool.__class__,attr,None)):
+        self.wrap(tool,attr,"%s.%s"%(name,attr))
+
+  def hists(self):
+    """Create histograms of the total time and number of calls per stage."""
+    stages = [s for s in self.stages if self.stages[s][0]>0]
+    nbins  = max(1,len(stages))
+    htime  = TH1D(self.name,"Time per stage;;Time [s]",nbins,0,nbins)
+    hcalls = TH1D(self.name+'_ncalls',"Calls per stage;;Calls",nbins,0,nbins)
+    for i, stage in enumerate(stages,1):
+      ncalls, dtime = self.stages[stage]
+      for hist, value in [(htime,dtime),(hcalls,ncalls)]:
+        hist.GetXaxis().SetBinLabel(i,stage)
+        hist.SetBinContent(i,value)
+    return htime, hcalls
+
+  def write(self, directory):
+    """Write histograms and text summary to a ROOT directory, e.g. the output file."""
+    directory.cd()
+    htime, hcalls = self.hists()
+    summary = TNamed(self.name+'_summary',self.summary())
+    for obj in [htime,hcalls]:
+      obj.SetDirectory(directory)
+      obj.Write(obj.GetName(),TH1D.kOverwrite)
+    summary.Write(summary.GetName(),TNamed.kOverwrite)
+    return htime, hcalls
+
+  def summary(self, title="Profile:", sort=True):
+    """Return table with number of calls, total and average time per stage."""
+    return getsummary(self.stages,title=title,sort=sort)
+
+  def display(self, **kwargs):
+    print(self.summary(**kwargs))
+
+
+def getsummary(stages, title="Profile:", sort=True):
+  """Format table of stages, given as a dictionary stage -> [ncalls, time in seconds]."""
+  items = [(s,n,t) for s, (n,t) in stages.items() if n>0]
+  if sort: # slowest first
+    items.sort(key=lambda x: -x[2])
+  width = max([len(s) for s, n, t in items]+[5])
+  lines = [
+    ">>> "+title,
+    ">>> %-*s %10s %10s %10s"%(width,'stage','ncalls','total [s]','avg [us]'),
+    ">>> "+'-'*(width+33),
+  ]
+  for stage, ncalls, dtime in items:
+    lines.append(">>> %-*s %10d %10.3f %10.2f"%(width,stage,ncalls,dtime,1e6*dtime/ncalls))
+  return '\n'.join(lines)
+
+
+def readprofile(fnames, name='profile', verb=0):
+  """Sum the profiling histograms of several (job output) files.
+  Return a dictionary stage -> [ncalls, time in seconds], and the number of files with a profile."""
+  from TauFW.common.tools.root import ensureTFile
+  stages = { }
+  nfound = 0
+  for fname in fnames:
+    file   = ensureTFile(fname,'READ')
+    htime  = file.Get(name)
+    hcalls = file.Get(name+'_ncalls')
+    if htime and hcalls:
+      nfound += 1
+      for i in range(1,htime.GetXaxis().GetNbins()+1):
+        stage = htime.GetXaxis().GetBinLabel(i)
+        if stage not in stages:
+          stages[stage] = [0,0.]
+        stages[stage][0] += int(hcalls.GetBinContent(i))
+        stages[stage][1] += htime.GetBinContent(i)
+    elif verb>=1:
+      print(">>> readprofile: No profile %r in %s"%(name,fname))
+    file.Close()
+  return stages, nfound
+
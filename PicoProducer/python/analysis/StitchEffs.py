@@ -11,13 +11,15 @@
 #   pico.py run -c stitch -y 2018 -s DYJetsToLL_M-50 DY1J DY2J DY3J DY4J -m 100000 -E 'mutau=True'
 #   pico.py submit -c stitch -y 2018 -s DY*JetsToLL -E 'mutau=True'
 #   pico.py submit -c stitch -y 2018 -s W*JetsToLNu
+#   pico.py submit -c stitch -y 2018 -s W*JetsToLNu --rdf 4 # multi-threaded RDataFrame instead of event loop
 #   python/analysis/StitchEffs.py --mutau `for i in '' 1 2 3 4; do echo DY${i}JetsToLL=output/pico_stitch_2018_DY${i}JetsToLL_M-50.root; done`
 import ROOT; ROOT.PyConfig.IgnoreCommandLineOptions = True
 import re
 from array import array
-from ROOT import TFile, TH1D, TH2D, gStyle, kRed
+from ROOT import TFile, TH1D, TH2D, RDF, gStyle, kRed
 from PhysicsTools.NanoAODTools.postprocessing.framework.eventloop import Module
 from TauFW.PicoProducer.analysis.utils import filtermutau
+from TauFW.PicoProducer.analysis.columnar import ColumnLoader, mutaufields, selectmutau, definemutaufilter
 
 
 class StitchEffs(Module):
@@ -28,6 +30,8 @@ class StitchEffs(Module):
     self.outfile = TFile(fname,'RECREATE') # make custom file with only few histograms
     self.verb    = kwargs.get('verb', 0    )
     self.domutau = kwargs.get('mutau',False)
+    self.blocksize = kwargs.get('blocksize',10000) # number of entries read at once for mutau filter
+    self.mutaucols = None # ColumnLoader of GenPart for vectorized mutau filter
     print(">>> fname   = %r"%(self.fname))
     print(">>> domutau = %r"%(self.domutau))
     print(">>> verb    = %r"%(self.verb))
@@ -45,6 +49,14 @@ class StitchEffs(Module):
       self.h_mutau = TH1D('h_mutau',";Gen. mutau filter;Events",2,0,2)
       self.h_nup_vs_mutau = TH2D('h_nup_vs_mutau',";Gen. mutau filter;Number of LHE-level partons",2,0,2,8,0,8)
     
+  def beginFile(self, inputFile, outputFile, inputTree, wrappedOutputTree):
+    """Before processing a new file."""
+    if self.domutau: # evaluate mutau filter per block of entries
+      self.mutaucols = ColumnLoader(inputFile.GetName(),inputTree.GetName(),selectmutau,
+                                    collections={ 'GenPart': mutaufields },blocksize=self.blocksize,
+                                    nentries=inputTree.GetEntries(),elist=getattr(inputTree,'_entrylist',None),
+                                    verb=self.verb)
+    
   def endJob(self):
     """Wrap up after running on all events and files"""
     self.outfile.Write()
@@ -64,11 +76,34 @@ class StitchEffs(Module):
     self.h_ht.Fill(ht)
     self.h_nup_vs_ht.Fill(ht,nup)
     if self.domutau:
-      mutaufilter = filtermutau(event)
+      if self.mutaucols:
+        index, result = self.mutaucols.get(event)
+        mutaufilter = bool(result['mutau'][index])
+      else:
+        mutaufilter = filtermutau(event)
       self.h_mutau.Fill(mutaufilter)
       self.h_nup_vs_mutau.Fill(mutaufilter,nup)
     return False
     
+  def bookrdframe(self, rdframe):
+    """Book the same histograms on a RDataFrame instead of the event loop (see columnar.runrdframe).
+    Return list of (target, result) pairs."""
+    rdf = rdframe.Define('stitch_nup',"int(LHE_Njets)")
+    rdf = rdf.Define('stitch_ht',"std::min(double(LHE_HT),2501.)") # add overflow to last bin
+    rdf = rdf.Define('stitch_njets20',"int(Sum(Jet_pt>20))")
+    results = [
+      (self.h_nup,       rdf.Histo1D(RDF.TH1DModel(self.h_nup),'stitch_nup')),
+      (self.h_njets,     rdf.Histo1D(RDF.TH1DModel(self.h_njets),'stitch_njets20')),
+      (self.h_ht,        rdf.Histo1D(RDF.TH1DModel(self.h_ht),'stitch_ht')),
+      (self.h_nup_vs_ht, rdf.Histo2D(RDF.TH2DModel(self.h_nup_vs_ht),'stitch_ht','stitch_nup')),
+    ]
+    if self.domutau: # mutau filter as declared C++ function on the same event loop
+      rdf = definemutaufilter(rdf,'stitch_mutau')
+      rdf = rdf.Define('stitch_mutau_int',"int(stitch_mutau)")
+      results.append((self.h_mutau,        rdf.Histo1D(RDF.TH1DModel(self.h_mutau),'stitch_mutau_int')))
+      results.append((self.h_nup_vs_mutau, rdf.Histo2D(RDF.TH2DModel(self.h_nup_vs_mutau),'stitch_mutau_int','stitch_nup')))
+    return results
+    
 
 def formattitle(title):
   title = title.replace('HT',"H_{#lower[-0.2]{T}}").replace('pT',"p_{#lower[-0.2]{T}}")
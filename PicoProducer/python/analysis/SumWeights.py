@@ -7,13 +7,14 @@
 # Or with PicoProducer:
 #   pico.py channel sumw python/analysis/SumWeights.py
 #   pico.py run -c sumw -y UL2018 -s DYJetsToLL_M-50
+#   pico.py submit -c sumw -y UL2018 -s DYJetsToLL_M-50 --rdf 4 # multi-threaded RDataFrame instead of event loop
 # https://cms-nanoaod-integration.web.cern.ch/integration/cms-swmaster/mc106Xul16_doc.html
 # Float_t LHE scale variation weights (w_var / w_nominal);
 #   [0] is MUF="0.5" MUR="0.5"; [1] is MUF="1.0" MUR="0.5"; [2] is MUF="2.0" MUR="0.5";
 #   [3] is MUF="0.5" MUR="1.0"; [4] is MUF="1.0" MUR="1.0"; [5] is MUF="2.0" MUR="1.0";
 #   [6] is MUF="0.5" MUR="2.0"; [7] is MUF="1.0" MUR="2.0"; [8] is MUF="2.0" MUR="2.0"
 import ROOT; ROOT.PyConfig.IgnoreCommandLineOptions = True # to avoid conflict with argparse
-from ROOT import TFile, TH1D
+from ROOT import TFile, TH1D, RDF
 from PhysicsTools.NanoAODTools.postprocessing.framework.eventloop import Module
 
 
@@ -64,6 +65,22 @@ class SumWeights(Module):
       self.sumw_scale_genw.Fill(ibin,event.LHEWeight_originalXWGTUP*event.LHEScaleWeight[ibin]*event.genWeight)
     return False
   
+  def bookrdframe(self, rdframe):
+    """Book the same sums of weights on a RDataFrame instead of the event loop (see columnar.runrdframe).
+    Return list of (target, result) pairs."""
+    rdf = rdframe.Define('sumw_idx',"ROOT::RVec<int> i(nLHEScaleWeight); for(int j=0; j<nLHEScaleWeight; ++j) i[j]=j; return i;")
+    rdf = rdf.Define('sumw_scale',"ROOT::RVec<double>(LHEScaleWeight.begin(),LHEScaleWeight.end())*LHEWeight_originalXWGTUP")
+    rdf = rdf.Define('sumw_scale_genw',"sumw_scale*genWeight")
+    return [
+      (self.checkrdframe,    rdframe.Filter("nLHEScaleWeight!=9").Count()),
+      (self.sumw_scale,      rdf.Histo1D(RDF.TH1DModel(self.sumw_scale),'sumw_idx','sumw_scale')),
+      (self.sumw_scale_genw, rdf.Histo1D(RDF.TH1DModel(self.sumw_scale_genw),'sumw_idx','sumw_scale_genw')),
+    ]
+  
+  def checkrdframe(self, nbad):
+    """Check the number of LHE scale weights, like in analyze."""
+    assert nbad==0, "Got %s events with nLHEScaleWeight!=9, expected 9..."%(nbad)
+  
 
 # QUICK SCRIPT
 if __name__ == '__main__':
@@ -10,8 +10,17 @@
 #   Long64_t  'L'     'l'/'int62'/long     64-bit (signed) integer
 #   Float_t   'F'     'f'/'float32'        32-bit float
 #   Double_t  'D'     'd'/'float64'/float  64-bit float
+# Buffered filling:
+#   With buffer=N, the values of all branches are kept in one contiguous record, which is copied
+#   into a buffer of N events per tree at each fill; full buffers are filled into the tree column by column
+#   in C++ (one TBranch::Fill loop per branch), with clusters like TTree::Fill.
+#   pico.py run -c mutau -y 2018 -s DYJets -E buffer=1000
+# RNTuple output:
+#   With backend='rntuple', the trees are written as RNTuples with the same fields (see analysis/rntuple.py).
+#   pico.py channel mutau 'ModuleMuTau backend=rntuple'
+import json
 import numpy as np
-from ROOT import TTree, TFile, TH1D, TH2D, gDirectory, kRed
+from ROOT import TTree, TFile, TH1D, TH2D, TNamed, gDirectory, gInterpreter, kRed, std
 from TauFW.common.tools.root import ensureTFile
 from TauFW.PicoProducer.analysis.Cutflow import Cutflow
 
@@ -29,6 +38,39 @@ np_dtype = { # ROOT -> numpy data type
   'I': 'int32', 'L': 'int64', 'l': 'uint64',
   'F': 'float32', 'D': 'float64',
 }
+_fillcolumns = None # C++ function to fill a tree column by column from a buffer of records
+
+
+def getfillcolumns():
+  """Compile C++ function to fill a tree from a buffer of records column by column: fill each branch
+  for all buffered events (with the addresses pointing to the field in each record), instead of
+  filling all branches per event with TTree::Fill. Restore the branch addresses to the given row at the end."""
+  global _fillcolumns
+  if _fillcolumns==None:
+    gInterpreter.Declare("""
+      Long64_t TreeProducer_fillcolumns(TTree* tree, const std::vector<std::string>& names, const std::vector<size_t>& offsets,
+                                        const std::vector<int>& counts, ULong64_t row, ULong64_t buffer, size_t size, size_t nrows) {
+        char* address = reinterpret_cast<char*>(row);
+        char* records = reinterpret_cast<char*>(buffer);
+        Long64_t nbytes = 0;
+        for(size_t j=0; j<names.size(); ++j) {
+          TBranch* branch = tree->GetBranch(names[j].c_str());
+          TBranch* count  = counts[j]>=0 ? tree->GetBranch(names[counts[j]].c_str()) : nullptr; // length of array
+          for(size_t i=0; i<nrows; ++i) {
+            if(count) count->SetAddress(records+i*size+offsets[counts[j]]);
+            branch->SetAddress(records+i*size+offsets[j]);
+            nbytes += branch->Fill();
+          }
+        }
+        for(size_t j=0; j<names.size(); ++j)
+          tree->GetBranch(names[j].c_str())->SetAddress(address+offsets[j]);
+        tree->SetEntries(tree->GetEntries()+nrows);
+        return nbytes;
+      }
+    """)
+    from ROOT import TreeProducer_fillcolumns
+    _fillcolumns = TreeProducer_fillcolumns
+  return _fillcolumns
 
 
 class TreeProducer(object):
@@ -45,9 +87,32 @@ class TreeProducer(object):
     ncuts          = kwargs.get('ncuts',25)
     self.cutflow   = Cutflow('cutflow',ncuts) if ncuts>0 else None
     self.display   = kwargs.get('display',True) # display cutflow at the end
+    self.buffer    = kwargs.get('buffer',getattr(module,'buffer',0)) or 0 # number of events to buffer per tree before bulk filling
+    self.backend   = kwargs.get('backend',getattr(module,'backend','ttree')) or 'ttree' # 'ttree' or 'rntuple'
+    if self.backend=='rntuple':
+      from TauFW.PicoProducer.analysis.rntuple import hasrntuple
+      if not hasrntuple(verb=self.verbosity):
+        print(">>> TreeProducer.__init__: Warning! RNTuple is not supported by this ROOT version. Falling back to TTree...")
+        self.backend = 'ttree'
+      elif self.buffer>0:
+        print(">>> TreeProducer.__init__: Warning! Buffered filling is not supported for RNTuple. Ignoring buffer=%r..."%(self.buffer))
+        self.buffer = 0
+    elif self.backend!='ttree':
+      raise IOError("TreeProducer.__init__: Did not recognize backend %r! Please choose from 'ttree' and 'rntuple'."%(self.backend))
     self.pileup    = TH1D('pileup', 'pileup', 100, 0, 100)
     self.tree      = TTree('tree','tree')
+    if self.backend=='rntuple': # only keep TTree for branch addresses
+      self.tree.SetDirectory(0)
     self.hists     = { } #OrderedDict() # extra histograms to be drawn
+    self.variations = { None: (self.tree,self.cutflow) } # trees & cutflows of variations, e.g. TES shifts
+    self.variation = None  # current variation
+    self.branches  = [ ]   # (name, arrname, dtype, maxlen, arrlen) of each branch, for buffered filling or RNTuple
+    self.aliases   = { }   # alias -> expression, stored in file for RNTuple
+    self.writers   = None  # variation -> RNTuple writer
+    self.row       = None  # record with the addresses of all branches, for buffered filling
+    self.rowbytes  = None  # raw bytes of the record, for fast copying
+    self.columns   = None  # field names, offsets and lengths in the record, for filling column by column
+    self.buffers   = { }   # variation -> [buffer of raw records, number of buffered events]
   
   def addHist(self,name,*args,**kwargs):
     """Add a histogram. Call as
@@ -149,7 +214,10 @@ class TreeProducer(object):
       elif dtype=='D':        # 'D' = 'complex128', which do not work for filling float branches
         print(">>> TreeProducer.addBranch: Warning! Converting numpy data type 'D' (complex128) to 'd' (float64, Double_t)")
         dtype = 'float64'     # 'd' = 'float64' -> 'D' -> Double_t
+    if self.row is not None or self.writers is not None:
+      raise IOError("Cannot add branch %r after filling started! Please add all branches before..."%(name))
     address = np.zeros(maxlen,dtype=dtype) # array address to be filled during event loop
+    self.branches.append((name,arrname,np.dtype(dtype),maxlen,arrlen))
     setattr(self,arrname,address)
     leaflist = "%s%s/%s"%(name,arrstr,root_dtype[dtype])
     if self.verbosity>=1:
@@ -179,19 +247,122 @@ class TreeProducer(object):
     if self.verbosity>=1:
       print(">>> TreeProducer.setAlias: %r -> %r..."%(oldbranch,newbranch))
     self.tree.SetAlias(newbranch,oldbranch)
+    self.aliases[newbranch] = oldbranch
     return newbranch
   
+  def addVariation(self,name):
+    """Add a tree and cutflow for a variation (e.g. TES shift) filled in the same event loop.
+    The tree has the same branches as the nominal tree, and shares their array addresses,
+    so call this after all branches were added."""
+    if self.verbosity>=1:
+      print(">>> TreeProducer.addVariation: Adding tree 'tree_%s'..."%(name))
+    tree = self.tree.CloneTree(0) # empty clone with same branch addresses
+    tree.SetName('tree_'+name)
+    tree.SetTitle('tree, '+name)
+    tree.SetDirectory(0 if self.backend=='rntuple' else self.outfile)
+    cutflow = self.cutflow.clone('cutflow_'+name) if self.cutflow else None
+    if cutflow:
+      cutflow.hist.SetDirectory(self.outfile)
+    self.variations[name] = (tree,cutflow)
+    return tree
+  
+  def setVariation(self,name=None):
+    """Fill tree and cutflow of given variation. Use None for nominal."""
+    self.tree, self.cutflow = self.variations[name]
+    self.variation = name
+  
   def fill(self,hname=None,*args):
     """Fill tree."""
     if hname: # fill histograms for this key
       return self.hists[hname].Fill(*args)
+    elif self.buffer>0: # copy values to buffer of current tree
+      return self.fillBuffer()
+    elif self.backend=='rntuple': # copy values to RNTuple of current variation
+      if self.writers is None:
+        self.initRNTuple()
+      return self.writers[self.variation].Fill()
     else: # fill trees
       return self.tree.Fill()
   
+  def initBuffer(self):
+    """Move the addresses of all branches into one contiguous record, so that the values of
+    an event can be copied at once. The arrays of the branches become views of this record."""
+    dtype    = np.dtype([(n,d,(l,)) for n, a, d, l, _ in self.branches],align=True)
+    self.row = np.zeros(1,dtype=dtype)
+    self.rowbytes = self.row.view(np.uint8)
+    trees    = [t for t, c in self.variations.values()]
+    if self.verbosity>=1:
+      print(">>> TreeProducer.initBuffer: Buffer %d events of %d branches (%d bytes) for %d tree(s)"%(
+        self.buffer,len(self.branches),dtype.itemsize,len(trees)))
+    for name, arrname, _, _, _ in self.branches:
+      address    = self.row[name][0] # view of field in record
+      address[:] = getattr(self,arrname) # keep default values
+      setattr(self,arrname,address)
+      for tree in trees:
+        tree.GetBranch(name).SetAddress(address) # SetBranchAddress does not accept all numpy types
+  
+  def initRNTuple(self):
+    """Create a RNTuple with the same fields as the branches of the tree for each variation.
+    The values are copied from the same arrays as the TTree branch addresses."""
+    from TauFW.PicoProducer.analysis.rntuple import getrntuplewriter
+    addresses = { a: getattr(self,a) for n, a, d, m, l in self.branches }
+    self.writers = { }
+    for name, (tree, cutflow) in self.variations.items():
+      if self.verbosity>=1:
+        print(">>> TreeProducer.initRNTuple: Creating RNTuple %r with %d fields..."%(tree.GetName(),len(self.branches)))
+      self.writers[name] = getrntuplewriter(tree.GetName(),self.branches,addresses,self.outfile)
+  
+  def fillBuffer(self):
+    """Copy the values of all branches to the buffer of the current tree, and fill the tree if it is full."""
+    if self.row is None:
+      self.initBuffer()
+    buffer = self.buffers.get(self.variation,None)
+    if buffer is None:
+      buffer = self.buffers[self.variation] = [np.zeros((self.buffer,self.row.dtype.itemsize),dtype=np.uint8),0]
+    buffer[0][buffer[1]] = self.rowbytes # plain memory copy of the record
+    buffer[1] += 1
+    if buffer[1]>=self.buffer:
+      self.flush(self.variation)
+    return buffer[1]
+  
+  def flush(self,name=None):
+    """Fill the buffered events into the tree of a variation column by column. Use None for nominal."""
+    records, nrows = self.buffers.get(name,(None,0))
+    if nrows<=0:
+      return 0
+    tree   = self.variations[name][0]
+    if self.columns is None: # field names, offsets in record, and index of length branch
+      names  = [n for n, a, d, m, l in self.branches]
+      counts = [names.index(l) if isinstance(l,str) else -1 for n, a, d, m, l in self.branches]
+      self.columns = (std.vector('string')(names),std.vector('size_t')(self.row.dtype.fields[n][1] for n in names),
+                      std.vector('int')(counts))
+    nbytes = getfillcolumns()(tree,*self.columns,self.row.ctypes.data,records.ctypes.data,self.row.dtype.itemsize,nrows)
+    self.buffers[name][1] = 0
+    nentries  = tree.GetEntries()
+    autoflush = tree.GetAutoFlush() # number of entries (>0) or bytes (<0) per cluster
+    if (autoflush>0 and nentries//autoflush>(nentries-nrows)//autoflush) or (autoflush<0 and tree.GetZipBytes()>-autoflush):
+      tree.FlushBaskets(True) # write baskets & mark end of cluster, like TTree::Fill
+      if autoflush<0: # like TTree::Fill after first cluster
+        tree.SetAutoFlush(nentries)
+    if self.verbosity>=2:
+      print(">>> TreeProducer.flush: Filled %d events into %r"%(nrows,tree.GetName()))
+    return nbytes
+  
   def endJob(self):
     """Write and close files after the job ends."""
-    if self.cutflow and self.display:
+    for name in self.buffers:
+      self.flush(name)
+    if self.backend=='rntuple':
+      if self.writers is None: # no events: create empty RNTuples
+        self.initRNTuple()
+      nfinal = self.writers[self.variation].GetEntries()
+      for writer in self.writers.values():
+        writer.Close() # commit to file
+      self.outfile.cd()
+      TNamed('aliases',json.dumps(self.aliases)).Write('aliases',TNamed.kOverwrite) # no aliases in RNTuple
+    else:
       nfinal = self.tree.GetEntries() if self.tree else None
+    if self.cutflow and self.display:
       self.cutflow.display(nfinal=nfinal,final="stored in tree")
       print(">>> Write %s..."%(self.outfile.GetName()))
     self.outfile.Write()
@@ -0,0 +1,539 @@
+# Description: Columnar (array-at-a-time) tools for the ModuleTauPair family:
+#              Read blocks of nanoAOD entries into numpy arrays and apply object
+#              selections as vectorized operations instead of Python loops over Collection.
+# Usage:
+#   pico.py channel mutau 'ModuleMuTau engine=columnar'
+#   pico.py channel mutau 'ModuleMuTau engine=columnar blocksize=20000'
+import time
+import numpy as np
+from math import pi
+from TauFW.common.tools.log import Logger
+LOG = Logger('Columnar')
+
+
+def flatten(values,dtype=None):
+  """Concatenate an array of ROOT::RVec objects, as returned by RDataFrame.AsNumpy,
+  into a single flat numpy array."""
+  if len(values)==0:
+    return np.zeros(0,dtype=dtype or np.float32)
+  flat = np.concatenate([np.asarray(v) for v in values])
+  if dtype!=None and flat.dtype!=dtype:
+    flat = flat.astype(dtype)
+  return flat
+
+
+def deltaPhi(phi1,phi2):
+  """Vectorized difference in azimuthal angle, folded into [-pi,pi],
+  like PhysicsTools.NanoAODTools' deltaPhi for |phi|<=pi."""
+  dphi = np.asarray(phi1,dtype=np.float64) - np.asarray(phi2,dtype=np.float64)
+  dphi = np.where(dphi>pi,dphi-2*pi,dphi)
+  dphi = np.where(dphi<-pi,dphi+2*pi,dphi)
+  return dphi
+
+
+def deltaR(eta1,phi1,eta2,phi2):
+  """Vectorized angular distance between two sets of objects."""
+  deta = np.asarray(eta1,dtype=np.float64) - np.asarray(eta2,dtype=np.float64)
+  dphi = deltaPhi(phi1,phi2)
+  return np.sqrt(deta*deta + dphi*dphi)
+
+
+def invmass(pt1,eta1,phi1,m1,pt2,eta2,phi2,m2):
+  """Vectorized invariant mass of the sum of two sets of objects,
+  with the same arithmetic as TLorentzVector::SetPtEtaPhiM and M."""
+  px, py, pz, e = 0., 0., 0., 0.
+  for pt, eta, phi, m in [(pt1,eta1,phi1,m1),(pt2,eta2,phi2,m2)]:
+    pt  = np.abs(np.asarray(pt,dtype=np.float64))
+    m   = np.asarray(m,dtype=np.float64)
+    x   = pt*np.cos(np.asarray(phi,dtype=np.float64))
+    y   = pt*np.sin(np.asarray(phi,dtype=np.float64))
+    z   = pt*np.sinh(np.asarray(eta,dtype=np.float64))
+    p2  = x*x+y*y+z*z
+    px, py, pz = px+x, py+y, pz+z
+    e   = e + np.where(m>=0,np.sqrt(p2+m*m),np.sqrt(np.maximum(p2-m*m,0.)))
+  mm = e*e-(px*px+py*py+pz*pz)
+  return np.where(mm<0,-np.sqrt(np.abs(mm)),np.sqrt(np.abs(mm)))
+
+
+def cartesian(idx1,evt1,idx2,evt2,nevts):
+  """Build all pairs of two sets of objects within the same event, given the flat indices
+  of the objects and their event index (sorted by event).
+  The pairs are ordered like nested loops over the first and second set in each event."""
+  n1    = np.bincount(evt1,minlength=nevts)
+  n2    = np.bincount(evt2,minlength=nevts)
+  off1  = np.cumsum(n1)-n1
+  off2  = np.cumsum(n2)-n2
+  npair = n1*n2
+  evt   = np.repeat(np.arange(nevts,dtype=np.int64),npair)
+  ipair = np.arange(npair.sum(),dtype=np.int64) - np.repeat(np.cumsum(npair)-npair,npair) # index of pair within event
+  i1    = idx1[off1[evt] + ipair//n2[evt]]
+  i2    = idx2[off2[evt] + ipair%n2[evt]]
+  return i1, i2, evt
+
+
+def bestpair(evt,nevts,*keys):
+  """Select the best pair in each event by lexicographical ordering of the keys (largest first),
+  e.g. keys = (pt1,pt2,-iso1,iso2). In case of a complete tie, the last pair is chosen,
+  like max() with the LeptonPair.__gt__ comparison.
+  Return the index of the best pair per event, or -1 if the event has no pairs."""
+  best = np.full(nevts,-1,dtype=np.int64)
+  if len(evt)==0:
+    return best
+  order = np.lexsort((np.arange(len(evt)),)+tuple(reversed(keys))+(evt,))
+  sevt  = evt[order]
+  last  = np.append(sevt[1:]!=sevt[:-1],True) # last pair of each event after sorting
+  best[sevt[last]] = order[last]
+  return best
+
+
+def getbranches(func):
+  """Get names of attributes used by a per-event function, e.g. the branch names
+  of HLT paths in a trigger lambda like 'lambda e: e.HLT_IsoMu24 or e.HLT_IsoMu27'."""
+  if hasattr(func,'__code__'):
+    return list(func.__code__.co_names)
+  return [ ]
+
+
+class JaggedArray:
+  """Container of flat per-object arrays of a nanoAOD collection (e.g. 'Muon_pt', 'Muon_eta')
+  in a block of entries, with the offsets of each event."""
+
+  def __init__(self, name, counts, arrays=None):
+    counts       = np.asarray(counts,dtype=np.int64)
+    offsets      = np.zeros(len(counts)+1,dtype=np.int64)
+    np.cumsum(counts,out=offsets[1:])
+    self.name    = name    # collection name, e.g. 'Muon'
+    self.counts  = counts  # number of objects per event
+    self.offsets = offsets # index of first object of each event in the flat arrays
+    self.evtidx  = np.repeat(np.arange(len(counts),dtype=np.int64),counts) # event index of each object
+    self.locidx  = np.arange(offsets[-1],dtype=np.int64) - offsets[:-1][self.evtidx] # index of each object within its event
+    self.arrays  = arrays or { } # field -> flat numpy array
+
+  def __repr__(self):
+    return "<%s(%r,%d) at %s>"%(self.__class__.__name__,self.name,len(self.counts),hex(id(self)))
+
+  def __len__(self):
+    """Total number of objects in the block."""
+    return int(self.offsets[-1])
+
+  def __getattr__(self, field):
+    arrays = self.__dict__.get('arrays',{ })
+    if field in arrays:
+      return arrays[field]
+    raise AttributeError("%r has no field %r! Available: %s"%(self,field,', '.join(arrays)))
+
+  def __setitem__(self, field, array):
+    self.arrays[field] = array
+
+  def any(self, mask):
+    """Return per-event boolean array: whether any object in the event passes the mask."""
+    return np.bincount(self.evtidx[mask],minlength=len(self.counts))>0
+
+
+class _Row:
+  """Light-weight view of the scalar columns of a block at a given entry,
+  to evaluate per-event functions like trigger lambdas."""
+  __slots__ = ('_columns','_index')
+
+  def __init__(self, columns):
+    self._columns = columns
+    self._index   = 0
+
+  def __getattr__(self, attr):
+    try:
+      return self._columns[attr][self._index]
+    except KeyError:
+      raise AttributeError("Column %r was not loaded! Available: %s"%(attr,', '.join(self._columns)))
+
+
+class ColumnBlock:
+  """Block of consecutive entries [first,stop) of the input tree, with scalar branches as flat
+  numpy arrays, and collections as JaggedArray objects."""
+
+  def __init__(self, first, stop, scalars, collections):
+    self.first       = first       # first tree entry in this block
+    self.stop        = stop        # last tree entry (exclusive)
+    self.size        = stop-first  # number of entries
+    self.scalars     = scalars     # branch name -> numpy array
+    self.collections = collections # collection name -> JaggedArray
+
+  def __repr__(self):
+    return "<%s(%d,%d) at %s>"%(self.__class__.__name__,self.first,self.stop,hex(id(self)))
+
+  def __contains__(self, entry):
+    return self.first<=entry<self.stop
+
+  def __getattr__(self, attr):
+    for key in ['scalars','collections']:
+      columns = self.__dict__.get(key,{ })
+      if attr in columns:
+        return columns[attr]
+    raise AttributeError("%r has no column %r!"%(self,attr))
+
+  def evaluate(self, func, dtype=np.float64):
+    """Evaluate a per-event function of scalar branches (e.g. trigger lambda, or a pt cut that
+    depends on the trigger) for all entries in the block at once: The function is only called once
+    for each unique combination of the values of the branches it uses (e.g. at most 2^n for n HLT paths),
+    and the results are broadcast to all entries with numpy."""
+    names = [n for n in getbranches(func) if n in self.scalars]
+    key   = np.zeros(self.size,dtype=np.int64)
+    ncomb = 1
+    for name in names: # mixed-radix code of unique values per entry
+      uniq, inverse = np.unique(self.scalars[name],return_inverse=True)
+      ncomb *= max(1,len(uniq))
+      if ncomb>self.size: # e.g. continuous values: no gain
+        key = np.arange(self.size,dtype=np.int64)
+        break
+      key = key*len(uniq)+inverse.reshape(-1)
+    _, first, inverse = np.unique(key,return_index=True,return_inverse=True)
+    row    = _Row({ n: self.scalars[n][first] for n in names })
+    def iterrows():
+      for i in range(len(first)):
+        row._index = i
+        yield func(row)
+    values = np.fromiter(iterrows(),dtype=dtype,count=len(first))
+    return values[inverse.reshape(-1)]
+
+
+class ColumnLoader:
+  """Load blocks of entries of the input nanoAOD tree with RDataFrame, and cache the result
+  of a vectorized selection function per block, so the event loop can look it up per entry."""
+
+  def __init__(self, fname, treename, selector, scalars=[ ], collections={ }, **kwargs):
+    self.fname       = fname       # input file
+    self.treename    = treename    # input tree, e.g. 'Events'
+    self.selector    = selector    # function taking a ColumnBlock, and returning a dict of per-event numpy arrays
+    self.scalars     = list(scalars)     # list of scalar branches to load
+    self.collections = dict(collections) # collection name -> list of fields to load
+    self.redirects   = kwargs.get('redirects', { }    ) # branch -> replacement branch (str), or default value
+    self.blocksize   = kwargs.get('blocksize', 10000  ) # number of entries per block
+    self.nentries    = kwargs.get('nentries',  None   ) # total number of entries in the tree
+    self.elist       = kwargs.get('elist',     None   ) # TEntryList of pre-selection, mapping event index -> tree entry
+    self.verbosity   = kwargs.get('verb',      0      ) # verbosity
+    self.rdframe     = None # RDataFrame of the input tree, created once per file
+    self.block       = None # current block
+    self.result      = None # selection result for current block
+    self.branches    = None # set of available branches
+
+  def __repr__(self):
+    return "<%s(%r,%r) at %s>"%(self.__class__.__name__,self.fname,self.treename,hex(id(self)))
+
+  def entry(self, event):
+    """Get tree entry of an Event object, taking into account the entry list of the pre-selection."""
+    entry = event._entry
+    if self.elist:
+      entry = self.elist.GetEntry(entry)
+    return entry
+
+  def column(self, branch):
+    """Resolve branch name with redirects (see ModuleTauPair.beginFile) for missing branches."""
+    if self.branches==None or branch in self.branches:
+      return branch, None
+    if branch not in self.redirects:
+      LOG.throw(IOError,"ColumnLoader.column: Branch %r does not exist in %r..."%(branch,self.fname))
+    redirect = self.redirects[branch]
+    if isinstance(redirect,str):
+      return redirect, None
+    return None, redirect # default value
+
+  def load(self, first):
+    """Read entries [first,first+blocksize) of the input tree into numpy arrays."""
+    from ROOT import RDataFrame
+    stop = first+self.blocksize
+    if self.nentries!=None:
+      stop = min(stop,self.nentries)
+    if self.rdframe==None: # reuse for all blocks
+      self.rdframe  = RDataFrame(self.treename,self.fname)
+      self.branches = set(str(b) for b in self.rdframe.GetColumnNames())
+    rdframe = self.rdframe.Range(first,stop)
+    columns = { } # requested branch -> column to read
+    defaults = { } # requested branch -> default value
+    for branch in self.scalars+['n'+c for c in self.collections]+\
+                  [c+'_'+f for c, fields in self.collections.items() for f in fields]:
+      column, default = self.column(branch)
+      if column:
+        columns[branch] = column
+      else:
+        defaults[branch] = default
+    if self.verbosity>=2:
+      print(">>> ColumnLoader.load: Reading entries [%d,%d) of %r..."%(first,stop,self.fname))
+    arrays = rdframe.AsNumpy(sorted(set(columns.values())))
+    size   = len(arrays[columns['n'+list(self.collections)[0]]]) if self.collections else\
+             len(arrays[next(iter(columns.values()))]) if columns else stop-first
+
+    # SCALARS
+    scalars = { }
+    for branch in self.scalars:
+      if branch in columns:
+        scalars[branch] = arrays[columns[branch]]
+      else:
+        scalars[branch] = np.full(size,defaults[branch])
+
+    # COLLECTIONS
+    collections = { }
+    for name, fields in self.collections.items():
+      counts = arrays[columns['n'+name]]
+      jagged = JaggedArray(name,counts)
+      for field in fields:
+        branch = name+'_'+field
+        if branch in columns:
+          jagged[field] = flatten(arrays[columns[branch]])
+        else: # e.g. [True]*32 for branches not available anymore in nanoAODv9
+          default = defaults[branch]
+          value   = default[0] if isinstance(default,(list,tuple)) else default
+          jagged[field] = np.full(len(jagged),value)
+      collections[name] = jagged
+
+    self.block  = ColumnBlock(first,first+size,scalars,collections)
+    self.result = self.selector(self.block)
+    return self.block
+
+  def get(self, event):
+    """Get the index of this event in the current block (loading a new block if needed),
+    and the per-event selection result of the block."""
+    entry = self.entry(event)
+    if self.block==None or entry not in self.block:
+      self.load(entry)
+    return entry-self.block.first, self.result
+
+  
+
+mutaufields = ['pdgId','status','statusFlags','genPartIdxMother','pt','eta','phi','mass'] # GenPart fields for filtermutau
+mutaucolumns = ['nGenPart']+['GenPart_'+f for f in mutaufields] # branches for evalmutaufilter
+
+
+def getmutaucands(genparts):
+  """Find muons and last-copy taus from the hard process in a JaggedArray of GenPart,
+  and return their masks, and whether each event has exactly one muon and two taus."""
+  nevts  = len(genparts.counts)
+  pid    = np.abs(genparts.pdgId)
+  flags  = genparts.statusFlags
+  ismuon = (pid==13) & ((flags & ((1<<9)|(1<<10)))!=0) # isHardProcessTauDecayProduct or isDirectHardProcessTauDecayProduct
+  istau  = (pid==15) & ((flags & (1<<8))!=0) & (genparts.status==2) # fromHardProcess, last copy
+  iscand = (np.bincount(genparts.evtidx[ismuon],minlength=nevts)==1) &\
+           (np.bincount(genparts.evtidx[istau],minlength=nevts)==2)
+  return ismuon, istau, iscand
+
+
+def getpseudorapidity(px,py,pz):
+  """Vectorized pseudorapidity with the same arithmetic and limits as TVector3::PseudoRapidity."""
+  mag = np.sqrt(px*px+py*py+pz*pz)
+  with np.errstate(divide='ignore',invalid='ignore'):
+    cos = np.where(mag==0,1.0,pz/np.where(mag==0,1.0,mag))
+    eta = -0.5*np.log((1.0-cos)/(1.0+cos))
+  return np.where(cos*cos<1,eta,np.where(pz==0,0.,np.where(pz>0,10e10,-10e10)))
+
+
+def filtermutau(genparts, ptmin=18., etamax=2.5):
+  """Vectorized generator-level mutau filter for stitching DYJetsToTauTauToMuTauh, see utils.filtermutau.
+  Take a JaggedArray of GenPart with the fields in mutaufields, and return a boolean array per event:
+  exactly one muon from the hard-process taus with pt>ptmin, |eta|<etamax, and two last-copy taus
+  from the hard process, of which one has opposite charge to the muon, and a visible pt>ptmin, |eta|<etamax.
+  The visible tau momentum is the sum of the non-leptonic daughters (|pdgId|>16) of the last-copy tau."""
+  nevts  = len(genparts.counts)
+  passed = np.zeros(nevts,dtype=bool)
+  if len(genparts)==0:
+    return passed
+  ismuon, istau, iscand = getmutaucands(genparts)
+  if not iscand.any():
+    return passed
+  evtidx = genparts.evtidx
+  pdgid  = genparts.pdgId
+  pt, eta, phi = genparts.pt, genparts.eta, genparts.phi
+  
+  # MUON
+  imuon  = np.full(nevts,-1,dtype=np.int64)
+  idxs   = np.flatnonzero(ismuon & iscand[evtidx])
+  imuon[evtidx[idxs]] = idxs # unique per candidate event
+  ismuok = iscand.copy()
+  ismuok[iscand] = (pt[imuon[iscand]]>ptmin) & (np.abs(eta[imuon[iscand]])<etamax)
+  if not ismuok.any():
+    return passed
+  
+  # VISIBLE TAU MOMENTUM: sum daughters in the order of the collection, like TLorentzVector += p4
+  mother = genparts.genPartIdxMother
+  isvis  = (np.abs(pdgid)>16) & (mother>=0) & (mother<genparts.locidx) & ismuok[evtidx] # mother stored before daughter
+  vidxs  = np.flatnonzero(isvis)
+  gmoth  = mother[vidxs]+genparts.offsets[evtidx[vidxs]] # global index of mother
+  keep   = istau[gmoth]
+  vidxs, gmoth = vidxs[keep], gmoth[keep]
+  vpt, vphi = pt[vidxs].astype(np.float64), phi[vidxs].astype(np.float64)
+  px     = np.bincount(gmoth,weights=vpt*np.cos(vphi),minlength=len(genparts))
+  py     = np.bincount(gmoth,weights=vpt*np.sin(vphi),minlength=len(genparts))
+  pz     = np.bincount(gmoth,weights=vpt*np.sinh(eta[vidxs].astype(np.float64)),minlength=len(genparts))
+  
+  # TAUS: opposite charge to muon, visible pt & eta
+  tidxs  = np.flatnonzero(istau & ismuok[evtidx])
+  tevts  = evtidx[tidxs]
+  tpx, tpy, tpz = px[tidxs], py[tidxs], pz[tidxs]
+  istauok = (pdgid[tidxs]*pdgid[imuon[tevts]]<0) & (np.sqrt(tpx*tpx+tpy*tpy)>ptmin) &\
+            (np.abs(getpseudorapidity(tpx,tpy,tpz))<etamax)
+  passed[tevts[istauok]] = True
+  return passed
+
+
+def selectmutau(block):
+  """Selector for a ColumnLoader of GenPart with the fields in mutaufields."""
+  return { 'mutau': filtermutau(block.GenPart) }
+
+
+def declaremutaufilter():
+  """Declare the generator-level mutau filter as a C++ function on the RVec columns of GenPart,
+  with the same arithmetic as filtermutau, to evaluate it in RDataFrame.Define without loading
+  arrays into memory. The template allows both the Int_t and the (U)Short_t branches of newer nanoAOD."""
+  import ROOT
+  if not hasattr(ROOT,'TauFW_filtermutau'):
+    ROOT.gInterpreter.Declare("""
+      template<typename I, typename S, typename F, typename M, typename V>
+      bool TauFW_filtermutau(const I& pdgId, const S& status, const F& flags, const M& mother,
+                             const V& pt, const V& eta, const V& phi, double ptmin, double etamax) {
+        int imuon = -1, nmuon = 0;
+        std::vector<int> itaus;
+        for (size_t i=0; i<pdgId.size(); ++i) {
+          int pid = std::abs(int(pdgId[i]));
+          if (pid==13 && (int(flags[i]) & ((1<<9)|(1<<10)))) { imuon = i; nmuon++; }
+          else if (pid==15 && (int(flags[i]) & (1<<8)) && status[i]==2) itaus.push_back(i);
+        }
+        if (nmuon!=1 || itaus.size()!=2) return false;
+        if (!(pt[imuon]>ptmin && std::abs(eta[imuon])<etamax)) return false;
+        for (int itau: itaus) {
+          if (int(pdgId[itau])*int(pdgId[imuon])>=0) continue;
+          double px = 0, py = 0, pz = 0; // visible tau momentum
+          for (size_t i=itau+1; i<pdgId.size(); ++i) {
+            if (int(mother[i])!=itau || std::abs(int(pdgId[i]))<=16) continue;
+            px += double(pt[i])*std::cos(double(phi[i]));
+            py += double(pt[i])*std::sin(double(phi[i]));
+            pz += double(pt[i])*std::sinh(double(eta[i]));
+          }
+          double mag = std::sqrt(px*px+py*py+pz*pz);
+          double cos = mag==0 ? 1.0 : pz/mag;
+          double abseta = cos*cos<1 ? std::abs(-0.5*std::log((1.0-cos)/(1.0+cos))) : (pz==0 ? 0. : 10e10);
+          if (std::sqrt(px*px+py*py)>ptmin && abseta<etamax) return true;
+        }
+        return false;
+      }""")
+  return 'TauFW_filtermutau'
+
+
+def definemutaufilter(rdframe, name='mutau', ptmin=18., etamax=2.5):
+  """Define a column with the generator-level mutau filter in a RDataFrame (or a filtered node)."""
+  func = declaremutaufilter()
+  args = ','.join('GenPart_'+f for f in ['pdgId','status','statusFlags','genPartIdxMother','pt','eta','phi'])
+  return rdframe.Define(name,"%s(%s,%r,%r)"%(func,args,float(ptmin),float(etamax)))
+
+
+def getmutaufilter(rdframe, ptmin=18., etamax=2.5):
+  """Evaluate the generator-level mutau filter for all events in a RDataFrame (or a filtered node),
+  e.g. to compute stitching efficiencies without an event loop. Return a boolean numpy array per event."""
+  rdf = definemutaufilter(rdframe,'getmutaufilter',ptmin=ptmin,etamax=etamax)
+  return rdf.AsNumpy(['getmutaufilter'])['getmutaufilter'].astype(bool)
+
+
+def evalmutaufilter(arrays, ptmin=18., etamax=2.5):
+  """Evaluate the generator-level mutau filter on a dictionary of arrays of the branches
+  in mutaucolumns, as returned by RDataFrame.AsNumpy."""
+  genparts = JaggedArray('GenPart',arrays['nGenPart'])
+  for field in mutaufields:
+    genparts[field] = flatten(arrays['GenPart_'+field])
+  return filtermutau(genparts,ptmin=ptmin,etamax=etamax)
+
+
+def runrdframe(modules, fnames, treename='Events', firstEntry=0, maxEntries=None, nthreads=0, verb=0):
+  """Run "histogram-only" modules (e.g. SumWeights, StitchEffs) as a RDataFrame graph instead of
+  nanoAOD-tools' PostProcessor. Each module should have a method bookrdframe(rdframe), which books
+  its accumulations lazily, and returns a list of (target, result) pairs: after the event loop,
+  the result is added to the target histogram, or passed to the target if it is a function.
+  Like in the PostProcessor, firstEntry and maxEntries are applied to each file.
+  Without an entry range, all files are processed in one multi-threaded event loop;
+  with an entry range, RDataFrame.Range requires one single-threaded event loop per file."""
+  from ROOT import RDataFrame, std, EnableImplicitMT, DisableImplicitMT, IsImplicitMTEnabled
+  start    = time.time()
+  firstEntry = max(0,firstEntry or 0)
+  maxEntries = maxEntries if maxEntries and maxEntries>0 else 0
+  if firstEntry>0 or maxEntries>0: # entry range per file
+    if IsImplicitMTEnabled():
+      DisableImplicitMT()
+    stop     = firstEntry+maxEntries if maxEntries>0 else 0 # 0 = until end of tree
+    rdframes = [RDataFrame(treename,fname).Range(firstEntry,stop) for fname in fnames]
+  else:
+    if nthreads!=1:
+      EnableImplicitMT(nthreads) # 0 = all available cores
+    rdframes = [RDataFrame(treename,std.vector('string')(fnames))]
+  if verb>=1:
+    print(">>> runrdframe: Running %d module(s) on %d file(s) with %d RDataFrame(s), first=%r, max=%r, nthreads=%r"%(
+      len(modules),len(fnames),len(rdframes),firstEntry,maxEntries,nthreads if len(rdframes)==1 else 1))
+  
+  # BOOK
+  booked = [ ]
+  counts = [ ]
+  for rdframe in rdframes:
+    counts.append(rdframe.Count())
+    for module in modules:
+      booked.extend(module.bookrdframe(rdframe))
+  
+  # RUN & COLLECT
+  nevts = sum(c.GetValue() for c in counts) # trigger event loop of each graph
+  for target, result in booked:
+    value = result.GetValue()
+    if hasattr(target,'Add'): # histogram
+      target.Add(value)
+    else: # function
+      target(value)
+  print(">>> runrdframe: Processed %d events in %.1f seconds"%(nevts,time.time()-start))
+  return nevts
+
+
+def entrylistfilter(elist, contains=True):
+  """Return a C++ functor for RDataFrame.Filter(functor,['rdfentry_']) that keeps the entries
+  that are (not) in a TEntryList. The tree entry is only equal to rdfentry_ in a single-threaded
+  event loop, and TEntryList::Contains is not thread-safe, so use it without implicit multithreading."""
+  import ROOT
+  if not hasattr(ROOT,'TauFW_EntryListFilter'):
+    ROOT.gInterpreter.Declare("""
+      struct TauFW_EntryListFilter {
+        TEntryList* elist;
+        bool contains;
+        TauFW_EntryListFilter(TEntryList& list, bool keep): elist(&list), contains(keep) { }
+        bool operator()(ULong64_t entry) const { return bool(elist->Contains(entry))==contains; }
+      };""")
+  return ROOT.TauFW_EntryListFilter(elist,contains)
+
+
+class SingleThread:
+  """Context manager to temporarily disable ROOT's implicit multithreading,
+  e.g. for RDataFrame.Range or to use rdfentry_ as tree entry."""
+  
+  def __enter__(self):
+    from ROOT import IsImplicitMTEnabled, DisableImplicitMT, GetThreadPoolSize
+    self.nthreads = GetThreadPoolSize() if IsImplicitMTEnabled() else None
+    if self.nthreads!=None:
+      DisableImplicitMT()
+    return self
+  
+  def __exit__(self, type, value, traceback):
+    from ROOT import EnableImplicitMT
+    if self.nthreads!=None:
+      EnableImplicitMT(self.nthreads)
+
+
+def getrejected(tree, columns, firstEntry=0, maxEntries=None):
+  """Get arrays of branches for the entries in the read range of a nanoAOD-tools InputTree
+  that are not in its entry list, i.e. the events rejected by the PostProcessor cut (or JSON)
+  before the event loop. Return a dictionary of numpy arrays, as returned by RDataFrame.AsNumpy."""
+  from ROOT import RDataFrame
+  elist = getattr(tree,'_entrylist',None)
+  if not elist: # nothing rejected
+    return { c: np.zeros(0) for c in columns }
+  oldlist  = tree.GetEntryList()
+  if oldlist: # make sure RDataFrame runs over all entries
+    tree.SetEntryList(0)
+  nentries = tree.GetEntries()
+  firstEntry = max(0,firstEntry or 0)
+  lastEntry  = min(nentries,firstEntry+maxEntries) if maxEntries and maxEntries>0 else nentries
+  with SingleThread():
+    rdframe = RDataFrame(tree).Range(firstEntry,lastEntry)
+    rdframe = rdframe.Filter(entrylistfilter(elist,False),['rdfentry_'],'rejected')
+    arrays  = rdframe.AsNumpy(columns)
+  if oldlist:
+    tree.SetEntryList(oldlist)
+  return arrays
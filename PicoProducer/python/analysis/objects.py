@@ -0,0 +1,126 @@
+# Description: Light-weight proxies of nanoAOD objects for the ModuleTauPair family:
+#              Each branch of a collection is read only once per event into a python list, and shared
+#              between all helper functions (and all modules of a channel group) that process the same event,
+#              instead of reading it via PyROOT for each Object created by every call of Collection(event,name).
+#              Proxies use __slots__ for the attributes a module declares to need, which are pre-bound in bulk;
+#              other attributes are fetched lazily, like in nanoAOD-tools' Object.
+# Usage:
+#   muons = getcollection(event,'Muon',fields=['pt','eta','phi']) # list of proxies with pre-bound pt, eta, phi
+#   for muon in muons:
+#     if muon.dz>0.2: continue # fetched lazily from the shared Muon_dz list
+import math
+import numpy as np
+from ROOT import TLorentzVector
+_proxyclasses = { } # cache of proxy classes per (collection name, pre-bound fields)
+
+
+class EventArrays:
+  """Cache of the branches of collections in the current event as python lists."""
+  __slots__ = ('event','entry','counts','arrays','numpys')
+
+  def __init__(self, event):
+    self.event  = event
+    self.entry  = event._entry
+    self.counts = { } # collection name -> number of objects
+    self.arrays = { } # branch name -> list of values
+    self.numpys = { } # branch name -> numpy array of values (or derived masks, e.g. for lepton vetoes)
+
+  def count(self, name):
+    """Get number of objects in a collection."""
+    if name not in self.counts:
+      self.counts[name] = int(getattr(self.event,'n'+name))
+    return self.counts[name]
+
+  def get(self, name, field):
+    """Get the values of a branch of a collection as a python list."""
+    branch = name+'_'+field
+    if branch not in self.arrays:
+      array  = getattr(self.event,branch)
+      values = [array[i] for i in range(self.count(name))]
+      if values and isinstance(values[0],str): # UChar_t, like in Object
+        values = [ord(v) for v in values]
+      self.arrays[branch] = values
+    return self.arrays[branch]
+
+  def getarray(self, name, field):
+    """Get the values of a branch of a collection as a numpy array, for vectorized selections."""
+    branch = name+'_'+field
+    if branch not in self.numpys:
+      self.numpys[branch] = np.array(self.get(name,field))
+    return self.numpys[branch]
+
+
+def getarrays(event):
+  """Get the cache of branch arrays of an event, which is created once per event."""
+  arrays = event.__dict__.get('_arrays',None)
+  if arrays is None or arrays.entry!=event._entry:
+    arrays = EventArrays(event)
+    event._arrays = arrays
+  return arrays
+
+
+class ObjectProxy(object):
+  """Replacement of nanoAOD-tools' Object for an object in a collection.
+  Values are read from the shared branch arrays of the event on first access, and stored in the proxy,
+  so they can be overwritten (e.g. tau.pt *= tes) without affecting other proxies of the same object."""
+  __slots__ = ('_arrays','_name','_index','__dict__')
+
+  def __init__(self, arrays, name, index):
+    self._arrays = arrays
+    self._name   = name
+    self._index  = index
+
+  def __getattr__(self, field):
+    """Fetch value of a field that is not set yet."""
+    if field[:2]=='__' and field[-2:]=='__':
+      raise AttributeError(field)
+    value = self._arrays.get(self._name,field)[self._index]
+    setattr(self,field,value)
+    return value
+
+  def __getitem__(self, field):
+    return getattr(self,field)
+
+  def __repr__(self):
+    return "<%s[%s]>"%(self._name,self._index)
+
+  def p4(self, corr_pt=None):
+    """Create TLorentzVector for this object."""
+    ret = TLorentzVector()
+    ret.SetPtEtaPhiM(self.pt if corr_pt==None else corr_pt,self.eta,self.phi,self.mass)
+    return ret
+
+  def DeltaR(self, other):
+    """Compute DeltaR with another object or TLorentzVector."""
+    if isinstance(other,TLorentzVector):
+      deta = abs(other.Eta()-self.eta)
+      dphi = abs(other.Phi()-self.phi)
+    else:
+      deta = abs(other.eta-self.eta)
+      dphi = abs(other.phi-self.phi)
+    while dphi>math.pi:
+      dphi = abs(dphi-2*math.pi)
+    return math.sqrt(dphi*dphi+deta*deta)
+
+
+def getproxyclass(name, fields=()):
+  """Get proxy class of a collection with slots for the given fields."""
+  key = (name,tuple(fields))
+  if key not in _proxyclasses:
+    _proxyclasses[key] = type(str(name+'Proxy'),(ObjectProxy,),{ '__slots__': tuple(fields) })
+  return _proxyclasses[key]
+
+
+def getcollection(event, name, fields=()):
+  """Get a list of proxies of all objects in a collection, like Collection(event,name).
+  The given fields are pre-bound: their branches are read and set for all objects at once."""
+  fields  = [f for i, f in enumerate(fields) if f not in fields[:i]] # remove duplicates
+  arrays  = getarrays(event)
+  proxy   = getproxyclass(name,fields)
+  objects = [proxy(arrays,name,i) for i in range(arrays.count(name))]
+  for field in fields:
+    setter = getattr(proxy,field).__set__ # slot descriptor
+    for obj, value in zip(objects,arrays.get(name,field)):
+      setter(obj,value)
+  return objects
+
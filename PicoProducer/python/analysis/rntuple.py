@@ -0,0 +1,96 @@
+# Description: Write the output of TreeProducer as RNTuple instead of TTree (requires ROOT v6.30 or newer)
+#              The values of each event are copied from the same numpy arrays that are used as TTree
+#              branch addresses, so analysis modules do not need to change.
+# Usage:
+#   pico.py channel mutau 'ModuleMuTau backend=rntuple'
+import ROOT
+from ROOT import gROOT, gInterpreter
+_hasrntuple = None # cache result of compilation
+rntuple_dtype = { # numpy -> type code for TreeProducer_RNTuple::Writer::Add (same as TTree leaf list)
+  'bool': 'O', 'int8': 'b', 'int32': 'I', 'int64': 'L', 'uint64': 'l', 'float32': 'F', 'float64': 'D',
+}
+
+
+def hasrntuple(verb=0):
+  """Check if this ROOT version supports writing RNTuples, and compile the writer."""
+  global _hasrntuple
+  if _hasrntuple==None:
+    _hasrntuple = gROOT.GetVersionInt()>=63000 and gInterpreter.Declare("""
+      #include <functional>
+      #include <ROOT/RNTupleModel.hxx>
+      #if ROOT_VERSION_CODE >= ROOT_VERSION(6,32,0)
+      #include <ROOT/RNTupleWriter.hxx>
+      #else
+      #include <ROOT/RNTuple.hxx>
+      #endif
+      #include <TFile.h>
+      namespace TreeProducer_RNTuple {
+      #if ROOT_VERSION_CODE >= ROOT_VERSION(6,35,0)
+        using ROOT::RNTupleModel; using ROOT::RNTupleWriter;
+      #else
+        using ROOT::Experimental::RNTupleModel; using ROOT::Experimental::RNTupleWriter;
+      #endif
+        class Writer {
+         public:
+          Writer(const std::string& name) : fName(name), fModel(RNTupleModel::Create()) { }
+          template<typename T> void AddField(const std::string& field, ULong64_t address, ULong64_t count, int len) {
+            const T* src = reinterpret_cast<const T*>(address);
+            if(count==0 && len<=1) { // scalar
+              auto ptr = fModel->MakeField<T>(field);
+              fCopies.push_back([ptr,src]() { *ptr = *src; });
+            } else { // array with variable (count) or fixed length (len)
+              auto ptr = fModel->MakeField<std::vector<T>>(field);
+              const Int_t* size = reinterpret_cast<const Int_t*>(count);
+              fCopies.push_back([ptr,src,size,len]() { ptr->assign(src,src+(size ? *size : len)); });
+            }
+          }
+          void Add(const std::string& field, char type, ULong64_t address, ULong64_t count=0, int len=1) {
+            switch(type) {
+              case 'O': AddField<bool>(field,address,count,len); break;
+              case 'b': AddField<std::uint8_t>(field,address,count,len); break;
+              case 'I': AddField<std::int32_t>(field,address,count,len); break;
+              case 'L': AddField<std::int64_t>(field,address,count,len); break;
+              case 'l': AddField<std::uint64_t>(field,address,count,len); break;
+              case 'F': AddField<float>(field,address,count,len); break;
+              case 'D': AddField<double>(field,address,count,len); break;
+              default: throw std::runtime_error("TreeProducer_RNTuple::Writer: Unknown type "+std::string(1,type));
+            }
+          }
+          void Open(TFile* file) { fWriter = RNTupleWriter::Append(std::move(fModel),fName,*file); }
+          void Fill() {
+            for(auto& copy: fCopies) copy();
+            fWriter->Fill();
+            ++fEntries;
+          }
+          ULong64_t GetEntries() const { return fEntries; }
+          const std::string& GetName() const { return fName; }
+          void Close() { fWriter.reset(); } // commit dataset to file
+         private:
+          std::string fName;
+          std::unique_ptr<RNTupleModel> fModel;
+          std::unique_ptr<RNTupleWriter> fWriter;
+          std::vector<std::function<void()>> fCopies;
+          ULong64_t fEntries = 0;
+        };
+      }
+    """)
+    if verb>=1:
+      print(">>> hasrntuple: ROOT %s, RNTuple writer available: %r"%(gROOT.GetVersion(),_hasrntuple))
+  return _hasrntuple
+
+
+def getrntuplewriter(name, branches, addresses, file):
+  """Create RNTuple writer in a file for a list of TreeProducer branches (name, arrname, dtype, maxlen, arrlen),
+  and a dictionary of their numpy address arrays."""
+  writer = ROOT.TreeProducer_RNTuple.Writer(name)
+  for bname, arrname, dtype, maxlen, arrlen in branches:
+    address = addresses[arrname]
+    count   = 0 # address of count branch for arrays of variable length
+    if isinstance(arrlen,str):
+      carray = addresses[[a for b, a, d, m, l in branches if b==arrlen][0]]
+      if carray.dtype.name!='int32':
+        raise IOError("Count branch %r of %r should be of type int32, not %s!"%(arrlen,bname,carray.dtype.name))
+      count = carray.ctypes.data
+    writer.Add(bname,rntuple_dtype[dtype.name],address.ctypes.data,count,maxlen if arrlen else 1)
+  writer.Open(file)
+  return writer
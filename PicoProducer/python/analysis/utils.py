@@ -2,7 +2,7 @@
 #from __future__ import print_function # for python3 compatibility
 import os, sys
 from math import sqrt, sin, cos, pi, log10, floor
-from itertools import combinations
+import numpy as np
 import ROOT; ROOT.PyConfig.IgnoreCommandLineOptions = True # to avoid conflict with argparse
 from ROOT import TH1D, TLorentzVector, RDataFrame
 from TauFW.PicoProducer import basedir
@@ -11,6 +11,9 @@ from TauFW.common.tools.file import ensurefile
 from TauFW.common.tools.file import ensuremodule as _ensuremodule
 from TauFW.common.tools.log import Logger
 from PhysicsTools.NanoAODTools.postprocessing.framework.datamodel import Collection, Event, Object
+from TauFW.PicoProducer.analysis.objects import getcollection, getarrays
+from TauFW.PicoProducer.analysis.columnar import JaggedArray, mutaufields, getmutaucands
+from TauFW.PicoProducer.analysis.columnar import filtermutau as _filtermutau
 LOG = Logger('Analysis')
 
 
@@ -176,46 +179,20 @@ def filtermutau(event):
   Pythia8 gen filter bug fix:
     https://github.com/cms-sw/cmssw/pull/38829
     https://indico.cern.ch/event/1170879/#2-validation-of-exclusive-dy-t
+  Vectorized over the GenPart arrays of the event with columnar.filtermutau,
+  which can also be applied to blocks of events, or a RDataFrame with columnar.getmutaufilter.
   """
-  ###print '-'*80
-  particles = Collection(event,'GenPart')
-  muon = None
-  taus = [ ]
-  ###hasZ = False # Z boson required in the buggy DYJetsToTauTauToMuTauh Pythia8 filter
-  for particle in particles:
-    pid = abs(particle.pdgId)
-    if pid==13 and (particle.statusflag('isHardProcessTauDecayProduct') or particle.statusflag('isDirectHardProcessTauDecayProduct')):
-      ###dumpgenpart(particle,genparts=particles,flags=[3,4,5,6,8,9,10])
-      if muon: # more than two muons from hard-proces taus
-        return False # do not bother any further
-      muon = particle
-    elif pid==15 and particle.statusflag('fromHardProcess'): # status==2 = last copy
-      if particle.status==2:
-        ###print getprodchain(particle,particles)
-        particle.pvis = TLorentzVector() # visible 4-momentum
-        taus.append(particle)
-      ###else: # particle.status==23
-      ###  # QUICK FIX to exclude events with taus radiating FSR photons due to bug in EmbeddingHepMCFilter
-      ###  # pre-CMSSW_10_6_30_patch1 affecting Summer19 and Summer20 UL
-      ###  # => loss of ~20% events in DYJetsToTauTauToMuTauh
-      ###  ###dumpgenpart(particle,genparts=particles,flags=['fromHardProcess','isHardProcessTauDecayProduct','isDirectHardProcessTauDecayProduct','isLastCopy'])
-      ###  ###print(getdecaychain(particle,particles))
-      ###  return False # veto events with radiating taus !
-    ###elif pid==23:
-    ###  hasZ = True # Z boson required in buggy DYJetsToTauTauToMuTauh Pythia8 filter
-    elif pid>16: # ignore neutrinos and charged leptons
-      for tau in taus:
-        if tau._index==particle.genPartIdxMother: # non-leptonic tau decay product
-          ###print(">>> add %+d to %+d"%(particle.pdgId,tau.pdgId))
-          tau.pvis += particle.p4() # add visible tau decay product
-  if len(taus)==2 and muon and muon.pt>18. and abs(muon.eta)<2.5:
-    if any(tau.pdgId*muon.pdgId<0 and tau.pvis.Pt()>18 and abs(tau.pvis.Eta())<2.5 for tau in taus):
-      return True
-  ###for genvistau in Collection(event,'GenVisTau'): # not complete...
-  ###  ###print ">>> genvistau: pt=%.1f, eta=%.2f"%(genvistau.pt,genvistau.eta)
-  ###  if genvistau.pt>18 and abs(genvistau.eta)<2.5 and genvistau.charge*muon.pdgId>0: #and any(genvistau.DeltaR(t)<0.5 for t in taus)
-  ###    return True
-  return False
+  arrays   = getarrays(event)
+  if arrays.count('GenPart')==0:
+    return False
+  genparts = JaggedArray('GenPart',[arrays.count('GenPart')])
+  for field in mutaufields[:4]: # identify muon & taus first
+    genparts[field] = arrays.getarray('GenPart',field)
+  if not getmutaucands(genparts)[2][0]: # not exactly one muon and two taus
+    return False # do not bother reading the kinematics
+  for field in mutaufields[4:]:
+    genparts[field] = arrays.getarray('GenPart',field)
+  return bool(_filtermutau(genparts)[0])
   
 
 def matchgenvistau(event,tau,dRmin=0.5):
@@ -365,64 +342,95 @@ def idIso(tau):
   return 0 if raw>4.5 else 1 if raw>3.5 else 3 # VVLoose, VLoose
 
 
-def getlepvetoes(event, electrons, muons, taus, channel, era):
-  """Check if event has extra electrons or muons. (HTT definitions.)"""
+def getdeltaRs(eta1, phi1, eta2, phi2):
+  """Vectorized DeltaR between arrays of objects, with the same arithmetic as Object.DeltaR,
+  broadcast like numpy, e.g. eta1[:,None] vs. eta2[None,:] for all combinations."""
+  deta = np.abs(eta2-eta1)
+  dphi = np.abs(phi2-phi1)
+  dphi = np.where(dphi>pi,np.abs(dphi-2*pi),dphi) # |phi|<=pi, so one step is enough
+  return np.sqrt(dphi*dphi+deta*deta)
+  
+
+def hasoverlap(eta, phi, objects, dRmin=0.4):
+  """Vectorized check which objects in the arrays (eta,phi) are within DeltaR<dRmin of any of the given objects."""
+  if not objects:
+    return np.zeros(len(eta),dtype=bool)
+  oeta = np.array([o.eta for o in objects])
+  ophi = np.array([o.phi for o in objects])
+  return (getdeltaRs(eta[:,None],phi[:,None],oeta[None,:],ophi[None,:])<dRmin).any(axis=1)
+  
+
+def hasoppositepair(mask, charge, eta, phi, dRmin):
+  """Vectorized check if any pair of selected objects has opposite charge and DeltaR>dRmin."""
+  idx = np.flatnonzero(mask)
+  if len(idx)<2:
+    return False
+  i1, i2 = np.triu_indices(len(idx),1) # all combinations of two objects
+  i1, i2 = idx[i1], idx[i2]
+  return bool(((charge[i1]*charge[i2]<0) & (getdeltaRs(eta[i1],phi[i1],eta[i2],phi[i2])>dRmin)).any())
+  
+
+def getvetomasks(arrays, name, era=""):
+  """Vectorized selection of muons or electrons for the lepton vetoes, before the overlap removal with taus.
+  Return the masks of veto candidates, extra leptons and loose leptons for the dilepton veto.
+  The masks are cached per event in the branch arrays, as they do not depend on the selected objects."""
+  key = (name,'vetomasks',era)
+  if key not in arrays.numpys:
+    if name=='Muon':
+      obj   = lambda f: arrays.getarray('Muon',f)
+      mask  = (obj('pt')>=10) & (np.abs(obj('eta'))<=2.4) & (np.abs(obj('dz'))<=0.2) &\
+              (np.abs(obj('dxy'))<=0.045) & (obj('pfRelIso04_all')<=0.3)
+      extra = mask & (obj('mediumId')!=0)
+      loose = mask & (obj('pt')>15) & (obj('isPFcand')!=0) & (obj('isGlobal')!=0) & (obj('isTracker')!=0)
+    else:
+      obj   = lambda f: arrays.getarray('Electron',f)
+      if '2022' in era:
+        iso90, iso = obj('mvaIso_Fall17V2_WP90'), obj('mvaIso_Fall17V2_WPL')
+      elif '2023' in era:
+        iso90, iso = obj('mvaIso_WP90'), obj('mvaIso')
+      else:
+        iso90, iso = obj('mvaFall17V2Iso_WP90'), obj('mvaFall17V2Iso_WPL')
+      mask  = (obj('pt')>=10) & (np.abs(obj('eta'))<=2.5) & (np.abs(obj('dz'))<=0.2) &\
+              (np.abs(obj('dxy'))<=0.045) & (obj('pfRelIso03_all')<=0.3)
+      extra = mask & (obj('convVeto')==1) & (obj('lostHits')<=1) & (iso90!=0)
+      loose = mask & (obj('pt')>15) & (obj('cutBased')>0) & (iso!=0)
+    arrays.numpys[key] = (mask.any(), mask, extra, loose)
+  return arrays.numpys[key]
+  
+
+def getlepvetoes(event, electrons, muons, taus, channel, era=""):
+  """Check if event has extra electrons or muons. (HTT definitions.)
+  Vectorized with numpy over the muon and electron arrays of the event, which are shared between calls."""
   # https://twiki.cern.ch/twiki/bin/viewauth/CMS/HiggsToTauTauWorkingLegacyRun2#Common_lepton_vetoes
   
   extramuon_veto = False
   extraelec_veto = False
   dilepton_veto  = False
+  arrays = getarrays(event)
   
   # EXTRA MUON VETO
-  looseMuons = [ ]
-  for muon in Collection(event,'Muon'):
-    if muon.pt<10: continue
-    if abs(muon.eta)>2.4: continue
-    if abs(muon.dz)>0.2: continue
-    if abs(muon.dxy)>0.045: continue
-    if muon.pfRelIso04_all>0.3: continue
-    if any(muon.DeltaR(tau)<0.4 for tau in taus): continue
-    if muon.mediumId and all(m._index!=muon._index for m in muons):
-      extramuon_veto = True
-    if muon.pt>15 and muon.isPFcand and muon.isGlobal and muon.isTracker:
-      looseMuons.append(muon)
-
-
+  if arrays.count('Muon')>0:
+    anymask, mask, extra, loose = getvetomasks(arrays,'Muon',era)
+    if anymask:
+      eta, phi = arrays.getarray('Muon','eta'), arrays.getarray('Muon','phi')
+      clean = ~hasoverlap(eta,phi,taus,0.4)
+      extra = extra & clean
+      extra[[m._index for m in muons]] = False
+      extramuon_veto = bool(extra.any())
+      if channel=='mutau':
+        dilepton_veto = hasoppositepair(loose & clean,arrays.getarray('Muon','charge'),eta,phi,0.15)
+  
   # EXTRA ELECTRON VETO
-  looseElectrons = [ ]
-  for electron in Collection(event,'Electron'): 
-    if '2022' in era:
-      electronIso90=electron.mvaIso_Fall17V2_WP90
-      electronIso=electron.mvaIso_Fall17V2_WPL
-    elif '2023' in era:
-      electronIso90=electron.mvaIso_WP90
-      electronIso=electron.mvaIso
-    else:
-      electronIso90=electron.mvaFall17V2Iso_WP90
-      electronIso=electron.mvaFall17V2Iso_WPL
-
-    if electron.pt<10: continue
-    if abs(electron.eta)>2.5: continue
-    if abs(electron.dz)>0.2: continue
-    if abs(electron.dxy)>0.045: continue
-    if electron.pfRelIso03_all>0.3: continue
-    if any(electron.DeltaR(tau)<0.4 for tau in taus): continue
-    if all(e._index!=electron._index for e in electrons) and electron.convVeto==1 and electron.lostHits<=1 and electronIso90:
-      extraelec_veto = True
-    if electron.pt>15 and electron.cutBased>0 and electronIso:
-      looseElectrons.append(electron)
- 
-  # DILEPTON VETO
-  if channel=='mutau':
-    for muon1, muon2 in combinations(looseMuons,2):
-      if muon1.charge*muon2.charge<0 and muon1.DeltaR(muon2)>0.15:
-        dilepton_veto = True
-        break
-  elif channel=='eletau' or channel=='etau':
-    for electron1, electron2 in combinations(looseElectrons,2):
-      if electron1.charge*electron2.charge<0 and electron1.DeltaR(electron2)>0.20:
-        dilepton_veto = True
-        break
+  if arrays.count('Electron')>0:
+    anymask, mask, extra, loose = getvetomasks(arrays,'Electron',era)
+    if anymask:
+      eta, phi = arrays.getarray('Electron','eta'), arrays.getarray('Electron','phi')
+      clean = ~hasoverlap(eta,phi,taus,0.4)
+      extra = extra & clean
+      extra[[e._index for e in electrons]] = False
+      extraelec_veto = bool(extra.any())
+      if channel=='eletau' or channel=='etau':
+        dilepton_veto = hasoppositepair(loose & clean,arrays.getarray('Electron','charge'),eta,phi,0.20)
   
   return extramuon_veto, extraelec_veto, dilepton_veto
   
@@ -1,7 +1,8 @@
 # Author: Izaak Neutelings (May 2020)
 from past.builtins import basestring # for python2 compatibility
 #import os, re, shutil
-import os, re
+import os, re, time, json
+import getpass
 import importlib
 from TauFW.common.tools.utils import execute
 from abc import ABCMeta, abstractmethod
@@ -11,6 +12,7 @@ class BatchSystem(object):
   """Abstract superclass for batch systems.
   Please subclass and override the abstract methods with your own routines."""
   __metaclass__ = ABCMeta
+  _queue = { } # jobs of the user per batch system, queried once per invocation: system -> (time, JobList)
   
   def __init__(self,verb=1):
     self.verbosity  = verb
@@ -62,6 +64,46 @@ class BatchSystem(object):
         print(repr(job))
     return jobs
   
+  def alljobs(self,maxage=0,**kwargs):
+    """Query all jobs of the user only once per invocation, and return a JobList indexed by job ID,
+    to select the slice of each sample with JobList.select(jobids).
+    If maxage>0, reuse the queue from a cache file that is younger than maxage seconds."""
+    verbosity = kwargs.get('verb',self.verbosity)
+    refresh   = kwargs.get('refresh',False)
+    cachename = self.queuecache()
+    if not refresh and self.system in BatchSystem._queue: # already queried in this invocation
+      return BatchSystem._queue[self.system][1]
+    if not refresh and maxage>0 and os.path.isfile(cachename) and time.time()-os.path.getmtime(cachename)<maxage:
+      if verbosity>=1:
+        print(">>> BatchSystem.alljobs: Reusing queue from %s..."%(cachename))
+      with open(cachename,'r') as file:
+        rows = json.load(file)
+      jobs = JobList([Job(self,j,taskid=t,args=a,status=s) for j, t, s, a in rows],verb=verbosity)
+    else:
+      jobs = self.jobs([ ],verb=verbosity)
+      if maxage>0:
+        if not os.path.exists(os.path.dirname(cachename)):
+          os.makedirs(os.path.dirname(cachename))
+        with open(cachename,'w') as file:
+          json.dump([(j.jobid,j.taskid,j.status,j.args) for j in jobs],file)
+    BatchSystem._queue[self.system] = (time.time(),jobs)
+    return jobs
+  
+  def queuecache(self):
+    """Cache file of the queue for alljobs."""
+    return os.path.join("/tmp",getpass.getuser(),"pico_queue_%s.json"%(self.system))
+  
+  def clearqueue(self,**kwargs):
+    """Forget the queue from alljobs (in this invocation and the cache file),
+    e.g. after submitting new jobs, so the next call queries the batch system again."""
+    verbosity = kwargs.get('verb',self.verbosity)
+    cachename = self.queuecache()
+    BatchSystem._queue.pop(self.system,None)
+    if os.path.isfile(cachename):
+      if verbosity>=2:
+        print(">>> BatchSystem.clearqueue: Removing %s..."%(cachename))
+      os.remove(cachename)
+  
   @abstractmethod
   def submit(self,script=None,taskfile=None,**kwargs):
     """Submit a script with some optional parameters."""
@@ -84,6 +126,7 @@ class JobList(object):
   def __init__(self,jobs=[ ],verb=0):
     self.jobs      = jobs
     self.verbosity = verb
+    self._index    = None # job ID -> list of jobs
   
   def __iter__(self):
     for job in self.jobs:
@@ -94,6 +137,26 @@ class JobList(object):
   
   def append(self,job):
     self.jobs.append(job)
+    self._index = None
+  
+  def index(self):
+    """Index jobs by job ID (cluster ID for HTCondor)."""
+    if self._index==None:
+      self._index = { }
+      for job in self.jobs:
+        self._index.setdefault(job.jobid,[ ]).append(job)
+    return self._index
+  
+  def select(self,jobids,ranges=None):
+    """Return JobList with the jobs of the given job IDs. If a job ID is shared with other samples
+    (bulk submission), only select the task IDs in its range of ranges = { jobid: [first,last] }."""
+    index  = self.index()
+    ranges = ranges or { }
+    jobs   = [ ]
+    for jobid in jobids:
+      first, last = ranges.get(str(jobid),(None,None))
+      jobs.extend(j for j in index.get(int(jobid),[ ]) if first==None or first<=j.taskid<=last)
+    return JobList(jobs,verb=self.verbosity)
   
   def running(self):
     return [j for j in self.jobs if j.getstatus()=='r']
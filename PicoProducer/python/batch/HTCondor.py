@@ -45,13 +45,7 @@ class HTCondor(BatchSystem):
     if queue:
       appcmds.append("+JobFlavour=%s"%(queue))
     if time:
-      if time.count(':')==2: # e.g. 04:20:00
-        hours, mins, secs = time.split(':')
-        time = 3600*int(hours)+60*int(mins)+int(secs)
-      elif time.count(':')==1: # e.g. 04:20
-        hours, mins = time.split(':')
-        time = 3600*int(hours)+60*int(mins)
-      appcmds.append("+MaxRuntime=%s"%(time))
+      appcmds.append("+MaxRuntime=%s"%(self.getseconds(time)))
     for appcmd in appcmds:
       subcmd += " -append %s"%(appcmd)
     subcmd += " "+script
@@ -73,6 +67,67 @@ class HTCondor(BatchSystem):
     jobid = jobids[0] if len(jobids)==1 else jobids if len(jobids)>1 else 0
     return jobid
   
+  def getseconds(self,time):
+    """Convert run time to seconds, e.g. 420, 04:20:00, 04:20."""
+    time = str(time)
+    if time.count(':')==2: # e.g. 04:20:00
+      hours, mins, secs = time.split(':')
+      time = 3600*int(hours)+60*int(mins)+int(secs)
+    elif time.count(':')==1: # e.g. 04:20
+      hours, mins = time.split(':')
+      time = 3600*int(hours)+60*int(mins)
+    return time
+  
+  def submitbulk(self,items,script=None,**kwargs):
+    """Submit the tasks of several samples as a single cluster, with the initial directory, log file name,
+    number of CPUs and job arguments of each task as itemdata, i.e. items = [(initdir,logname,ncpus,arg), ...].
+    Use the htcondor Python bindings if available, else 'condor_submit -queue ... from itemfile'.
+    Return the cluster ID. The process IDs follow the order of the items."""
+    itemfile  = kwargs.pop('itemfile', None  ) # file to write items to for condor_submit
+    options   = kwargs.get('opt',      None  )
+    dry       = kwargs.get('dry',      False )
+    verbosity = kwargs.get('verb',     self.verbosity )
+    columns   = ['initdir','logname','ncpus','arg'] # arg last: gets remainder of line
+    if script==None:
+      script = self.script
+    if not dry and not options: # extra condor_submit options are not supported by the bindings
+      try:
+        import htcondor
+      except ImportError:
+        htcondor = None
+      if htcondor:
+        with open(script,'r') as file:
+          submit = htcondor.Submit(file.read())
+        submit['initialdir'] = "$(initdir)"
+        submit['mylogfile']  = "log/$(logname).$(ClusterId).$(ProcId).log"
+        submit['request_cpus'] = "$(ncpus)"
+        if kwargs.get('name',None):
+          submit['batch_name'] = kwargs['name']
+        if kwargs.get('short',False):
+          if not kwargs.get('queue'): kwargs['queue'] = "espresso"
+          kwargs['time'] = kwargs.get('time',None) or "720"
+        if kwargs.get('queue',None):
+          submit['+JobFlavour'] = kwargs['queue']
+        if kwargs.get('time',None):
+          submit['+MaxRuntime'] = str(self.getseconds(kwargs['time']))
+        for appcmd in kwargs.get('app',[ ]):
+          key, value = appcmd.split('=',1)
+          submit[key] = value.strip("'")
+        itemdata = [dict(zip(columns,[str(v) for v in item])) for item in items]
+        if verbosity>=1:
+          print(">>> HTCondor.submitbulk: Submitting %d tasks with htcondor bindings..."%(len(itemdata)))
+        result = htcondor.Schedd().submit(submit,itemdata=iter(itemdata))
+        print(">>> %d job(s) submitted to cluster %s."%(len(itemdata),result.cluster()))
+        return result.cluster()
+    if itemfile==None:
+      raise IOError("HTCondor.submitbulk: Please give name of file to write the items to!")
+    with open(itemfile,'w') as file:
+      for item in items:
+        file.write("%s,%s,%s,%s\n"%tuple(item))
+    appcmds = ["initialdir='$(initdir)'","mylogfile='log/$(logname).$(ClusterId).$(ProcId).log'",
+               "request_cpus='$(ncpus)'"]+kwargs.pop('app',[ ])
+    return self.submit(script,qcmd="%s from %s"%(','.join(columns),itemfile),app=appcmds,**kwargs)
+  
   def queue(self,job,**kwargs):
     """Get queue status."""
     qcmd  = "condor_q"
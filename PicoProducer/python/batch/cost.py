@@ -0,0 +1,178 @@
+# Description: Cost model of batch jobs per (era, channel, sample), learned from the measured event rate
+#              and overhead in the log files of previous jobs, to pack files and event ranges into chunks
+#              of roughly equal predicted wall time for a given target job duration.
+# Usage:
+#   pico.py status -y UL2018 -c mutau # learns cost model from log files of finished jobs
+#   pico.py submit -y UL2018 -c mutau --jobtime 120 # pack chunks of ~120 minutes
+import os, re, glob, json, time, tempfile
+import heapq
+from TauFW.PicoProducer import basedir
+from TauFW.common.tools.log import Logger
+from TauFW.common.tools.math import ceil
+from TauFW.PicoProducer.batch.utils import evtsplitexp
+LOG      = Logger('JobCost')
+costfile = os.environ.get('PICO_JOBCOST',os.path.join(basedir,'cache','jobcost.json'))
+rateexp  = re.compile(r"Total time ([\d.]+) sec\. to process (\d+) events") # nanoAOD-tools' PostProcessor
+rdfexp   = re.compile(r"rdfskim: Skimmed \d+ / (\d+) read events of .+ in ([\d.]+) seconds") # RDataFrame skim
+doneexp  = re.compile(r"(?:pico|skim)job\.py done after ([\d.]+) seconds")
+
+
+def parselog(fname):
+  """Parse log file of a finished job. Return number of processed events, time spent in the event loop,
+  and total wall time, or None if the job did not finish."""
+  nevts, looptime, walltime = 0, 0., None
+  with open(fname,'r',errors='replace') as file:
+    for line in file:
+      match = rateexp.search(line)
+      if match:
+        looptime += float(match.group(1))
+        nevts    += int(match.group(2))
+        continue
+      match = rdfexp.search(line)
+      if match:
+        nevts    += int(match.group(1))
+        looptime += float(match.group(2))
+        continue
+      match = doneexp.search(line)
+      if match:
+        walltime = float(match.group(1))
+  if walltime==None or nevts<=0 or looptime<=0:
+    return None
+  return nevts, looptime, walltime
+
+
+def loadcosts():
+  """Load dictionary of cost models."""
+  if os.path.isfile(costfile):
+    with open(costfile,'r') as file:
+      return json.load(file)
+  return { }
+
+
+def getkey(era, channel, sample):
+  return "%s/%s/%s"%(era,channel,sample)
+
+
+def savecosts(costs):
+  """Write dictionary of cost models atomically, so other processes never read a partial file."""
+  dirname = os.path.dirname(costfile) or '.'
+  if not os.path.exists(dirname):
+    os.makedirs(dirname)
+  fd, tmpname = tempfile.mkstemp(prefix=".jobcost_",suffix=".json",dir=dirname)
+  try:
+    with os.fdopen(fd,'w') as file:
+      json.dump(costs,file,indent=2,sort_keys=True)
+    os.replace(tmpname,costfile)
+  except:
+    os.remove(tmpname)
+    raise
+
+
+def learncost(logdir, era, channel, sample, verb=0):
+  """Learn the event rate (events per second in the event loop) and the overhead per job (seconds
+  outside the event loop, e.g. loading modules, copying output) from all log files in logdir.
+  Only log files modified after the last update of the cache are parsed again."""
+  key     = getkey(era,channel,sample)
+  costs   = loadcosts()
+  cached  = costs.get(key,{ }).get('logs',{ }) # parsed results per log file
+  mtime   = os.path.getmtime(costfile) if os.path.isfile(costfile) else -1
+  logs    = { }
+  nparsed = 0
+  for fname in glob.glob(os.path.join(logdir,"*.log")):
+    logname = os.path.basename(fname)
+    if logname in cached and os.path.getmtime(fname)<mtime:
+      logs[logname] = cached[logname]
+      continue
+    result = parselog(fname)
+    nparsed += 1
+    if result:
+      logs[logname] = list(result)
+  LOG.verb("learncost: Parsed %d new log files in %s"%(nparsed,logdir),verb,2)
+  results = list(logs.values())
+  if not results:
+    LOG.verb("learncost: No finished jobs with event rate in %s"%(logdir),verb,1)
+    return None
+  if key in costs and logs==cached:
+    return costs[key] # nothing changed
+  nevts     = sum(r[0] for r in results)
+  looptime  = sum(r[1] for r in results)
+  overheads = sorted(max(0.,r[2]-r[1]) for r in results)
+  cost = {
+    'rate':     nevts/looptime, # events per second
+    'overhead': overheads[len(overheads)//2], # median
+    'njobs':    len(results),
+    'time':     time.strftime("%Y-%m-%d %H:%M:%S"),
+    'logs':     logs,
+  }
+  costs[key] = cost
+  savecosts(costs)
+  LOG.verb("learncost: %s: %.1f events/s, overhead %.1f s from %d jobs"%(
+    key,cost['rate'],cost['overhead'],cost['njobs']),verb,1)
+  return cost
+
+
+def getcost(era, channel, sample, verb=0):
+  """Get cost model of a sample. If it was not measured yet, use the median rate and overhead
+  of the other samples in the same era and channel. Return None if none are available."""
+  costs = loadcosts()
+  key   = getkey(era,channel,sample)
+  if key in costs:
+    return costs[key]
+  others = [c for k, c in costs.items() if k.startswith(getkey(era,channel,''))]
+  if not others:
+    return None
+  LOG.verb("getcost: No cost model for %s, using the median of %d samples..."%(key,len(others)),verb,1)
+  rates     = sorted(c['rate'] for c in others)
+  overheads = sorted(c['overhead'] for c in others)
+  return { 'rate': rates[len(rates)//2], 'overhead': overheads[len(overheads)//2], 'njobs': 0 }
+
+
+def chunkify_by_cost(fnames,jobtime,cost,evtdict,verb=0):
+  """Pack files into chunks of roughly equal predicted wall time, overhead + nevts/rate, close to jobtime (in seconds).
+  Files with a predicted time longer than jobtime are split evenly into event ranges 'fname:firstevt:maxevts'.
+  The other files are spread over the minimal number of chunks with the longest-first heuristic.
+  Return total number of events, list of chunks, and list of predicted times per chunk."""
+  rate   = cost['rate']
+  budget = max(0.25*jobtime,jobtime-cost['overhead']) # time available for event loop
+  maxevts = max(1,int(budget*rate)) # events per chunk
+  result = [ ]
+  small  = [ ]
+  ntot   = 0
+  for fname in fnames[:]:
+    if evtsplitexp.match(fname): # already split (resubmission); cannot be split again
+      result.append(([fname],int(evtsplitexp.match(fname).group(3))))
+      continue
+    nevts = evtdict[fname]
+    ntot += nevts
+    if nevts<=0:
+      LOG.warning("chunkify_by_cost: File %r has %s<=0 events, not including..."%(fname,nevts))
+    elif nevts>maxevts: # split evenly in event ranges
+      nchunks  = ceil(float(nevts)/maxevts)
+      maxevts_ = int(ceil(nevts/nchunks))
+      fnames.remove(fname)
+      for ifirst in range(0,nevts,maxevts_):
+        infname = "%s:%d:%d"%(fname,ifirst,maxevts_)
+        fnames.append(infname) # update for book keeping
+        result.append(([infname],min(maxevts_,nevts-ifirst)))
+    else:
+      small.append((nevts,fname))
+  if small: # longest-first: add largest remaining file to chunk with fewest events
+    small.sort(reverse=True)
+    nchunks = ceil(sum(n for n, f in small)/float(maxevts))
+    while True:
+      heap = [(0,i,[ ]) for i in range(nchunks)]
+      for nevts, fname in small:
+        tot, i, chunk = heapq.heappop(heap)
+        chunk.append(fname)
+        heapq.heappush(heap,(tot+nevts,i,chunk))
+      if max(t for t, i, c in heap)<=maxevts or nchunks>=len(small):
+        break
+      nchunks += 1
+    result.extend((c,t) for t, i, c in sorted(heap,key=lambda x: x[1]) if c)
+  times = [cost['overhead']+n/rate for c, n in result]
+  if verb>=1:
+    print(">>> chunkify_by_cost: rate=%.1f events/s, overhead=%.1f s, jobtime=%.1f s => max. %d events per chunk"%(
+      rate,cost['overhead'],jobtime,maxevts))
+    if times:
+      print(">>> chunkify_by_cost: %d chunks with predicted times between %.1f and %.1f s"%(len(times),min(times),max(times)))
+  return ntot, [c for c, n in result], times
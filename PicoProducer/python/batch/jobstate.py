@@ -0,0 +1,144 @@
+# Description: Incremental state of the jobs of a sample in a sqlite database next to its job configs,
+#              so that repeated 'pico.py status' and 'resubmit' calls only validate output files
+#              that are new or changed (size, modification time), skip the batch queue if all chunks of the same
+#              jobs succeeded, and reuse the number of events from the last DAS check.
+#              It is removed by 'pico.py clean' and on first-time submission.
+#              The job config JSON remains the source of chunk definitions.
+# Usage:
+#   with JobState(cfgname,postfix) as state:
+#     for nevts, fname in state.itervalid(outfiles,ncores=4):
+#       ...
+#     state.setchunks(good=goodchunks,pend=pendchunks,bad=badchunks,miss=misschunks)
+import os, time
+import sqlite3
+from TauFW.PicoProducer.storage.evtcache import getmeta, nostat
+from TauFW.common.tools.log import Logger
+LOG = Logger('JobState')
+
+
+def getstatename(cfgname, postfix):
+  """Get name of state database shared by all tries of a job, e.g. config/jobstate_mutau.db."""
+  return os.path.join(os.path.dirname(cfgname),"jobstate%s.db"%(postfix))
+
+
+def removestate(cfgname, postfix, verb=0):
+  """Remove state database, e.g. for first-time submission."""
+  dbname = getstatename(cfgname,postfix)
+  if os.path.isfile(dbname):
+    LOG.verb("removestate: Removing %s..."%(dbname),verb,1)
+    os.remove(dbname)
+
+
+class JobState(object):
+  """Keep track of validated output files, the last status of each chunk, and other slow look-ups."""
+
+  def __init__(self, cfgname, postfix, **kwargs):
+    self.dbname    = kwargs.get('dbname',   getstatename(cfgname,postfix))
+    self.nthreads  = kwargs.get('nthreads', 16 ) # number of parallel stat calls
+    self.verbosity = kwargs.get('verb',     0  ) # verbosity level
+    self.cfgname   = cfgname
+    self.meta      = { } # fname -> (size, mtime) of this session
+    self.db = sqlite3.connect(self.dbname,timeout=60)
+    self.db.execute("CREATE TABLE IF NOT EXISTS outputs (fname TEXT PRIMARY KEY, size INTEGER, mtime TEXT, nevts REAL, checked REAL)")
+    self.db.execute("CREATE TABLE IF NOT EXISTS chunks (ichunk INTEGER PRIMARY KEY, status TEXT, config TEXT, updated REAL)")
+    self.db.execute("CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value TEXT)")
+    self.db.commit()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, type, value, traceback):
+    self.close()
+
+  def close(self):
+    self.db.close()
+
+  def get(self, key, default=None):
+    """Get stored value, e.g. number of events in DAS."""
+    row = self.db.execute("SELECT value FROM info WHERE key=?",(key,)).fetchone()
+    return default if row==None else row[0]
+
+  def set(self, key, value):
+    self.db.execute("INSERT OR REPLACE INTO info VALUES (?,?)",(key,str(value)))
+    self.db.commit()
+
+  def unset(self, key):
+    self.db.execute("DELETE FROM info WHERE key=?",(key,))
+    self.db.commit()
+
+  def getmeta(self, fnames):
+    """Get size and modification time of output files in parallel, and remember them for this session."""
+    todo = [f for f in fnames if f not in self.meta]
+    if len(todo)>=2 and self.nthreads>=2:
+      from multiprocessing.pool import ThreadPool
+      pool = ThreadPool(min(self.nthreads,len(todo)))
+      self.meta.update(zip(todo,pool.map(getmeta,todo)))
+      pool.close()
+    else:
+      self.meta.update((f,getmeta(f)) for f in todo)
+    return { f: self.meta[f] for f in fnames }
+
+  def getvalid(self, fnames):
+    """Return dictionary of number of events of validated output files that did not change since."""
+    metas  = self.getmeta(fnames)
+    result = { }
+    for i in range(0,len(fnames),500): # limit number of SQL variables
+      subset = fnames[i:i+500]
+      query  = "SELECT fname, size, mtime, nevts FROM outputs WHERE fname IN (%s)"%(','.join('?'*len(subset)))
+      for fname, size, mtime, nevts in self.db.execute(query,subset):
+        if metas[fname]!=nostat and (size,mtime)==tuple(metas[fname]):
+          result[fname] = nevts
+    LOG.verb("JobState.getvalid: %d/%d output files unchanged since last validation"%(len(result),len(fnames)),self.verbosity,2)
+    return result
+
+  def setvalid(self, filenevts):
+    """Store number of events of validated output files. Bad files (nevts<0) are always checked again."""
+    metas = self.getmeta(list(filenevts))
+    now   = time.time()
+    rows  = [(f,metas[f][0],metas[f][1],n,now) for f, n in filenevts.items() if n>=0 and metas[f]!=nostat]
+    bad   = [(f,) for f, n in filenevts.items() if n<0]
+    self.db.executemany("INSERT OR REPLACE INTO outputs VALUES (?,?,?,?,?)",rows)
+    self.db.executemany("DELETE FROM outputs WHERE fname=?",bad)
+    self.db.commit()
+
+  def isvalid(self, fname, **kwargs):
+    """Same as storage.utils.isvalid, but only open the file if it is new or changed."""
+    from TauFW.PicoProducer.storage.utils import isvalid
+    valid = self.getvalid([fname])
+    if fname in valid:
+      return valid[fname]
+    nevts = isvalid(fname,**kwargs)
+    self.setvalid({ fname: nevts })
+    return nevts
+
+  def itervalid(self, fnames, checkevts=True, ncores=4, verb=0, **kwargs):
+    """Same as storage.utils.itervalid, but only open new or changed files (in parallel)."""
+    from TauFW.PicoProducer.storage.utils import itervalid
+    if not checkevts:
+      for fname in fnames:
+        yield 0, fname
+      return
+    valid = self.getvalid(fnames)
+    for fname in fnames:
+      if fname in valid:
+        yield valid[fname], fname
+    todo  = [f for f in fnames if f not in valid]
+    new   = { }
+    for nevts, fname in itervalid(todo,checkevts=checkevts,ncores=ncores,verb=verb,**kwargs):
+      new[fname] = nevts
+      yield nevts, fname
+    self.setvalid(new)
+
+  def getchunks(self, status=None):
+    """Get dictionary of last status of each chunk ('good', 'pend', 'bad', 'miss')."""
+    chunks = { i: s for i, s in self.db.execute("SELECT ichunk, status FROM chunks") }
+    if status:
+      return [i for i, s in chunks.items() if s==status]
+    return chunks
+
+  def setchunks(self, **kwargs):
+    """Store last status of chunks, e.g. setchunks(good=[0,1],pend=[2])."""
+    now  = time.time()
+    rows = [(i,s,self.cfgname,now) for s, chunks in kwargs.items() for i in chunks]
+    self.db.executemany("INSERT OR REPLACE INTO chunks VALUES (?,?,?,?)",rows)
+    self.db.commit()
@@ -31,13 +31,25 @@ def guess_batch():
   return batch
   
 
-def chunkify_by_evts(fnames,maxevts,evenly=True,evtdict=None,verb=0):
+def chunkify_by_evts(fnames,maxevts,evenly=True,evtdict=None,cache=True,ncores=0,verb=0):
   """Split list of files into chunks with total events per chunks less than given maximum,
   and update input fnames to bookkeep first event and maximum events.
   E.g. ['nano_1.root','nano_2.root','nano_3.root','nano_4.root']
         -> [ ['nano_1.root:0:1000'], ['nano_1.root:1000:1000'], # 'fname:firstevt:maxevts'
              ['nano_2.root','nano_3.root','nano_4.root'] ] # group files with <maxevts events each
+  The number of events per file is taken from evtdict, or the persistent event cache (if cache=True),
+  and files that are missing are opened in parallel (if ncores>=2).
   """ 
+  if cache: # get number of events from persistent cache, or count in parallel
+    todo = [f for f in fnames if not evtsplitexp.match(f) and not (evtdict and f in evtdict)]
+    if todo:
+      from TauFW.PicoProducer.storage.evtcache import EventCache
+      with EventCache(verb=verb) as evtcache:
+        filenevts = evtcache.getnevents(todo,ncores=ncores,verb=verb)
+      if isinstance(evtdict,dict):
+        evtdict.update(filenevts) # store for possible later reuse
+      else:
+        evtdict = filenevts
   result   = [ ] # list of chunks
   nlarge   = { }
   nsmall   = { }
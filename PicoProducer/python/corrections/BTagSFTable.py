@@ -0,0 +1,264 @@
+# Description: Pure python/numpy version of BTagCalibrationReader to evaluate b tag SFs from BTagCalibration CSV files
+#              for single jets or arrays of jets, without a call via PyROOT per jet and per uncertainty.
+#              The formula of an entry is only a function of pt, and the entries are piecewise in (flavor, eta, pt),
+#              so the first matching entry is looked up once per (sysType, flavor, eta bin, pt bin) and memoised.
+# Sources:
+#   https://twiki.cern.ch/twiki/bin/view/CMSPublic/BTagCalibration
+#   https://github.com/cms-sw/cmssw/blob/master/CondTools/BTau/test/BTagCalibrationStandalone.cpp
+# Usage:
+#   table = BTagSFTable([(csvname,'comb',[FLAV_B,FLAV_C]),(csvname,'incl',[FLAV_UDSG])],opnum=1,systypes=['central','up','down'])
+#   sf  = table.eval(FLAV_B,abs(eta),pt,'central') # like reader.eval(FLAV_B,abs(eta),pt)
+#   sfs = table.evaluate(FLAVs,abs(etas),pts,'up') # array in, array out
+#   The parsed CSV file is cached as JSON next to it (e.g. DeepJet_102XSF_WP_V1.cache.json), and keyed on the checksum
+#   of the CSV file, so it is parsed only once. To create or update the cache explicitly, e.g. before submitting jobs:
+#   python3 python/corrections/BTagSFTable.py data/btag/*.csv
+from __future__ import print_function, division # formulas like 1/2 in python2
+import os, math, json, hashlib
+import numpy as np
+from bisect import bisect_left
+from TauFW.common.tools.log import Logger
+LOG = Logger('BTagSFTable')
+FLAV_B, FLAV_C, FLAV_UDSG = 0, 1, 2 # same as BTagEntry enum
+OPNUMS = { 'L': 0, 'M': 1, 'T': 2, 'shape': 3 } # OP_LOOSE, OP_MEDIUM, OP_TIGHT, OP_RESHAPING
+SCALARFUNCS = { # for TFormula expressions of x in CSV files
+  'log': math.log,  'exp': math.exp,  'sqrt': math.sqrt,  'pow': math.pow,  'abs': abs,  'max': max,  'min': min,
+  'Log': math.log,  'Exp': math.exp,  'Sqrt': math.sqrt,  'Power': math.pow,'Abs': abs,  'Max': max,  'Min': min,
+}
+ARRAYFUNCS = {
+  'log': np.log,    'exp': np.exp,    'sqrt': np.sqrt,    'pow': np.power,  'abs': np.abs,'max': np.maximum, 'min': np.minimum,
+  'Log': np.log,    'Exp': np.exp,    'Sqrt': np.sqrt,    'Power': np.power,'Abs': np.abs,'Max': np.maximum, 'Min': np.minimum,
+}
+_formulas = { } # cache of compiled formulas, shared between tables
+_csvs     = { } # cache of parsed CSV files
+
+
+def tofloat(value):
+  """Round to single precision, like the float arguments of BTagCalibrationReader.eval."""
+  return float(np.float32(value))
+
+
+def compileformula(formula):
+  """Compile a TFormula expression of x into a python function for single values (math),
+  and one for numpy arrays."""
+  if formula not in _formulas:
+    expr = "lambda x: "+formula.replace('TMath::','').replace('^','**')
+    try:
+      _formulas[formula] = (eval(expr,dict(SCALARFUNCS)),eval(expr,dict(ARRAYFUNCS)))
+    except SyntaxError:
+      LOG.throw(SyntaxError,"compileformula: Could not compile formula %r..."%(formula))
+  return _formulas[formula]
+
+
+def getchecksum(fname):
+  """Get MD5 checksum of a file."""
+  md5 = hashlib.md5()
+  with open(fname,'rb') as file:
+    for block in iter(lambda: file.read(1<<20),b''):
+      md5.update(block)
+  return md5.hexdigest()
+
+
+def getcachename(csvname):
+  """Get name of cache of a CSV file, stored next to it."""
+  return os.path.splitext(csvname)[0]+".cache.json"
+
+
+def parsecsv(csvname):
+  """Parse all entries of a BTagCalibration CSV file.
+  Return list of [OperatingPoint,measurementType,sysType,jetFlavor,etaMin,etaMax,ptMin,ptMax,formula]."""
+  entries = [ ]
+  with open(csvname) as file:
+    for line in file:
+      if 'OperatingPoint' in line or not line.strip(): # skip header
+        continue
+      parts = [p.strip() for p in line.split(',',10)]
+      if len(parts)<11:
+        LOG.warning("parsecsv: Ignoring line with less than 11 columns in %s: %r"%(csvname,line))
+        continue
+      op     = OPNUMS[parts[0]] if parts[0] in OPNUMS else int(parts[0])
+      bounds = [tofloat(p) for p in parts[4:8]] # etaMin, etaMax, ptMin, ptMax
+      entries.append([op,parts[1],parts[2],int(parts[3])]+bounds+[parts[10].strip('"').strip()])
+  return entries
+
+
+def writecache(csvname,entries,checksum,cachename=None,verb=0):
+  """Write parsed entries of a CSV file to a compact JSON cache, keyed on the checksum of the CSV file.
+  Strings (measurementType, sysType & formula) are stored only once, and referred to by index."""
+  cachename = cachename or getcachename(csvname)
+  strings   = [ ] # unique strings
+  indices   = { }
+  def index(string):
+    if string not in indices:
+      indices[string] = len(strings)
+      strings.append(string)
+    return indices[string]
+  rows  = [[e[0],index(e[1]),index(e[2]),e[3]]+e[4:8]+[index(e[8])] for e in entries]
+  cache = { 'csvname': os.path.basename(csvname), 'checksum': checksum, 'strings': strings, 'entries': rows }
+  tmpname = "%s.%s.tmp"%(cachename,os.getpid())
+  try:
+    with open(tmpname,'w') as file:
+      json.dump(cache,file,separators=(',',':'))
+    os.rename(tmpname,cachename) # atomic, in case of parallel jobs
+  except (IOError,OSError) as err: # e.g. read-only directory
+    LOG.warning("writecache: Could not write cache %s: %s"%(cachename,err))
+    if os.path.isfile(tmpname):
+      os.remove(tmpname)
+    return None
+  if verb>=1:
+    print(">>> writecache: Wrote %d entries of %s to %s"%(len(rows),csvname,cachename))
+  return cachename
+
+
+def readcache(cachename,checksum=None):
+  """Read entries from JSON cache of a CSV file. Return None if it does not exist, or if the checksum does not match."""
+  if not os.path.isfile(cachename):
+    return None
+  try:
+    with open(cachename) as file:
+      cache = json.load(file)
+  except ValueError: # e.g. corrupted
+    LOG.warning("readcache: Could not read cache %s. Ignoring..."%(cachename))
+    return None
+  if checksum and cache.get('checksum')!=checksum:
+    return None
+  strings = cache['strings']
+  return [[r[0],strings[r[1]],strings[r[2]],r[3]]+r[4:8]+[strings[r[8]]] for r in cache['entries']]
+
+
+def loadcsv(csvname,cache=True,verb=0):
+  """Load all entries of a BTagCalibration CSV file, from the cache if the checksum of the CSV file matches,
+  otherwise parse the CSV file and (re)write the cache."""
+  if csvname not in _csvs:
+    entries = None
+    if cache:
+      checksum  = getchecksum(csvname)
+      cachename = getcachename(csvname)
+      entries   = readcache(cachename,checksum)
+      if entries!=None and verb>=1:
+        print(">>> loadcsv: Loaded %d entries of %s from cache %s"%(len(entries),csvname,cachename))
+    if entries==None:
+      entries = parsecsv(csvname)
+      if cache:
+        writecache(csvname,entries,checksum,cachename,verb=verb)
+    _csvs[csvname] = entries
+  return _csvs[csvname]
+
+
+def readcsv(csvname,opnum,meastype,flavors,systypes,cache=True):
+  """Read the entries of a BTagCalibration CSV file for one operating point & measurement type,
+  in the same order as BTagCalibrationReader.load.
+  Return dictionary of (sysType,flavor) -> list of (etaMin,etaMax,ptMin,ptMax,formula)."""
+  entries = { (s,f): [ ] for s in systypes for f in flavors }
+  for op, meas, systype, flavor, etamin, etamax, ptmin, ptmax, formula in loadcsv(csvname,cache=cache):
+    key = (systype,flavor)
+    if op==opnum and meas==meastype and key in entries:
+      entries[key].append((etamin,etamax,ptmin,ptmax,formula))
+  return entries
+
+
+class BTagSFTable:
+  """Evaluate b tag SFs like BTagCalibrationReader.eval for several sysTypes:
+  Return the formula of the first entry with etaMin <= eta <= etaMax and ptMin < pt <= ptMax,
+  evaluated at pt, or zero if there is no such entry."""
+
+  def __init__(self, sources, opnum, systypes=['central'], name=None, cache=True):
+    """Load entries from a list of (csvname, measurementType, flavors)."""
+    self.name    = name or ', '.join(s[0].split('/')[-1] for s in sources)
+    self.opnum   = opnum
+    self.entries = { } # (sysType,flavor) -> list of entries
+    for csvname, meastype, flavors in sources:
+      self.entries.update(readcsv(csvname,opnum,meastype,flavors,systypes,cache=cache))
+    self.init()
+
+  def init(self):
+    """Set bin edges from entries, and reset the memo of matched formulas."""
+    etas, pts  = set(), set()
+    for entries in self.entries.values():
+      for etamin, etamax, ptmin, ptmax, formula in entries:
+        etas.update([etamin,etamax])
+        pts.update([ptmin,ptmax])
+    self.etaedges  = sorted(etas) # python lists for fast scalar lookup
+    self.ptedges   = sorted(pts)
+    self.aetaedges = np.array(self.etaedges,dtype=np.float64) # numpy arrays for batched lookup
+    self.aptedges  = np.array(self.ptedges,dtype=np.float64)
+    self.useabseta = [ all(e[0]>=0 for (s,f), l in self.entries.items() if f==flav for e in l) for flav in range(3) ]
+    self.memo      = { } # (sysType,flavor,eta bin,pt bin) -> compiled formula of first matching entry, or None
+
+  def __repr__(self):
+    return "<%s(%r,%d entries) at %s>"%(self.__class__.__name__,self.name,sum(len(l) for l in self.entries.values()),hex(id(self)))
+
+  def findbin(self, eta, pt):
+    """Find index of eta and pt bin of a single jet. The eta edges themselves are separate (even) bins,
+    because the eta range of entries is inclusive on both sides. The pt range is (ptMin,ptMax]."""
+    ieta = bisect_left(self.etaedges,eta)
+    ieta = 2*ieta if ieta<len(self.etaedges) and self.etaedges[ieta]==eta else 2*ieta-1
+    return ieta, bisect_left(self.ptedges,pt)
+
+  def findbins(self, eta, pt):
+    """Find indices of eta and pt bins of arrays of jets."""
+    neta  = len(self.aetaedges)
+    ietas = np.searchsorted(self.aetaedges,eta,side='left')
+    onedge = (ietas<neta) & (self.aetaedges[np.minimum(ietas,neta-1)]==eta)
+    ietas = np.where(onedge,2*ietas,2*ietas-1)
+    return ietas, np.searchsorted(self.aptedges,pt,side='left')
+
+  def getformula(self, systype, flavor, ieta, ipt):
+    """Find the formula of the first entry that matches a bin, and memoise it."""
+    key = (systype,flavor,ieta,ipt)
+    if key not in self.memo:
+      entries = self.entries[(systype,flavor)]
+      neta, npt = len(self.etaedges), len(self.ptedges)
+      if ieta<0 or ieta>=2*neta-1 or ipt<=0 or ipt>=npt: # outside all entries
+        self.memo[key] = None
+        return None
+      if ieta%2==0: # on edge
+        eta = self.etaedges[ieta//2]
+      else: # inside bin
+        eta = 0.5*(self.etaedges[ieta//2]+self.etaedges[ieta//2+1])
+      pt = self.ptedges[ipt] # upper edge represents (ptedges[ipt-1],ptedges[ipt]]
+      self.memo[key] = None
+      for etamin, etamax, ptmin, ptmax, formula in entries:
+        if etamin<=eta<=etamax and ptmin<pt<=ptmax:
+          self.memo[key] = compileformula(formula)
+          break
+    return self.memo[key]
+
+  def eval(self, flavor, eta, pt, systype='central'):
+    """Evaluate SF for a single jet."""
+    eta, pt = tofloat(eta), tofloat(pt)
+    if eta<0 and self.useabseta[flavor]:
+      eta = -eta
+    func = self.getformula(systype,flavor,*self.findbin(eta,pt))
+    return func[0](pt) if func else 0.
+
+  def evaluate(self, flavor, eta, pt, systype='central'):
+    """Evaluate SFs for arrays of jets (batched). The formula of each distinct bin is evaluated once
+    for all jets in that bin."""
+    eta    = np.asarray(eta,dtype=np.float32).astype(np.float64)
+    pt     = np.asarray(pt,dtype=np.float32).astype(np.float64)
+    flavor = np.broadcast_to(np.asarray(flavor,dtype=np.int64),pt.shape)
+    eta    = np.where((eta<0) & np.array(self.useabseta)[flavor],-eta,eta)
+    ietas, ipts = self.findbins(eta,pt)
+    neta, npt = 2*len(self.etaedges)+1, len(self.ptedges)+1
+    codes  = (flavor*neta+(ietas+1))*npt+ipts # unique code per bin
+    sfs    = np.zeros(pt.shape,dtype=np.float64)
+    ucodes, inverse = np.unique(codes,return_inverse=True)
+    inverse = inverse.reshape(pt.shape)
+    for i, code in enumerate(ucodes.tolist()):
+      func = self.getformula(systype,code//(neta*npt),(code//npt)%neta-1,code%npt)
+      if func:
+        mask = (inverse==i)
+        sfs[mask] = func[1](pt[mask])
+    return sfs
+
+
+if __name__ == "__main__":
+  from argparse import ArgumentParser
+  description = """Create or update the JSON cache of BTagCalibration CSV files."""
+  parser = ArgumentParser(prog="BTagSFTable",description=description,epilog="Good luck!")
+  parser.add_argument('csvnames', nargs='+', help="BTagCalibration CSV files" )
+  parser.add_argument('-v', '--verbose', dest='verbosity', type=int, nargs='?', const=1, default=1, action='store',
+                                         help="set verbosity" )
+  args = parser.parse_args()
+  for csvname in args.csvnames:
+    loadcsv(csvname,verb=args.verbosity)
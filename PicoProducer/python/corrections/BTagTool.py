@@ -7,17 +7,31 @@
 #   https://github.com/cms-nanoAOD/nanoAOD-tools/blob/master/python/postprocessing/modules/btv/btagSFProducer.py
 import os
 from array import array
+import numpy as np
 import ROOT
 #ROOT.gROOT.ProcessLine('.L ./BTagCalibrationStandalone.cpp+')
 from TauFW.PicoProducer import datadir
 from TauFW.common.tools.root import ensureTFile
 from TauFW.common.tools.log import Logger
+from TauFW.PicoProducer.corrections.LookupTable import LookupTable
+from TauFW.PicoProducer.corrections.BTagSFTable import BTagSFTable
 from ROOT import TH2D, BTagCalibration, BTagCalibrationReader
 from ROOT.BTagEntry import OP_LOOSE, OP_MEDIUM, OP_TIGHT, OP_RESHAPING # enum 0, 1, 2, 3
 from ROOT.BTagEntry import FLAV_B, FLAV_C, FLAV_UDSG # enum: 0, 1, 2
 datadir = os.path.join(datadir,"btag/")
 effsdir = os.path.join(datadir,"effs/")
 LOG     = Logger('BTagTool',showname=True)
+_readers = { } # cache of calibrations & readers, shared between BTagWeightTool instances (e.g. different channels in one job), only loaded if needed
+_tables  = { } # cache of SF tables, shared between BTagWeightTool instances
+SYSTYPES = { # uncertainty -> sysType in CSV file
+  'Nom':        'central',
+  'Up':         'up',
+  'Down':       'down',
+  'UpCorr':     'up_correlated',
+  'DownCorr':   'down_correlated',
+  'UpUncorr':   'up_uncorrelated',
+  'DownUncorr': 'down_uncorrelated',
+}
 
 
 class BTagWPs:
@@ -203,35 +217,17 @@ class BTagWeightTool:
     
     # LOAD CALIBRATION TOOL
     print("Loading BTagWeightTool for %s (%s WP) %s..."%(tagger,wp,csvname)) #,(", "+sigma) if sigma!='central' else ""
-    if 'validate' in BTagCalibration.__init__.__doc__: # for CMSSW_12_X
-      calib = BTagCalibration(tagger,csvname,False) # validate=False to speed up
-    else: # for older than CMSSW_12_X ('validate' argument not available)
-      calib = BTagCalibration(tagger,csvname)
-    if csvname_bc and csvname_bc!=csvname:
-      print("  and from %s..."%(csvname_bc))
-      calib_bc = BTagCalibration(tagger,csvname_bc)
-    else:
-      calib_bc = calib # use same calibrator
-    print("  with efficiencies from %s..."%(effname))
-    
-    # CSV READER
-    readers   = { }
     opnum     = OP_LOOSE if wp=='loose' else OP_MEDIUM if wp=='medium' else OP_TIGHT if wp=='tight' else OP_RESHAPING
-    type_udsg = 'incl'
-    type_bc   = type_bc # 'mujets' for QCD; 'comb' for QCD+TT
-    readers['Nom'] = BTagCalibrationReader(opnum,'central')
-    if loadsys:
-      readers['Up']   = BTagCalibrationReader(opnum,'up')
-      readers['Down'] = BTagCalibrationReader(opnum,'down')
-    if spliteras: # split uncertainties by year
-      readers['UpCorr']     = BTagCalibrationReader(op,'up_correlated')
-      readers['DownCorr']   = BTagCalibrationReader(op,'down_correlated')
-      readers['UpUncorr']   = BTagCalibrationReader(op,'up_uncorrelated')
-      readers['DownUncorr'] = BTagCalibrationReader(op,'down_uncorrelated')
-    for reader in readers.values():
-      reader.load(calib_bc,FLAV_B,type_bc)
-      reader.load(calib_bc,FLAV_C,type_bc)
-      reader.load(calib,FLAV_UDSG,type_udsg)
+    cachekey  = (tagger,csvname,csvname_bc,opnum,type_bc,loadsys,spliteras)
+    uncs      = getuncs(loadsys,spliteras)
+    if cachekey in _tables: # reuse SF table loaded by another instance
+      print("  reusing SF table that was already loaded...")
+    else: # for fast evaluation of SFs without PyROOT; CSV files are read from cache if available
+      if csvname_bc!=csvname:
+        print("  and from %s..."%(csvname_bc))
+      systypes = [SYSTYPES[u] for u in uncs]
+      _tables[cachekey] = BTagSFTable([(csvname_bc,type_bc,[FLAV_B,FLAV_C]),(csvname,'incl',[FLAV_UDSG])],opnum,systypes,name=tagger)
+    print("  with efficiencies from %s..."%(effname))
     
     # EFFICIENCIES
     jetmaps = { t: { } for t in filltags } # histograms counting jets to compute the b tagging efficiencies in MC
@@ -265,15 +261,35 @@ class BTagWeightTool:
                   "efficiency histogram with data/btag/getBTagEfficiencies.py after running all MC samples with BTagWeightTool.")
     
     self.tagged   = tagged
-    self.calib    = calib
-    self.calib_bc = calib_bc
-    self.readers  = readers
+    self.cachekey = cachekey
+    self.uncs     = uncs # available uncertainties, e.g. ['Nom','Up','Down']
+    self.sftable  = _tables[cachekey]
     self.loadsys  = loadsys
     self.jetmaps  = jetmaps
     self.effmaps  = effmaps
+    self.efftabs  = { f: LookupTable(h,clamp=True) for f, h in effmaps.items() } # fast lookup
     self.maxeta   = maxeta
     self.maxpt    = maxpt
   
+  @property
+  def calib(self):
+    return self.getReaders()[0]
+  
+  @property
+  def calib_bc(self):
+    return self.getReaders()[1]
+  
+  @property
+  def readers(self):
+    return self.getReaders()[2]
+  
+  def getReaders(self):
+    """Load BTagCalibration & readers via ROOT only when they are needed (e.g. for validation),
+    because parsing the CSV files and compiling the formulas is slow."""
+    if self.cachekey not in _readers:
+      _readers[self.cachekey] = loadreaders(*self.cachekey)
+    return _readers[self.cachekey]
+  
   def getWeight(self,jets,unc='Nom'):
     """Get b tagging event weight for a given set of jets."""
     weight = 1.
@@ -306,19 +322,21 @@ class BTagWeightTool:
           weight_udsg *= self.getSF(jet.pt,jet.eta,jet.partonFlavour,self.tagged(jet),unc=unc)
     return weight_bc, weight_udsg
   
-  def getSF(self,pt,eta,flavor,tagged,unc='Nom'):
-    """Get b tag SF for a single jet."""
+  def getSF(self,pt,eta,flavor,tagged,unc='Nom',sfnom=None):
+    """Get b tag SF for a single jet. For jets with pt >= maxpt, the uncertainty is doubled w.r.t.
+    the nominal SF, which can be passed as sfnom if it was already evaluated for this jet."""
     FLAV = flavorToFLAV(flavor)
     if   eta>=+self.maxeta: eta = self.maxeta-0.001 # BTagCalibrationReader returns zero if |eta| > 2.4
     elif eta<=-self.maxeta: eta = 0.001-self.maxeta
     if pt>=self.maxpt:
-      sf = self.readers[unc].eval(FLAV,abs(eta),self.maxpt)
+      sf = self.sftable.eval(FLAV,abs(eta),self.maxpt,SYSTYPES[unc])
       if unc!='Nom': # double uncertainty
         # https://twiki.cern.ch/twiki/bin/viewauth/CMS/BtagRecommendation94X#AK4_jets
-        sfnom = self.readers['Nom'].eval(FLAV,abs(eta),self.maxpt)
+        if sfnom==None:
+          sfnom = self.sftable.eval(FLAV,abs(eta),self.maxpt,SYSTYPES['Nom'])
         sf = 2*sf - sfnom # = sfnom + 2*(sf-sfnom) = 2*sf - sfnom
     else:
-      sf = self.readers[unc].eval(FLAV,abs(eta),pt) # newer versions: use eval_auto_bounds instead !
+      sf = self.sftable.eval(FLAV,abs(eta),pt,SYSTYPES[unc]) # same as self.readers[unc].eval(FLAV,abs(eta),pt)
     if not tagged:
       eff = self.getEff(pt,eta,flavor)
       if eff>=1. or eff<0.:
@@ -328,21 +346,85 @@ class BTagWeightTool:
         sf = (1.-sf*eff)/(1.-eff)
     return sf
   
+  def getWeights(self,pt,eta,flavor,tagged,evtidx=None,nevts=None,uncs=None):
+    """Get b tagging event weights for arrays of jets for the nominal SFs and several uncertainties in one call.
+    Jets with |eta| >= maxeta are ignored, like in getWeight. Pass evtidx (index of the event of each jet)
+    and nevts for a chunk of events, to get an array of weights per event instead of a single weight.
+    Return dictionary of weights per uncertainty, e.g. { 'Nom': w, 'Up': wup, 'Down': wdown }."""
+    uncs    = self.uncs if uncs==None else uncs
+    pt      = np.asarray(pt,dtype=np.float64)
+    eta     = np.asarray(eta,dtype=np.float64)
+    flavor  = np.asarray(flavor,dtype=np.int64)
+    tagged  = np.asarray(tagged,dtype=bool)
+    mask    = np.abs(eta)<self.maxeta
+    if evtidx is not None:
+      evtidx = np.asarray(evtidx,dtype=np.int64)[mask]
+      if nevts==None:
+        nevts = evtidx.max()+1 if len(evtidx) else 0
+    pt, eta, flavor, tagged = pt[mask], eta[mask], flavor[mask], tagged[mask]
+    absflav = np.abs(flavor)
+    FLAVs   = np.where(absflav==5,FLAV_B,np.where((absflav==4) | (absflav==15),FLAV_C,FLAV_UDSG))
+    highpt  = pt>=self.maxpt
+    pt_     = np.where(highpt,self.maxpt,pt)
+    abseta  = np.abs(eta)
+    
+    # EFFICIENCIES for untagged jets
+    untagged = ~tagged
+    effs    = self.getEffs(pt[untagged],eta[untagged],flavor[untagged])
+    badeff  = (effs>=1.) | (effs<0.)
+    if badeff.any():
+      LOG.warning("BTagWeightTool.getWeights: MC efficiency is <0 or >=1 for %d untagged jets with pt=%s, eta=%s, flavor=%s"%(
+                  badeff.sum(),pt[untagged][badeff],eta[untagged][badeff],flavor[untagged][badeff]))
+      effs  = np.where(badeff,0.,effs) # SF = 1
+    
+    # SFs & WEIGHTS
+    weights = { }
+    sfnom   = self.sftable.evaluate(FLAVs,abseta,pt_,'central') # reused for high-pt uncertainties
+    for unc in uncs:
+      if unc=='Nom':
+        sfs = sfnom
+      else:
+        sfs = self.sftable.evaluate(FLAVs,abseta,pt_,SYSTYPES[unc])
+        sfs = np.where(highpt,2*sfs-sfnom,sfs) # double uncertainty
+      sfs = sfs.copy()
+      sfs[untagged] = np.where(badeff,1.,(1.-sfs[untagged]*effs)/(1.-effs))
+      if evtidx is None:
+        weight = 1.
+        for sf in sfs.tolist(): # same order of multiplications as getWeight
+          weight *= sf
+      else:
+        weight = np.ones(nevts,dtype=np.float64)
+        np.multiply.at(weight,evtidx,sfs)
+      weights[unc] = weight
+    return weights
+  
+  def getJetWeights(self,jets,uncs=None):
+    """Get b tagging event weights for the nominal SFs and several uncertainties for a given set of jets."""
+    pt     = [j.pt for j in jets]
+    eta    = [j.eta for j in jets]
+    flavor = [j.partonFlavour for j in jets]
+    tagged = [self.tagged(j) for j in jets]
+    return self.getWeights(pt,eta,flavor,tagged,uncs=uncs)
+  
   def getEff(self,pt,eta,flavor):
     """Get b tag efficiency for a single jet in MC."""
     flavor = flavorToString(flavor)
-    hist   = self.effmaps[flavor]
-    xbin   = hist.GetXaxis().FindBin(pt)
-    ybin   = hist.GetYaxis().FindBin(eta)
-    if xbin==0: xbin = 1
-    elif xbin>hist.GetXaxis().GetNbins(): xbin -= 1
-    if ybin==0: ybin = 1
-    elif ybin>hist.GetYaxis().GetNbins(): ybin -= 1
-    eff    = hist.GetBinContent(xbin,ybin)
+    eff    = self.efftabs[flavor](pt,eta)
     ###if eff==1:
     ###  print("Warning! BTagWeightTool.getEff: MC efficiency is 1 for pt=%s, eta=%s, flavor=%s, sf=%s"%(pt,eta,flavor,sf))
     return eff
   
+  def getEffs(self,pt,eta,flavor):
+    """Get b tag efficiencies for arrays of jets in MC."""
+    pt      = np.asarray(pt,dtype=np.float64)
+    eta     = np.asarray(eta,dtype=np.float64)
+    absflav = np.abs(np.asarray(flavor))
+    effs    = np.empty(len(pt))
+    for flavor, mask in [('b',absflav==5),('c',absflav==4),('udsg',(absflav!=5)&(absflav!=4))]:
+      if mask.any():
+        effs[mask] = self.efftabs[flavor].evaluate(pt[mask],eta[mask])
+    return effs
+  
   def fillEffMaps(self,jets,usejec=False,tag=""):
     """Fill histograms to make efficiency map for MC, split by true jet flavor,
     and jet pT and eta. Numerator = b tagged jets; denominator = all jets."""
@@ -366,6 +448,41 @@ class BTagWeightTool:
     return directory
   
 
+def loadreaders(tagger,csvname,csvname_bc,opnum,type_bc='comb',loadsys=False,spliteras=False):
+  """Load calibrations from CSV files, and the calibration readers for each uncertainty."""
+  if 'validate' in BTagCalibration.__init__.__doc__: # for CMSSW_12_X
+    calib = BTagCalibration(tagger,csvname,False) # validate=False to speed up
+  else: # for older than CMSSW_12_X ('validate' argument not available)
+    calib = BTagCalibration(tagger,csvname)
+  if csvname_bc and csvname_bc!=csvname:
+    print("  and from %s..."%(csvname_bc))
+    calib_bc = BTagCalibration(tagger,csvname_bc)
+  else:
+    calib_bc = calib # use same calibrator
+  
+  # CSV READER
+  readers   = { }
+  type_udsg = 'incl'
+  type_bc   = type_bc # 'mujets' for QCD; 'comb' for QCD+TT
+  for unc in getuncs(loadsys,spliteras):
+    readers[unc] = BTagCalibrationReader(opnum,SYSTYPES[unc])
+  for reader in readers.values():
+    reader.load(calib_bc,FLAV_B,type_bc)
+    reader.load(calib_bc,FLAV_C,type_bc)
+    reader.load(calib,FLAV_UDSG,type_udsg)
+  return calib, calib_bc, readers
+  
+
+def getuncs(loadsys=False,spliteras=False):
+  """Help function to get list of available uncertainties."""
+  uncs = ['Nom']
+  if loadsys:
+    uncs += ['Up','Down']
+  if spliteras: # split uncertainties by year
+    uncs += ['UpCorr','DownCorr','UpUncorr','DownUncorr']
+  return uncs
+  
+
 def flavorToFLAV(flavor):
   """Help function to convert an integer flavor ID to a BTagEntry enum value."""
   return FLAV_B if abs(flavor)==5 else FLAV_C if abs(flavor) in [4,15] else FLAV_UDSG       
@@ -4,6 +4,7 @@ import os, re
 from TauFW.PicoProducer import datadir
 from TauFW.common.tools.root import ensureTFile
 from TauFW.common.tools.log import Logger
+from TauFW.PicoProducer.corrections.LookupTable import LookupTable
 datadir = os.path.join(datadir,"jetveto")
 LOG     = Logger('JetVetoMapTool',showname=True)
 
@@ -31,7 +32,12 @@ class JetVetoMapTool:
     self.hist = self.file.Get('jetvetomap')
     self.hist.SetDirectory(0) # load into memory, so we can safely close the file
     self.file.Close()
+    self.table = LookupTable(self.hist,clamp=False) # fast lookup; use under/overflow outside map
     
   def applyJetVetoMap(self,eta,phi):
     """Get eta phi region where jetveto needs to be applied"""
-    return self.hist.GetBinContent(self.hist.GetXaxis().FindBin(eta), self.hist.GetYaxis().FindBin(phi))
+    return self.table(eta,phi)
+    
+  def applyJetVetoMaps(self,eta,phi):
+    """Get veto map values for arrays of eta, phi."""
+    return self.table.evaluate(eta,phi)
@@ -0,0 +1,70 @@
+# Description: Dense lookup tables of binned corrections (TH1/TH2 maps), converted once into
+#              edge & value arrays to avoid TAxis.FindBin and GetBinContent calls via PyROOT per object.
+#              The bin numbering follows ROOT: 0 = underflow, 1..N = bins, N+1 = overflow.
+# Usage:
+#   table = LookupTable(hist) # copy bin edges & contents of TH2
+#   sf  = table(eta,pt)       # single value, like hist.GetBinContent(hist.FindBin(eta,pt))
+#   sfs = table.evaluate(etas,pts) # array in, array out
+import numpy as np
+from bisect import bisect_right
+from TauFW.common.tools.log import Logger
+LOG = Logger('LookupTable')
+
+
+def getedges(axis):
+  """Get list of bin edges of a TAxis."""
+  nbins = axis.GetNbins()
+  return [axis.GetBinLowEdge(i) for i in range(1,nbins+1)]+[axis.GetBinUpEdge(nbins)]
+
+
+class LookupTable:
+  """Dense lookup table of a TH1 or TH2 histogram.
+  If clamp=True, values outside the axis range are taken from the first/last bin,
+  otherwise from the under/overflow bins, like GetBinContent(FindBin(x))."""
+
+  def __init__(self, hist, clamp=True, name=None):
+    self.name   = name or hist.GetName()
+    self.clamp  = clamp
+    self.ndim   = hist.GetDimension()
+    LOG.insist(self.ndim in [1,2],"LookupTable(%s): Only TH1 and TH2 are supported, got %s-dimensional %r"%(self.name,self.ndim,hist))
+    axes        = [hist.GetXaxis(),hist.GetYaxis()][:self.ndim]
+    self.edges  = [getedges(a) for a in axes]  # bin edges as python lists for fast scalar lookup
+    self.nbins  = [len(e)-1 for e in self.edges]
+    self.aedges = [np.array(e,dtype=np.float64) for e in self.edges] # bin edges as numpy arrays for batched lookup
+    if self.ndim==1:
+      self.values = [hist.GetBinContent(i) for i in range(self.nbins[0]+2)]
+    else:
+      self.values = [[hist.GetBinContent(i,j) for j in range(self.nbins[1]+2)] for i in range(self.nbins[0]+2)]
+    self.avalues = np.array(self.values,dtype=np.float64)
+
+  def __repr__(self):
+    return "<%s(%r,%s) at %s>"%(self.__class__.__name__,self.name,'x'.join(str(n) for n in self.nbins),hex(id(self)))
+
+  def findbin(self, iaxis, x):
+    """Find bin of a single value along given axis."""
+    ibin  = bisect_right(self.edges[iaxis],x)
+    if self.clamp:
+      nbins = self.nbins[iaxis]
+      if ibin<1: ibin = 1
+      elif ibin>nbins: ibin = nbins
+    return ibin
+
+  def findbins(self, iaxis, x):
+    """Find bins of an array of values along given axis."""
+    ibins = np.searchsorted(self.aedges[iaxis],np.asarray(x,dtype=np.float64),side='right')
+    if self.clamp:
+      ibins = np.clip(ibins,1,self.nbins[iaxis])
+    return ibins
+
+  def __call__(self, x, y=None):
+    """Get value for a single point."""
+    if self.ndim==1:
+      return self.values[self.findbin(0,x)]
+    return self.values[self.findbin(0,x)][self.findbin(1,y)]
+
+  def evaluate(self, x, y=None):
+    """Get values for arrays of points (batched)."""
+    if self.ndim==1:
+      return self.avalues[self.findbins(0,x)]
+    return self.avalues[self.findbins(0,x),self.findbins(1,y)]
+
@@ -3,6 +3,8 @@ import os, re
 from TauFW.PicoProducer import datadir
 from TauFW.common.tools.root import ensureTFile
 from TauFW.common.tools.log import Logger
+from TauFW.PicoProducer.corrections.LookupTable import LookupTable
+import numpy as np
 datadir = os.path.join(datadir,"pileup")
 LOG     = Logger('PileupTool',showname=True)
 
@@ -77,12 +79,14 @@ class PileupWeightTool:
     self.mchist.Scale(1./self.mchist.Integral())
     self.datafile.Close()
     self.mcfile.Close()
+    self.datatable = LookupTable(self.datahist,clamp=False) # fast lookup, like GetBinContent(FindBin(npu))
+    self.mctable   = LookupTable(self.mchist,clamp=False)
     
   
   def getWeight(self,npu):
     """Get pileup weight for a given number of pileup interactions."""
-    data = self.datahist.GetBinContent(self.datahist.GetXaxis().FindBin(npu))
-    mc   = self.mchist.GetBinContent(self.mchist.GetXaxis().FindBin(npu))
+    data = self.datatable(npu)
+    mc   = self.mctable(npu)
     if mc>0.:
       ratio = data/mc
       if ratio>5.: return 5.
@@ -90,6 +94,17 @@ class PileupWeightTool:
     LOG.warning("PileupWeightTools.getWeight: Could not make pileup weight for npu=%s data=%s, mc=%s"%(npu,data,mc))
     return 1.
   
+  def getWeights(self,npu):
+    """Get pileup weights for an array of numbers of pileup interactions."""
+    data    = self.datatable.evaluate(npu)
+    mc      = self.mctable.evaluate(npu)
+    nonzero = mc>0.
+    if not nonzero.all():
+      LOG.warning("PileupWeightTools.getWeights: Could not make pileup weight for npu=%s"%(np.asarray(npu)[~nonzero]))
+    weights = np.ones(len(mc))
+    weights[nonzero] = np.minimum(data[nonzero]/mc[nonzero],5.)
+    return weights
+  
   
 
 def hasBuggyPU(sample):
@@ -2,6 +2,7 @@
 import os, re
 from TauFW.common.tools.root import ensureTFile
 from TauFW.common.tools.log import Logger
+from TauFW.PicoProducer.corrections.LookupTable import LookupTable
 LOG = Logger('ScaleFactorTool')
 
 
@@ -13,6 +14,7 @@ class ScaleFactor:
     self.ptvseta  = ptvseta
     self.filename = filename
     self.file, self.hist = self.gethist(filename,histname,verb=verb)
+    self.table    = LookupTable(self.hist,clamp=True,name=name) # fast lookup; clamp to first/last bin
     self.getSF    = self.getSF_ptvseta if ptvseta else self.getSF_etavspt
   
   def gethist(self,filename,histname,verb=0):
@@ -41,27 +43,21 @@ class ScaleFactor:
   
   def getSF_ptvseta(self, pt, eta):
     """Get SF for a given pT, eta."""
-    xbin = self.hist.GetXaxis().FindBin(eta)
-    ybin = self.hist.GetYaxis().FindBin(pt)
-    if xbin==0: xbin = 1
-    elif xbin>self.hist.GetXaxis().GetNbins(): xbin -= 1
-    if ybin==0: ybin = 1
-    elif ybin>self.hist.GetYaxis().GetNbins(): ybin -= 1
-    sf = self.hist.GetBinContent(xbin,ybin)
+    sf = self.table(eta,pt)
     #print "ScaleFactor(%s).getSF_ptvseta: pt = %6.2f, eta = %6.3f, sf = %6.3f"%(self.name,pt,eta,sf)
     return sf
   
   def getSF_etavspt(self, pt, eta):
     """Get SF for a given pT, eta."""
-    xbin = self.hist.GetXaxis().FindBin(pt)
-    ybin = self.hist.GetYaxis().FindBin(eta)
-    if xbin==0: xbin = 1
-    elif xbin>self.hist.GetXaxis().GetNbins(): xbin -= 1
-    if ybin==0: ybin = 1
-    elif ybin>self.hist.GetYaxis().GetNbins(): ybin -= 1
-    sf = self.hist.GetBinContent(xbin,ybin)
+    sf = self.table(pt,eta)
     #print "ScaleFactor(%s).getSF_etavspt: pt = %6.2f, eta = %6.3f, sf = %6.3f"%(self.name,pt,eta,sf)
     return sf
+  
+  def getSFs(self, pt, eta):
+    """Get SFs for arrays of pT, eta."""
+    if self.ptvseta:
+      return self.table.evaluate(eta,pt)
+    return self.table.evaluate(pt,eta)
     
 
 class ScaleFactorHTT(ScaleFactor):
@@ -1,12 +1,19 @@
 # Author: Izaak Neutelings (November, 2019)
 # Description: Tools to match reco objects to trigger objects in nanoAOD,
 #              and to read JSON file containing trigger information
+#              The trigger objects are indexed once per event by object ID and filter bits,
+#              so matching several reco objects is a vectorized DeltaR query on numpy arrays.
+#              For the columnar engine, a whole block of entries is matched at once, see matchcolumns.
 # Sources:
 #   https://github.com/cms-sw/cmssw/blob/master/PhysicsTools/NanoAOD/python/triggerObjects_cff.py
 #   https://cms-nanoaod-integration.web.cern.ch/integration/master-106X/mc106X_doc.html#TrigObj
 import os, sys, yaml #, json
+from math import pi
 from collections import namedtuple
+import numpy as np
 from PhysicsTools.NanoAODTools.postprocessing.framework.datamodel import Collection
+from TauFW.PicoProducer.analysis.objects import getarrays
+from TauFW.PicoProducer.analysis.columnar import cartesian, deltaR
 TriggerData = namedtuple('TriggerData',['trigdict','combdict']) # simple container class
 objectTypes = { 1: 'Jet', 6: 'FatJet', 2: 'MET', 3: 'HT', 4: 'MHT',
                 11: 'Electron', 13: 'Muon', 15: 'Tau', 22: 'Photon', } 
@@ -128,7 +135,13 @@ class Trigger:
     self.path     = path                  # human readable trigger combination
     self.patheval = patheval              # trigger evaluation per event 'e'
     self.fireddef = "lambda e: "+patheval # exact definition of 'fired' function
-    self.fired    = eval(self.fireddef)   # method to check if trigger was fired for a given event
+  
+  def fired(self,event):
+    """Check if trigger was fired for a given event: direct check of the HLT branch (and run range),
+    equivalent to the function in fireddef."""
+    if self.runrange and not (self.runrange[0]<=event.run<=self.runrange[1]):
+      return False
+    return getattr(event,self.path)
   
   def __repr__(self):
     """Returns string representation of Trigger object."""
@@ -275,7 +288,7 @@ class TrigObjMatcher:
     self.path     = path           # human readable trigger combination
     self.patheval = patheval       # trigger evaluation per event 'e'
     self.fireddef = fireddef       # exact definition of 'fired' function
-    self.fired    = eval(fireddef) # method to check if any of the triggers was fired for a given event
+    self._index   = None           # index of trigger objects in the current event, see getindex
   
   def __repr__(self):
     """Returns string representation of TriggerFilter object."""
@@ -291,14 +304,91 @@ class TrigObjMatcher:
       for i, filter in enumerate(trigger.filters,1):
         print("%s  leg %d: %s, %r"%(indent,i,filter.type,filter.name))
   
+  def getindex(self,event):
+    """Get the index of the current event, built once per event: a list of which triggers fired,
+    and a dictionary of (object ID, filter bits) -> (indices, eta, phi) of the trigger objects
+    with this ID and these filter bits, in the order of the TrigObj collection, filled lazily."""
+    arrays = getarrays(event) # shared cache of branches of the current event
+    if self._index is None or self._index[0] is not arrays:
+      fired = [trigger.fired(event) for trigger in self.triggers]
+      self._index = (arrays,fired,{ })
+    return self._index
+  
+  def getsubset(self,event,id,bits):
+    """Get indices, eta and phi of trigger objects with a given ID, that have all given filter bits."""
+    arrays, fired, subsets = self.getindex(event)
+    key = (id,bits)
+    if key not in subsets:
+      if arrays.count('TrigObj')==0:
+        subsets[key] = (np.zeros(0,dtype=np.int64),np.zeros(0),np.zeros(0))
+      else:
+        ids  = arrays.getarray('TrigObj','id')
+        fbits = arrays.getarray('TrigObj','filterBits')
+        idxs = np.nonzero((ids==id) & ((fbits & bits)==bits))[0]
+        subsets[key] = (idxs,arrays.getarray('TrigObj','eta')[idxs],arrays.getarray('TrigObj','phi')[idxs])
+    return subsets[key]
+  
+  def fired(self,event):
+    """Check if any of the triggers was fired for a given event."""
+    return any(self.getindex(event)[1])
+  
   def match(self,event,recoObj,leg=1,dR=0.2):
-    """Match given reconstructed object to trigger objects."""
+    """Match given reconstructed object to trigger objects. Return the first trigger object,
+    in the order of the triggers and the TrigObj collection, that has the filter bits of a fired trigger,
+    is within dR, and for which the reco object passes the offline pT and eta cut; None otherwise."""
     leg     -= 1 # index starting at 0
-    trigObjs = [o for o in Collection(event,'TrigObj') if o.id==self.ids[leg]] # and (o.filterBits&self.bits)>0
-    for trigger in self.triggers:
-      if not trigger.fired(event): continue
-      for trigObj in trigObjs:
-        if trigger.filters[leg].matchbits(trigObj) and trigger.filters[leg].match(trigObj,recoObj,dR=dR):
-          return trigObj
+    fired    = self.getindex(event)[1]
+    pt, eta, phi = recoObj.pt, recoObj.eta, recoObj.phi
+    for trigger, isfired in zip(self.triggers,fired):
+      if not isfired: continue
+      filter = trigger.filters[leg]
+      if not (pt>filter.ptmin and abs(eta)<filter.etamax): continue
+      idxs, etas, phis = self.getsubset(event,self.ids[leg],filter.bits)
+      if len(idxs)==0: continue
+      dphi   = phis-phi
+      dphi   = np.where(dphi>pi,dphi-2*pi,np.where(dphi<-pi,dphi+2*pi,dphi))
+      passed = np.nonzero(np.hypot(etas-eta,dphi)<dR)[0]
+      if len(passed)>0:
+        return Collection(event,'TrigObj')[int(idxs[passed[0]])]
     return None
   
+  
+  def getcolumns(self):
+    """Get the scalar branches and the TrigObj fields needed by firedcolumns and matchcolumns."""
+    scalars = [trigger.path for trigger in self.triggers]
+    if any(trigger.runrange for trigger in self.triggers):
+      scalars.append('run')
+    return scalars, ['id','filterBits','eta','phi']
+  
+  def firedcolumns(self,block):
+    """Vectorized version of fired for a block of entries (see analysis/columnar.py).
+    Return a boolean array of shape (ntriggers,nevents) of which triggers fired in each event."""
+    fired = np.zeros((len(self.triggers),block.size),dtype=bool)
+    for i, trigger in enumerate(self.triggers):
+      fired[i] = block.scalars[trigger.path]!=0
+      if trigger.runrange:
+        run = block.scalars['run']
+        fired[i] &= (run>=trigger.runrange[0]) & (run<=trigger.runrange[1])
+    return fired
+  
+  def matchcolumns(self,block,objs,mask,leg=1,dR=0.2,fired=None):
+    """Vectorized version of match for a block of entries: Given a JaggedArray of reco objects
+    with pt, eta and phi, and a mask of objects to consider, return the mask of objects that are
+    matched to a trigger object with the filter bits of a fired trigger, and pass its offline cuts."""
+    leg     -= 1 # index starting at 0
+    if fired is None:
+      fired  = self.firedcolumns(block)
+    trigobjs = block.TrigObj
+    nevts    = block.size
+    matched  = np.zeros(len(objs),dtype=bool)
+    for trigger, isfired in zip(self.triggers,fired):
+      filter = trigger.filters[leg]
+      objmask = mask & ~matched & isfired[objs.evtidx] & (objs.pt>filter.ptmin) & (np.abs(objs.eta)<filter.etamax)
+      if not objmask.any(): continue
+      trigmask = isfired[trigobjs.evtidx] & (trigobjs.id==self.ids[leg]) &\
+                 ((trigobjs.filterBits & filter.bits)==filter.bits)
+      iobj, itrig, _ = cartesian(np.nonzero(objmask)[0],objs.evtidx[objmask],
+                                 np.nonzero(trigmask)[0],trigobjs.evtidx[trigmask],nevts)
+      close  = deltaR(trigobjs.eta[itrig],trigobjs.phi[itrig],objs.eta[iobj],objs.phi[iobj])<dR
+      matched[iobj[close]] = True
+    return matched
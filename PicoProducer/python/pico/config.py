@@ -313,7 +313,15 @@ def main_link(args):
     if char in key:
       LOG.throw(IOError,"Given key '%s', but keys cannot contain any of these characters: %s"%(key,char))
   if varkey=='channels':
-    if 'skim' in key.lower(): #or 'test' in key:
+    if ',' in value: # group of channels to run in the same job, e.g. "mutau,etau,tautau"
+      subchannels = [c.strip() for c in value.split(',') if c.strip()]
+      for subchannel in subchannels:
+        LOG.insist(subchannel in CONFIG.channels,"Channel '%s' in group '%s' not found in the configuration! Available: %s"%(
+                                                 subchannel,key,', '.join(CONFIG.channels)))
+        LOG.insist('skim' not in subchannel.lower() and ',' not in CONFIG.channels[subchannel],
+                   "Channel groups can only contain analysis channels, not skimming channels or other groups!")
+      value  = ','.join(subchannels)
+    elif 'skim' in key.lower(): #or 'test' in key:
       parts  = value.split(' ') # "PROCESSOR [--FLAG[=VALUE] ...]"
       script = os.path.basename(parts[0]) # separate script from options
       ensurefile("python/processors",script)
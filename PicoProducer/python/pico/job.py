@@ -1,6 +1,6 @@
 #! /usr/bin/env python
 # Author: Izaak Neutelings (April 2020)
-import os, sys, re, glob, json
+import os, sys, re, glob, json, gzip
 from datetime import datetime
 from collections import OrderedDict
 from TauFW.common.tools.file import ensuredir, getline
@@ -8,7 +8,10 @@ from TauFW.common.tools.utils import execute, chunkify
 from TauFW.common.tools.string import repkey, lreplace, alphanum_key
 from TauFW.common.tools.LoadingBar import LoadingBar
 from TauFW.PicoProducer.batch.utils import getbatch, getcfgsamples, chunkify_by_evts, evtsplitexp
+from TauFW.PicoProducer.batch.cost import getcost, learncost, chunkify_by_cost
+from TauFW.PicoProducer.batch.jobstate import JobState, getstatename, removestate
 from TauFW.PicoProducer.storage.utils import getstorage, getsamples, isvalid, itervalid, print_no_samples
+from TauFW.PicoProducer.storage.evtcache import EventCache
 from TauFW.PicoProducer.pico.run import getmodule
 from TauFW.PicoProducer.pico.common import *
 if sys.version_info.major<3: # for compatiblity with python2
@@ -36,14 +39,18 @@ def preparejobs(args):
   dasvetoes    = args.dasvetoes    # exclude these DAS paths (glob patterns)
   dasfiles     = args.dasfiles     # explicitly process nanoAOD files stored on DAS (as opposed to local storage)
   checkdas     = args.checkdas     # look up number of events in DAS and compare to processed events in job output
-  checkqueue   = args.checkqueue   # check job status to speed up if batch is slow: 0 (no check), 1 (check once, fast), -1 (check every job, slow, default)
+  checkqueue   = args.checkqueue   # check job status: 0 (no check), 1 or -1 (query batch system once for all samples, default)
+  queuecache   = args.queuecache   # reuse queue from previous call if younger than this (in seconds)
   checkevts    = args.checkevts    # validate output files and counts events (default, but slow)
   checkexpevts = args.checkexpevts # compare actual vs. processed number of events
   extraopts    = args.extraopts    # extra options for module (for all runs)
   prefetch     = args.prefetch     # copy input file first to local output directory
+  userdf       = args.rdf          # run histogram-only modules with RDataFrame (number of threads)
+  workers      = args.workers      # number of worker processes per job
   preselect    = args.preselect    # preselection string for post-processing
   nfilesperjob = args.nfilesperjob # split jobs based on number of files
   maxevts      = args.maxevts      # split jobs based on events
+  jobtime      = args.jobtime      # split jobs based on predicted run time (in minutes)
   split_nfpj   = args.split_nfpj   # split failed (file-based) chunks into even smaller chunks
   testrun      = args.testrun      # only run a few test jobs
   queue        = args.queue        # queue option for the batch system (job flavor for HTCondor)
@@ -52,7 +59,6 @@ def preparejobs(args):
   tmpdir       = args.tmpdir or CONFIG.get('tmpskimdir',None) # temporary dir for creating skimmed file before copying to outdir
   ncores       = args.ncores       # number of cores; validate output files in parallel
   verbosity    = args.verbosity
-  jobs         = None
   
   # LOOP over ERAS
   for era in eras:
@@ -65,9 +71,11 @@ def preparejobs(args):
       # MODULE & PROCESSOR
       skim = 'skim' in channel.lower()
       module, processor, procopts, extrachopts = getmodule(channel,extraopts)
+      subchannels = [channel] if skim else GLOB.getchannels(channel,CONFIG) # group of channels run in one job
       if verbosity>=1:
         print('-'*80)
         print(">>> %-12s = %r"%('channel',channel))
+        print(">>> %-12s = %r"%('subchannels',subchannels))
         print(">>> %-12s = %r"%('processor',processor))
         print(">>> %-12s = %r"%('module',module))
         print(">>> %-12s = %r"%('procopts',procopts))
@@ -112,8 +120,13 @@ def preparejobs(args):
         jobids     = sample.jobcfg.get('jobids',[ ])
         queue_     = queue or sample.jobcfg.get('queue',None)
         prefetch_  = sample.jobcfg.get('prefetch',prefetch) or prefetch # if resubmit: reuse old setting, or override by user
+        userdf_    = userdf if userdf!=None else sample.jobcfg.get('rdf',None) # if resubmit: reuse old setting, or override by user
+        workers_   = workers or sample.jobcfg.get('workers',1) # if resubmit: reuse old setting, or override by user
         dtype      = sample.dtype
         postfix    = "_%s%s"%(channel,tag)
+        postfixes  = [postfix] # postfix of each output file per job (one per channel in a group)
+        if len(subchannels)>1:
+          postfixes = ["_%s%s"%(c,tag) for c in subchannels]
         jobtag     = "%s_try%d"%(postfix,subtry)
         jobname    = "%s%s_%s%s"%(sample.name,postfix,era,"_try%d"%subtry if subtry>1 else "")
         extraopts_ = extrachopts[:] # extra options for module (for this channel & sample)
@@ -127,6 +140,7 @@ def preparejobs(args):
           maxevts_ = sample.jobcfg.get('maxevts',maxevts_)
           if nfilesperjob<=0: # reuse previous nfilesperjob settings if nfilesperjob not set by user
             nfilesperjob_ = sample.jobcfg.get('nfilesperjob',nfilesperjob_)
+        jobtime_   = jobtime or (sample.jobcfg.get('jobtime',None) if resubmit else None) # if resubmit: reuse old setting, or override by user
         daspath    = sample.paths[0].strip('/')
         outdir     = repkey(outdirformat,ERA=era,CHANNEL=channel,TAG=tag,SAMPLE=sample.name,
                                          DAS=daspath,PATH=daspath,GROUP=sample.group)
@@ -147,9 +161,11 @@ def preparejobs(args):
           print(">>> %-12s = %r"%('jobname',jobname))
           print(">>> %-12s = %r"%('jobtag',jobtag))
           print(">>> %-12s = %r"%('postfix',postfix))
+          print(">>> %-12s = %r"%('postfixes',postfixes))
           print(">>> %-12s = %r"%('outdir',outdir))
           print(">>> %-12s = %r"%('extraopts',extraopts_))
           print(">>> %-12s = %r"%('prefetch',prefetch_))
+          print(">>> %-12s = %r"%('rdf',userdf_))
           print(">>> %-12s = %r"%('preselect',preselect))
           print(">>> %-12s = %r"%('cfgdir',cfgdir))
           print(">>> %-12s = %r"%('logdir',logdir))
@@ -201,13 +217,11 @@ def preparejobs(args):
         # GET FILES
         nevents = 0
         if resubmit: # resubmission
-          if checkqueue==1 and jobs!=None: # check jobs only once to speed up performance
-            batch = getbatch(CONFIG,verb=verbosity)
-            jobs  = batch.jobs(verb=verbosity-1)
-          infiles, chunkdict = checkchunks(sample,channel=channel,tag=tag,jobs=jobs,checkqueue=checkqueue,checkevts=checkevts,
-                                           checkexpevts=checkexpevts,das=checkdas,ncores=ncores,verb=verbosity)[:2]
+          infiles, chunkdict = checkchunks(sample,era=era,channel=channel,tag=tag,checkqueue=checkqueue,queuecache=queuecache,checkevts=checkevts,
+                                           checkexpevts=checkexpevts,das=checkdas,force=force,ncores=ncores,verb=verbosity)[:2]
           nevents = sample.jobcfg['nevents'] # updated in checkchunks
         else: # first-time submission
+          removestate(cfgname,postfix,verb=verbosity) # forget chunk status and validated output of previous submissions
           infiles = sample.getfiles(das=dasfiles,verb=verbosity-1)
           if checkdas:
             nevents = sample.getnevents(verb=verbosity-1)
@@ -216,10 +230,12 @@ def preparejobs(args):
           infiles = infiles[:4] # only run four files per sample
         if verbosity==1:
           print(">>> %-12s = %s"%('maxevts',maxevts_))
+          print(">>> %-12s = %s"%('jobtime',jobtime_))
           print(">>> %-12s = %s"%('nfilesperjob',nfilesperjob_))
           print(">>> %-12s = %s"%('nfiles',len(infiles)))
         elif verbosity>=2:
           print(">>> %-12s = %s"%('maxevts',maxevts_))
+          print(">>> %-12s = %s"%('jobtime',jobtime_))
           print(">>> %-12s = %s"%('nfilesperjob',nfilesperjob_))
           print(">>> %-12s = %s"%('nfiles',len(infiles)))
           print(">>> %-12s = [ "%('infiles'))
@@ -230,11 +246,33 @@ def preparejobs(args):
         # CHUNKS - partition/split list of input files
         infiles.sort() # to have consistent order with resubmission
         chunks    = [ ] # chunk indices
-        if maxevts_>1: # split jobs by number of events (max. maxevts_ events per job)
+        cost      = getcost(era,channel,sample.name,verb=verbosity) if jobtime_ else None
+        if jobtime_ and not cost:
+          LOG.warn("No cost model for %s/%s/%s yet! Please check the status of finished jobs first. "%(era,channel,sample.name)+
+                   "Splitting by %s instead..."%("events" if maxevts_>1 else "files"))
+        if cost: # split jobs by predicted run time (learned events/s and overhead per job)
+          if verbosity>=1:
+            print(">>> Preparing jobs with chunks split by predicted run time (jobtime_=%s min)..."%(jobtime_))
+          try:
+            with EventCache(verb=verbosity) as evtcache:
+              todo = [f for f in infiles if f not in sample.filenevts and not evtsplitexp.match(f)]
+              sample.filenevts.update(evtcache.getnevents(todo,ncores=ncores,verb=verbosity))
+            ntot, fchunks, jobtimes = chunkify_by_cost(infiles,60.*jobtime_,cost,sample.filenevts,verb=verbosity)
+            if nevents<=0 and not resubmit:
+              nevents = ntot
+          except IOError as err: # capture if opening files fail
+            print("IOError: "+str(err))
+            LOG.warn("Skipping submission...")
+            failed.append(sample)
+            print("")
+            continue # ignore this submission
+          if testrun:
+            fchunks = fchunks[:4]
+        elif maxevts_>1: # split jobs by number of events (max. maxevts_ events per job)
           if verbosity>=1:
             print(">>> Preparing jobs with chunks split by number of events...")
           try:
-            ntot, fchunks = chunkify_by_evts(infiles,maxevts_,evtdict=sample.filenevts,verb=verbosity) # list of file chunks split by events
+            ntot, fchunks = chunkify_by_evts(infiles,maxevts_,evtdict=sample.filenevts,ncores=ncores,verb=verbosity) # list of file chunks split by events
             if nevents<=0 and not resubmit:
               nevents = ntot
           except IOError as err: # capture if opening files fail
@@ -304,6 +342,10 @@ def preparejobs(args):
                 jobcmd   += " -y %s -d %r -c %s -M %s --copydir %s -t %s"%(era,dtype,channel,module,outdir,filetag)
               if prefetch_:
                 jobcmd   += " -p"
+              if userdf_!=None and not skim:
+                jobcmd   += " --rdf %d"%(userdf_) # RDataFrame graph instead of PostProcessor
+              if workers_>1 and not skim:
+                jobcmd   += " --workers %d"%(workers_) # split files or events over worker processes
               if preselect and skim:
                 jobcmd   += " --preselect '%s'"%(preselect)
               if firstevt>=0:
@@ -326,10 +368,12 @@ def preparejobs(args):
           ('time',str(datetime.now())),
           ('group',sample.group), ('paths',sample.paths), ('name',sample.name), ('nevents',nevents),
           ('dtype',dtype),        ('channel',channel),    ('module',module),    ('extraopts',extraopts_),
+          ('channels',subchannels), ('postfixes',postfixes),
           ('jobname',jobname),    ('jobtag',jobtag),      ('tag',tag),          ('postfix',postfix),
           ('try',subtry),         ('queue',queue_),       ('jobids',jobids),    ('prefetch',prefetch_),
+          ('rdf',userdf_),        ('workers',workers_),   ('procranges',sample.jobcfg.get('procranges',{ })),
           ('outdir',outdir),      ('jobdir',jobdir),      ('cfgdir',cfgdir),    ('logdir',logdir),
-          ('cfgname',cfgname),    ('joblist',joblist),    ('maxevts',maxevts_),
+          ('cfgname',cfgname),    ('joblist',joblist),    ('maxevts',maxevts_), ('jobtime',jobtime_),
           ('nfiles',nfiles),      ('files',infiles),      ('nfilesperjob',nfilesperjob_), #('nchunks',nchunks),
           ('nchunks',nchunks),    ('chunks',chunks),      ('chunkdict',chunkdict),
           ('filenevts',sample.filenevts),
@@ -357,19 +401,23 @@ def checkchunks(sample,**kwargs):
   channel      = kwargs.get('channel',      None  )
   tag          = kwargs.get('tag',          None  )
   checkqueue   = kwargs.get('checkqueue',   -1    ) # check queue of batch system for pending jobs
+  queuecache   = kwargs.get('queuecache',   0     ) # reuse queue from previous call if younger than this (in seconds)
   checkevts    = kwargs.get('checkevts',    True  ) # validate output file & count events (slow, default)
   checkexpevts = kwargs.get('checkexpevts', False ) # compare actual to expected number of processed events
-  pendjobs     = kwargs.get('jobs',         None  )
   checkdas     = kwargs.get('das',          True  ) # check number of events from DAS
   showlogs     = kwargs.get('showlogs',     False ) # print log files of failed jobs for debugging
+  force        = kwargs.get('force',        False ) # forget number of events from previous DAS check
   ncores       = kwargs.get('ncores',       4     ) # validate files in parallel
+  era          = kwargs.get('era',          None  ) # to learn cost model of jobs
   verbosity    = kwargs.get('verb',         0     )
   oldjobcfg    = sample.jobcfg # job config from last job
   oldcfgname   = oldjobcfg['config']
   chunkdict    = oldjobcfg['chunkdict'] # filenames
   jobids       = oldjobcfg['jobids']
+  procranges   = oldjobcfg.get('procranges',{ }) # range of process IDs per shared cluster ID (bulk submission)
   joblist      = oldjobcfg['joblist']
   postfix      = oldjobcfg['postfix']
+  postfixes    = oldjobcfg.get('postfixes',[postfix]) # one output file per channel in the group
   logdir       = oldjobcfg['logdir']
   nfilesperjob = oldjobcfg['nfilesperjob']
   filenevts    = sample.filenevts
@@ -380,6 +428,13 @@ def checkchunks(sample,**kwargs):
     channel    = oldjobcfg['channel']
   if tag==None:
     tag        = oldjobcfg['tag']
+  state        = JobState(oldcfgname,postfix,verb=verbosity) # incremental state of chunks and validated output
+  if checkexpevts!=False: # fill in missing number of events from persistent cache (without opening files)
+    infiles = set(evtsplitexp.sub(r"\1",f) for i in chunkdict for f in chunkdict[i])
+    infiles = [f for f in infiles if f not in filenevts]
+    if infiles:
+      with EventCache(verb=verbosity) as evtcache:
+        filenevts.update(evtcache.lookup(infiles))
   if not filenevts:
     checkexpevts==False
   elif checkexpevts==None:
@@ -395,22 +450,30 @@ def checkchunks(sample,**kwargs):
   # NUMBER OF EVENTS
   nprocevents = 0   # total number of processed events
   ndasevents  = oldjobcfg['nevents'] # total number of available events
+  if force: # forget number of events from previous DAS check
+    state.unset('ndasevents')
   if checkdas: #and ndasevents==0: # get nevents straight from DAS
     ndasevents = sample.getnevents(das=True)
+    state.set('ndasevents',ndasevents) # reuse in later checks without DAS
     oldjobcfg['nevents'] = ndasevents
-  elif verbosity>=2:
-    print(">>> %-12s = %s"%('ndasevents',ndasevents))
+  else:
+    ndasevents = int(state.get('ndasevents',ndasevents)) # reuse from previous DAS check
+    oldjobcfg['nevents'] = ndasevents
+    if verbosity>=2:
+      print(">>> %-12s = %s"%('ndasevents',ndasevents))
   if verbosity>=3:
     print(">>> %-12s = %s"%('chunkdict',chunkdict))
     print(">>> %-12s = %s"%('ncores',ncores))
   
   # CHECK PENDING JOBS
-  if checkqueue<0 or pendjobs:
-    if checkqueue!=1 or not pendjobs:
-      batch = getbatch(CONFIG,verb=verbosity)
-      pendjobs = batch.jobs(jobids,verb=verbosity-1) # refresh job list
-    elif pendjobs:
-      pendjobs = [j for j in pendjobs if j.jobid in jobids] # get new job list with right job id
+  if chunkdict and state.get('jobids')==json.dumps(jobids) and all(i in state.getchunks('good') for i in chunkdict): # no need to check queue
+    LOG.verb("checkchunks: All chunks succeeded in previous check, skipping batch queue...",verbosity,2)
+    pendjobs = [ ]
+  elif checkqueue!=0: # query batch system only once for all samples, and select jobs with right job id
+    batch = getbatch(CONFIG,verb=verbosity)
+    pendjobs = batch.alljobs(maxage=queuecache,verb=verbosity-1).select(jobids,procranges)
+  else:
+    pendjobs = None
   
   ###########################################################################
   # CHECK SKIMMED OUTPUT: nanoAOD format, one or more output files per job
@@ -484,7 +547,7 @@ def checkchunks(sample,**kwargs):
     elif verbosity>=2:
       print(">>> %-12s = %s"%('pendchunks',pendchunks))
       print(">>> %-12s = %s"%('outfiles',outfiles))
-    validated = itervalid(outfiles,checkevts=checkevts,ncores=ncores,verb=verbosity) # get number of events processed & check for corruption
+    validated = state.itervalid(outfiles,checkevts=checkevts,ncores=ncores,verb=verbosity) # get number of events processed & check for corruption (new or changed files only)
     for nevents, fname in validated: # use validator for parallel processing
       if verbosity>=2:
         print(">>>   Checking job output '%s'..."%(fname))
@@ -578,11 +641,12 @@ def checkchunks(sample,**kwargs):
   
   
   ###########################################################################
-  # CHECK ANALYSIS OUTPUT: custom tree format, one output file per job, numbered post-fix
+  # CHECK ANALYSIS OUTPUT: custom tree format, one output file per job (and channel), numbered post-fix
   else:
     flagexp    = re.compile(r"-t \w*_(\d+)")
-    fpattern   = "*%s_[0-9]*.root"%(postfix) # _$postfix_$chunk
-    chunkexp   = re.compile(r".+%s_(\d+)\.root"%(postfix))
+    fpattern   = ["*%s_[0-9]*.root"%(p) for p in postfixes] # _$postfix_$chunk
+    chunkexp   = re.compile(r".+(%s)_(\d+)\.root"%('|'.join(re.escape(p) for p in postfixes)))
+    noutputs   = { } # number of good output files per chunk (one per channel in the group)
     if verbosity>=2:
       print(">>> %-12s = %r"%('flagexp',flagexp.pattern))
       print(">>> %-12s = %r"%('fpattern',fpattern))
@@ -615,6 +679,8 @@ def checkchunks(sample,**kwargs):
     
     # CHECK OUTPUT FILES
     outfiles = storage.getfiles(filter=fpattern,verb=verbosity-1) # get output files
+    if checkevts:
+      state.getmeta(outfiles) # get size and modification time in parallel
     bar      = None # loading bar
     if verbosity<=1 and len(outfiles)>=15:
       bar = LoadingBar(len(outfiles),width=20,pre=">>> Checking output files: ",
@@ -627,7 +693,7 @@ def checkchunks(sample,**kwargs):
         print(">>>   Checking job output '%s'..."%(fname))
       match = chunkexp.search(fname)
       if match:
-        ichunk = int(match.group(1))
+        ichunk = int(match.group(2))
         LOG.insist(ichunk in chunkdict,"Found an impossible chunk %d for file %s! Chunkdict has %s"%(ichunk,fname,list(sorted(chunkdict.keys())))+
                                        " Possible overcounting or conflicting job output file format! Check %s"%(oldcfgname))
         if ichunk in pendchunks:
@@ -635,12 +701,15 @@ def checkchunks(sample,**kwargs):
       else:
         #LOG.warn("Did not recognize output file '%s'!"%(fname))
         continue
-      nevents = isvalid(fname) if checkevts else 0 # get number of processed events & check for corruption
+      nevents = state.isvalid(fname) if checkevts else 0 # get number of processed events & check for corruption (new or changed files only)
       if nevents<0:
         if verbosity>=2:
           print(">>>   => Bad, nevents=%s"%(nevents))
-        badchunks.append(ichunk)
+        if ichunk not in badchunks:
+          badchunks.append(ichunk)
         # TODO: remove file from outdir to avoid conflicting output ?
+      elif match.group(1)!=postfixes[0]: # other channels in the group: same events processed
+        noutputs[ichunk] = noutputs.get(ichunk,0)+1
       else:
         nevtsexp = 0 # expected number of processed events
         if checkexpevts or verbosity>=2:
@@ -665,12 +734,15 @@ def checkchunks(sample,**kwargs):
           else:
             print(">>>   => Good, nevents=%s"%(nevents))
         nprocevents += nevents
-        goodchunks.append(ichunk)
+        noutputs[ichunk] = noutputs.get(ichunk,0)+1
       if bar:
         status = "files, %s/%s events (%d%%)"%(nprocevents,ndasevents,100.0*nprocevents/ndasevents) if ndasevents>0 else ""
         bar.count(status)
     
     # GET FILES for RESUBMISSION + sanity checks
+    for ichunk, noutput in noutputs.items():
+      if ichunk not in badchunks and noutput>=len(postfixes): # all channels have good output
+        goodchunks.append(ichunk)
     if verbosity>=2:
       print(">>> %-12s = %s"%('nprocevents',nprocevents))
     for ichunk in list(chunkdict.keys()):
@@ -746,6 +818,7 @@ def checkchunks(sample,**kwargs):
             chunkset[jobid] = chunks
         if chunks and chunk in chunks:
           taskid  = chunks.index(chunk)+(0 if 'HTCondor' in CONFIG.batch else 1)
+          taskid += procranges.get(str(jobid),[0])[0] # offset in cluster shared by samples (bulk submission)
           logexp  = "%d.%d.log"%(jobid,taskid)
           #logexp  = re.compile(".*\.\d{3,}\.%d(?:\.log)?$"%(taskid)) #$JOBNAME.$JOBID.$TASKID.log
           matches = [f for f in lognames if f.endswith(logexp)]
@@ -756,6 +829,15 @@ def checkchunks(sample,**kwargs):
       else:
         LOG.warn("Did not find log file for chunk %d"%(chunk))
   
+  # STORE STATE for next check
+  state.setchunks(good=goodchunks,pend=pendchunks,bad=badchunks,miss=misschunks)
+  state.set('jobids',json.dumps(jobids)) # chunk status is only valid for these jobs
+  state.close()
+  
+  # LEARN COST MODEL from measured event rate and overhead in log files of finished jobs
+  if era!=None and goodchunks:
+    learncost(logdir,era,channel,sample.name,verb=verbosity)
+  
   return resubfiles, chunkdict, len(pendchunks)
   
 
@@ -778,6 +860,10 @@ def main_submit(args):
   time      = args.time      # maximum time for the batch system
   batchopts = args.batchopts # extra options for the batch system
   batch     = getbatch(CONFIG,verb=verbosity+1)
+  bulk      = args.bulk and 'HTCondor' in batch.system # submit all samples as one cluster per queue
+  bulkcfgs  = [ ] # job configs to be submitted in bulk
+  if args.bulk and not bulk:
+    LOG.warn("Bulk submission is only implemented for HTCondor, not %s! Submitting each sample separately..."%(batch.system))
   
   for jobcfg in preparejobs(args):
     jobid   = None
@@ -789,6 +875,7 @@ def main_submit(args):
     jobname = jobcfg['jobname']
     nchunks = jobcfg['nchunks']
     queue   = jobcfg['queue']
+    workers = jobcfg.get('workers',1) or 1 # request one core per worker process
     jkwargs = { # key-word arguments for batch.submit
       'name': jobname, 'opt': batchopts, 'dry': dryrun,
       'short': (testrun>0), 'queue':queue, 'time':time
@@ -800,10 +887,14 @@ def main_submit(args):
     if 'HTCondor' in batch.system:
       appcmds = ["initialdir=%s"%(jobdir),
                  "mylogfile='log/%s.$(ClusterId).$(ProcId).log'"%(jobname)]
+      if workers>1:
+        appcmds.append("request_cpus=%d"%(workers))
       jkwargs.update({ 'app': appcmds })
     elif 'SLURM' in batch.system:
       logfile = os.path.join(logdir,"%x.%A.%a.log") # $JOBNAME.o$JOBID.$TASKID.log
       jkwargs.update({ 'log': logfile, 'array': nchunks })
+      if workers>1:
+        jkwargs['opt'] = ("%s --cpus-per-task=%d"%(batchopts or '',workers)).strip()
     #elif 'SGE' in batch.system:
     #elif 'CRAB' in batch.system:
     #else:
@@ -821,27 +912,72 @@ def main_submit(args):
           submit = 'y'
           args.prompt = False # stop asking for next samples
         if 'y' in submit.lower(): # submit this job
-          jobid = batch.submit(script,taskfile=joblist,**jkwargs)
+          if bulk: # submit later together with other samples
+            bulkcfgs.append(jobcfg)
+          else:
+            jobid = batch.submit(script,taskfile=joblist,**jkwargs)
           break
         elif 'n' in submit.lower(): # do not submit this job
           print(">>> Not submitting.")
           break
         else:
           print(">>> '%s' is not a valid answer, please choose y/n."%submit)
+    elif bulk: # submit later together with other samples
+      bulkcfgs.append(jobcfg)
     else:
       jobid = batch.submit(script,taskfile=joblist,**jkwargs)
     
     # WRITE JOBCONFIG
     if jobid!=None:
       jobcfg['jobids'].append(jobid)
-      if verbosity>=1:
-        print(">>> Creating config file '%s'..."%(cfgname))
-      if cfgname.endswith(".json.gz"):
-        with gzip.open(cfgname,'wt') as file:
-          file.write(json.dump(jobcfg),indent=2)
-      else:
-        with open(cfgname,'w') as file:
-          json.dump(jobcfg,file,indent=2)
+      writejobcfg(jobcfg,verb=verbosity)
+      batch.clearqueue(verb=verbosity) # queried queue does not have the new jobs
+  
+  # BULK SUBMISSION
+  if bulkcfgs:
+    submitbulk(batch,bulkcfgs,opt=batchopts,dry=dryrun,short=(testrun>0),time=time,verb=verbosity)
+  
+
+def writejobcfg(jobcfg,verb=0):
+  """Write job config to its JSON file."""
+  cfgname = jobcfg['cfgname']
+  if verb>=1:
+    print(">>> Creating config file '%s'..."%(cfgname))
+  if cfgname.endswith(".json.gz"):
+    with gzip.open(cfgname,'wt') as file:
+      json.dump(jobcfg,file,indent=2)
+  else:
+    with open(cfgname,'w') as file:
+      json.dump(jobcfg,file,indent=2)
+  
+
+def submitbulk(batch,jobcfgs,verb=0,**kwargs):
+  """Submit the jobs of several samples as one HTCondor cluster per queue (job flavor),
+  and store the range of process IDs of each sample in the shared cluster in its job config."""
+  queues = OrderedDict()
+  for jobcfg in jobcfgs:
+    queues.setdefault(jobcfg['queue'],[ ]).append(jobcfg)
+  for queue, jobcfgs_ in queues.items():
+    items  = [ ] # (initdir, logname, ncpus, arg) per job
+    ranges = [ ] # (first, last) process ID per sample
+    for jobcfg in jobcfgs_:
+      with open(jobcfg['joblist'],'r') as file:
+        jobargs = [l.strip() for l in file if l.strip()]
+      workers = jobcfg.get('workers',1) or 1 # request one core per worker process
+      ranges.append((len(items),len(items)+len(jobargs)-1))
+      items.extend((jobcfg['jobdir'],jobcfg['jobname'],workers,a) for a in jobargs)
+    bulkdir  = os.path.commonpath([c['cfgdir'] for c in jobcfgs_])
+    itemfile = os.path.join(bulkdir,"bulk_%s.txt"%(datetime.now().strftime("%Y%m%d_%H%M%S")))
+    name     = "bulk_%dsamples"%(len(jobcfgs_))
+    print(">>> Submitting %d jobs of %d samples as one cluster%s..."%(len(items),len(jobcfgs_)," to queue %r"%(queue) if queue else ""))
+    jobid    = batch.submitbulk(items,itemfile=itemfile,name=name,queue=queue,**kwargs)
+    if jobid==None:
+      continue
+    for jobcfg, (first, last) in zip(jobcfgs_,ranges):
+      jobcfg['jobids'].append(jobid)
+      jobcfg['procranges'][str(jobid)] = [first,last]
+      writejobcfg(jobcfg,verb=verb)
+    batch.clearqueue(verb=verb) # queried queue does not have the new jobs
   
 
 
@@ -860,6 +996,7 @@ def main_status(args):
   tag            = args.tag
   checkdas       = args.checkdas     # check number of events from DAS
   checkqueue     = args.checkqueue   # check queue of batch system for pending jobs
+  queuecache     = args.queuecache   # reuse queue from previous call if younger than this (in seconds)
   checkevts      = args.checkevts    # validate output file & count events (slow, default)
   checkexpevts   = args.checkexpevts # compare actual to expected number of processed events
   dtypes         = args.dtypes       # filter (only include) these sample types ('data','mc','embed')
@@ -882,7 +1019,6 @@ def main_status(args):
   outdirformat   = CONFIG.outdir
   jobdirformat   = CONFIG.jobdir
   storedirformat = CONFIG.picodir
-  jobs           = None
   if subcmd not in ['hadd','clean','haddclean']:
     if not channels:
       channels = ['*']
@@ -930,11 +1066,6 @@ def main_status(args):
         for path in sample.paths:
           print(">>> %s"%(bold(path)))
         
-        # CHECK JOBS ONLY ONCE
-        if checkqueue==1 and jobs!=None:
-          batch = getbatch(CONFIG,verb=verbosity)
-          jobs  = batch.jobs(verb=verbosity-1)
-        
         # HADD or CLEAN
         if subcmd in ['hadd','haddclean','clean']:
           cfgname  = sample.jobcfg['config'] # config file
@@ -943,12 +1074,11 @@ def main_status(args):
           logdir   = sample.jobcfg['logdir'] # job log directory
           outdir   = sample.jobcfg['outdir'] # job output directory
           postfix  = sample.jobcfg['postfix']
-          storedir = repkey(storedirformat,ERA=era,CHANNEL=channel_,TAG=tag,SAMPLE=sample.name,
-                                           DAS=sample.paths[0].strip('/'),GROUP=sample.group)
-          storage  = getstorage(storedir,ensure=True,haddcmd=haddcmd,verb=verbosity)
-          outfile  = "%s_%s%s.root"%(sample.name,channel_,tag)
-          infiles  = os.path.join(outdir,"*%s_[0-9]*.root"%(postfix))
+          subchans = sample.jobcfg.get('channels',[channel_]) # group of channels run in the same job
+          postfixs = sample.jobcfg.get('postfixes',[postfix]) # one output file per channel in the group
+          infiles  = [os.path.join(outdir,"*%s_[0-9]*.root"%(p)) for p in postfixs]
           cfgfiles = os.path.join(cfgdir,"job*%s_try[0-9]*.*"%(postfix))
+          statefile = getstatename(cfgname,postfix) # incremental state of checkchunks
           logfiles = os.path.join(logdir,"*%s*.*.log"%(postfix))
           if verbosity>=1:
             print(">>> %sing job output for '%s'"%(subcmd.capitalize(),sample.name))
@@ -956,19 +1086,24 @@ def main_status(args):
             print(">>> %-12s = %r"%('jobdir',jobdir))
             print(">>> %-12s = %r"%('cfgdir',cfgdir))
             print(">>> %-12s = %r"%('outdir',outdir))
-            print(">>> %-12s = %r"%('storedir',storedir))
             print(">>> %-12s = %s"%('infiles',infiles))
-            if subcmd in ['hadd','haddclean']:
-              print(">>> %-12s = %r"%('outfile',outfile))
-          resubfiles, chunkdict, npend = checkchunks(sample,channel=channel_,tag=tag,jobs=jobs,checkqueue=checkqueue,checkevts=checkevts,
-                                                     das=checkdas,checkexpevts=checkexpevts,ncores=ncores,verb=verbosity)
+          resubfiles, chunkdict, npend = checkchunks(sample,era=era,channel=channel_,tag=tag,checkqueue=checkqueue,queuecache=queuecache,checkevts=checkevts,
+                                                     das=checkdas,checkexpevts=checkexpevts,force=force,ncores=ncores,verb=verbosity)
           if (len(resubfiles)>0 or npend>0) and not force: # only clean or hadd if all jobs were successful
             LOG.warn("Cannot %s job output because %d chunks need to be resubmitted..."%(subcmd,len(resubfiles))+
                      " Please use -f or --force to %s anyway.\n"%(subcmd))
             continue
           
           if subcmd in ['hadd','haddclean']:
-            haddout = storage.hadd(infiles,outfile,dry=dryrun,verb=cmdverb,maxopenfiles=maxopenfiles)
+            for subchannel, infiles_ in zip(subchans,infiles): # one hadd per channel in the group
+              storedir = repkey(storedirformat,ERA=era,CHANNEL=subchannel,TAG=tag,SAMPLE=sample.name,
+                                               DAS=sample.paths[0].strip('/'),GROUP=sample.group)
+              storage  = getstorage(storedir,ensure=True,haddcmd=haddcmd,verb=verbosity)
+              outfile  = "%s_%s%s.root"%(sample.name,subchannel,tag)
+              if verbosity>=1:
+                print(">>> %-12s = %r"%('storedir',storedir))
+                print(">>> %-12s = %r"%('outfile',outfile))
+              haddout = storage.hadd(infiles_,outfile,dry=dryrun,verb=cmdverb,maxopenfiles=maxopenfiles)
             # TODO: add option to print out cutflow for outfile
           
           # CLEAN UP
@@ -980,11 +1115,12 @@ def main_status(args):
               if verbosity>=2:
                 print(">>> %-12s = %s"%('cfgfiles',cfgfiles))
               rmcmds.append("rm -r %s"%(jobdir)) # remove whole job directory
-              if outdir!=jobdir and len(glob.glob(infiles))>=len(glob.glob(os.path.join(outdir,"*.root"))): # check for other jobs in same directory
+              noutfiles = sum(len(glob.glob(f)) for f in infiles)
+              if outdir!=jobdir and noutfiles>=len(glob.glob(os.path.join(outdir,"*.root"))): # check for other jobs in same directory
                 rmcmds.append("rm -r %s"%(outdir)) # remove whole output directory with ROOT output files
             else: # only remove files related to this job (era/channel/sample)
               rmfiles   = [ ]
-              rmfileset = [infiles,cfgfiles,logfiles]
+              rmfileset = infiles+[cfgfiles,statefile,logfiles]
               for files in rmfileset:
                 if len(glob.glob(files))>0:
                   rmfiles.append(files)
@@ -1011,8 +1147,20 @@ def main_status(args):
             print(">>> %-12s = %r"%('jobdir',jobdir))
             print(">>> %-12s = %r"%('outdir',outdir))
             print(">>> %-12s = %r"%('logdir',logdir))
-          checkchunks(sample,channel=channel_,tag=tag,jobs=jobs,showlogs=showlogs,checkqueue=checkqueue,
-                      checkevts=checkevts,das=checkdas,ncores=ncores,verb=verbosity)
+          checkchunks(sample,era=era,channel=channel_,tag=tag,showlogs=showlogs,checkqueue=checkqueue,queuecache=queuecache,
+                      checkevts=checkevts,das=checkdas,force=force,ncores=ncores,verb=verbosity)
+          if getattr(args,'profile',False): # aggregate timing profiles of job output (see analysis/Profiler.py)
+            from TauFW.PicoProducer.analysis.Profiler import readprofile, getsummary
+            postfix  = sample.jobcfg['postfix']
+            subchans = sample.jobcfg.get('channels',[channel_]) # group of channels run in the same job
+            postfixs = sample.jobcfg.get('postfixes',[postfix]) # one output file per channel in the group
+            for subchannel, postfix_ in zip(subchans,postfixs):
+              fnames = sorted(glob.glob(os.path.join(outdir,"*%s_[0-9]*.root"%(postfix_))),key=alphanum_key)
+              stages, nfound = readprofile(fnames,verb=verbosity)
+              if stages:
+                print(getsummary(stages,title="Profile of %d/%d jobs for %s, %s:"%(nfound,len(fnames),sample.name,subchannel)))
+              else:
+                print(">>> No profiles found in %d output files of %s, %s..."%(len(fnames),sample.name,subchannel))
         
         print('')
       
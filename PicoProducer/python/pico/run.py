@@ -26,6 +26,9 @@ def main_run(args):
   dasvetoes  = args.dasvetoes  # exclude these DAS paths (glob patterns)
   extraopts  = args.extraopts  # extra options for module (for all runs)
   prefetch   = args.prefetch   # copy input file first to local output directory
+  userdf     = args.rdf        # run histogram-only modules with RDataFrame (number of threads)
+  learn      = args.learn      # learn keep/drop file of branches read by module (number of events)
+  workers    = args.workers    # number of worker processes to split files or events over
   maxevts    = args.maxevts    # maximum number of files (per sample, era, channel)
   dasfiles   = args.dasfiles   # explicitly process nanoAOD files stored on DAS (as opposed to local storage)
   userfiles  = args.infiles    # use these input files
@@ -63,6 +66,9 @@ def main_run(args):
         print(">>> %-12s = %r"%('procopts',procopts))
         print(">>> %-12s = %r"%('extrachopts',extrachopts))
         print(">>> %-12s = %r"%('prefetch',prefetch))
+        print(">>> %-12s = %r"%('rdf',userdf))
+        print(">>> %-12s = %r"%('learn',learn))
+        print(">>> %-12s = %r"%('workers',workers))
         print(">>> %-12s = %r"%('preselect',preselect))
         print(">>> %-12s = %s"%('filters',filters))
         print(">>> %-12s = %s"%('vetoes',vetoes))
@@ -159,6 +165,12 @@ def main_run(args):
           runcmd += " -i %s"%(' '.join(infiles))
         if prefetch:
           runcmd += " -p"
+        if userdf!=None and not skim:
+          runcmd += " --rdf %d"%(userdf)
+        if learn!=None and not skim:
+          runcmd += " --learn %d"%(learn)
+        if workers>1 and not skim:
+          runcmd += " --workers %d"%(workers)
         if extraopts_:
           runcmd += " --opt '%s'"%("' '".join(extraopts_))
         #elif nfiles:
@@ -181,7 +193,16 @@ def getmodule(channel,extraopts):
   module      = CONFIG.channels[channel]
   procopts    = "" # extra options for processor
   extrachopts = extraopts[:] # extra options for module (per channel)
-  if 'skim' in channel.lower():
+  if ',' in module: # group of channels: run modules in one job on the same events
+    processor = "picojob.py"
+    modules   = [ ]
+    for subchannel in GLOB.getchannels(channel,CONFIG):
+      parts   = CONFIG.channels[subchannel].split(' ') # "MODULE [KEY=VALUE ...]"
+      ensuremodule(parts[0]) # sanity check
+      modules.append(parts[0])
+      extrachopts.extend("%s:%s"%(subchannel,o) for o in parts[1:]) # only for this channel's module
+    module    = ','.join(modules)
+  elif 'skim' in channel.lower():
     parts     = module.split(' ') # "PROCESSOR [--FLAG[=VALUE] ...]"
     processor = parts[0]
     procopts  = ' '.join(parts[1:])
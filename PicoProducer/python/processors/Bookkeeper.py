@@ -1,10 +1,13 @@
 # Author: Izaak Neutelings (July 2022)
 # Description: Keep track of number of events and sum of weights before and after skimming
+#              The sums of weights of the input tree are computed in one RDataFrame pass per file.
 from __future__ import print_function # for python3 compatibility
 import time
 import ROOT
-from ROOT import TH1D
+from ROOT import TH1D, RDataFrame
 from PhysicsTools.NanoAODTools.postprocessing.framework.eventloop import Module
+from TauFW.PicoProducer.analysis.columnar import SingleThread, entrylistfilter
+sumweights = ['LHEScaleWeight','LHEPdfWeight','PSWeight'] # arrays of weights to sum per index before any selections
 
 
 def printCutflow(cutflow):
@@ -18,6 +21,10 @@ def printCutflow(cutflow):
     'read_wgt': "read sum of weights",
     'skim_wgt': "pre-skimmed sum of weights",
     'pass_wgt': "passed events sum of weights",
+    'full_wgt2': "all sum of weights squared in the input tree",
+    'read_wgt2': "read sum of weights squared",
+    'skim_wgt2': "pre-skimmed sum of weights squared",
+    'pass_wgt2': "passed events sum of weights squared",
   }
   den1 = cutflow.GetBinContent(1)
   den2 = cutflow.GetBinContent(2)
@@ -25,8 +32,8 @@ def printCutflow(cutflow):
   for i in range(1,cutflow.GetXaxis().GetNbins()+1):
     label = cutflow.GetXaxis().GetBinLabel(i)
     num   = cutflow.GetBinContent(i)
-    den1  = num if i in [5] else den1
-    den2  = num if i in [6] else den2
+    den1  = num if i in [5,9] else den1
+    den2  = num if i in [6,10] else den2
     frac1 = "" if den1==0 else "%.2f%%"%(100.0*num/den1)
     frac2 = "" if den2==0 or num>den2 else "%.2f%%"%(100.0*num/den2)
     if label:
@@ -34,11 +41,29 @@ def printCutflow(cutflow):
       print(">>> %13.1f %8s %8s  %s"%(num,frac1,frac2,title))
   
 
+def booksumws(rdframe, tree, weights=sumweights):
+  """Book the sums of arrays of weights (times genWeight) per index lazily on a RDataFrame of the input tree,
+  as histograms named 'sumw_<weight>'. Arrays that are not in the tree are skipped."""
+  hists = [ ]
+  for wname in weights:
+    nleaf = tree.GetLeaf('n'+wname)
+    if not nleaf: continue
+    nmax = max(1,nleaf.GetMaximum()) # maximum array length stored in the file
+    name = 'sumw_'+wname
+    idx  = 'sumw_idx_'+wname
+    wgt  = 'sumw_wgt_'+wname
+    rdf  = rdframe.Define(idx,"ROOT::RVec<int> i(%s.size()); for(size_t j=0; j<i.size(); ++j) i[j]=j; return i;"%(wname))
+    rdf  = rdf.Define(wgt,"ROOT::RVec<double> w(%s.begin(),%s.end()); return w*genWeight;"%(wname,wname))
+    hists.append(rdf.Histo1D((name,"Sum of genWeight*%s;%s index;Sum of weights"%(wname,wname),nmax,0,nmax),idx,wgt))
+  return hists
+  
+
 class Bookkeeper(Module):
   
-  def __init__(self,verb=0):
-    # TODO: add histogram with sum of PDF and scale weights before any selections
+  def __init__(self,verb=0,weights=sumweights):
     self.verb = verb # verbosity level
+    self.weights = weights # arrays of weights to sum (times genWeight) per index before any selections
+    self.sumws = { } # total sum of weights per index (all files)
     if self.verb>=3:
       print(">>> Bookkeeper.__init__")
     self.cutflow = TH1D('cutflow_tot','cutflow',12,0,12) # total cutflow (all files)
@@ -51,6 +76,10 @@ class Bookkeeper(Module):
     self.bin_read_wgt = 6
     self.bin_skim_wgt = 7
     self.bin_pass_wgt = 8
+    self.bin_full_wgt2 = 9
+    self.bin_read_wgt2 = 10
+    self.bin_skim_wgt2 = 11
+    self.bin_pass_wgt2 = 12
     self.cutflow.GetXaxis().SetBinLabel(self.bin_full,'full') # all events in input tree before any cuts
     self.cutflow.GetXaxis().SetBinLabel(self.bin_read,'read') # after firstEntry, maxEvents
     self.cutflow.GetXaxis().SetBinLabel(self.bin_skim,'skim') # after pre-skimming (pre-selection cut, JSON)
@@ -59,6 +88,10 @@ class Bookkeeper(Module):
     self.cutflow.GetXaxis().SetBinLabel(self.bin_read_wgt,'read_wgt')
     self.cutflow.GetXaxis().SetBinLabel(self.bin_skim_wgt,'skim_wgt')
     self.cutflow.GetXaxis().SetBinLabel(self.bin_pass_wgt,'pass_wgt')
+    self.cutflow.GetXaxis().SetBinLabel(self.bin_full_wgt2,'full_wgt2')
+    self.cutflow.GetXaxis().SetBinLabel(self.bin_read_wgt2,'read_wgt2')
+    self.cutflow.GetXaxis().SetBinLabel(self.bin_skim_wgt2,'skim_wgt2')
+    self.cutflow.GetXaxis().SetBinLabel(self.bin_pass_wgt2,'pass_wgt2')
   
   ###def beginJob(self):
   ###  """Prepare output analysis tree and cutflow histogram."""
@@ -102,24 +135,30 @@ class Bookkeeper(Module):
     cutflow.SetBinContent(self.bin_pass,cutflow.GetBinContent(self.bin_pass)+outputTree.GetEntries())
     
     # WEIGHTED
+    sumws = [ ]
     if hasattr(inputTree,'genWeight'): # for (NLO) MC
       if self.verb>=2:
         print(">>> Bookkeeper.endFile: Getting sum of weights...")
-      #cutflow.SetBinContent(self.bin_read_wgt,inputTree.GetEntries('genWeight')+cutflow.GetBinContent(self.bin_read_wgt))
-      inputTree.Draw("%s >> +cutflow"%(self.bin_full_wgt-0.5),'genWeight','gOff')
-      inputTree.Draw("%s >> +cutflow"%(self.bin_read_wgt-0.5),'genWeight','gOff',maxEntries,firstEntry)
-      if elist: # entry list after pre-skimming (firstEntry, maxEntries, pre-selection, JSON)
-        inputTree.SetEntryList(elist)
-        inputTree.Draw("%s >> +cutflow"%(self.bin_skim_wgt-0.5),'genWeight','gOff')
-      else: # no pre-selection or JSON
-        cutflow.SetBinContent(self.bin_skim_wgt,cutflow.GetBinContent(self.bin_read_wgt)) # reuse read sum of weights 
-    if hasattr(outputTree,'genWeight'):
+      sums, sumws = self.getsums(inputTree,firstEntry,firstEntry+nread,elist)
+      for bin, value in sums.items():
+        cutflow.SetBinContent(bin,cutflow.GetBinContent(bin)+value)
+    if hasattr(outputTree,'genWeight'): # small tree: only passed events
       outputTree.Draw("%s >> +cutflow"%(self.bin_pass_wgt-0.5),'genWeight','gOff')
+      outputTree.Draw("%s >> +cutflow"%(self.bin_pass_wgt2-0.5),'genWeight*genWeight','gOff')
     
     # WRITE
     self.cutflow.Add(cutflow) # add to total cutflow for final report
     outputFile.cutflow.SetDirectory(outputFile)
     cutflow.Write('cutflow',TH1D.kOverwrite)
+    for hist in sumws: # sum of weights per index
+      name = hist.GetName()
+      if name in self.sumws:
+        self.sumws[name].Add(hist)
+      else:
+        self.sumws[name] = hist.Clone(name+'_tot')
+        self.sumws[name].SetDirectory(0)
+      hist.SetDirectory(outputFile)
+      hist.Write(name,TH1D.kOverwrite)
     if self.verb>=2:
       print(">>> Bookkeeper.endFile: Cutflow for this file:")
       printCutflow(cutflow)
@@ -128,6 +167,37 @@ class Bookkeeper(Module):
       print(">>> Bookkeeper.endFile: Intermediate total cutflow:")
       printCutflow(cutflow)
   
+  def getsums(self, tree, start, end, elist=None):
+    """Compute the sums of genWeight and genWeight^2 for all events, the read range [start,end), and
+    the pre-skimmed entries in the entry list, as well as the sums of arrays of weights per index,
+    booked lazily in a single RDataFrame event loop over the input tree, instead of several TTree::Draw calls.
+    Return dictionary of cutflow bin -> sum, and list of histograms of the sums of weights per index."""
+    oldlist = tree.GetEntryList()
+    if oldlist: # make sure RDataFrame runs over all entries
+      tree.SetEntryList(0)
+    with SingleThread(): # rdfentry_ is the tree entry and TEntryList::Contains is not thread-safe
+      rdframe = RDataFrame(tree).Define('genWeight2',"double(genWeight)*genWeight")
+      rdread  = rdframe.Filter("rdfentry_>=%d && rdfentry_<%d"%(start,end),'read')
+      if elist: # entry list after pre-skimming (firstEntry, maxEntries, pre-selection, JSON)
+        rdskim = rdread.Filter(entrylistfilter(elist),['rdfentry_'],'skim')
+      else: # no pre-selection or JSON
+        rdskim = None
+      results = { }
+      for bin, rdf, var in [(self.bin_full_wgt, rdframe,'genWeight'), (self.bin_full_wgt2,rdframe,'genWeight2'),
+                            (self.bin_read_wgt, rdread, 'genWeight'), (self.bin_read_wgt2,rdread, 'genWeight2'),
+                            (self.bin_skim_wgt, rdskim, 'genWeight'), (self.bin_skim_wgt2,rdskim, 'genWeight2')]:
+        if rdf is not None:
+          results[bin] = rdf.Sum(var) # jitted sums are double, also for Float_t genWeight
+      hists = booksumws(rdframe,tree,self.weights)
+      sums = { b: r.GetValue() for b, r in results.items() } # trigger event loop
+      hists = [h.GetValue().Clone() for h in hists] # detach from RDataFrame result
+    if not rdskim:
+      sums[self.bin_skim_wgt]  = sums[self.bin_read_wgt] # reuse read sum of weights
+      sums[self.bin_skim_wgt2] = sums[self.bin_read_wgt2]
+    if oldlist:
+      tree.SetEntryList(oldlist)
+    return sums, hists
+  
   def endJob(self):
     """Wrap up after running on all events and files"""
     if self.verb>=2:
@@ -135,6 +205,9 @@ class Bookkeeper(Module):
     if self.verb>=1:
       print(">>> Bookkeeper.endFile: Final total cutflow:")
       printCutflow(self.cutflow)
+    if self.verb>=2:
+      for name, hist in self.sumws.items():
+        print(">>> Bookkeeper.endJob: %s = %s"%(name,[hist.GetBinContent(i) for i in range(1,hist.GetXaxis().GetNbins()+1)]))
   
   def analyze(self, event):
     """Process and pre-select events; fill branches and return True if the events passes, return False otherwise."""
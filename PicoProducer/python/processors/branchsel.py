@@ -0,0 +1,86 @@
+# Description: Derive a minimal keep/drop file of nanoAOD branches for a module by recording all branches
+#              that are read via nanoAOD-tools' InputTree.readBranch (incl. Event, Collection, Object, the proxies in
+#              analysis/objects.py, and branches redirected by analysis.utils.redirectbranch) in a short "learn" run.
+#              Later jobs pick up the learned file automatically, and enable any branch that is not listed
+#              lazily on first access as a safety fallback.
+# Usage:
+#   pico.py run -c mutau -y UL2018 -s DYJetsToLL_M-50 --learn # write data/branchsel/keep_and_drop_ModuleMuTau_UL2018_mc.txt
+#   pico.py submit -c mutau -y UL2018 # jobs use the learned keep/drop file
+import os
+from TauFW.PicoProducer import datadir
+alwayskeep = ['run','luminosityBlock','event'] # e.g. for JSON filter
+
+
+def getlearnedfile(modname, era, dtype):
+  """Get path to learned keep/drop file for a module (or list of modules in a channel group), era and data type."""
+  if isinstance(modname,(list,tuple)):
+    modname = '-'.join(modname)
+  return os.path.join(datadir,'branchsel',"keep_and_drop_%s_%s_%s.txt"%(modname,era,dtype))
+
+
+def recordbranches():
+  """Record the names of all branches read via InputTree.readBranch, i.e. via Event.__getattr__,
+  and via the properties of branches that are redirected with analysis.utils.redirectbranch.
+  Return the set of names, which is filled during the event loop."""
+  from PhysicsTools.NanoAODTools.postprocessing.framework import treeReaderArrayTools
+  accessed = set()
+  readBranch_ = treeReaderArrayTools.readBranch
+  def readBranch(tree, name):
+    value = readBranch_(tree,name) # only record if it exists
+    accessed.add(name)
+    return value
+  treeReaderArrayTools.readBranch = readBranch # bound to each tree in InputTree
+  return accessed
+
+
+def enablelazily():
+  """Enable disabled branches on first access via InputTree.readBranch (incl. redirected branches),
+  as a safety fallback for branches that are not in the (learned) keep/drop file.
+  Return the set of enabled branches."""
+  from PhysicsTools.NanoAODTools.postprocessing.framework import treeReaderArrayTools
+  enabled = set()
+  readBranch_ = treeReaderArrayTools.readBranch
+  def readBranch(tree, name):
+    checked = tree.__dict__.setdefault('_checkedbranches',set()) # only check once per tree
+    if name not in checked:
+      checked.add(name)
+      if tree.GetBranch(name) and not tree.GetBranchStatus(name):
+        if name not in enabled:
+          print(">>> enablelazily: Warning! Branch %r is not in the keep/drop file, enabling it..."%(name))
+        tree.SetBranchStatus(name,1)
+        leaf = tree.GetLeaf(name)
+        if leaf and leaf.GetLeafCount(): # counter of array branch
+          tree.SetBranchStatus(leaf.GetLeafCount().GetName(),1)
+        enabled.add(name)
+    return readBranch_(tree,name)
+  treeReaderArrayTools.readBranch = readBranch # bound to each tree in InputTree
+  return enabled
+
+
+def writebranchsel(fname, branches, infile=None, treename='Events', verb=0):
+  """Write keep/drop file that drops all branches except the given ones.
+  The counters of array branches are kept as well, using the tree in an input file."""
+  from ROOT import TFile
+  branches = set(branches)|set(alwayskeep)
+  if infile: # add counters, and ignore non-existing branches
+    file = TFile.Open(infile,'READ')
+    tree = file.Get(treename)
+    for name in list(branches):
+      leaf = tree.GetLeaf(name)
+      if not leaf:
+        branches.discard(name)
+      elif leaf.GetLeafCount():
+        branches.add(leaf.GetLeafCount().GetName())
+    file.Close()
+  outdir = os.path.dirname(fname)
+  if outdir and not os.path.exists(outdir):
+    os.makedirs(outdir)
+  with open(fname,'w') as file:
+    file.write("# Learned keep/drop file: branches read by the module (see processors/branchsel.py)\n")
+    file.write("drop *\n")
+    for name in sorted(branches):
+      file.write("keep %s\n"%(name))
+  print(">>> writebranchsel: Wrote %d branches to %s"%(len(branches),fname))
+  if verb>=1:
+    print(">>> writebranchsel: %s"%(', '.join(sorted(branches))))
+  return fname
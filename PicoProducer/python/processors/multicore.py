@@ -0,0 +1,110 @@
+# Description: Process the files or event range of a single pico job in several worker processes,
+#              each running picojob.py with its own module instance and partial output file,
+#              and merge the partial outputs (trees, cutflow and other histograms) into the expected output file.
+# Usage:
+#   python3 picojob.py -y UL2018 -c mutau -i file1.root file2.root file3.root --workers 3
+#   pico.py submit -c mutau -y UL2018 --workers 4 # request 4 cores per job
+from __future__ import print_function # for python3 compatibility
+import os, sys, time
+import subprocess
+
+
+def splitwork(infiles, nworkers, firstevt=0, maxevts=None, treename='Events'):
+  """Split the input files, or the event range of a single file, over several workers.
+  Return list of (files, firstevt, maxevts) per worker."""
+  if nworkers<=1:
+    return [(infiles,firstevt,maxevts)]
+  if len(infiles)>=2: # split files in contiguous, equally sized groups
+    nworkers = min(nworkers,len(infiles))
+    bounds   = [(i*len(infiles))//nworkers for i in range(nworkers+1)]
+    return [(infiles[bounds[i]:bounds[i+1]],firstevt,maxevts) for i in range(nworkers)]
+  from ROOT import TFile
+  file   = TFile.Open(infiles[0],'READ')
+  nevts  = file.Get(treename).GetEntries()
+  file.Close()
+  nevts  = max(0,nevts-firstevt)
+  if maxevts!=None and maxevts>0:
+    nevts = min(nevts,maxevts)
+  nworkers = max(1,min(nworkers,nevts))
+  bounds = [firstevt+(i*nevts)//nworkers for i in range(nworkers+1)]
+  return [(infiles,bounds[i],bounds[i+1]-bounds[i]) for i in range(nworkers)]
+
+
+def stripargs(argv, options):
+  """Remove options and their values from a list of command line arguments."""
+  newargv = [ ]
+  skip    = False
+  for arg in argv:
+    if arg in options:
+      skip = True
+      continue
+    if any(arg.startswith(o+'=') for o in options if o.startswith('--')):
+      skip = False
+      continue
+    if skip and (not arg.startswith('-') or arg.lstrip('-').isdigit()): # value(s) of removed option
+      continue
+    skip = False
+    newargv.append(arg)
+  return newargv
+
+
+def runworkers(script, argv, work, outdir, verb=0):
+  """Run a worker process per chunk of work with its own output directory, and wait for all to finish.
+  Return list of output directories, and list of failed workers."""
+  argv     = stripargs(argv,['-i','--infiles','-o','--outdir','-C','--copydir',
+                             '-s','--firstevt','-m','--maxevts','-n','--nfiles','-w','--workers'])
+  procs    = [ ]
+  partdirs = [ ]
+  start    = time.time()
+  for i, (files, firstevt, maxevts) in enumerate(work):
+    partdir = os.path.join(outdir,"part%d"%(i))
+    if not os.path.exists(partdir):
+      os.makedirs(partdir)
+    cmd = [sys.executable,script]+argv+['-o',partdir,'-s',str(firstevt),'-n',str(len(files))]
+    if maxevts!=None:
+      cmd += ['-m',str(maxevts)]
+    cmd += ['-i']+list(files) # add last
+    logname = os.path.join(partdir,"worker.log")
+    print(">>> Starting worker %d with %d file(s), firstevt=%s, maxevts=%s, log %s"%(i,len(files),firstevt,maxevts,logname))
+    if verb>=1:
+      print(">>>   %s"%(' '.join(cmd)))
+    log = open(logname,'w')
+    procs.append((subprocess.Popen(cmd,stdout=log,stderr=subprocess.STDOUT),log,logname))
+    partdirs.append(partdir)
+  failed = [ ]
+  for i, (proc, log, logname) in enumerate(procs):
+    proc.wait()
+    log.close()
+    if proc.returncode!=0:
+      print(">>> Warning! Worker %d failed with exit code %s! Last lines of %s:"%(i,proc.returncode,logname))
+      with open(logname) as file:
+        print(''.join(file.readlines()[-20:]))
+      failed.append(i)
+  print(">>> %d worker(s) finished after %.1f seconds"%(len(procs),time.time()-start))
+  return partdirs, failed
+
+
+def mergeoutput(outfnames, partdirs, haddcmd='hadd -f', clean=True, verb=0):
+  """Merge partial output files of the workers with the same basename as the expected output files."""
+  for outfname in outfnames:
+    partfiles = [os.path.join(d,os.path.basename(outfname)) for d in partdirs]
+    partfiles = [f for f in partfiles if os.path.isfile(f)]
+    if not partfiles:
+      raise IOError("No partial output files found for %s in %s!"%(outfname,partdirs))
+    cmd = "%s %s %s"%(haddcmd,outfname,' '.join(partfiles))
+    print(">>> Merging %d partial output files into %s..."%(len(partfiles),outfname))
+    if verb>=1:
+      print(">>>   %s"%(cmd))
+    out = subprocess.check_output(cmd,shell=True,stderr=subprocess.STDOUT)
+    if verb>=2:
+      print(out.decode('utf-8','replace'))
+    if clean:
+      for fname in partfiles:
+        os.remove(fname)
+  if clean:
+    for partdir in partdirs:
+      logname = os.path.join(partdir,"worker.log")
+      if os.path.isfile(logname):
+        os.remove(logname)
+      if os.path.isdir(partdir) and not os.listdir(partdir):
+        os.rmdir(partdir)
@@ -2,7 +2,7 @@
 # Author: Izaak Neutelings (May 2020)
 # Description: Skim nanoAOD file and store locally: pre-select events, filter branches, add jet/MET corrections, ...
 from __future__ import print_function
-import os, re
+import os, sys, re
 import time; time0 = time.time()
 import ROOT; ROOT.PyConfig.IgnoreCommandLineOptions = True
 from PhysicsTools.NanoAODTools.postprocessing.framework.postprocessor import PostProcessor
@@ -24,6 +24,14 @@ parser.add_argument('-M', '--module',   dest='module',    default=None)
 parser.add_argument('-c', '--channel',  dest='channel',   default=None)
 parser.add_argument('-E', '--opts',     dest='extraopts', default=[ ], nargs='+')
 parser.add_argument('-p', '--prefetch', dest='prefetch',  action='store_true')
+parser.add_argument('--budget',         dest='budget',    type=float, default=4000,
+                                        help="disk budget for prefetched input files in MB, default=%(default)s")
+parser.add_argument('-w', '--workers',  dest='workers',   type=int, default=1,
+                                        help="number of worker processes to split files or events over, and merge output")
+parser.add_argument('--learn',          dest='learn',     type=int, nargs='?', const=2000, default=None,
+                                        help="learn keep/drop file of branches read by the module in this number of events")
+parser.add_argument('--rdf',            dest='rdf',       type=int, nargs='?', const=0, default=None,
+                                        help="run histogram-only modules with a RDataFrame graph with this number of threads (0 = all cores)")
 parser.add_argument('-b', '--branchsel',dest='branchsel', default=None)
 parser.add_argument('-A', '--compress', dest='compress',  help="e.g. 'LZMA:9'")
 parser.add_argument('-v', '--verbose',  dest='verbosity', type=int, nargs='?', const=1, default=0)
@@ -34,17 +42,31 @@ args = parser.parse_args()
 era       = args.era      # e.g. '2017', 'UL2017', ...
 year      = getyear(era)  # integer year, e.g. 2017
 modname   = args.module   # main module to run
-channel   = args.channel  # channel
+channel   = args.channel  # channel, or group of channels, e.g. 'mutau,etau,tautau,mumu'
+channels  = [channel]     # channels to run in the same event loop, each with their own output file
+chopts    = { }           # extra options per channel
 if channel:
   import TauFW.PicoProducer.tools.config as GLOB
   CONFIG  = GLOB.getconfig(verb=0)
-  if not modname:
+  channels = GLOB.getchannels(channel,CONFIG)
+  if len(channels)>1: # run multiple modules on the same events
+    modnames = modname.split(',') if modname else [ ]
+    if not modnames:
+      for subchannel in channels:
+        assert subchannel in CONFIG.channels, "Did not find channel '%s' in configuration. Available channels: %s"%(subchannel,CONFIG.channels)
+        parts = CONFIG.channels[subchannel].split(' ') # "MODULE [KEY=VALUE ...]"
+        modnames.append(parts[0])
+        chopts[subchannel] = parts[1:]
+    assert len(modnames)==len(channels), "Number of modules (%r) does not match number of channels (%r)!"%(modname,channel)
+    modname = modnames
+  elif not modname:
     assert channel in CONFIG.channels, "Did not find channel '%s' in configuration. Available channels: %s"%(channel,CONFIG.channels)
     modname = CONFIG.channels[args.channel]
 else:
   if not modname:
     modname = "ModuleMuTauSimple"
   channel = modname
+  channels = [channel]
 dtype     = args.dtype             # data type ('data', 'mc', 'embed')
 outdir    = ensuredir(args.outdir) # directory to create output
 copydir   = args.copydir           # directory to copy output to at end
@@ -55,12 +77,21 @@ tag       = args.tag               # postfix tag of job output file
 if tag:
   tag     = ('' if tag.startswith('_') else '_') + tag
 outfname  = os.path.join(outdir,"pico%s.root"%(tag)) #channel,
+outfnames = [outfname]             # one output file per channel
+if len(channels)>1: # replace group in tag by channel, e.g. '_ltau_0' -> '_mutau_0'
+  chtag   = tag[len(channel)+1:] if tag.startswith('_'+channel) else tag # tag without group, e.g. '_0'
+  outfnames = [os.path.join(outdir,"pico_%s%s.root"%(c,chtag)) for c in channels]
 url       = "root://cms-xrd-global.cern.ch/"
 prefetch  = args.prefetch          # copy input file(s) to ouput directory first
+workers   = args.workers           # number of worker processes to split files or events over
+userdf    = args.rdf               # number of threads for RDataFrame instead of PostProcessor (None = PostProcessor)
 compress  = args.compress          # compression algorithm & level, e.g. 'LZMA:9'
 verbosity = args.verbosity         # verbosity level
 presel    = None                   # simple pre-selection string, e.g. "Muon_pt[0] > 50"
 branchsel = args.branchsel or None # file with branch selection (disable unneeded branches for faster processing)
+learn     = args.learn             # number of events to learn keep/drop file of branches read by module
+if learn!=None and (maxevts==None or maxevts<=0 or maxevts>learn):
+  maxevts = learn
 #branchsel = os.path.join(moddir,"keep_and_drop_skim.txt")
 json      = None                   # JSON file of certified events
 modules   = [ ]                    # list of modules to run
@@ -84,11 +115,17 @@ if dtype=='data':
 
 # EXTRA OPTIONS
 kwargs = { 'era': era, 'year': year, 'dtype': dtype, 'compress': compress, 'verb': verbosity }
-for option in args.extraopts:
+chkwargs = { c: { } for c in channels } # extra options for one channel in a group, given as 'CHANNEL:KEY=VALUE'
+for option in ["%s:%s"%(c,o) for c in channels for o in chopts.get(c,[ ])]+args.extraopts:
   #for option in options.strip().split(' '):
   assert '=' in option, "Extra option '%s' should contain '='! All: %s"%(option,args.extraopts)
   split       = option.split('=')
   key, val    = split[0], ''.join(split[1:])
+  if ':' in key: # channel-specific option
+    subchannel, key = key.split(':',1)
+    if subchannel in chkwargs:
+      chkwargs[subchannel][key] = convertstr(val)
+    continue
   kwargs[key] = convertstr(val) # convert to bool, float or int if possible
 
 # PRINT
@@ -99,40 +136,125 @@ print(">>> %-12s = %r"%('channel',channel))
 print(">>> %-12s = %r"%('modname',modname))
 print(">>> %-12s = %r"%('dtype',dtype))
 print(">>> %-12s = %r"%('kwargs',kwargs))
+if len(channels)>1:
+  print(">>> %-12s = %r"%('channels',channels))
+  print(">>> %-12s = %r"%('chkwargs',chkwargs))
 print(">>> %-12s = %s"%('firstevt',firstevt))
 print(">>> %-12s = %s"%('maxevts',maxevts))
 print(">>> %-12s = %r"%('outdir',outdir))
 print(">>> %-12s = %r"%('copydir',copydir))
 print(">>> %-12s = %s"%('infiles',infiles))
-print(">>> %-12s = %r"%('outfname',outfname))
+print(">>> %-12s = %r"%('outfname',outfname if len(channels)==1 else outfnames))
 print(">>> %-12s = %r"%('branchsel',branchsel))
 print(">>> %-12s = %r"%('json',json))
 print(">>> %-12s = %s"%('prefetch',prefetch))
+if prefetch:
+  print(">>> %-12s = %s MB"%('budget',args.budget))
+print(">>> %-12s = %r"%('rdf',userdf))
+print(">>> %-12s = %r"%('workers',workers))
 print(">>> %-12s = %s"%('cwd',os.getcwd()))
 print('-'*80)
 
+# COPY
+def copyoutput():
+  """Copy output files to copydir, if given."""
+  if copydir and outdir!=copydir:
+    print(">>> %-12s = %s"%('cwd',os.getcwd()))
+    print(">>> %-12s = %s"%('ls',os.listdir(outdir)))
+    from TauFW.PicoProducer.storage.utils import getstorage
+    from TauFW.common.tools.file import rmfile
+    store = getstorage(copydir,verb=2)
+    for outfname_ in outfnames:
+      store.cp(outfname_)
+      print(">>> Removing %r..."%(outfname_))
+      rmfile(outfname_)
+
+# MULTI-CORE: process subsets of files or events in worker processes, and merge their output
+if workers>1 and userdf==None and learn==None:
+  from TauFW.PicoProducer.processors.multicore import splitwork, runworkers, mergeoutput
+  work = splitwork(infiles,workers,firstevt,maxevts)
+  if len(work)>1:
+    partdirs, failed = runworkers(os.path.abspath(__file__),sys.argv[1:],work,outdir,verb=verbosity)
+    if failed:
+      print(">>> Warning! %d/%d workers failed, not merging output!"%(len(failed),len(work)))
+      exit(1)
+    mergeoutput(outfnames,partdirs,verb=verbosity)
+    copyoutput()
+    print(">>> picojob.py done after %.1f seconds"%(time.time()-time0))
+    exit(0)
+
 # GET MODULE
-module = getmodule(modname)(outfname,**kwargs)
-modules.append(module)
-if not branchsel and hasattr(module,'branchsel') and module.branchsel:
-  branchsel = module.branchsel # default keep/drop file for this module (if it exists)
-  print(">>> Using default branchsel=%r"%(branchsel))
+if len(channels)>1: # several modules on the same events; correction tools are shared (see ModuleTauPair)
+  from TauFW.PicoProducer.analysis.ModuleGroup import ModuleGroup
+  group = [ ]
+  for subchannel, modname_, outfname_ in zip(channels,modname,outfnames):
+    kwargs_ = kwargs.copy()
+    kwargs_.update(chkwargs[subchannel])
+    group.append(getmodule(modname_)(outfname_,**kwargs_))
+  modules.append(ModuleGroup(group,verb=verbosity)) # do not use default branchsel of a single module
+else:
+  module = getmodule(modname)(outfname,**kwargs)
+  modules.append(module)
+  if not branchsel and hasattr(module,'branchsel') and module.branchsel and learn==None:
+    branchsel = module.branchsel # default keep/drop file for this module (if it exists)
+    print(">>> Using default branchsel=%r"%(branchsel))
+
+# PRESELECTION: conservative cut of the module(s) to skip events before the Python event loop (option presel=True)
+premods = group if len(channels)>1 else modules
+if learn==None and all(getattr(m,'presel',False) and hasattr(m,'getpreselection') for m in premods):
+  cuts = [m.getpreselection(infiles) for m in premods] # check trigger paths in all files
+  if all(cuts): # OR of all channels in group
+    presel = cuts[0] if len(cuts)==1 else ' || '.join("(%s)"%(c) for c in cuts)
+    for module_ in premods:
+      module_.setpreselection(presel,firstevt,maxevts,json=json)
+    print(">>> Using preselection %r"%(presel))
+  else:
+    print(">>> Warning! No preselection available for %r, processing all events..."%(modname))
+
+# BRANCH SELECTION: learn or use minimal keep/drop file for this module, era and data type
+from TauFW.PicoProducer.processors.branchsel import getlearnedfile, recordbranches, enablelazily, writebranchsel
+learnfile = getlearnedfile(modname,era,dtype)
+enabled   = set() # branches enabled on first access
+if learn!=None: # record branches read by module
+  branchsel = None # enable all branches
+  accessed  = recordbranches()
+  print(">>> Learning branches read in %s events for %r..."%(maxevts,learnfile))
+elif not args.branchsel and os.path.isfile(learnfile):
+  branchsel = learnfile
+  enabled   = enablelazily() # safety fallback for branches that were not read in the learn run
+  print(">>> Using learned branchsel=%r"%(branchsel))
 
 # RUN
-p = PostProcessor(outdir,infiles,cut=None,branchsel=branchsel,firstEntry=firstevt,maxEntries=maxevts,
-                  jsonInput=json,modules=modules,noOut=True,prefetch=prefetch)
-p.run()
+if userdf!=None and (json or presel or learn!=None or not all(hasattr(m,'bookrdframe') for m in modules)):
+  print(">>> Warning! Cannot run %r with RDataFrame (JSON, preselection, learn mode, or module without bookrdframe), using PostProcessor..."%(modname))
+  userdf = None
+if userdf!=None: # histogram-only modules: accumulate in (multi-threaded) RDataFrame graph
+  from TauFW.PicoProducer.analysis.columnar import runrdframe
+  if prefetch:
+    print(">>> Warning! Prefetching is not supported with RDataFrame, reading input files remotely...")
+  for module in modules:
+    module.beginJob()
+  runrdframe(modules,infiles,firstEntry=firstevt,maxEntries=maxevts,nthreads=userdf,verb=verbosity+1)
+  for module in modules:
+    module.endJob()
+else:
+  p = PostProcessor(outdir,infiles,cut=presel,branchsel=branchsel,firstEntry=firstevt,maxEntries=maxevts,
+                    jsonInput=json,modules=modules,noOut=True,prefetch=prefetch)
+  if prefetch: # copy next input file in background while processing the current one
+    from TauFW.PicoProducer.processors.prefetcher import Prefetcher
+    with Prefetcher(infiles,outdir,budget=args.budget,verb=verbosity) as prefetcher:
+      prefetcher.attach(p)
+      p.run()
+  else:
+    p.run()
+if learn!=None:
+  writebranchsel(learnfile,accessed,infile=infiles[0],verb=verbosity)
+elif enabled:
+  print(">>> Warning! Enabled %d branches that were not in %s: %s. Please consider learning again with --learn."%(
+    len(enabled),learnfile,', '.join(sorted(enabled))))
 
 # COPY
-if copydir and outdir!=copydir:
-  print(">>> %-12s = %s"%('cwd',os.getcwd()))
-  print(">>> %-12s = %s"%('ls',os.listdir(outdir)))
-  from TauFW.PicoProducer.storage.utils import getstorage
-  from TauFW.common.tools.file import rmfile
-  store = getstorage(copydir,verb=2)
-  store.cp(outfname)
-  print(">>> Removing %r..."%(outfname))
-  rmfile(outfname)
+copyoutput()
 
 # DONE
 print(">>> picojob.py done after %.1f seconds"%(time.time()-time0))
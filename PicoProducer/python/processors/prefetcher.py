@@ -0,0 +1,148 @@
+# Description: Prefetch remote (XRootD) input files in a background thread, so that the next file is copied
+#              to local disk while the PostProcessor processes the current one. The total size of copied files
+#              that are not yet consumed is bounded by a disk budget, failed copies are retried with back-off
+#              and validated by size (and optionally checksum), and files are deleted as soon as they are processed.
+# Usage:
+#   prefetcher = Prefetcher(infiles,outdir,budget=4000)
+#   p = PostProcessor(outdir,infiles,...,prefetch=True)
+#   prefetcher.attach(p) # replace PostProcessor.prefetchFile
+#   p.run()
+#   prefetcher.close()
+from __future__ import print_function # for python3 compatibility
+import os, re, time
+import threading
+import subprocess
+urlexp = re.compile(r"^(root://[^/]+)/+(.+)$") # split XRootD URL in server and path
+
+
+def getremotesize(fname, timeout=120):
+  """Get size of remote file in bytes with xrdfs stat. Return None if unknown."""
+  match = urlexp.match(fname)
+  if not match:
+    return None
+  server, path = match.group(1), '/'+match.group(2).lstrip('/')
+  try:
+    out = subprocess.check_output(['xrdfs',server,'stat',path],stderr=subprocess.STDOUT,timeout=timeout)
+  except Exception:
+    return None
+  match = re.search(r"Size:\s*(\d+)",out.decode('utf-8','replace'))
+  return int(match.group(1)) if match else None
+
+
+class Prefetcher(object):
+  """Copy remote input files in order to a local directory in a background thread.
+  Local files are not copied. Files that cannot be copied are read remotely instead."""
+
+  def __init__(self, infiles, outdir='.', **kwargs):
+    self.infiles   = list(infiles)
+    self.tmpdir    = kwargs.get('tmpdir',   os.path.join(outdir,'prefetch')) # directory for local copies
+    self.budget    = kwargs.get('budget',   4000)*1024**2 # maximum size of local copies on disk at the same time (in MB)
+    self.ntries    = kwargs.get('ntries',   3    ) # number of attempts per file
+    self.backoff   = kwargs.get('backoff',  10.  ) # seconds to wait before second attempt, doubled for each next attempt
+    self.timeout   = kwargs.get('timeout',  3600 ) # timeout of single copy in seconds
+    self.checksum  = kwargs.get('checksum', None ) # checksum type for xrdcp to validate, e.g. 'adler32'
+    self.verbosity = kwargs.get('verb',     0    ) # verbosity level
+    self.local     = { } # remote file -> local copy (or None if copy failed)
+    self.sizes     = { } # local copy -> size in bytes
+    self.ready     = { f: threading.Event() for f in self.infiles }
+    self.stopped   = threading.Event()
+    self.thread    = threading.Thread(target=self._loop,name='Prefetcher')
+    self.thread.daemon = True # do not block exit
+    self.thread.start()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, type, value, traceback):
+    self.close()
+
+  def attach(self, processor):
+    """Replace the prefetchFile method of a nanoAOD-tools PostProcessor, which is called for each
+    input file if prefetch=True, and deletes the returned file after processing if the flag is True."""
+    processor.prefetch = True
+    processor.prefetchFile = self.get
+    return processor
+
+  def getlocalname(self, fname):
+    """Local path for a remote file. Keep the basename, as the PostProcessor uses it for the output file."""
+    return os.path.join(self.tmpdir,os.path.basename(fname))
+
+  def ondisk(self):
+    """Total size of copied files that are still on disk, i.e. not yet consumed and deleted."""
+    for fname in list(self.sizes):
+      if not os.path.exists(fname):
+        self.sizes.pop(fname)
+    return sum(self.sizes.values())
+
+  def _loop(self):
+    """Copy all remote files in order, waiting for the disk budget if needed."""
+    for fname in self.infiles:
+      if self.stopped.is_set():
+        break
+      if not fname.startswith('root://'): # already local
+        self.local[fname] = None
+      else:
+        size = getremotesize(fname)
+        while self.sizes and (size or 0)+self.ondisk()>self.budget: # always allow one file
+          if self.stopped.wait(1):
+            break
+        if not self.stopped.is_set():
+          self.local[fname] = self.copy(fname,size)
+      self.ready[fname].set()
+    for event in self.ready.values(): # do not block get after close
+      event.set()
+
+  def copy(self, fname, size=None):
+    """Copy a remote file with retries and exponential back-off. Return local path or None on failure."""
+    if not os.path.exists(self.tmpdir):
+      os.makedirs(self.tmpdir)
+    lname = self.getlocalname(fname)
+    cmd   = ['xrdcp','-f','-N']
+    if self.checksum:
+      cmd += ['--cksum',"%s:source"%(self.checksum)]
+    cmd  += [fname,lname]
+    for itry in range(1,self.ntries+1):
+      start = time.time()
+      try:
+        subprocess.check_output(cmd,stderr=subprocess.STDOUT,timeout=self.timeout)
+        lsize = os.path.getsize(lname)
+        if size!=None and lsize!=size:
+          raise IOError("Size of local copy (%d B) does not match remote size (%d B)"%(lsize,size))
+        self.sizes[lname] = lsize
+        print(">>> Prefetcher: Copied %s (%.1f MB) in %.1f seconds"%(fname,lsize/1024.**2,time.time()-start))
+        return lname
+      except Exception as err:
+        if isinstance(err,subprocess.CalledProcessError):
+          err = err.output.decode('utf-8','replace').strip() or err
+        print(">>> Prefetcher: Warning! Attempt %d/%d to copy %s failed: %s"%(itry,self.ntries,fname,err))
+        if os.path.exists(lname):
+          os.remove(lname)
+        if itry<self.ntries and self.stopped.wait(self.backoff*2**(itry-1)):
+          break
+    print(">>> Prefetcher: Warning! Could not copy %s, reading remotely..."%(fname))
+    return None
+
+  def get(self, fname, verbose=True):
+    """Wait for the local copy of a file. Return the file name to open,
+    and whether it should be deleted after processing (same as PostProcessor.prefetchFile)."""
+    if fname not in self.ready: # not known in advance
+      return fname, False
+    start = time.time()
+    self.ready[fname].wait()
+    lname = self.local.get(fname,None)
+    if verbose and lname and self.verbosity>=1:
+      print(">>> Prefetcher: Waited %.1f seconds for %s"%(time.time()-start,lname))
+    if lname and os.path.exists(lname):
+      return lname, True
+    return fname, False
+
+  def close(self):
+    """Stop copying and remove any local copies that were not consumed."""
+    self.stopped.set()
+    self.thread.join(5)
+    for lname in list(self.sizes):
+      if os.path.exists(lname):
+        if self.verbosity>=1:
+          print(">>> Prefetcher: Removing %s..."%(lname))
+        os.remove(lname)
+    self.sizes.clear()
@@ -0,0 +1,325 @@
+# Description: Skim nanoAOD files with a (multi-threaded) RDataFrame Filter + Snapshot instead of the PostProcessor:
+#              The pre-selection string (TTreeFormula syntax) is translated to a C++ expression, the keep/drop
+#              rules to a list of columns, and the JSON of certified data to a C++ function of (run,lumi).
+#              The output files have the same name and layout as the PostProcessor's (Events, Runs, LuminosityBlocks),
+#              with the same cutflow and sums of weights per index as the Bookkeeper (option cutflow=True).
+# Usage:
+#   python3 skimjob.py --engine rdf --nthreads 4 -y UL2018 -i nano.root --preselect "Max\$(Muon_pt)>20"
+#   pico.py channel skimrdf 'skimjob.py --engine rdf --nthreads 4'
+from __future__ import print_function # for python3 compatibility
+import os, re, time
+import json as jsonlib
+from fnmatch import fnmatch
+import ROOT
+from ROOT import gInterpreter, TFile, TH1D
+_declared = { } # cache of declared helpers and JSON filters
+copytrees = ['Runs','LuminosityBlocks','MetaData','ParameterSets'] # copied as a whole, like in the PostProcessor
+
+
+def declarehelpers():
+  """Compile helper functions for translated TTreeFormula expressions."""
+  if 'helpers' not in _declared:
+    _declared['helpers'] = gInterpreter.Declare("""
+      #include <cmath>
+      #include <limits>
+      #include <ROOT/RVec.hxx>
+      namespace rdfskim {
+        using ROOT::RVec;
+        template<typename T> double Max(const RVec<T>& v) { return v.empty() ? 0. : double(ROOT::VecOps::Max(v)); } // Max$
+        template<typename T> double Min(const RVec<T>& v) { return v.empty() ? 0. : double(ROOT::VecOps::Min(v)); } // Min$
+        template<typename T> double Sum(const RVec<T>& v) { return double(ROOT::VecOps::Sum(v)); } // Sum$
+        template<typename T> int Length(const RVec<T>& v) { return v.size(); } // Length$
+        template<typename T> double At(const RVec<T>& v, size_t i) { // out of range: NaN fails any comparison
+          return i<v.size() ? double(v[i]) : std::numeric_limits<double>::quiet_NaN();
+        }
+        inline bool Pass(bool x) { return x; }
+        template<typename T> bool Pass(const RVec<T>& v) { return ROOT::VecOps::Any(v); } // any instance passes
+      }
+    """)
+  return _declared['helpers']
+
+
+def splitcut(cut, ops=['&&','||']):
+  """Split expression at the given top-level operators. Return list of terms and operators."""
+  parts, depth, start, i = [ ], 0, 0, 0
+  while i<len(cut):
+    if cut[i]=='(':
+      depth += 1
+    elif cut[i]==')':
+      depth -= 1
+    elif depth==0 and cut[i:i+2] in ops:
+      parts += [cut[start:i].strip(),cut[i:i+2]]
+      start = i+2
+      i += 1
+    i += 1
+  parts.append(cut[start:].strip())
+  return parts
+
+
+def isenclosed(term):
+  """Check if the whole term is enclosed in parentheses, e.g. '(a || b)', but not '(a) || (b)'."""
+  if not term.startswith('('):
+    return False
+  depth = 0
+  for i, char in enumerate(term):
+    depth += (char=='(')-(char==')')
+    if depth==0:
+      return i==len(term)-1
+  return False
+
+
+def getcounters(term, arrays):
+  """Get the counters (collections) of array branches that are used element-wise in a term,
+  i.e. not reduced with Max$, Min$, Sum$, Length$, or an index."""
+  while True: # remove reductions
+    match = re.search(r"(?:Max|Min|Sum|Length)\$\(",term)
+    if not match: break
+    depth, end = 0, len(term)
+    for i in range(match.end()-1,len(term)):
+      depth += (term[i]=='(')-(term[i]==')')
+      if depth==0:
+        end = i+1
+        break
+    term = term[:match.start()]+'0'+term[end:]
+  term = re.sub(r"\b[A-Za-z_]\w*\[\d+\]",'0',term) # remove indexed arrays
+  return set(arrays[n] for n in re.findall(r"\b[A-Za-z_]\w*\b",term) if n in arrays)
+
+
+def translateexpr(expr):
+  """Translate a single TTreeFormula expression to C++."""
+  for func in ['Max','Min','Sum','Length']:
+    expr = expr.replace(func+'$(','rdfskim::%s('%(func))
+  expr = re.sub(r"\b([A-Za-z_]\w*)\[(\d+)\]",r"rdfskim::At(\1,\2)",expr) # safe index
+  expr = re.sub(r"(?<![\w:.])(abs|fabs)\(",r"std::abs(",expr)
+  return expr
+
+
+def translatecut(cut, arrays={ }):
+  """Translate a pre-selection string in TTreeFormula syntax to a C++ expression for RDataFrame.Filter.
+  Cuts on arrays of one collection (e.g. 'Muon_pt>20 && Muon_eta<2.4') pass if any instance passes, like in TTree::Draw.
+  Cuts on several collections (arrays = { branch: counter }) are split at the || and && operators, and the terms
+  of a conjunction are grouped per collection, so that collections are never combined element-wise, while terms
+  of the same collection keep TTreeFormula's same-index semantics, e.g. 'Muon_pt>28 && Tau_pt>18 && Muon_mediumId'
+  becomes Any(Muon_pt>28 && Muon_mediumId) && Any(Tau_pt>18), which is at least as loose as TTreeFormula's loop
+  over the smallest collection. Raise ValueError for terms that cannot be split without loosening the cut on a
+  collection, e.g. 'Muon_pt+Tau_pt>50' or 'Muon_pt>28 && (Muon_eta<2.1 || Tau_pt>30)';
+  please use Max$, Min$, Sum$ and Length$ instead."""
+  cut = cut.replace('\\$','$').strip()
+  if len(getcounters(cut,arrays))<=1: # element-wise on one collection, or scalars only
+    return "rdfskim::Pass(%s)"%(translateexpr(cut))
+  parts = splitcut(cut,['||'])
+  if len(parts)>1: # any instance passes any term: Any(a || b) = Any(a) || Any(b)
+    return ' || '.join(translatecut(p,arrays) for p in parts[::2])
+  parts = splitcut(cut,['&&'])
+  if len(parts)>1: # group terms per collection
+    groups = [ ] # list of (counters, terms)
+    for term in parts[::2]:
+      counters = getcounters(term,arrays)
+      for counters_, terms in groups:
+        if len(counters)==1 and counters==counters_:
+          terms.append(term)
+          break
+        elif counters & counters_: # shared collection in terms that cannot be grouped
+          raise ValueError("translatecut: Cannot translate %r, which combines arrays of %s element-wise with other collections! "
+                           "Please use Max$, Min$, Sum$ or Length$."%(cut,', '.join(sorted(counters & counters_))))
+      else:
+        groups.append((counters,[term]))
+    return ' && '.join(translatecut(' && '.join(t),arrays) for c, t in groups)
+  if isenclosed(cut):
+    return "(%s)"%(translatecut(cut[1:-1],arrays))
+  raise ValueError("translatecut: Cannot translate %r, which combines arrays of different collections (%s) element-wise! "
+                   "Please use Max$, Min$, Sum$ or Length$, or separate terms with && or ||."%(cut,', '.join(sorted(getcounters(cut,arrays)))))
+
+
+def getarrays(tree):
+  """Get dictionary of array branches with their counter, e.g. { 'Muon_pt': 'nMuon' }."""
+  return { l.GetName(): l.GetLeafCount().GetName() for l in tree.GetListOfLeaves() if l.GetLeafCount() }
+
+
+def cancut(cut, fname, treename='Events'):
+  """Check if a cut can be translated for the branches in a file."""
+  file = TFile.Open(fname,'READ')
+  arrays = getarrays(file.Get(treename))
+  file.Close()
+  try:
+    translatecut(cut,arrays)
+  except ValueError as err:
+    print(">>> rdfskim: %s"%(err))
+    return False
+  return True
+
+
+def declarejson(fname):
+  """Compile a function that checks if (run,lumi) is in the JSON of certified data. Return its name."""
+  if fname not in _declared:
+    with open(fname) as file:
+      runs = jsonlib.load(file)
+    name  = "rdfskim::InJSON%d"%(len(_declared))
+    items = ','.join("{%s,{%s}}"%(run,','.join("{%d,%d}"%(l1,l2) for l1, l2 in lumis)) for run, lumis in runs.items())
+    gInterpreter.Declare("""
+      #include <map>
+      #include <vector>
+      namespace rdfskim {
+        bool %s(UInt_t run, UInt_t lumi) {
+          static const std::map<UInt_t,std::vector<std::pair<UInt_t,UInt_t>>> runs = { %s };
+          auto it = runs.find(run);
+          if(it==runs.end()) return false;
+          for(const auto& range: it->second)
+            if(range.first<=lumi && lumi<=range.second) return true;
+          return false;
+        }
+      }
+    """%(name.split('::')[1],items))
+    _declared[fname] = name
+  return _declared[fname]
+
+
+def getbranchsel(tree, branchsel):
+  """Get list of branches to keep after applying the keep/drop rules of a file
+  (keep/drop with wildcards, keepmatch/dropmatch with regular expressions), like nanoAOD-tools' BranchSelection.
+  The counters of kept array branches are kept as well."""
+  names = [b.GetName() for b in tree.GetListOfBranches()]
+  keep  = { n: True for n in names }
+  if branchsel:
+    with open(branchsel) as file:
+      for line in file:
+        line = line.split('#')[0].strip()
+        if not line: continue
+        op, sel = line.split()
+        if op in ['keep','drop']:
+          match = lambda n: fnmatch(n,sel)
+        elif op in ['keepmatch','dropmatch']:
+          regexp = re.compile("(:?%s)$"%(sel))
+          match = lambda n: bool(regexp.match(n))
+        else:
+          raise IOError("Unknown operation %r in %s! Use keep, drop, keepmatch or dropmatch."%(op,branchsel))
+        for name in names:
+          if match(name):
+            keep[name] = op.startswith('keep')
+  columns = [n for n in names if keep[n]]
+  for name in columns[:]:
+    leaf = tree.GetLeaf(name)
+    if leaf and leaf.GetLeafCount() and leaf.GetLeafCount().GetName() not in columns:
+      columns.append(leaf.GetLeafCount().GetName())
+  return columns
+
+
+def getsnapshotoptions(compress='LZMA:9', lazy=True):
+  """Snapshot options with compression algorithm and level, e.g. 'LZMA:9' (same as the PostProcessor)."""
+  options = ROOT.RDF.RSnapshotOptions()
+  options.fLazy = lazy
+  if compress and compress.lower()!='none':
+    algo, level = compress.split(':') if ':' in compress else (compress,'9')
+    options.fCompressionAlgorithm = getattr(ROOT.RCompressionSetting.EAlgorithm,'k'+algo.upper())
+    options.fCompressionLevel = int(level)
+  return options
+
+
+def getcutflow(name='cutflow'):
+  """Create cutflow histogram with the same bins as the Bookkeeper."""
+  from TauFW.PicoProducer.processors.Bookkeeper import Bookkeeper
+  cutflow = Bookkeeper().cutflow.Clone(name)
+  cutflow.SetTitle('cutflow')
+  cutflow.Reset()
+  cutflow.SetDirectory(0)
+  return cutflow
+
+
+def skimfile(fname, outfname, cut=None, branchsel=None, json=None, firstEntry=0, maxEntries=None,
+             compress='LZMA:9', cutflow=False, treename='Events', verb=0):
+  """Skim one nanoAOD file with RDataFrame. Return the number of read and skimmed events,
+  and the cutflow histogram (if requested)."""
+  from ROOT import RDataFrame
+  start  = time.time()
+  file   = TFile.Open(fname,'READ')
+  tree   = file.Get(treename)
+  nfull  = tree.GetEntries()
+  columns = getbranchsel(tree,branchsel)
+  rdframe = RDataFrame(tree)
+  rdread = rdframe
+  firstEntry = max(0,firstEntry or 0)
+  if firstEntry>0 or (maxEntries and maxEntries>0): # entry range (single-threaded only)
+    rdread = rdframe.Range(firstEntry,firstEntry+maxEntries if maxEntries and maxEntries>0 else 0)
+  rdskim = rdread
+  if json: # certified data
+    rdskim = rdskim.Filter("%s(run,luminosityBlock)"%(declarejson(json)),'json')
+  if cut:
+    declarehelpers()
+    expr   = translatecut(cut,getarrays(tree))
+    if verb>=1:
+      print(">>> rdfskim: Translated cut: %r"%(expr))
+    rdskim = rdskim.Filter(expr,'presel')
+  results = [rdread.Count(),rdskim.Count()]
+  ismc    = bool(tree.GetBranch('genWeight'))
+  sumws   = [ ] # sums of weights per index, like the Bookkeeper
+  if cutflow and ismc:
+    from TauFW.PicoProducer.processors.Bookkeeper import booksumws
+    sumws   = booksumws(rdframe,tree)
+    rdframe = rdframe.Define('genWeight2',"double(genWeight)*genWeight")
+    rdread  = rdread.Define('genWeight2',"double(genWeight)*genWeight")
+    rdskim  = rdskim.Define('genWeight2',"double(genWeight)*genWeight")
+    for rdf in [rdframe,rdread,rdskim]:
+      results += [rdf.Sum('genWeight'),rdf.Sum('genWeight2')] # jitted sums are double
+  snapshot = rdskim.Snapshot(treename,outfname,columns,getsnapshotoptions(compress))
+  values   = [r.GetValue() for r in results] # run event loop
+  snapshot.GetValue()
+  nread, nskim = values[:2]
+
+  # COPY OTHER TREES & CUTFLOW
+  outfile = TFile.Open(outfname,'UPDATE')
+  for name in copytrees:
+    intree = file.Get(name)
+    if intree:
+      outfile.cd()
+      outtree = intree.CloneTree(-1,'fast')
+      outtree.Write(name,outtree.kOverwrite)
+  hist = None
+  if cutflow: # same bins as Bookkeeper (passed = skimmed, as there are no modules)
+    hist = getcutflow()
+    for bin, value in enumerate([nfull,nread,nskim,nskim],1):
+      hist.SetBinContent(bin,value)
+    if ismc: # sums of weights (full, read, skim, pass) and squared weights
+      wgts, wgts2 = values[2::2], values[3::2]
+      for bin, value in enumerate(wgts+wgts[-1:]+wgts2+wgts2[-1:],5):
+        hist.SetBinContent(bin,value)
+    outfile.cd()
+    hist.Write('cutflow',TH1D.kOverwrite)
+    for sumw in sumws:
+      sumw = sumw.GetValue()
+      sumw.Write(sumw.GetName(),TH1D.kOverwrite)
+  outfile.Close()
+  file.Close()
+  print(">>> rdfskim: Skimmed %d / %d read events of %s in %.1f seconds"%(nskim,nread,fname,time.time()-start))
+  return nread, nskim, hist
+
+
+def skim(infiles, outdir='.', postfix='_skim', cut=None, branchsel=None, json=None, firstEntry=0, maxEntries=None,
+         compress='LZMA:9', nthreads=0, cutflow=False, verb=0):
+  """Skim nanoAOD files with RDataFrame, one output file per input file in outdir with the same name as
+  the PostProcessor's. Use nthreads threads (0 = all cores), unless an entry range is given."""
+  from ROOT import EnableImplicitMT, DisableImplicitMT, IsImplicitMTEnabled
+  if (firstEntry and firstEntry>0) or (maxEntries and maxEntries>0):
+    if IsImplicitMTEnabled():
+      DisableImplicitMT()
+    print(">>> rdfskim: Entry range requires single-threaded event loop...")
+  elif nthreads!=1:
+    EnableImplicitMT(nthreads) # 0 = all available cores
+  if verb>=1:
+    print(">>> rdfskim: cut=%r, branchsel=%r, json=%r, compress=%r, nthreads=%r"%(cut,branchsel,json,compress,nthreads))
+  outfnames = [ ]
+  total   = None
+  for fname in infiles:
+    outfname = os.path.join(outdir,os.path.basename(fname).replace('.root',postfix+'.root'))
+    nread, nskim, hist = skimfile(fname,outfname,cut=cut,branchsel=branchsel,json=json,firstEntry=firstEntry,
+                                  maxEntries=maxEntries,compress=compress,cutflow=cutflow,verb=verb)
+    if hist:
+      if total:
+        total.Add(hist)
+      else:
+        total = hist.Clone('cutflow_tot')
+        total.SetDirectory(0)
+    outfnames.append(outfname)
+  if total and verb>=1:
+    from TauFW.PicoProducer.processors.Bookkeeper import printCutflow
+    printCutflow(total)
+  return outfnames
@@ -24,6 +24,14 @@ parser.add_argument('-d', '--dtype',     dest='dtype',     choices=['data','mc',
 parser.add_argument('-y', '-e','--era',  dest='era',       default="")
 parser.add_argument('-E', '--opts',      dest='extraopts', default=[ ], nargs='+')
 parser.add_argument('-p', '--prefetch',  dest='prefetch',  action='store_true')
+parser.add_argument('--budget',          dest='budget',    type=float, default=4000,
+                                         help="disk budget for prefetched input files in MB, default=%(default)s")
+parser.add_argument('--engine',          dest='engine',    choices=['postprocessor','rdf'], default='postprocessor',
+                                         help="skim with nanoAOD-tools' PostProcessor, or RDataFrame Snapshot, default=%(default)r")
+parser.add_argument('--nthreads',        dest='nthreads',  type=int, default=0,
+                                         help="number of threads for RDataFrame (0 = all cores), default=%(default)s")
+parser.add_argument('-A', '--compress',  dest='compress',  default='LZMA:9',
+                                         help="compression algorithm and level for RDataFrame, default=%(default)r")
 parser.add_argument('-J', '--jec',       dest='doJEC',     action='store_true')
 parser.add_argument('-S', '--jec-sys',   dest='doJECSys',  action='store_true')
 parser.add_argument('-U', '--jec-unc',   dest='jesuncs',   default='Total')
@@ -53,6 +61,7 @@ presel    = args.preselect         # simple pre-selection string, e.g. for mutau
 commonpresel = args.commonpresel   # common TauPOG pre-selection for lepton and/or jet
 branchsel = os.path.join(moddir,"keep_and_drop_skim.txt") # file with branch selection
 json      = None                   # JSON file of certified events
+engine    = args.engine            # skim with PostProcessor or RDataFrame Snapshot
 modules   = [ ]                    # list of modules to run
 
 # INPUT FILES
@@ -101,8 +110,18 @@ if presel:
 elif commonpresel: # common pre-selection for TauPOG studies
   presel = "Max$(Jet_pt)>30 || Max$(Tau_pt)>30 || Max$(Muon_pt)>18 || Max$(Electron_pt)>20"
 
+# ENGINE
+if engine=='rdf' and modules: # RDataFrame only skims, no modules
+  print(">>> WARNING! JEC modules are not supported with RDataFrame, using the PostProcessor instead...")
+  engine = 'postprocessor'
+if engine=='rdf' and presel: # cuts that combine collections element-wise cannot be translated
+  from TauFW.PicoProducer.processors.rdfskim import cancut
+  if not cancut(presel,infiles[0]):
+    print(">>> WARNING! Cannot translate preselection for RDataFrame, using the PostProcessor instead...")
+    engine = 'postprocessor'
+
 # BOOKKEEPING
-if presel:
+if presel and engine=='postprocessor':
   from TauFW.PicoProducer.processors.Bookkeeper import Bookkeeper
   modules.append(Bookkeeper(verb=1)) # order should not matter
 
@@ -124,6 +143,12 @@ print(">>> %-12s = %r"%('branchsel',branchsel))
 print(">>> %-12s = %r"%('json',json))
 print(">>> %-12s = %s"%('modules',modules))
 print(">>> %-12s = %s"%('prefetch',prefetch))
+if prefetch:
+  print(">>> %-12s = %s MB"%('budget',args.budget))
+print(">>> %-12s = %r"%('engine',engine))
+if engine=='rdf':
+  print(">>> %-12s = %s"%('nthreads',args.nthreads))
+  print(">>> %-12s = %r"%('compress',args.compress))
 print(">>> %-12s = %r"%('doJEC',doJEC))
 print(">>> %-12s = %r"%('doJECSys',doJECSys))
 print(">>> %-12s = %r"%('jesuncs',jesuncs))
@@ -132,12 +157,25 @@ print(">>> %-12s = %r"%('preselection',presel))
 print('-'*80)
 
 # RUN
-print(">>> Loading post processor...")
-p = PostProcessor(outdir,infiles,cut=presel,branchsel=None,outputbranchsel=branchsel,
-                  firstEntry=firstevt,maxEntries=maxevts,jsonInput=json,
-                  modules=modules,postfix=postfix,noOut=False,prefetch=prefetch)
-print(">>> Start post processor...")
-p.run()
+if engine=='rdf': # RDataFrame Filter + Snapshot
+  from TauFW.PicoProducer.processors.rdfskim import skim
+  print(">>> Start RDataFrame skim...")
+  skim(infiles,outdir,postfix=postfix,cut=presel,branchsel=branchsel,json=json,
+       firstEntry=firstevt,maxEntries=maxevts,compress=args.compress,nthreads=args.nthreads,
+       cutflow=bool(presel),verb=1)
+else:
+  print(">>> Loading post processor...")
+  p = PostProcessor(outdir,infiles,cut=presel,branchsel=None,outputbranchsel=branchsel,
+                    firstEntry=firstevt,maxEntries=maxevts,jsonInput=json,
+                    modules=modules,postfix=postfix,noOut=False,prefetch=prefetch)
+  print(">>> Start post processor...")
+  if prefetch: # copy next input file in background while processing the current one
+    from TauFW.PicoProducer.processors.prefetcher import Prefetcher
+    with Prefetcher(infiles,outdir,budget=args.budget) as prefetcher:
+      prefetcher.attach(p)
+      p.run()
+  else:
+    p.run()
 
 # GET OUTFILES
 basenames = [os.path.basename(f).replace('.root','') for f in infiles] # basenames of output files
@@ -19,6 +19,7 @@ from TauFW.common.tools.LoadingBar import LoadingBar
 import TauFW.PicoProducer.tools.config as GLOB
 #from TauFW.PicoProducer.tools.config import user
 from TauFW.PicoProducer.storage.utils import LOG, getstorage, getnevents, iterevts
+from TauFW.PicoProducer.storage.evtcache import EventCache
 from TauFW.PicoProducer.storage.das import dasgoclient, getdasnevents, getdasfiles
 dasurls = ["root://cms-xrd-global.cern.ch/","root://xrootd-cms.infn.it/", "root://cmsxrootd.fnal.gov/"]
 fevtsexp = re.compile(r"(.+\.root)(?::(\d+))?$") # input file stored in lis in text file
@@ -293,6 +294,9 @@ class Sample(object):
       if checkfiles or (self.storage and not das): # get number of events per file from storage system
         LOG.verb("Sample._getnevents: Get events per file (storage=%r, das=%r)..."%(self.storage,das),verb,2)
         files = self.getfiles(url=True,das=das,refresh=refresh,limit=limit,verb=verb)
+        cache = EventCache(verb=verb)
+        if not refresh: # get unchanged files from persistent cache
+          filenevts.update(cache.lookup([f for f in files if f not in filenevts],tree=tree))
         if verb<=0 and len(files)>=5:
           bar = LoadingBar(len(files),width=20,pre=">>> Getting number of events: ",counter=True,remove=True)
         for nevts, fname in iterevts(files,tree,filenevts,refresh,ncores=ncores,verb=verb):
@@ -304,6 +308,8 @@ class Sample(object):
                bar.count("files, %d/%d events (%d%%)"%(nevents,self.nevents,100.0*nevents/self.nevents))
              else:
                bar.count("files, %d events"%(nevents))
+        cache.store({ f: filenevts[f] for f in files if f in filenevts },tree=tree)
+        cache.close()
       else: # get total number of events from DAS
         LOG.verb("Sample._getnevents: Get total number of events per path (storage=%r, das=%r)..."%(self.storage,das),verb,2)
         for daspath in self.paths:
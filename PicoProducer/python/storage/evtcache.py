@@ -0,0 +1,142 @@
+# Description: Persistent on-disk (sqlite) cache of the number of events per nanoAOD file,
+#              shared by Sample.getnevents, chunkify_by_evts and checkchunks, so that repeated
+#              submit, resubmit and status calls do not need to reopen unchanged files.
+#              Entries are keyed by LFN and tree name, and invalidated if the size or modification time changes.
+# Usage:
+#   cache = EventCache()
+#   filenevts = cache.getnevents(fnames,tree='Events',ncores=4) # { fname: nevts }
+import os, re, time
+import sqlite3
+import subprocess
+from multiprocessing.pool import ThreadPool
+from TauFW.PicoProducer import basedir
+from TauFW.common.tools.log import Logger
+LOG     = Logger('EventCache')
+urlexp  = re.compile(r"^(root://[^/]+)/+(.+)$") # split XRootD URL in server and path
+nostat  = (-1,'') # metadata of files that could not be stat'ed: only LFN is used as key
+
+
+def getlfn(fname):
+  """Get logical file name, i.e. strip XRootD URL, e.g. 'root://cms-xrd-global.cern.ch//store/...' -> '/store/...'."""
+  match = urlexp.match(fname)
+  if match:
+    return '/'+match.group(2).lstrip('/')
+  return os.path.abspath(fname) if os.path.exists(fname) else fname
+
+
+def getmeta(fname, timeout=60):
+  """Get size and modification time of a local or remote file. Return nostat if unknown."""
+  match = urlexp.match(fname)
+  if not match: # local
+    try:
+      stat = os.stat(fname)
+    except OSError:
+      return nostat
+    return (stat.st_size,"%d"%(stat.st_mtime))
+  server, path = match.group(1), '/'+match.group(2).lstrip('/')
+  try:
+    out = subprocess.check_output(['xrdfs',server,'stat',path],stderr=subprocess.STDOUT,timeout=timeout)
+  except Exception:
+    return nostat
+  out   = out.decode('utf-8','replace')
+  size  = re.search(r"Size:\s*(\d+)",out)
+  mtime = re.search(r"MTime:\s*(.+)",out)
+  if not size:
+    return nostat
+  return (int(size.group(1)),mtime.group(1).strip() if mtime else '')
+
+
+class EventCache(object):
+  """Cache of the number of events per file in a sqlite database."""
+
+  def __init__(self, dbname=None, **kwargs):
+    if dbname==None:
+      dbname = os.environ.get('PICO_EVTCACHE',os.path.join(basedir,'cache','nevents.db'))
+    self.dbname    = dbname
+    self.validate  = kwargs.get('validate', True ) # check size & modification time of files
+    self.nthreads  = kwargs.get('nthreads', 16   ) # number of parallel stat calls
+    self.verbosity = kwargs.get('verb',     0    ) # verbosity level
+    self.meta      = { } # fname -> (size, mtime) of this session
+    dirname = os.path.dirname(dbname)
+    if dirname and not os.path.exists(dirname):
+      os.makedirs(dirname)
+    self.db = sqlite3.connect(dbname,timeout=60) # wait for other pico.py processes
+    self.db.execute("CREATE TABLE IF NOT EXISTS nevents (lfn TEXT, tree TEXT, size INTEGER, mtime TEXT, nevts INTEGER, "
+                    "updated REAL, PRIMARY KEY (lfn, tree))")
+    self.db.commit()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, type, value, traceback):
+    self.close()
+
+  def close(self):
+    self.db.close()
+
+  def getmeta(self, fnames):
+    """Get size and modification time of files (in parallel), and remember them for this session."""
+    if not self.validate:
+      return { f: nostat for f in fnames }
+    todo = [f for f in fnames if f not in self.meta]
+    if todo:
+      start = time.time()
+      if len(todo)>=2 and self.nthreads>=2:
+        pool  = ThreadPool(min(self.nthreads,len(todo)))
+        metas = pool.map(getmeta,todo)
+        pool.close()
+      else:
+        metas = [getmeta(f) for f in todo]
+      self.meta.update(zip(todo,metas))
+      LOG.verb("EventCache.getmeta: Got metadata of %d files in %.1f seconds"%(len(todo),time.time()-start),self.verbosity,1)
+    return { f: self.meta[f] for f in fnames }
+
+  def lookup(self, fnames, tree='Events'):
+    """Return dictionary of number of events for files in the cache with unchanged metadata."""
+    result = { }
+    if not fnames:
+      return result
+    metas  = self.getmeta(fnames)
+    rows   = { }
+    lfns   = { f: getlfn(f) for f in fnames }
+    lfnlist = list(set(lfns.values()))
+    for i in range(0,len(lfnlist),500): # limit number of SQL variables
+      subset = lfnlist[i:i+500]
+      query  = "SELECT lfn, size, mtime, nevts FROM nevents WHERE tree=? AND lfn IN (%s)"%(','.join('?'*len(subset)))
+      for lfn, size, mtime, nevts in self.db.execute(query,[tree]+subset):
+        rows[lfn] = ((size,mtime),nevts)
+    for fname in fnames:
+      row = rows.get(lfns[fname],None)
+      if row==None:
+        continue
+      if self.validate and row[0]!=tuple(metas[fname]):
+        LOG.verb("EventCache.lookup: Metadata of %s changed: %s -> %s"%(fname,row[0],metas[fname]),self.verbosity,1)
+        continue
+      result[fname] = row[1]
+    LOG.verb("EventCache.lookup: Found %d/%d files in %s"%(len(result),len(fnames),self.dbname),self.verbosity,1)
+    return result
+
+  def store(self, filenevts, tree='Events'):
+    """Store number of events per file. Negative numbers (failures) are not stored."""
+    filenevts = { f: n for f, n in filenevts.items() if n!=None and n>=0 }
+    metas = self.getmeta(list(filenevts))
+    now   = time.time()
+    rows  = [(getlfn(f),tree,metas[f][0],metas[f][1],n,now) for f, n in filenevts.items()]
+    self.db.executemany("INSERT OR REPLACE INTO nevents VALUES (?,?,?,?,?,?)",rows)
+    self.db.commit()
+    LOG.verb("EventCache.store: Stored %d files in %s"%(len(rows),self.dbname),self.verbosity,2)
+
+  def getnevents(self, fnames, tree='Events', refresh=False, ncores=0, verb=0):
+    """Get number of events for each file from the cache, and open the missing or changed files,
+    in parallel if ncores>=2. Return dictionary { fname: nevts }."""
+    from TauFW.PicoProducer.storage.utils import iterevts
+    result  = { } if refresh else self.lookup(fnames,tree=tree)
+    missing = [f for f in fnames if f not in result]
+    if missing:
+      LOG.verb("EventCache.getnevents: Opening %d files..."%(len(missing)),max(verb,self.verbosity),1)
+      new = { }
+      for nevts, fname in iterevts(missing,tree,{ },refresh=True,ncores=ncores,verb=verb):
+        new[fname] = nevts
+      self.store(new,tree=tree)
+      result.update(new)
+    return result
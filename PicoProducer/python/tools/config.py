@@ -151,7 +151,20 @@ def setdefaultconfig(verb=0):
   CONFIG  = Config(cfgdict,cfgname)
   CONFIG.write(backup=False,verb=verb)
   return CONFIG
-  
+
+
+def getchannels(channel,config=None):
+  """Expand a group of channels that are run in the same job on the same events,
+  given as a comma-separated list (e.g. 'mutau,etau'), or as a channel in the configuration
+  that links to such a list, e.g.
+    pico.py channel ltau mutau,etau,tautau,mumu
+  Return list of channels, or [channel] if it is not a group."""
+  if config==None:
+    config = getconfig(verb=0)
+  if channel in config.channels and ',' in config.channels[channel]:
+    channel = config.channels[channel]
+  return [c.strip() for c in channel.split(',') if c.strip()]
+
 
 class Config(object):
   
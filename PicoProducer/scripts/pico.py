@@ -77,7 +77,9 @@ if __name__ == "__main__":
                                                 help="number of cores to run event checks or validation in parallel, default=%(default)s")
   parser_job = ArgumentParser(add_help=False,parents=[parser_sam]) # common for submit, resubmit, status, ...
   parser_job.add_argument('--checkqueue',       dest='checkqueue', type=int, nargs='?', const=1, default=-1,
-                          metavar='N',          help="check job status: 0 (no check), 1 (check once, fast), -1 (check every job, slow, default)") # speed up if batch is slow
+                          metavar='N',          help="check job status: 0 (no check), 1 or -1 (query batch system once for all samples, default)") # speed up if batch is slow
+  parser_job.add_argument('--queue-cache',      dest='queuecache', type=int, default=0,
+                          metavar='SECONDS',    help="reuse batch queue of previous call if younger than SECONDS, default=%(default)d")
   parser_job.add_argument('--skipevts',         dest='checkevts', action='store_false',
                                                 help="skip validation and counting of events in output files (faster)")
   parser_job.add_argument('--checkexpevts',     dest='checkexpevts', action='store_true', default=None,
@@ -88,6 +90,12 @@ if __name__ == "__main__":
                                                 help="preselection to be shipped to skimjob.py during run command")
   parser_job.add_argument('-p','--prefetch',    dest='prefetch', action='store_true',
                                                 help="copy remote file during job to increase processing speed and ensure stability")
+  parser_job.add_argument('--rdf',              dest='rdf', type=int, nargs='?', const=1, default=None,
+                          metavar='NTHREADS',   help="run histogram-only modules (e.g. SumWeights, StitchEffs) as RDataFrame graph "
+                                                     "instead of event loop, with NTHREADS threads (0 = all cores), default=%(const)d")
+  parser_job.add_argument('-w','--workers',     dest='workers', type=int, default=None,
+                                                help="number of worker processes per job to split its files or events over, "
+                                                     "requesting as many cores from the batch system")
   parser_job.add_argument('-B','--batch-opts',  dest='batchopts', default=CONFIG.batchopts,
                                                 help="extra options for the batch system, default=%(default)r")
   parser_job.add_argument('-M','--time',        dest='time', default=None,
@@ -96,12 +104,17 @@ if __name__ == "__main__":
                                                 help="queue of batch system (job flavor on HTCondor)")
   parser_job.add_argument('-P','--prompt',      dest='prompt', action='store_true',
                                                 help="ask user permission before submitting a sample")
+  parser_job.add_argument('--bulk',             dest='bulk', action='store_true',
+                                                help="submit all samples as one cluster per queue (HTCondor only)")
   parser_job.add_argument('-T','--test',        dest='testrun', type=int, nargs='?', const=2000, default=0,
                           metavar='NEVTS',      help="run a test with limited nummer of jobs and events, default nevts=%(const)d")
   parser_job.add_argument('-n','--filesperjob', dest='nfilesperjob', type=int, default=-1,
                                                 help="number of files per job, default=%d"%(CONFIG.nfilesperjob))
   parser_job.add_argument('-m','--maxevts',     dest='maxevts', type=int, default=None,
                           metavar='NEVTS',      help="maximum number of events per job to process (split large files, group small ones), default=%d"%(CONFIG.maxevtsperjob))
+  parser_job.add_argument('--jobtime',          dest='jobtime', type=float, default=None,
+                          metavar='MINUTES',    help="pack files and event ranges into jobs of roughly this predicted run time, "
+                                                     "using the events/s learned from previous jobs of the same sample and channel")
   parser_job.add_argument('--split',            dest='split_nfpj', type=int, nargs='?', const=2, default=1,
                           metavar='NFILES',     help="divide default number of files per job, default=%(const)d")
   parser_job.add_argument('--tmpdir',           dest='tmpdir', type=str, default=None,
@@ -189,8 +202,18 @@ if __name__ == "__main__":
                                                 help="output directory, default=%(default)r")
   parser_run.add_argument('-p','--prefetch',    dest='prefetch', action='store_true',
                                                 help="copy remote file during run to increase processing speed and ensure stability")
+  parser_run.add_argument('--rdf',              dest='rdf', type=int, nargs='?', const=0, default=None,
+                          metavar='NTHREADS',   help="run histogram-only modules (e.g. SumWeights, StitchEffs) as RDataFrame graph "
+                                                     "instead of event loop, with NTHREADS threads (0 = all cores), default=%(const)d")
+  parser_run.add_argument('-w','--workers',     dest='workers', type=int, default=1,
+                                                help="number of worker processes to split files or events over, default=%(default)d")
+  parser_run.add_argument('--learn',            dest='learn', type=int, nargs='?', const=2000, default=None,
+                          metavar='NEVTS',      help="learn minimal keep/drop file of branches read by the module in NEVTS events, "
+                                                     "which is used automatically by later jobs, default=%(const)d")
   parser_sts.add_argument('-l','--log',         dest='showlogs', type=int, nargs='?', const=-1, default=0,
                           metavar='NLOGS',      help="show log files of failed jobs: 0 (show none), -1 (show all), n (show max n)")
+  parser_sts.add_argument('--profile',          dest='profile', action='store_true',
+                                                help="aggregate timing profiles of jobs run with -E profile=True")
   #parser_hdd.add_argument('--keep',             dest='cleanup', action='store_false',
   #                                              help="do not remove job output after hadd'ing")
   parser_hdd.add_argument('-r','--clean',       dest='cleanup', action='store_true',
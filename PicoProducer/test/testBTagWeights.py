@@ -0,0 +1,122 @@
+#! /usr/bin/env python
+# Description: Check BTagSFTable and the batched BTagWeightTool.getWeights against BTagCalibrationReader,
+#              and benchmark the latency per jet
+#   python3 test/testBTagWeights.py
+#   python3 test/testBTagWeights.py -y 2018 -t DeepCSV -n 100000
+import time
+import numpy as np
+from TauFW.common.tools.log import Logger
+from TauFW.PicoProducer.corrections.BTagTool import BTagWeightTool, SYSTYPES, flavorToFLAV
+LOG = Logger('testBTagWeights')
+
+
+def getweight_readers(tool,pts,etas,flavors,tagged,unc='Nom'):
+  """Reference: Old per-jet event weight via BTagCalibrationReader.eval with PyROOT, like getWeight before BTagSFTable."""
+  weight = 1.
+  for pt, eta, flavor, tag in zip(pts,etas,flavors,tagged):
+    if abs(eta)>=tool.maxeta: continue
+    FLAV = flavorToFLAV(flavor)
+    if pt>=tool.maxpt:
+      sf = tool.readers[unc].eval(FLAV,abs(eta),tool.maxpt)
+      if unc!='Nom':
+        sf = 2*sf - tool.readers['Nom'].eval(FLAV,abs(eta),tool.maxpt)
+    else:
+      sf = tool.readers[unc].eval(FLAV,abs(eta),pt)
+    if not tag:
+      eff = tool.getEff(pt,eta,flavor)
+      sf = 1. if (eff>=1. or eff<0.) else (1.-sf*eff)/(1.-eff)
+    weight *= sf
+  return weight
+
+
+def main(args):
+  njets  = args.njets
+  era    = args.era
+  tagger = args.tagger
+  np.random.seed(args.seed)
+  nfail  = 0
+
+  # TOOL
+  start = time.time()
+  tool  = BTagWeightTool(tagger,'medium',era=era,channel='mutau',loadsys=True,spliteras=args.spliteras)
+  print(">>> Initialized %s in %.2f s with uncertainties %s"%(tool.sftable,time.time()-start,tool.uncs))
+
+  # RANDOM JETS: ~4 jets per event, with some jets on bin edges and above maxpt
+  nevts    = njets//4
+  evtidx   = np.sort(np.random.randint(0,nevts,njets))
+  pts      = np.random.uniform(20.,1200.,njets)
+  etas     = np.random.uniform(-2.6,2.6,njets)
+  flavors  = np.random.choice([0,1,2,3,4,5,15,21,-4,-5],njets)
+  tagged   = np.random.uniform(0,1,njets)<0.3
+  pts[:6]  = [20.,30.,50.,1000.,1000.,1500.]
+  etas[:6] = [0.,-2.4,2.4,-1.5,2.5,2.4999]
+
+  # SINGLE SFs: table vs. reader
+  LOG.header("BTagSFTable.eval vs. BTagCalibrationReader.eval")
+  for unc in tool.uncs:
+    FLAVs = [flavorToFLAV(f) for f in flavors.tolist()]
+    start = time.time()
+    ref   = [tool.readers[unc].eval(F,abs(e),p) for F, e, p in zip(FLAVs,etas.tolist(),pts.tolist())]
+    time1 = time.time()-start
+    start = time.time()
+    vals  = [tool.sftable.eval(F,abs(e),p,SYSTYPES[unc]) for F, e, p in zip(FLAVs,etas.tolist(),pts.tolist())]
+    time2 = time.time()-start
+    start = time.time()
+    avals = tool.sftable.evaluate(FLAVs,np.abs(etas),pts,SYSTYPES[unc])
+    time3 = time.time()-start
+    ndiff = sum(v!=r for v, r in zip(vals,ref))
+    maxdiff = np.abs(avals-np.array(ref)).max()
+    print(">>> %-10s reader: %6.3f us/jet, table.eval: %6.3f us/jet, table.evaluate: %6.3f us/jet, %d differences, max. batched diff. %.2g"%(
+          unc,1e6*time1/njets,1e6*time2/njets,1e6*time3/njets,ndiff,maxdiff))
+    nfail += ndiff + int(maxdiff>1e-12)
+
+  # EVENT WEIGHTS: per event & per uncertainty vs. batched
+  LOG.header("BTagWeightTool.getWeights vs. per-jet weights")
+  bounds = np.searchsorted(evtidx,np.arange(nevts+1))
+  start  = time.time()
+  ref    = { u: np.array([getweight_readers(tool,pts[i:j].tolist(),etas[i:j].tolist(),flavors[i:j].tolist(),tagged[i:j].tolist(),unc=u)
+                          for i, j in zip(bounds[:-1],bounds[1:])]) for u in tool.uncs }
+  time1  = time.time()-start
+  start  = time.time()
+  evtws  = [tool.getWeights(pts[i:j],etas[i:j],flavors[i:j],tagged[i:j]) for i, j in zip(bounds[:-1],bounds[1:])]
+  time2  = time.time()-start
+  start  = time.time()
+  weights = tool.getWeights(pts,etas,flavors,tagged,evtidx=evtidx,nevts=nevts)
+  time3  = time.time()-start
+  print(">>> %-24s %10s %10s"%("method","us/event","speed-up"))
+  print(">>> %-24s %10.3f %10s"%("readers, per unc.",1e6*time1/nevts,"1.0"))
+  print(">>> %-24s %10.3f %10.1f"%("getWeights, per event",1e6*time2/nevts,time1/time2))
+  print(">>> %-24s %10.3f %10.1f"%("getWeights, chunk",1e6*time3/nevts,time1/time3))
+  for unc in tool.uncs:
+    maxdiff1 = np.abs(np.array([w[unc] for w in evtws])-ref[unc]).max()
+    maxdiff2 = np.abs(weights[unc]-ref[unc]).max()
+    print(">>> %-10s max. difference: %.2g (per event), %.2g (chunk)"%(unc,maxdiff1,maxdiff2))
+    nfail += int(maxdiff1>1e-12) + int(maxdiff2>1e-12)
+
+  if nfail:
+    LOG.warning("Found %d differences in total!"%(nfail))
+  else:
+    print(">>> BTagSFTable and getWeights agree with BTagCalibrationReader!")
+
+
+if __name__ == "__main__":
+  from argparse import ArgumentParser
+  description = """Check and benchmark batched b tag weights against BTagCalibrationReader."""
+  parser = ArgumentParser(prog="testBTagWeights",description=description,epilog="Good luck!")
+  parser.add_argument('-n', '--njets',   type=int, default=20000,
+                                         help="number of random jets, default=%(default)r" )
+  parser.add_argument('-y', '--era',     default='UL2018',
+                                         help="era, default=%(default)r" )
+  parser.add_argument('-t', '--tagger',  default='DeepJet', choices=['DeepJet','DeepCSV'],
+                                         help="tagger, default=%(default)r" )
+  parser.add_argument('-S', '--spliteras', action='store_true',
+                                         help="also load year (un)correlated uncertainties" )
+  parser.add_argument('-s', '--seed',    type=int, default=1,
+                                         help="random seed, default=%(default)r" )
+  parser.add_argument('-v', '--verbose', dest='verbosity', type=int, nargs='?', const=1, default=0, action='store',
+                                         help="set verbosity" )
+  args = parser.parse_args()
+  LOG.verbosity = args.verbosity
+  main(args)
+  print("\n>>> Done.")
+
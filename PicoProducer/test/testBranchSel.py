@@ -0,0 +1,129 @@
+#! /usr/bin/env python
+# Description: Test that learning the keep/drop file records the source of redirected branches
+#              (analysis.utils.redirectbranch), and that the lazy fallback enables them if they are dropped,
+#              on a small nanoAOD-like file with a tau ID branch that is redirected like for v9 files
+#   python3 test/testBranchSel.py -n 200
+import os, shutil, tempfile
+from array import array
+import numpy as np
+from ROOT import TFile, TTree
+from PhysicsTools.NanoAODTools.postprocessing.framework import treeReaderArrayTools
+from PhysicsTools.NanoAODTools.postprocessing.framework.treeReaderArrayTools import InputTree
+from PhysicsTools.NanoAODTools.postprocessing.framework.datamodel import Event, Collection
+from PhysicsTools.NanoAODTools.postprocessing.framework.branchselection import BranchSelection
+from TauFW.common.tools.log import Logger
+from TauFW.PicoProducer.analysis.utils import redirectbranch
+from TauFW.PicoProducer.processors.branchsel import recordbranches, enablelazily, writebranchsel
+LOG = Logger('testBranchSel')
+oldbranch = 'Tau_idDeepTau2017v2p1VSjet' # in file
+newbranch = 'Tau_idDeepTau2018v2p5VSjet' # read by module
+
+
+def createfile(fname, nevts, nmax=6):
+  """Create nanoAOD-like file with random taus."""
+  file  = TFile(fname,'RECREATE')
+  tree  = TTree('Events','Events')
+  run   = array('I',[1])
+  lumi  = array('I',[1])
+  evt   = array('L',[0])
+  ntau  = array('i',[0])
+  pt    = array('f',[0.]*nmax)
+  idjet = array('B',[0]*nmax) # UChar_t
+  tree.Branch('run',run,'run/i')
+  tree.Branch('luminosityBlock',lumi,'luminosityBlock/i')
+  tree.Branch('event',evt,'event/l')
+  tree.Branch('nTau',ntau,'nTau/I')
+  tree.Branch('Tau_pt',pt,'Tau_pt[nTau]/F')
+  tree.Branch(oldbranch,idjet,'%s[nTau]/b'%(oldbranch))
+  np.random.seed(1)
+  for i in range(nevts):
+    evt[0]  = i
+    ntau[0] = np.random.randint(0,nmax+1)
+    for j in range(ntau[0]):
+      pt[j]    = np.random.uniform(20,100)
+      idjet[j] = np.random.randint(0,256)
+    tree.Fill()
+  file.Write()
+  file.Close()
+
+
+def readtaus(fname, branchsel=None):
+  """Read the tau ID via the redirected branch like a module, with an optional keep/drop file."""
+  values = [ ]
+  file = TFile.Open(fname,'READ')
+  tree = file.Get('Events')
+  if branchsel:
+    BranchSelection(branchsel).selectBranches(tree)
+  tree = InputTree(tree)
+  for i in range(tree.GetEntries()):
+    event = Event(tree,i)
+    taus  = Collection(event,'Tau')
+    for tau in taus:
+      if tau.pt<20: continue
+      values.append(getattr(tau,newbranch[4:])) # Object reads Event.Tau_idDeepTau2018v2p5VSjet property
+  file.Close()
+  return values
+
+
+def main(args):
+  outdir = tempfile.mkdtemp(prefix="testBranchSel_")
+  fname  = os.path.join(outdir,"nano.root")
+  createfile(fname,args.nevts)
+  redirectbranch(oldbranch,newbranch)
+  readBranch = treeReaderArrayTools.readBranch
+  nfail  = 0
+
+  # REFERENCE: all branches
+  ref = readtaus(fname)
+
+  # LEARN
+  accessed  = recordbranches()
+  learned   = readtaus(fname)
+  treeReaderArrayTools.readBranch = readBranch # undo
+  learnfile = writebranchsel(os.path.join(outdir,"keep_and_drop_learned.txt"),accessed,infile=fname,verb=args.verbosity)
+  print(">>> Recorded branches: %s"%(', '.join(sorted(accessed))))
+  if oldbranch not in accessed:
+    LOG.warning("Source %r of redirected branch %r was not recorded!"%(oldbranch,newbranch))
+    nfail += 1
+
+  # APPLY LEARNED FILE
+  values = readtaus(fname,learnfile)
+  if values!=ref:
+    LOG.warning("Tau ID with learned keep/drop file differs from reference!")
+    nfail += 1
+
+  # LAZY FALLBACK: drop source of redirected branch
+  dropfile = os.path.join(outdir,"keep_and_drop_stale.txt")
+  with open(dropfile,'w') as file:
+    file.write("drop *\nkeep nTau\nkeep Tau_pt\n")
+  enabled = enablelazily()
+  values  = readtaus(fname,dropfile)
+  treeReaderArrayTools.readBranch = readBranch # undo
+  print(">>> Enabled lazily: %s"%(', '.join(sorted(enabled))))
+  if oldbranch not in enabled:
+    LOG.warning("Dropped source %r of redirected branch %r was not enabled lazily!"%(oldbranch,newbranch))
+    nfail += 1
+  if values!=ref:
+    LOG.warning("Tau ID with lazily enabled branch differs from reference!")
+    nfail += 1
+
+  print(">>> Compared %d taus in %d events"%(len(ref),args.nevts))
+  shutil.rmtree(outdir)
+  if nfail:
+    LOG.warning("Found %d differences in total!"%(nfail))
+  else:
+    print(">>> Redirected branches are learned and enabled lazily!")
+
+
+if __name__ == "__main__":
+  from argparse import ArgumentParser
+  description = """Test learning and lazily enabling redirected branches."""
+  parser = ArgumentParser(prog="testBranchSel",description=description,epilog="Good luck!")
+  parser.add_argument('-n','--nevts',    type=int, default=200,
+                                         help="number of events, default=%(default)d" )
+  parser.add_argument('-v', '--verbose', dest='verbosity', type=int, nargs='?', const=1, default=0, action='store',
+                                         help="set verbosity" )
+  args = parser.parse_args()
+  LOG.verbosity = args.verbosity
+  main(args)
+  print("\n>>> Done.")
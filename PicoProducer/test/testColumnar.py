@@ -0,0 +1,131 @@
+#! /usr/bin/env python
+# Description: Test equivalence of the columnar engine (vectorized selection) of ModuleTauPair
+#              with the default Python engine (loop over objects), event by event
+#   test/testColumnar.py nano.root -y UL2018 -d mc -m 10000
+#   test/testColumnar.py nano.root -c mutau -y 2018 -d data -E tes=1.03
+#   test/testColumnar.py nano.root -c mutau etau tautau mumu emu -m 10000
+import os, time
+from TauFW.common.tools.log import Logger
+from TauFW.common.tools.root import ensureTFile
+from TauFW.PicoProducer.analysis.utils import getmodule, getyear, convertstr
+from PhysicsTools.NanoAODTools.postprocessing.framework.postprocessor import PostProcessor
+LOG = Logger('testColumnar')
+modules = {
+  'mutau':  'ModuleMuTau',
+  'etau':   'ModuleETau',
+  'tautau': 'ModuleTauTau',
+  'mumu':   'ModuleMuMu',
+  'emu':    'ModuleEMu',
+}
+
+
+def runmodule(modname,infiles,outfname,engine,args):
+  """Run module with given engine on input files."""
+  kwargs = {
+    'year': getyear(args.era), 'era': args.era, 'dtype': args.dtype,
+    'engine': engine, 'verb': args.verbosity,
+  }
+  for option in args.extraopts:
+    key, value = option.split('=',1)
+    kwargs[key] = convertstr(value) # convert to bool, float or int if possible
+  module = getmodule(modname)(outfname,**kwargs)
+  outdir = os.path.dirname(outfname) or '.'
+  proc   = PostProcessor(outdir,infiles,cut=None,branchsel=None,maxEntries=args.maxevts,
+                         modules=[module],noOut=True)
+  start  = time.time()
+  proc.run()
+  return time.time()-start
+
+
+def compare(fname1,fname2,verb=0):
+  """Compare cutflow and all branches of the output trees, event by event."""
+  file1  = ensureTFile(fname1)
+  file2  = ensureTFile(fname2)
+  nfail  = 0
+
+  # CUTFLOW
+  hist1  = file1.Get('cutflow')
+  hist2  = file2.Get('cutflow')
+  for i in range(1,hist1.GetXaxis().GetNbins()+1):
+    if hist1.GetBinContent(i)!=hist2.GetBinContent(i):
+      print(">>>   cutflow bin %d (%r) differs: %s vs. %s"%(
+        i,hist1.GetXaxis().GetBinLabel(i),hist1.GetBinContent(i),hist2.GetBinContent(i)))
+      nfail += 1
+
+  # TREE
+  tree1  = file1.Get('tree')
+  tree2  = file2.Get('tree')
+  nevts1 = tree1.GetEntries()
+  nevts2 = tree2.GetEntries()
+  print(">>>   tree1: %9d, tree2: %9d entries"%(nevts1,nevts2))
+  if nevts1!=nevts2:
+    nfail += 1
+  branches = [b.GetName() for b in tree1.GetListOfBranches()]
+  for i in range(min(nevts1,nevts2)):
+    tree1.GetEntry(i)
+    tree2.GetEntry(i)
+    for branch in branches:
+      value1 = getattr(tree1,branch)
+      value2 = getattr(tree2,branch)
+      if hasattr(value1,'__len__'): # vector branch
+        value1, value2 = list(value1), list(value2)
+      if value1!=value2:
+        if nfail<20 or verb>=1:
+          print(">>>   entry %d (evt=%d): %r differs: %r vs. %r"%(i,tree1.evt,branch,value1,value2))
+        nfail += 1
+  file1.Close()
+  file2.Close()
+  return nfail
+
+
+def main(args):
+  infiles  = args.infiles
+  outdir   = args.outdir
+  nfails   = { }
+  for channel in args.channels:
+    modname  = args.module or modules[channel]
+    LOG.header("Compare engines for %s"%(modname))
+    fname1   = os.path.join(outdir,"test_%s_python.root"%(channel))
+    fname2   = os.path.join(outdir,"test_%s_columnar.root"%(channel))
+    time1    = runmodule(modname,infiles,fname1,'python',args)
+    time2    = runmodule(modname,infiles,fname2,'columnar',args)
+    print(">>> Processing took %.1f s (python) vs. %.1f s (columnar)"%(time1,time2))
+    nfail    = compare(fname1,fname2,verb=args.verbosity)
+    nfails[channel] = nfail
+    if nfail:
+      LOG.warning("Found %d differences between engines for %s!"%(nfail,modname))
+    else:
+      print(">>> Output of both engines is identical!")
+  if len(nfails)>1:
+    print(">>> Summary:")
+    for channel, nfail in nfails.items():
+      print(">>>   %-8s %d differences"%(channel+':',nfail))
+
+
+if __name__ == "__main__":
+  from argparse import ArgumentParser
+  description = """Test equivalence of columnar and python engines of ModuleTauPair channels."""
+  parser = ArgumentParser(prog="testColumnar",description=description,epilog="Good luck!")
+  parser.add_argument('infiles',         type=str, nargs='+', action='store',
+                                         help="input nanoAOD files" )
+  parser.add_argument('-c', '--channel', dest='channels', choices=list(modules), nargs='+', default=['mutau'],
+                                         help="channel(s), default=%(default)r" )
+  parser.add_argument('-M', '--module',  default=None,
+                                         help="module, default: module of the channel" )
+  parser.add_argument('-y','-e','--era', default='2018',
+                                         help="era, default=%(default)r" )
+  parser.add_argument('-d', '--dtype',   choices=['data','mc','embed'], default='mc',
+                                         help="data type, default=%(default)r" )
+  parser.add_argument('-E', '--opts',    dest='extraopts', type=str, nargs='+', default=[ ],
+                                         help="extra options for the module, e.g. tes=1.03" )
+  parser.add_argument('-o', '--outdir',  default='.',
+                                         help="output directory, default=%(default)r" )
+  parser.add_argument('-m','--maxevts',  dest='maxevts', type=int, default=None,
+                                         help='maximum number of events (per file) to process')
+  parser.add_argument('-v', '--verbose', dest='verbosity', type=int, nargs='?', const=1, default=0, action='store',
+                                         help="set verbosity" )
+  args = parser.parse_args()
+  LOG.verbosity = args.verbosity
+  main(args)
+  print("\n>>> Done.")
+
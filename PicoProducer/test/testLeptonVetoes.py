@@ -0,0 +1,226 @@
+#! /usr/bin/env python
+# Description: Check the vectorized getlepvetoes against the original loop over muons and electrons,
+#              for all channels and eras, on random events, stored nanoAOD snippets, or nanoAOD files
+#   python3 test/testLeptonVetoes.py
+#   python3 test/testLeptonVetoes.py nano.root -y UL2018 -m 5000 --dump snippets_UL2018.json
+#   python3 test/testLeptonVetoes.py -s snippets_UL2018.json
+import time, json
+from itertools import combinations
+import numpy as np
+from TauFW.common.tools.log import Logger
+from TauFW.PicoProducer.analysis.objects import getcollection, getarrays
+from TauFW.PicoProducer.analysis.utils import getlepvetoes
+LOG = Logger('testLeptonVetoes')
+channels = ['mutau','etau','tautau','emu','mumu']
+fields = {
+  'Muon':     ['pt','eta','phi','dz','dxy','pfRelIso04_all','mediumId','isPFcand','isGlobal','isTracker','charge'],
+  'Electron': ['pt','eta','phi','dz','dxy','pfRelIso03_all','convVeto','lostHits','cutBased','charge'],
+  'Tau':      ['pt','eta','phi'],
+}
+isofields = { # electron MVA isolation per era
+  'UL2018':      ['mvaFall17V2Iso_WP90','mvaFall17V2Iso_WPL'],
+  '2022_postEE': ['mvaIso_Fall17V2_WP90','mvaIso_Fall17V2_WPL'],
+  '2023C':       ['mvaIso_WP90','mvaIso'],
+}
+
+
+def getlepvetoes_loop(event, electrons, muons, taus, channel, era=""):
+  """Reference: Original loop over all muons and electrons."""
+  extramuon_veto = False
+  extraelec_veto = False
+  dilepton_veto  = False
+  looseMuons = [ ]
+  for muon in getcollection(event,'Muon'):
+    if muon.pt<10: continue
+    if abs(muon.eta)>2.4: continue
+    if abs(muon.dz)>0.2: continue
+    if abs(muon.dxy)>0.045: continue
+    if muon.pfRelIso04_all>0.3: continue
+    if any(muon.DeltaR(tau)<0.4 for tau in taus): continue
+    if muon.mediumId and all(m._index!=muon._index for m in muons):
+      extramuon_veto = True
+    if muon.pt>15 and muon.isPFcand and muon.isGlobal and muon.isTracker:
+      looseMuons.append(muon)
+  looseElectrons = [ ]
+  for electron in getcollection(event,'Electron'):
+    if '2022' in era:
+      electronIso90=electron.mvaIso_Fall17V2_WP90
+      electronIso=electron.mvaIso_Fall17V2_WPL
+    elif '2023' in era:
+      electronIso90=electron.mvaIso_WP90
+      electronIso=electron.mvaIso
+    else:
+      electronIso90=electron.mvaFall17V2Iso_WP90
+      electronIso=electron.mvaFall17V2Iso_WPL
+    if electron.pt<10: continue
+    if abs(electron.eta)>2.5: continue
+    if abs(electron.dz)>0.2: continue
+    if abs(electron.dxy)>0.045: continue
+    if electron.pfRelIso03_all>0.3: continue
+    if any(electron.DeltaR(tau)<0.4 for tau in taus): continue
+    if all(e._index!=electron._index for e in electrons) and electron.convVeto==1 and electron.lostHits<=1 and electronIso90:
+      extraelec_veto = True
+    if electron.pt>15 and electron.cutBased>0 and electronIso:
+      looseElectrons.append(electron)
+  if channel=='mutau':
+    for muon1, muon2 in combinations(looseMuons,2):
+      if muon1.charge*muon2.charge<0 and muon1.DeltaR(muon2)>0.15:
+        dilepton_veto = True
+        break
+  elif channel=='eletau' or channel=='etau':
+    for electron1, electron2 in combinations(looseElectrons,2):
+      if electron1.charge*electron2.charge<0 and electron1.DeltaR(electron2)>0.20:
+        dilepton_veto = True
+        break
+  return extramuon_veto, extraelec_veto, dilepton_veto
+
+
+class SnippetEvent:
+  """Replacement of nanoAOD-tools' Event for stored or random snippets of branches."""
+  def __init__(self, branches, entry):
+    self.__dict__.update(branches)
+    self._entry = entry
+
+
+def getselected(event, channel):
+  """Mimic the selected objects of each channel: leading taus, muons and electrons."""
+  taus      = getcollection(event,'Tau',['eta','phi'])
+  muons     = getcollection(event,'Muon')
+  electrons = getcollection(event,'Electron')
+  if channel=='mutau':
+    return [ ], muons[:1], taus[:1]
+  elif channel=='etau':
+    return electrons[:1], [ ], taus[:1]
+  elif channel=='tautau':
+    return [ ], [ ], taus[:2]
+  elif channel=='emu':
+    return electrons[:1], muons[:1], [ ]
+  return [ ], muons[:2], [ ]
+
+
+def randomevent(entry, era):
+  """Create random snippet with edge cases close to the cuts."""
+  branches = { }
+  for name, nmax in [('Muon',5),('Electron',5),('Tau',3)]:
+    nobj = np.random.randint(0,nmax+1)
+    branches['n'+name] = nobj
+    branches[name+'_pt']  = np.random.choice([9.,10.,12.,15.,15.0001,20.,40.],nobj).tolist()
+    branches[name+'_eta'] = np.random.choice([-2.5,-2.4,-1.,-0.2,0.,0.2,0.3,1.,2.4,2.5,2.6],nobj).tolist()
+    branches[name+'_phi'] = np.random.choice([-np.pi,-3.,-0.2,0.,0.1,0.2,0.5,3.,np.pi],nobj).tolist()
+    if name=='Tau': continue
+    branches[name+'_dz']     = np.random.choice([-0.3,-0.2,0.,0.1,0.2,0.21],nobj).tolist()
+    branches[name+'_dxy']    = np.random.choice([-0.05,-0.045,0.,0.045,0.046],nobj).tolist()
+    branches[name+'_charge'] = np.random.choice([-1,1],nobj).tolist()
+    if name=='Muon':
+      branches['Muon_pfRelIso04_all'] = np.random.choice([0.,0.1,0.3,0.31],nobj).tolist()
+      for flag in ['mediumId','isPFcand','isGlobal','isTracker']:
+        branches['Muon_'+flag] = (np.random.uniform(0,1,nobj)<0.8).tolist()
+    else:
+      branches['Electron_pfRelIso03_all'] = np.random.choice([0.,0.1,0.3,0.31],nobj).tolist()
+      branches['Electron_convVeto'] = (np.random.uniform(0,1,nobj)<0.8).tolist()
+      branches['Electron_lostHits'] = np.random.randint(0,3,nobj).tolist()
+      branches['Electron_cutBased'] = np.random.randint(0,5,nobj).tolist()
+      for field in isofields[era]:
+        if field=='mvaIso': # MVA score in 2023
+          branches['Electron_'+field] = np.random.choice([-1.,0.,0.5],nobj).tolist()
+        else:
+          branches['Electron_'+field] = (np.random.uniform(0,1,nobj)<0.7).tolist()
+  return SnippetEvent(branches,entry)
+
+
+def getsnippet(event, era):
+  """Store the branches needed by getlepvetoes in a dictionary."""
+  arrays   = getarrays(event)
+  branches = { }
+  for name in fields:
+    branches['n'+name] = arrays.count(name)
+    for field in fields[name]+(isofields[era] if name=='Electron' else [ ]):
+      branches[name+'_'+field] = list(arrays.get(name,field))
+  return branches
+
+
+def getevents(args):
+  """Yield events from nanoAOD files, stored snippets, or random snippets."""
+  if args.infiles:
+    from ROOT import TFile
+    from PhysicsTools.NanoAODTools.postprocessing.framework.datamodel import Event
+    from PhysicsTools.NanoAODTools.postprocessing.framework.treeReaderArrayTools import InputTree
+    for fname in args.infiles:
+      file = TFile.Open(fname)
+      tree = InputTree(file.Get('Events'))
+      nevts = tree.GetEntries() if args.maxevts==None else min(args.maxevts,tree.GetEntries())
+      for i in range(nevts):
+        yield args.era, Event(tree,i)
+      file.Close()
+  elif args.snippets:
+    with open(args.snippets,'r') as file:
+      data = json.load(file)
+    for i, snippet in enumerate(data):
+      yield snippet['era'], SnippetEvent(snippet['branches'],i)
+  else:
+    np.random.seed(args.seed)
+    for i in range(args.maxevts or 20000):
+      era = list(isofields.keys())[i%len(isofields)]
+      yield era, randomevent(i,era)
+
+
+def main(args):
+  nfail    = 0
+  nevts    = 0
+  time1    = 0.
+  time2    = 0.
+  nvetoes  = np.zeros(3,dtype=np.int64)
+  snippets = [ ]
+  for era, event in getevents(args):
+    nevts += 1
+    for channel in channels:
+      electrons, muons, taus = getselected(event,channel)
+      for tauset in [taus,[ ]]: # like the two calls in ModuleMuTau
+        start = time.time()
+        ref   = getlepvetoes_loop(event,electrons,muons,tauset,channel,era=era)
+        time1 += time.time()-start
+        start = time.time()
+        flags = getlepvetoes(event,electrons,muons,tauset,channel,era=era)
+        time2 += time.time()-start
+        nvetoes += ref
+        if flags!=ref:
+          if nfail<20 or args.verbosity>=1:
+            print(">>>   event %d, %s, %s: vectorized %r vs. loop %r"%(nevts-1,era,channel,flags,ref))
+          nfail += 1
+    if args.dump:
+      snippets.append({ 'era': era, 'branches': getsnippet(event,era) })
+  print(">>> Checked %d events: %d extra muon, %d extra electron, %d dilepton vetoes (loop)"%(nevts,*nvetoes))
+  print(">>> loop: %.3f us/call, vectorized: %.3f us/call"%(
+        1e6*time1/max(1,2*nevts*len(channels)),1e6*time2/max(1,2*nevts*len(channels))))
+  if args.dump:
+    with open(args.dump,'w') as file:
+      json.dump(snippets,file)
+    print(">>> Stored %d snippets in %s"%(len(snippets),args.dump))
+  if nfail:
+    LOG.warning("Found %d differences!"%(nfail))
+  else:
+    print(">>> Vectorized lepton vetoes agree with the loop!")
+
+
+if __name__ == "__main__":
+  from argparse import ArgumentParser
+  description = """Check the vectorized lepton vetoes against the original loop."""
+  parser = ArgumentParser(prog="testLeptonVetoes",description=description,epilog="Good luck!")
+  parser.add_argument('infiles',         type=str, nargs='*', action='store',
+                                         help="input nanoAOD files (default: random events)" )
+  parser.add_argument('-s', '--snippets', default=None,
+                                         help="JSON file with stored snippets of nanoAOD events" )
+  parser.add_argument('--dump',          default=None,
+                                         help="store snippets of the input events in this JSON file" )
+  parser.add_argument('-y','-e','--era', default='UL2018', choices=list(isofields.keys()),
+                                         help="era of the input nanoAOD files, default=%(default)r" )
+  parser.add_argument('-m','--maxevts',  dest='maxevts', type=int, default=None,
+                                         help='maximum number of events (per file) to process')
+  parser.add_argument('-S', '--seed',    type=int, default=1,
+                                         help="random seed, default=%(default)r" )
+  parser.add_argument('-v', '--verbose', dest='verbosity', type=int, nargs='?', const=1, default=0, action='store',
+                                         help="set verbosity" )
+  args = parser.parse_args()
+  LOG.verbosity = args.verbosity
+  main(args)
+  print("\n>>> Done.")
@@ -0,0 +1,127 @@
+#! /usr/bin/env python
+# Description: Check LookupTable against TH1/TH2 FindBin & GetBinContent, and benchmark the latency per call
+#   python3 test/testLookupTable.py
+#   python3 test/testLookupTable.py -n 100000 -t pu jetveto -y 2022_postEE
+import time
+from array import array
+import numpy as np
+from ROOT import TH1D, TH2D
+from TauFW.common.tools.log import Logger
+from TauFW.PicoProducer.corrections.LookupTable import LookupTable
+LOG = Logger('testLookupTable')
+
+
+def getbincontent(hist,x,y,clamp=True):
+  """Reference: Old lookup via PyROOT, like ScaleFactor.getSF_ptvseta."""
+  xbin = hist.GetXaxis().FindBin(x)
+  ybin = hist.GetYaxis().FindBin(y)
+  if clamp:
+    if xbin==0: xbin = 1
+    elif xbin>hist.GetXaxis().GetNbins(): xbin -= 1
+    if ybin==0: ybin = 1
+    elif ybin>hist.GetYaxis().GetNbins(): ybin -= 1
+  return hist.GetBinContent(xbin,ybin)
+
+
+def benchmark(name,hist,xvals,yvals,clamp=True):
+  """Compare lookup table to histogram for random points, and time both methods."""
+  LOG.header(name)
+  start = time.time()
+  table = LookupTable(hist,clamp=clamp)
+  print(">>> Created %r in %.2f ms"%(table,1e3*(time.time()-start)))
+  npts  = len(xvals)
+  xlist, ylist = xvals.tolist(), yvals.tolist()
+
+  # TH2
+  start = time.time()
+  ref   = [getbincontent(hist,x,y,clamp=clamp) for x, y in zip(xlist,ylist)]
+  time1 = time.time()-start
+
+  # SCALAR
+  start = time.time()
+  vals  = [table(x,y) for x, y in zip(xlist,ylist)]
+  time2 = time.time()-start
+
+  # BATCHED
+  start = time.time()
+  avals = table.evaluate(xvals,yvals)
+  time3 = time.time()-start
+
+  nfail = sum(v!=r for v, r in zip(vals,ref)) + int((avals!=np.array(ref)).sum())
+  print(">>> %-16s %10s %10s"%("method","us/call","speed-up"))
+  print(">>> %-16s %10.3f %10s"%("TH2::FindBin",1e6*time1/npts,"1.0"))
+  print(">>> %-16s %10.3f %10.1f"%("table(x,y)",1e6*time2/npts,time1/time2))
+  print(">>> %-16s %10.3f %10.1f"%("table.evaluate",1e6*time3/npts,time1/time3))
+  if nfail:
+    LOG.warning("Found %d differences between lookup table and histogram!"%(nfail))
+  else:
+    print(">>> Lookup table agrees with histogram for %d points!"%(npts))
+  return nfail
+
+
+def main(args):
+  npts  = args.npoints
+  tools = args.tools
+  era   = args.era
+  np.random.seed(args.seed)
+  nfail = 0
+
+  # SYNTHETIC TH2: variable binning in eta vs. pt
+  etabins = array('d',[-2.5,-2.1,-1.6,-1.2,-0.8,-0.3,0.0,0.3,0.8,1.2,1.6,2.1,2.5])
+  ptbins  = array('d',[20,25,30,40,50,60,80,100,150,200,500])
+  hist    = TH2D('sf','sf',len(etabins)-1,etabins,len(ptbins)-1,ptbins)
+  for i in range(0,hist.GetNcells()):
+    hist.SetBinContent(i,np.random.uniform(0.8,1.2))
+  etas    = np.random.uniform(-3.0,3.0,npts)
+  pts     = np.random.uniform(10.,600.,npts)
+  etas[:4] = [-2.5,2.5,0.0,0.3] # bin edges
+  pts[:4]  = [20.,500.,30.,100.]
+  nfail += benchmark("TH2, clamped (ScaleFactor, BTagWeightTool)",hist,etas,pts,clamp=True)
+  nfail += benchmark("TH2, with under/overflow (JetVetoMapTool)",hist,etas,pts,clamp=False)
+
+  # REAL TOOLS
+  if 'jetveto' in tools:
+    from TauFW.PicoProducer.corrections.JetVetoMapTool import JetVetoMapTool
+    tool  = JetVetoMapTool(era)
+    phis  = np.random.uniform(-3.2,3.2,npts)
+    etas  = np.random.uniform(-5.5,5.5,npts)
+    nfail += benchmark("JetVetoMapTool(%r)"%(era),tool.hist,etas,phis,clamp=False)
+  if 'pu' in tools:
+    from TauFW.PicoProducer.corrections.PileupTool import PileupWeightTool
+    tool  = PileupWeightTool(era)
+    npus  = np.random.uniform(0,120,npts).round()
+    start = time.time()
+    ref   = [tool.mchist.GetBinContent(tool.mchist.GetXaxis().FindBin(n)) for n in npus.tolist()]
+    time1 = time.time()-start
+    start = time.time()
+    vals  = tool.mctable.evaluate(npus)
+    time2 = time.time()-start
+    LOG.header("PileupWeightTool(%r)"%(era))
+    print(">>> TH1::FindBin: %.3f us/call, table.evaluate: %.3f us/call"%(1e6*time1/npts,1e6*time2/npts))
+    nfail += int((vals!=np.array(ref)).sum())
+
+  if nfail:
+    LOG.warning("Found %d differences in total!"%(nfail))
+  else:
+    print(">>> All lookup tables agree with their histograms!")
+
+
+if __name__ == "__main__":
+  from argparse import ArgumentParser
+  description = """Check and benchmark dense lookup tables against ROOT histograms."""
+  parser = ArgumentParser(prog="testLookupTable",description=description,epilog="Good luck!")
+  parser.add_argument('-n', '--npoints', type=int, default=20000,
+                                         help="number of random points, default=%(default)r" )
+  parser.add_argument('-t', '--tool',    dest='tools', nargs='+', default=[ ], choices=['jetveto','pu'],
+                                         help="also test lookup tables of these correction tools" )
+  parser.add_argument('-y', '--era',     default='2022_postEE',
+                                         help="era for correction tools, default=%(default)r" )
+  parser.add_argument('-s', '--seed',    type=int, default=1,
+                                         help="random seed, default=%(default)r" )
+  parser.add_argument('-v', '--verbose', dest='verbosity', type=int, nargs='?', const=1, default=0, action='store',
+                                         help="set verbosity" )
+  args = parser.parse_args()
+  LOG.verbosity = args.verbosity
+  main(args)
+  print("\n>>> Done.")
+
@@ -0,0 +1,93 @@
+#! /usr/bin/env python
+# Description: Check the vectorized generator-level mutau filter against the original loop over GenPart,
+#              per event (utils.filtermutau) and per file with RDataFrame (columnar.getmutaufilter)
+#   python3 test/testMuTauFilter.py DYJetsToLL_M-50_nano.root -m 20000
+import time
+import numpy as np
+from ROOT import TFile, TLorentzVector, RDataFrame
+from PhysicsTools.NanoAODTools.postprocessing.framework.datamodel import Collection, Event
+from PhysicsTools.NanoAODTools.postprocessing.framework.treeReaderArrayTools import InputTree
+from TauFW.common.tools.log import Logger
+from TauFW.PicoProducer.analysis.utils import filtermutau
+from TauFW.PicoProducer.analysis.columnar import getmutaufilter
+LOG = Logger('testMuTauFilter')
+
+
+def filtermutau_loop(event):
+  """Reference: Original loop over GenPart with Object.statusflag and TLorentzVector."""
+  muon = None
+  taus = [ ]
+  for particle in Collection(event,'GenPart'):
+    pid = abs(particle.pdgId)
+    if pid==13 and (particle.statusflag('isHardProcessTauDecayProduct') or particle.statusflag('isDirectHardProcessTauDecayProduct')):
+      if muon:
+        return False
+      muon = particle
+    elif pid==15 and particle.statusflag('fromHardProcess'):
+      if particle.status==2:
+        particle.pvis = TLorentzVector()
+        taus.append(particle)
+    elif pid>16:
+      for tau in taus:
+        if tau._index==particle.genPartIdxMother:
+          tau.pvis += particle.p4()
+  if len(taus)==2 and muon and muon.pt>18. and abs(muon.eta)<2.5:
+    if any(tau.pdgId*muon.pdgId<0 and tau.pvis.Pt()>18 and abs(tau.pvis.Eta())<2.5 for tau in taus):
+      return True
+  return False
+
+
+def main(args):
+  nfail = 0
+  for fname in args.infiles:
+    LOG.header(fname)
+    file  = TFile.Open(fname)
+    tree  = InputTree(file.Get('Events'))
+    nevts = tree.GetEntries() if args.maxevts==None else min(args.maxevts,tree.GetEntries())
+
+    # EVENT LOOP
+    start = time.time()
+    ref   = np.array([filtermutau_loop(Event(tree,i)) for i in range(nevts)])
+    time1 = time.time()-start
+    start = time.time()
+    vals  = np.array([filtermutau(Event(tree,i)) for i in range(nevts)])
+    time2 = time.time()-start
+
+    # RDATAFRAME
+    start = time.time()
+    rvals = getmutaufilter(RDataFrame('Events',fname).Range(nevts))
+    time3 = time.time()-start
+    file.Close()
+
+    ndiff1 = int((vals!=ref).sum())
+    ndiff2 = int((rvals!=ref).sum())
+    print(">>> Efficiency: %.4f%% (%d / %d events)"%(100.*ref.sum()/max(1,nevts),ref.sum(),nevts))
+    print(">>> %-24s %10s %10s %6s"%("method","us/event","speed-up","diffs"))
+    print(">>> %-24s %10.3f %10s %6s"%("loop",1e6*time1/nevts,"1.0",""))
+    print(">>> %-24s %10.3f %10.1f %6d"%("vectorized, per event",1e6*time2/nevts,time1/time2,ndiff1))
+    print(">>> %-24s %10.3f %10.1f %6d"%("RDataFrame",1e6*time3/nevts,time1/time3,ndiff2))
+    if args.verbosity>=1:
+      for i in np.flatnonzero((vals!=ref)|(rvals!=ref))[:20]:
+        print(">>>   entry %d: loop %r, per event %r, RDataFrame %r"%(i,ref[i],vals[i],rvals[i]))
+    nfail += ndiff1 + ndiff2
+
+  if nfail:
+    LOG.warning("Found %d differences in total!"%(nfail))
+  else:
+    print(">>> Vectorized mutau filter agrees with the loop!")
+
+
+if __name__ == "__main__":
+  from argparse import ArgumentParser
+  description = """Check and benchmark the vectorized generator-level mutau filter."""
+  parser = ArgumentParser(prog="testMuTauFilter",description=description,epilog="Good luck!")
+  parser.add_argument('infiles',         type=str, nargs='+', action='store',
+                                         help="input nanoAOD files of DY samples" )
+  parser.add_argument('-m','--maxevts',  dest='maxevts', type=int, default=None,
+                                         help='maximum number of events (per file) to process')
+  parser.add_argument('-v', '--verbose', dest='verbosity', type=int, nargs='?', const=1, default=0, action='store',
+                                         help="set verbosity" )
+  args = parser.parse_args()
+  LOG.verbosity = args.verbosity
+  main(args)
+  print("\n>>> Done.")
@@ -0,0 +1,113 @@
+#! /usr/bin/env python
+# Description: Test the conservative module preselection (ModuleTauPair.getpreselection) for a job
+#              with input files that have different trigger branches: the cut must not be built
+#              from the first file only, because it is passed to the PostProcessor for all files
+#   python3 test/testPreselection.py -n 1000
+import os, shutil, tempfile
+from array import array
+import numpy as np
+from ROOT import TFile, TTree, gDirectory
+from TauFW.common.tools.log import Logger
+from TauFW.PicoProducer.analysis.ModuleTauPair import ModuleTauPair, getcommonbranches
+LOG = Logger('testPreselection')
+
+
+class DummyModule:
+  """Minimal module with the attributes used by getpreselection."""
+  def __init__(self):
+    self.trigger    = lambda e: e.HLT_IsoMu24 or e.HLT_IsoMu27
+    self.preselobjs = { 'Muon': 1, 'Tau': 1 }
+
+
+def createfile(fname, nevts, paths):
+  """Create nanoAOD-like file with random trigger bits for the given HLT paths, and random object multiplicities."""
+  file = TFile(fname,'RECREATE')
+  tree = TTree('Events','Events')
+  nmuo = array('i',[0])
+  ntau = array('i',[0])
+  bits = { p: array('b',[0]) for p in paths } # Bool_t
+  tree.Branch('nMuon',nmuo,'nMuon/I')
+  tree.Branch('nTau',ntau,'nTau/I')
+  for path in paths:
+    tree.Branch(path,bits[path],'%s/O'%(path))
+  rows = [ ]
+  for i in range(nevts):
+    nmuo[0] = np.random.randint(0,3)
+    ntau[0] = np.random.randint(0,3)
+    for path in paths:
+      bits[path][0] = np.random.uniform()<0.3
+    rows.append((nmuo[0],ntau[0],{ p: bool(bits[p][0]) for p in paths }))
+    tree.Fill()
+  file.Write()
+  file.Close()
+  return rows
+
+
+def getselected(fname, cut):
+  """Get entries selected by TTreeFormula, like the PostProcessor."""
+  file = TFile.Open(fname,'READ')
+  tree = file.Get('Events')
+  tree.Draw('>>elist',cut,'entrylist')
+  elist   = gDirectory.Get('elist')
+  entries = set(elist.GetEntry(i) for i in range(elist.GetN()))
+  file.Close()
+  return entries
+
+
+def main(args):
+  np.random.seed(args.seed)
+  outdir = tempfile.mkdtemp(prefix="testPreselection_")
+  module = DummyModule()
+  fname1 = os.path.join(outdir,"nano_1.root")
+  fname2 = os.path.join(outdir,"nano_2.root")
+  rows1  = createfile(fname1,args.nevts,['HLT_IsoMu24','HLT_IsoMu27'])
+  rows2  = createfile(fname2,args.nevts,['HLT_IsoMu24'])
+  nfail  = 0
+
+  # AVAILABLE PATHS
+  common, partial = getcommonbranches([fname1,fname2],['HLT_IsoMu24','HLT_IsoMu27'])
+  print(">>> Paths in all files: %s, only in some files: %s"%(common,partial))
+  if common!=['HLT_IsoMu24'] or partial!=['HLT_IsoMu27']:
+    LOG.warning("Unexpected common (%r) or partial (%r) paths!"%(common,partial))
+    nfail += 1
+
+  # FILES DISAGREE: no preselection
+  for fnames in [[fname1,fname2],[fname2,fname1]]:
+    cut = ModuleTauPair.getpreselection(module,fnames)
+    print(">>> Preselection for %s: %r"%(', '.join(os.path.basename(f) for f in fnames),cut))
+    if cut!=None:
+      LOG.warning("Got preselection %r for input files with different trigger paths!"%(cut))
+      nfail += 1
+
+  # FILES AGREE: cut keeps all events firing an available path, and TTreeFormula compiles for all files
+  for fname, rows in [(fname1,rows1),(fname2,rows2)]:
+    cut  = ModuleTauPair.getpreselection(module,[fname,fname])
+    refs = set(i for i, (nmuo, ntau, bits) in enumerate(rows) if nmuo>=1 and ntau>=1 and any(bits.values()))
+    sels = getselected(fname,cut)
+    print(">>> Preselection for %s: %r, selected %d / %d events (reference %d)"%(
+      os.path.basename(fname),cut,len(sels),len(rows),len(refs)))
+    if sels!=refs:
+      LOG.warning("Preselection %r lost %d events and kept %d extra events!"%(cut,len(refs-sels),len(sels-refs)))
+      nfail += 1
+
+  shutil.rmtree(outdir)
+  if nfail:
+    LOG.warning("Found %d differences in total!"%(nfail))
+  else:
+    print(">>> Preselection is only applied if all input files have the same trigger paths!")
+
+
+if __name__ == "__main__":
+  from argparse import ArgumentParser
+  description = """Test the module preselection for input files with different trigger branches."""
+  parser = ArgumentParser(prog="testPreselection",description=description,epilog="Good luck!")
+  parser.add_argument('-n','--nevts',    type=int, default=1000,
+                                         help="number of events per file, default=%(default)d" )
+  parser.add_argument('-S', '--seed',    type=int, default=1,
+                                         help="random seed, default=%(default)r" )
+  parser.add_argument('-v', '--verbose', dest='verbosity', type=int, nargs='?', const=1, default=0, action='store',
+                                         help="set verbosity" )
+  args = parser.parse_args()
+  LOG.verbosity = args.verbosity
+  main(args)
+  print("\n>>> Done.")
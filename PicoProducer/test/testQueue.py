@@ -0,0 +1,125 @@
+#! /usr/bin/env python
+# Description: Test that the batch queue is queried once for all samples, using a local stand-in for condor_q
+#              that prints fake jobs in the same format as condor_q -format, and counts its calls
+#   test/testQueue.py -n 200 -j 50
+import os, stat, shutil, tempfile
+from TauFW.common.tools.log import Logger
+from TauFW.PicoProducer.batch.HTCondor import HTCondor
+from TauFW.PicoProducer.batch.BatchSystem import BatchSystem
+LOG = Logger('testQueue')
+
+
+def createcondorq(bindir, rows):
+  """Create executable condor_q that prints fake job rows (user clusterid procid status args),
+  only of the requested cluster IDs (if any), and counts its calls in a file."""
+  qname = os.path.join(bindir,"condor_q")
+  fname = os.path.join(bindir,"condor_q.rows")
+  cname = os.path.join(bindir,"condor_q.calls")
+  with open(fname,'w') as file:
+    for row in rows:
+      file.write("%s %d %d %d %s\n"%row)
+  with open(qname,'w') as file:
+    file.write("#! /bin/bash\n")
+    file.write("echo x >> %s\n"%(cname))
+    file.write("ids=\"\"\n")
+    file.write("for arg in \"$@\"; do [[ $arg =~ ^[0-9]+$ ]] && ids=\"$ids $arg\"; [[ $arg == -* ]] && break; done\n")
+    file.write("while read -r row; do\n")
+    file.write("  id=$(echo $row | cut -d' ' -f2)\n")
+    file.write("  if [[ -z $ids || \" $ids \" == *\" $id \"* ]]; then echo \"$row\"; fi\n")
+    file.write("done < %s\n"%(fname))
+  os.chmod(qname,os.stat(qname).st_mode|stat.S_IEXEC|stat.S_IXGRP|stat.S_IXOTH)
+  return cname
+
+
+def ncalls(cname):
+  """Number of condor_q calls so far."""
+  if not os.path.isfile(cname):
+    return 0
+  with open(cname) as file:
+    return len(file.readlines())
+
+
+def main(args):
+  nsamples = args.nsamples
+  njobs    = args.njobs
+  bindir   = tempfile.mkdtemp(prefix="testQueue_")
+  os.environ['PATH'] = bindir+os.pathsep+os.environ['PATH']
+
+  # FAKE QUEUE: one cluster per sample, njobs tasks per cluster
+  rows   = [ ]
+  jobids = { }
+  for i in range(nsamples):
+    jobid = 1000+i
+    jobids["sample%d"%(i)] = [jobid]
+    for task in range(njobs):
+      status = 1 if task%3 else 2 # idle or running
+      rows.append(('user',jobid,task,status,"python3 picojob.py -y UL2018 -c mutau -i nano_%d_%d.root"%(i,task)))
+  cname = createcondorq(bindir,rows)
+  batch = HTCondor(verb=args.verbosity)
+
+  # OLD: one query per sample
+  print(">>> Querying per sample...")
+  old = { }
+  for sample, ids in jobids.items():
+    old[sample] = [(j.jobid,j.taskid,j.status,j.args) for j in batch.jobs(ids,verb=args.verbosity)]
+  ncalls_old = ncalls(cname)
+
+  # NEW: one query for all samples, select each sample's slice from index
+  print(">>> Querying once for all samples...")
+  BatchSystem._queue.clear()
+  new = { }
+  for sample, ids in jobids.items():
+    batch_ = HTCondor(verb=args.verbosity) # new instance per sample, like getbatch in checkchunks
+    new[sample] = [(j.jobid,j.taskid,j.status,j.args) for j in batch_.alljobs(verb=args.verbosity).select(ids)]
+  ncalls_new = ncalls(cname)-ncalls_old
+
+  # COMPARE
+  ndiffs = 0
+  for sample in jobids:
+    if old[sample]!=new[sample]:
+      ndiffs += 1
+      if args.verbosity>=1:
+        print(">>>   %s: per sample %s, indexed %s"%(sample,old[sample][:2],new[sample][:2]))
+
+  # SUBMIT: new cluster is missing from queried and cached queue, until it is cleared
+  print(">>> Submitting new cluster...")
+  newid = 1000+nsamples
+  BatchSystem._queue.clear()
+  batch.alljobs(maxage=3600,verb=args.verbosity) # query before submission, and write cache file
+  with open(os.path.join(bindir,"condor_q.rows"),'a') as file:
+    file.write("user %d 0 1 python3 picojob.py -i nano_new.root\n"%(newid))
+  batch.clearqueue(verb=args.verbosity) # like main_submit after successful submission
+  if os.path.isfile(batch.queuecache()):
+    LOG.warning("Cache file %s was not removed!"%(batch.queuecache()))
+    ndiffs += 1
+  newjobs = batch.alljobs(maxage=3600,verb=args.verbosity).select([newid])
+  batch.clearqueue(verb=args.verbosity)
+  if len(newjobs)!=1:
+    LOG.warning("Expected one job of new cluster %d after clearing the queue, but found %d!"%(newid,len(newjobs)))
+    ndiffs += 1
+  print(">>> %-24s %6s %6s"%("","calls","jobs"))
+  print(">>> %-24s %6d %6d"%("query per sample",ncalls_old,sum(len(j) for j in old.values())))
+  print(">>> %-24s %6d %6d"%("query once",ncalls_new,sum(len(j) for j in new.values())))
+  shutil.rmtree(bindir)
+  if ncalls_new!=1:
+    LOG.warning("Expected one condor_q call, but found %d!"%(ncalls_new))
+  if ndiffs:
+    LOG.warning("Found %d differences in total!"%(ndiffs))
+  elif ncalls_new==1:
+    print(">>> One query for %d samples gives the same jobs as one query per sample!"%(nsamples))
+
+
+if __name__ == "__main__":
+  from argparse import ArgumentParser
+  description = """Test that the batch queue is queried once for all samples."""
+  parser = ArgumentParser(prog="testQueue",description=description,epilog="Good luck!")
+  parser.add_argument('-n','--nsamples', type=int, default=100,
+                                         help="number of samples (clusters), default=%(default)d" )
+  parser.add_argument('-j','--njobs',    type=int, default=20,
+                                         help="number of jobs per sample, default=%(default)d" )
+  parser.add_argument('-v', '--verbose', dest='verbosity', type=int, nargs='?', const=1, default=0, action='store',
+                                         help="set verbosity" )
+  args = parser.parse_args()
+  LOG.verbosity = args.verbosity
+  main(args)
+  print("\n>>> Done.")
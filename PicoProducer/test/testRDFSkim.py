@@ -0,0 +1,189 @@
+#! /usr/bin/env python
+# Description: Test the RDataFrame skim with a preselection that mixes collections of different lengths,
+#              e.g. skimjob's "HLT_IsoMu27 && Muon_pt>28 && Tau_pt>18", against a reference in python,
+#              and check that terms on the same collection are applied to the same instance,
+#              like TTreeFormula (PostProcessor), and compare the output layout (events, cutflow and sums of
+#              weights per index) to the PostProcessor with the Bookkeeper
+#   python3 test/testRDFSkim.py -n 2000
+import os, shutil, tempfile
+from array import array
+import numpy as np
+from ROOT import TFile, TTree, gDirectory
+from TauFW.common.tools.log import Logger
+from TauFW.PicoProducer.processors.rdfskim import skim, translatecut, getarrays, getcounters, cancut
+LOG = Logger('testRDFSkim')
+
+
+def createfile(fname, nevts, nmax=4):
+  """Create nanoAOD-like file with random muons and taus of independent multiplicity,
+  and random generator weights and arrays of weights."""
+  file = TFile(fname,'RECREATE')
+  tree = TTree('Events','Events')
+  evt  = array('L',[0])
+  trig = array('b',[0]) # Bool_t
+  nmuo = array('i',[0])
+  ntau = array('i',[0])
+  mupt = array('f',[0.]*nmax)
+  muid = array('b',[0]*nmax) # Bool_t
+  taupt = array('f',[0.]*nmax)
+  genw = array('f',[0.])
+  weights = { w: (array('i',[0]),array('f',[0.]*n)) for w, n in [('LHEScaleWeight',9),('LHEPdfWeight',4),('PSWeight',4)] }
+  tree.Branch('event',evt,'event/l')
+  tree.Branch('HLT_IsoMu27',trig,'HLT_IsoMu27/O')
+  tree.Branch('nMuon',nmuo,'nMuon/I')
+  tree.Branch('Muon_pt',mupt,'Muon_pt[nMuon]/F')
+  tree.Branch('Muon_mediumId',muid,'Muon_mediumId[nMuon]/O')
+  tree.Branch('nTau',ntau,'nTau/I')
+  tree.Branch('Tau_pt',taupt,'Tau_pt[nTau]/F')
+  tree.Branch('genWeight',genw,'genWeight/F')
+  for wname, (nwgt, wgts) in weights.items():
+    tree.Branch('n'+wname,nwgt,'n%s/I'%(wname))
+    tree.Branch(wname,wgts,'%s[n%s]/F'%(wname,wname))
+  rows = [ ]
+  np.random.seed(1)
+  for i in range(nevts):
+    evt[0]  = i
+    trig[0] = np.random.uniform()<0.8
+    nmuo[0] = np.random.randint(0,nmax+1)
+    ntau[0] = np.random.randint(0,nmax+1)
+    for j in range(nmuo[0]):
+      mupt[j] = np.random.uniform(10,50)
+      muid[j] = np.random.uniform()<0.5
+    for j in range(ntau[0]):
+      taupt[j] = np.random.uniform(10,40)
+    genw[0] = np.random.choice([-1,1])*np.random.uniform(0.5,2)
+    for wname, (nwgt, wgts) in weights.items():
+      nwgt[0] = len(wgts) if wname!='LHEPdfWeight' else np.random.randint(0,len(wgts)+1) # variable length
+      for j in range(nwgt[0]):
+        wgts[j] = np.random.uniform(0.5,1.5)
+    rows.append((bool(trig[0]),list(zip(mupt[:nmuo[0]],muid[:nmuo[0]])),list(taupt[:ntau[0]])))
+    tree.Fill()
+  file.Write()
+  file.Close()
+  return rows
+
+
+def getevents(fname, cut=None):
+  """Get event numbers in output file, or selected by TTreeFormula."""
+  file = TFile.Open(fname,'READ')
+  tree = file.Get('Events')
+  if cut: # like the PostProcessor
+    tree.Draw('>>elist',cut,'entrylist')
+    elist  = gDirectory.Get('elist')
+    events = set(elist.GetEntry(i) for i in range(elist.GetN()))
+  else:
+    events = set()
+    for evt in tree:
+      events.add(int(evt.event))
+  file.Close()
+  return events
+
+
+def getoutput(fname):
+  """Get event numbers, cutflow and sums of weights per index in the output file of a skim."""
+  events = getevents(fname)
+  file   = TFile.Open(fname,'READ')
+  hists  = { }
+  for key in file.GetListOfKeys():
+    if key.GetName()=='cutflow' or key.GetName().startswith('sumw_'):
+      hist = key.ReadObj()
+      hists[key.GetName()] = [hist.GetBinContent(i) for i in range(1,hist.GetXaxis().GetNbins()+1)]
+  file.Close()
+  return events, hists
+
+
+def skimpostprocessor(fname, outdir, cut, postfix='_pp'):
+  """Skim with nanoAOD-tools' PostProcessor and the Bookkeeper, like skimjob.py."""
+  from PhysicsTools.NanoAODTools.postprocessing.framework.postprocessor import PostProcessor
+  from TauFW.PicoProducer.processors.Bookkeeper import Bookkeeper
+  p = PostProcessor(outdir,[fname],cut=cut,modules=[Bookkeeper()],postfix=postfix,noOut=False)
+  p.run()
+  return os.path.join(outdir,os.path.basename(fname).replace('.root',postfix+'.root'))
+
+
+def compareengines(fname, outdir, cut, nthreads=1, verb=0):
+  """Compare the output of the RDataFrame skim to the PostProcessor with Bookkeeper."""
+  ndiffs  = 0
+  rdfname = skim([fname],outdir,postfix='_rdf',cut=cut,nthreads=nthreads,cutflow=True,verb=verb)[0]
+  ppfname = skimpostprocessor(fname,outdir,cut)
+  rdevents, rdhists = getoutput(rdfname)
+  ppevents, pphists = getoutput(ppfname)
+  print(">>> %r: RDataFrame %d events, PostProcessor %d events"%(cut,len(rdevents),len(ppevents)))
+  if rdevents!=ppevents:
+    LOG.warning("Skimmed events differ between engines: %d missing, %d extra!"%(len(ppevents-rdevents),len(rdevents-ppevents)))
+    ndiffs += 1
+  for name in sorted(set(rdhists)|set(pphists)):
+    if name not in rdhists or name not in pphists:
+      LOG.warning("Histogram %r only written by %s!"%(name,"RDataFrame" if name in rdhists else "PostProcessor"))
+      ndiffs += 1
+    elif not np.allclose(rdhists[name],pphists[name],rtol=1e-6):
+      LOG.warning("Histogram %r differs between engines: %r vs. %r"%(name,rdhists[name],pphists[name]))
+      ndiffs += 1
+  print(">>> Compared histograms: %s"%(', '.join(sorted(pphists))))
+  return ndiffs
+
+
+def main(args):
+  outdir = tempfile.mkdtemp(prefix="testRDFSkim_")
+  fname  = os.path.join(outdir,"nano.root")
+  rows   = createfile(fname,args.nevts)
+  cuts   = [ # cut -> reference selection
+    ("HLT_IsoMu27 && Muon_pt>28 && Muon_mediumId", # same muon passes pt and ID, like TTreeFormula
+     lambda trig, muons, taupts: trig and any(p>28 and i for p, i in muons)),
+    ("HLT_IsoMu27 && Muon_pt>28 && Tau_pt>18",
+     lambda trig, muons, taupts: trig and any(p>28 for p, i in muons) and any(p>18 for p in taupts)),
+    ("HLT_IsoMu27 && Muon_pt>28 && Tau_pt>18 && Muon_mediumId",
+     lambda trig, muons, taupts: trig and any(p>28 and i for p, i in muons) and any(p>18 for p in taupts)),
+  ]
+  nfail  = 0
+
+  # TRANSLATE
+  file = TFile.Open(fname,'READ')
+  arrays = getarrays(file.Get('Events'))
+  file.Close()
+  for cut, _ in cuts:
+    print(">>> Translated %r -> %r"%(cut,translatecut(cut,arrays)))
+  for cut in ["Muon_pt+Tau_pt>50","Muon_pt>28 && (Muon_mediumId || Tau_pt>30)"]:
+    if cancut(cut,fname):
+      LOG.warning("Cut %r combines different collections element-wise, and should not be translatable!"%(cut))
+      nfail += 1
+
+  # SKIM
+  for cut, select in cuts:
+    skim([fname],outdir,postfix='_skim',cut=cut,nthreads=args.nthreads,verb=args.verbosity)
+    events  = getevents(os.path.join(outdir,"nano_skim.root"))
+    refs    = set(i for i, row in enumerate(rows) if select(*row))
+    formula = getevents(fname,cut)
+    print(">>> %r: Selected %d / %d events (reference %d, TTreeFormula %d)"%(cut,len(events),len(rows),len(refs),len(formula)))
+    if events!=refs:
+      LOG.warning("Skimmed events differ from reference: %d missing, %d extra!"%(len(refs-events),len(events-refs)))
+      nfail += 1
+    if len(getcounters(cut,arrays))<=1 and formula!=events: # TTreeFormula's instances of arrays with
+      LOG.warning("Skimmed events differ from TTreeFormula: %d missing, %d extra!"%( # different lengths are ill-defined
+        len(formula-events),len(events-formula)))
+      nfail += 1
+
+  # COMPARE ENGINES
+  nfail += compareengines(fname,outdir,cuts[0][0],nthreads=args.nthreads,verb=args.verbosity)
+
+  shutil.rmtree(outdir)
+  if nfail:
+    LOG.warning("Found %d differences in total!"%(nfail))
+  else:
+    print(">>> RDataFrame skim with mixed collections agrees with reference!")
+
+
+if __name__ == "__main__":
+  from argparse import ArgumentParser
+  description = """Test the RDataFrame skim with a cut on several collections."""
+  parser = ArgumentParser(prog="testRDFSkim",description=description,epilog="Good luck!")
+  parser.add_argument('-n','--nevts',    type=int, default=2000,
+                                         help="number of events, default=%(default)d" )
+  parser.add_argument('-t','--nthreads', type=int, default=1,
+                                         help="number of threads, default=%(default)d" )
+  parser.add_argument('-v', '--verbose', dest='verbosity', type=int, nargs='?', const=1, default=0, action='store',
+                                         help="set verbosity" )
+  args = parser.parse_args()
+  LOG.verbosity = args.verbosity
+  main(args)
+  print("\n>>> Done.")
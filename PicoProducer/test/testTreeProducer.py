@@ -0,0 +1,151 @@
+#! /usr/bin/env python
+# Description: Check and benchmark buffered filling of TreeProducer against filling the tree per event,
+#              for a tree with a similar number and types of branches as TreeProducerMuTau
+#   python3 test/testTreeProducer.py
+#   python3 test/testTreeProducer.py -n 200000 -b 100 1000 10000
+import os, time
+import numpy as np
+from ROOT import TFile
+from TauFW.common.tools.log import Logger
+from TauFW.PicoProducer.analysis.TreeProducer import TreeProducer
+LOG = Logger('testTreeProducer')
+branches = ( # (name, dtype, kwargs), similar to TreeProducerMuTau
+  [('run','i',{ }),('lumi','i',{ }),('evt','L',{ }),('trigger','?',{ })] +
+  [('float_%d'%i,'f',{ 'default': -1 }) for i in range(150)] +
+  [('int_%d'%i,'i',{ 'default': -1 }) for i in range(30)] +
+  [('bool_%d'%i,'?',{ }) for i in range(10)] +
+  [('byte_%d'%i,'b',{ }) for i in range(5)] +
+  [('double_%d'%i,'d',{ }) for i in range(3)] +
+  [('npdf','i',{ }),('pdfweight','f',{ 'len': 'npdf', 'max': 110 }),('scaleweight','f',{ 'len': 9 })]
+)
+
+
+class DummyModule:
+  verbosity = 0
+
+
+def fillevent(out, values, i):
+  """Set the branches like an analysis module: only some branches are set per event,
+  the others keep the value of the previous event."""
+  out.run[0]  = 1
+  out.lumi[0] = i//1000
+  out.evt[0]  = i
+  out.trigger[0] = values[i,0]>0.5
+  for j in range(150):
+    if j%3==i%3: continue # keep previous value
+    getattr(out,'float_%d'%j)[0] = values[i,j]
+  for j in range(30):
+    getattr(out,'int_%d'%j)[0] = int(10*values[i,j])
+  for j in range(10):
+    getattr(out,'bool_%d'%j)[0] = values[i,j]>0.3
+  for j in range(5):
+    getattr(out,'byte_%d'%j)[0] = int(100*values[i,j])
+  for j in range(3):
+    getattr(out,'double_%d'%j)[0] = values[i,j]
+  npdf = 100+i%10
+  out.npdf[0] = npdf
+  out.pdfweight[:npdf] = values[i,:npdf]
+  out.scaleweight[:] = values[i,:9]
+
+
+def produce(fname, values, buffer=0, nvars=0):
+  """Fill tree (and variations) with or without buffer, and return the total time,
+  and the time spent in filling the trees."""
+  out = TreeProducer(fname,DummyModule(),ncuts=0,buffer=buffer)
+  for name, dtype, kwargs in branches:
+    out.addBranch(name,dtype,**kwargs)
+  vnames = ['var%d'%i for i in range(nvars)]
+  for vname in vnames:
+    out.addVariation(vname)
+  start = time.time()
+  ftime = 0
+  for i in range(len(values)):
+    fillevent(out,values,i)
+    fstart = time.time()
+    out.fill()
+    for vname in vnames: # like ModuleTauPair.analyzevars
+      out.setVariation(vname)
+      out.float_0[0] = -values[i,0]
+      out.fill()
+      out.setVariation(None)
+    ftime += time.time()-fstart
+  fstart = time.time()
+  for name in list(out.buffers):
+    out.flush(name)
+  ftime += time.time()-fstart
+  dtime = time.time()-start
+  out.display = False
+  out.endJob()
+  return dtime, ftime
+
+
+def compare(fname1, fname2, treename='tree'):
+  """Compare all entries of the trees in two files."""
+  file1, file2 = TFile.Open(fname1), TFile.Open(fname2)
+  tree1, tree2 = file1.Get(treename), file2.Get(treename)
+  ndiffs = 0
+  if tree1.GetEntries()!=tree2.GetEntries():
+    print(">>>   %s: %d vs. %d entries"%(treename,tree1.GetEntries(),tree2.GetEntries()))
+    ndiffs += 1
+  names = [b.GetName() for b in tree1.GetListOfBranches()]
+  for i in range(min(tree1.GetEntries(),tree2.GetEntries())):
+    tree1.GetEntry(i)
+    tree2.GetEntry(i)
+    for name in names:
+      value1, value2 = getattr(tree1,name), getattr(tree2,name)
+      if hasattr(value1,'__len__'):
+        value1, value2 = list(value1), list(value2)
+      if value1!=value2:
+        if ndiffs<20:
+          print(">>>   %s, entry %d, %s: %r vs. %r"%(treename,i,name,value1,value2))
+        ndiffs += 1
+  file1.Close()
+  file2.Close()
+  return ndiffs
+
+
+def main(args):
+  np.random.seed(args.seed)
+  values = np.random.uniform(0,1,(args.nevts,150))
+  fname0 = "testTreeProducer_nobuffer.root"
+  time0, ftime0 = produce(fname0,values,nvars=args.nvars)
+  print(">>> %d branches, %d events, %d variation(s)"%(len(branches),args.nevts,args.nvars))
+  print(">>> %-12s %10s %10s %10s %6s"%("buffer","us/event","fill only","speed-up","diffs"))
+  print(">>> %-12s %10.3f %10.3f %10s %6s"%("none",1e6*time0/args.nevts,1e6*ftime0/args.nevts,"1.0",""))
+  nfail = 0
+  for buffer in args.buffers:
+    fname = "testTreeProducer_buffer%d.root"%(buffer)
+    dtime, ftime = produce(fname,values,buffer=buffer,nvars=args.nvars)
+    ndiffs = sum(compare(fname0,fname,t) for t in ['tree']+['tree_var%d'%i for i in range(args.nvars)])
+    print(">>> %-12d %10.3f %10.3f %10.1f %6d"%(buffer,1e6*dtime/args.nevts,1e6*ftime/args.nevts,ftime0/ftime,ndiffs))
+    nfail += ndiffs
+    if not args.keep:
+      os.remove(fname)
+  if not args.keep:
+    os.remove(fname0)
+  if nfail:
+    LOG.warning("Found %d differences in total!"%(nfail))
+  else:
+    print(">>> Buffered trees agree with trees filled per event!")
+
+
+if __name__ == "__main__":
+  from argparse import ArgumentParser
+  description = """Check and benchmark buffered filling of TreeProducer."""
+  parser = ArgumentParser(prog="testTreeProducer",description=description,epilog="Good luck!")
+  parser.add_argument('-n','--nevts',    type=int, default=20000,
+                                         help="number of events to fill, default=%(default)r" )
+  parser.add_argument('-b','--buffers',  type=int, nargs='+', default=[100,1000,10000],
+                                         help="buffer sizes to test, default=%(default)r" )
+  parser.add_argument('-V','--nvars',    type=int, default=1,
+                                         help="number of variation trees, default=%(default)r" )
+  parser.add_argument('-k','--keep',     action='store_true',
+                                         help="keep output files" )
+  parser.add_argument('-S', '--seed',    type=int, default=1,
+                                         help="random seed, default=%(default)r" )
+  parser.add_argument('-v', '--verbose', dest='verbosity', type=int, nargs='?', const=1, default=0, action='store',
+                                         help="set verbosity" )
+  args = parser.parse_args()
+  LOG.verbosity = args.verbosity
+  main(args)
+  print("\n>>> Done.")
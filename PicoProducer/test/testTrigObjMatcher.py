@@ -0,0 +1,98 @@
+#! /usr/bin/env python
+# Description: Check and benchmark the indexed TrigObjMatcher against the original matching,
+#              which loops over the TrigObj collection for every reco object
+#   python3 test/testTrigObjMatcher.py nano.root -y 2018 -m 10000
+import os, time
+from PhysicsTools.NanoAODTools.postprocessing.framework.datamodel import Collection, Event
+from PhysicsTools.NanoAODTools.postprocessing.framework.treeReaderArrayTools import InputTree
+from ROOT import TFile
+from TauFW.common.tools.log import Logger
+from TauFW.PicoProducer import datadir
+from TauFW.PicoProducer.corrections.TrigObjMatcher import TrigObjMatcher
+LOG = Logger('testTrigObjMatcher')
+
+
+class LoopMatcher:
+  """Reference: Original matching with eval'd trigger lambdas, and a loop over all trigger objects per call."""
+
+  def __init__(self, matcher):
+    self.matcher = matcher
+    self.types   = matcher.types
+    self.firedfuncs = [eval(t.fireddef) for t in matcher.triggers]
+    self.fired = eval(matcher.fireddef)
+
+  def match(self, event, recoObj, leg=1, dR=0.2):
+    leg     -= 1 # index starting at 0
+    trigObjs = [o for o in Collection(event,'TrigObj') if o.id==self.matcher.ids[leg]]
+    for trigger, fired in zip(self.matcher.triggers,self.firedfuncs):
+      if not fired(event): continue
+      for trigObj in trigObjs:
+        if trigger.filters[leg].matchbits(trigObj) and trigger.filters[leg].match(trigObj,recoObj,dR=dR):
+          return trigObj
+    return None
+
+
+def loop(matcher, tree, nevts):
+  """Check if any trigger fired and match all reco objects for each leg in each event.
+  Return list of results per event, and the time per event."""
+  results = [ ]
+  start   = time.time()
+  for i in range(nevts):
+    event  = Event(tree,i)
+    result = [bool(matcher.fired(event))]
+    for leg, type in enumerate(matcher.types,1):
+      for obj in Collection(event,type):
+        trigObj = matcher.match(event,obj,leg=leg)
+        result.append(trigObj._index if trigObj else -1)
+    results.append(result)
+  return results, (time.time()-start)/max(1,nevts)
+
+
+def main(args):
+  jsonfile = os.path.join(datadir,"trigger/tau_triggers_%s.json"%(args.year))
+  nfail = 0
+  for fname in args.infiles:
+    LOG.header(fname)
+    file  = TFile.Open(fname)
+    tree  = InputTree(file.Get('Events'))
+    nevts = tree.GetEntries() if args.maxevts==None else min(args.maxevts,tree.GetEntries())
+    print(">>> %-14s %10s %10s %10s %6s"%("trigger","loop [us]","index [us]","speed-up","diffs"))
+    for trigger in args.triggers:
+      matcher = TrigObjMatcher(jsonfile,trigger=trigger,isdata=args.isdata)
+      ref, time1 = loop(LoopMatcher(matcher),tree,nevts)
+      new, time2 = loop(matcher,tree,nevts)
+      ndiffs = 0
+      for i, (result1, result2) in enumerate(zip(ref,new)):
+        if result1!=result2:
+          if args.verbosity>=1 and ndiffs<20:
+            print(">>>   entry %d: loop %r, index %r"%(i,result1,result2))
+          ndiffs += 1
+      print(">>> %-14s %10.2f %10.2f %10.1f %6d"%(trigger,1e6*time1,1e6*time2,time1/time2,ndiffs))
+      nfail += ndiffs
+    file.Close()
+  if nfail:
+    LOG.warning("Found %d differences in total!"%(nfail))
+  else:
+    print(">>> Indexed matching agrees with the original!")
+
+
+if __name__ == "__main__":
+  from argparse import ArgumentParser
+  description = """Check and benchmark the indexed trigger object matching."""
+  parser = ArgumentParser(prog="testTrigObjMatcher",description=description,epilog="Good luck!")
+  parser.add_argument('infiles',         type=str, nargs='+', action='store',
+                                         help="input nanoAOD files" )
+  parser.add_argument('-y','--year',     type=int, default=2018,
+                                         help="year of trigger JSON file, default=%(default)r" )
+  parser.add_argument('-t','--trigger',  dest='triggers', nargs='+', default=['SingleMuon','SingleElectron','ditau'],
+                                         help="trigger combinations to test, default=%(default)r" )
+  parser.add_argument('-D','--data',     dest='isdata', action='store_true',
+                                         help="use triggers for data" )
+  parser.add_argument('-m','--maxevts',  dest='maxevts', type=int, default=None,
+                                         help='maximum number of events (per file) to process')
+  parser.add_argument('-v', '--verbose', dest='verbosity', type=int, nargs='?', const=1, default=0, action='store',
+                                         help="set verbosity" )
+  args = parser.parse_args()
+  LOG.verbosity = args.verbosity
+  main(args)
+  print("\n>>> Done.")
@@ -3,7 +3,8 @@
 import os, re
 from TauFW.Plotter.sample.utils import *
 from TauFW.common.tools.math import round2digit, reldiff
-from TauFW.common.tools.RDataFrame import RDF, RDataFrame, AddRDFColumn
+from TauFW.common.tools.RDataFrame import RDF, RDataFrame, AddRDFColumn, GetRDataFrame,\
+                                          isRNTuple, GetRNTupleEntries, GetStoredAliases
 from TauFW.Plotter.sample.ResultDict import ResultDict, MeanResult # for containing RDataFRame RResultPtr
 from TauFW.Plotter.plot.string import *
 from TauFW.Plotter.plot.utils import deletehist, printhist
@@ -187,6 +188,8 @@ class Sample(object):
     verbosity = LOG.getverbosity(kwargs)
     file = self.getfile()
     tree = file.Get(self.treename)
+    if isRNTuple(file,self.treename):
+      LOG.throw(IOError,'Sample.get_file_and_tree: %r for %r in %s is a RNTuple, please use RDataFrame!'%(self.treename,self.name,self.filename))
     if not tree or not isinstance(tree,TTree):
       LOG.throw(IOError,'Sample.get_file_and_tree: Could not find tree %r for %r in %s!'%(self.treename,self.name,self.filename))
     setaliases(tree,verb=verbosity-1,**self.aliases)
@@ -195,7 +198,12 @@ class Sample(object):
   
   def getentries_from_tree(self,cut=None):
     file  = self.getfile()
-    if cut==None:
+    if isRNTuple(file,self.treename):
+      if cut==None:
+        nevts = GetRNTupleEntries(self.treename,self.filename)
+      else:
+        nevts = GetRDataFrame(self.treename,self.filename,rntuple=True).Filter(cut).Count().GetValue()
+    elif cut==None:
       nevts = file.Get(self.treename).GetEntries()
     else:
       nevts = file.Get(self.treename).GetEntries(cut)
@@ -594,6 +602,17 @@ class Sample(object):
     self.splitsamples = splitsamples # save list of split samples
     return splitsamples
   
+  def isrntuple(self):
+    """Check if the tree is stored as RNTuple (see PicoProducer's TreeProducer with backend=rntuple).
+    The aliases stored in the file are cached as well, because RNTuples do not support aliases."""
+    key = (self.filename,self.treename) # cache per file, in case the sample was cloned
+    if getattr(self,'_rntuple',(None,))[0]!=key:
+      file = self.getfile()
+      rntuple = isRNTuple(file,self.treename)
+      self._rntuple = (key,rntuple,GetStoredAliases(file) if rntuple else { })
+      file.Close()
+    return self._rntuple[1]
+  
   def getrdframe(self,variables,selections,**kwargs):
     """Create RDataFrame for list of selections and variables.
     The basic structure is:
@@ -650,6 +669,9 @@ class Sample(object):
     replaceweight = kwargs.get('replaceweight', None   ) # replace weight, e.g. replaceweight=('idweight_2','idweightUp_2')
     preselection  = kwargs.get('preselect', None       ) # pre-selection string (common pre-filter, before aliases all other selections)
     alias_dict    = self.aliases
+    rntuple       = self.isrntuple() # RNTuple instead of TTree
+    if rntuple and self._rntuple[2]: # add aliases stored in file (user aliases take precedence)
+      alias_dict  = dict(self._rntuple[2],**alias_dict)
     if hasattr(preselection,'selection'): # ensure string
       preselection = preselection.selection
     if 'alias' in kwargs: # update alias dictionary
@@ -702,7 +724,7 @@ class Sample(object):
           if rdf_dict!=None and rdfkey_main in rdf_dict:
             rdframe = rdf_dict[rdfkey_main] # reuse shared RDataFrame for improved performance
           else: # create main RDataFrame common to all selections
-            rdframe = RDataFrame(self.treename,self.filename) # save for next iteration on selection
+            rdframe = GetRDataFrame(self.treename,self.filename,rntuple=rntuple) # save for next iteration on selection
             nevts = self.getentries_from_tree() # get total number of events to process
             RDF.AddProgressBar(rdframe,nevts,": "+task+name)
             if rdf_dict!=None:
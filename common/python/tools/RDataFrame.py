@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 # Author: Izaak Neutelings (November 2023)
-import os
+import os, json
 import ROOT; ROOT.PyConfig.IgnoreCommandLineOptions = True # to avoid conflict with argparse
 from ROOT import gROOT, gInterpreter, RDataFrame, RDF
 
@@ -97,6 +97,33 @@ def SetNumberOfThreads(nthreads=None,verb=0):
 RDF.SetNumberOfThreads = SetNumberOfThreads
 
 
+def isRNTuple(file,name):
+  """Check if an object in a file is a RNTuple (e.g. written by TreeProducer with backend=rntuple) instead of a TTree."""
+  key = file.GetKey(name)
+  return bool(key) and 'RNTuple' in key.GetClassName()
+  
+
+def GetRDataFrame(treename,filename,rntuple=False):
+  """Create RDataFrame for a TTree or RNTuple in a file.
+  Before ROOT v6.32, RNTuples need a dedicated data source."""
+  if rntuple and gROOT.GetVersionInt()<63200:
+    return RDF.Experimental.FromRNTuple(treename,filename)
+  return RDataFrame(treename,filename)
+  
+
+def GetRNTupleEntries(treename,filename):
+  """Get number of entries in a RNTuple without event loop."""
+  reader = getattr(ROOT,'RNTupleReader',None) or ROOT.Experimental.RNTupleReader
+  return reader.Open(treename,filename).GetNEntries()
+  
+
+def GetStoredAliases(file,name='aliases'):
+  """Get dictionary of aliases stored as JSON string in a TNamed by TreeProducer with backend=rntuple,
+  because RNTuples do not support aliases like TTree::SetAlias."""
+  named = file.Get(name)
+  return json.loads(named.GetTitle()) if named else { }
+  
+
 def printRDFReport(report,reorder=False):
   """Print cutflow from RCutFlowReport."""
   print(">>> \033[4m%10s %10s %10s %10s    %s\033[0m"%("Pass","All","Eff. [%]","Cum. [%]","Selection"+' '*50))